@@ -0,0 +1,55 @@
+"""
+Configuración de Gunicorn para Render.com
+
+Los parámetros de la línea de comandos (Procfile / render.yaml) tienen prioridad;
+aquí se definen los hilos por worker, el modo preload y los hooks que reportan
+memoria al arrancar.
+
+GUNICORN_THREADS (2) es el número de peticiones que un worker atiende a la vez.
+Subirlo deja entrar más búsquedas mientras corren lotes (el trabajo real sigue
+pasando por los turnos de scheduler.py), pero cada hilo suma sus imágenes en
+memoria: en instancias pequeñas conviene dejarlo bajo.
+
+Con PRELOAD_MODELS=1 la app se importa en el master (preload_app) y carga el modelo
+de rembg antes del fork: los workers comparten esas páginas copy-on-write en lugar
+de cargar cada uno su propia copia del modelo.
+"""
+
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts', 'web_app'))
+
+from metrics import current_rss_bytes  # noqa: E402
+
+threads = int(os.environ.get('GUNICORN_THREADS', '2'))
+preload_app = os.environ.get('PRELOAD_MODELS', '').lower() in ('1', 'true', 'yes')
+
+_started = time.perf_counter()
+
+
+def _rss_mb():
+    return current_rss_bytes() / 1024 / 1024
+
+
+def when_ready(server):
+    mode = 'preload (modelo compartido copy-on-write)' if preload_app else 'carga por worker'
+    server.log.info(f"🚀 Master listo en {(time.perf_counter() - _started) * 1000:.0f} ms - "
+                    f"modo {mode}, RSS master {_rss_mb():.0f} MB")
+
+
+def pre_fork(server, worker):
+    # Mueve los objetos ya creados a la generación permanente: el GC no vuelve a
+    # tocarlos y así no se rompe el copy-on-write de las páginas compartidas
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    server.log.info(f"👷 Worker {worker.pid} iniciado (RSS {_rss_mb():.0f} MB)")
+
+
+def post_worker_init(worker):
+    worker.log.info(f"✅ Worker {worker.pid} listo para atender (RSS {_rss_mb():.0f} MB)")
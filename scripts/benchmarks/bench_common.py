@@ -0,0 +1,126 @@
+"""
+Utilidades compartidas por los benchmarks: estadísticas, RSS y líneas base.
+
+Los resultados se guardan como JSON plano {"metrics": {nombre: valor}, "meta": {...}}
+para poder compararlos entre commits. Las métricas terminadas en '_per_sec'
+son "más alto es mejor"; el resto (latencias, memoria) "más bajo es mejor".
+"""
+
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+from datetime import datetime
+
+WEB_APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'web_app'))
+
+
+def add_web_app_to_path():
+    """Permite importar app.py y sus módulos igual que lo hace wsgi.py"""
+    if WEB_APP_DIR not in sys.path:
+        sys.path.insert(0, WEB_APP_DIR)
+
+
+def percentile(values, pct):
+    """Percentil por rango más cercano (sin numpy)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    """RSS máximo del proceso actual en MB (ru_maxrss está en KB en Linux y en bytes en macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def higher_is_better(metric_name):
+    return metric_name.endswith('_per_sec')
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return 'desconocida'
+
+
+def build_results(name, metrics, **meta):
+    return {
+        'benchmark': name,
+        'metrics': {key: round(value, 4) for key, value in metrics.items()},
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            **meta,
+        },
+    }
+
+
+def save_results(path, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+        f.write('\n')
+
+
+def compare_with_baseline(results, baseline_path, threshold):
+    """Devuelve la lista de regresiones mayores que threshold (p.ej. 0.10 = 10%)"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)['metrics']
+    regressions = []
+    for name, value in results['metrics'].items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        change = (value - base) / base
+        if higher_is_better(name):
+            change = -change
+        if change > threshold:
+            regressions.append({'metric': name, 'baseline': base, 'current': value, 'change': round(change, 4)})
+    return regressions
+
+
+def print_table(results):
+    width = max(len(name) for name in results['metrics']) if results['metrics'] else 10
+    print(f"\n📊 {results['benchmark']} ({results['meta']['git_revision']})")
+    for name, value in sorted(results['metrics'].items()):
+        print(f"  {name:<{width}}  {value:>12.4f}")
+
+
+def print_regressions(regressions, threshold):
+    if not regressions:
+        print(f"\n✅ Sin regresiones por encima del {threshold:.0%}")
+        return
+    print(f"\n❌ {len(regressions)} regresiones por encima del {threshold:.0%}:")
+    for item in regressions:
+        print(f"  {item['metric']}: {item['baseline']} -> {item['current']} ({item['change']:+.1%})")
+
+
+def add_baseline_arguments(parser):
+    parser.add_argument('--output', help='Guardar resultados en este JSON')
+    parser.add_argument('--baseline', help='Comparar contra un JSON de resultados previo')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Regresión máxima tolerada frente a la línea base (0.10 = 10%%)')
+
+
+def finish(results, args):
+    """Imprime, guarda y compara; devuelve el código de salida del proceso"""
+    print_table(results)
+    if args.output:
+        save_results(args.output, results)
+        print(f"\n💾 Resultados guardados en {args.output}")
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.threshold)
+        print_regressions(regressions, args.threshold)
+        return 1 if regressions else 0
+    return 0
@@ -0,0 +1,131 @@
+"""
+Benchmark de extremo a extremo del pipeline contra proveedores simulados.
+
+Levanta stub_providers en un hilo, apunta app.py a él mediante variables de
+entorno y ejecuta /process_bulk, /process_images_only y /process_bulk_images
+con el cliente de pruebas de Flask, consumiendo el stream SSE igual que el
+navegador. Reporta EANs/s, latencia por EAN (p50/p95) y RSS máximo.
+
+    python scripts/benchmarks/e2e_bench.py --eans 20 --output base.json
+    python scripts/benchmarks/e2e_bench.py --eans 20 --baseline base.json --threshold 0.15
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from bench_common import (add_baseline_arguments, add_web_app_to_path, build_results,
+                          finish, peak_rss_mb, percentile)
+from stub_providers import StubServer, add_stub_arguments, config_from_args
+
+ROUTES = ('process_bulk', 'process_images_only', 'process_bulk_images')
+
+
+def sample_eans(count, start=8400000000000):
+    """EANs sintéticos de 13 dígitos (el stub de OFF responde a cualquiera)"""
+    return [str(start + i) for i in range(count)]
+
+
+def iter_sse(response):
+    """Itera los eventos 'data:' de una respuesta SSE en streaming"""
+    buffer = ''
+    for chunk in response.response:
+        buffer += chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
+        while '\n\n' in buffer:
+            raw, buffer = buffer.split('\n\n', 1)
+            for line in raw.splitlines():
+                if line.startswith('data: '):
+                    yield json.loads(line[6:])
+
+
+def run_route(client, route, eans):
+    """Ejecuta un trabajo completo y devuelve sus métricas"""
+    started = time.perf_counter()
+    response = client.post(f'/{route}', data={'eans': json.dumps(eans)}, buffered=False)
+    per_ean_ms = []
+    failures = 0
+    first_event_ms = None
+    last_event = started
+    complete = None
+    for event in iter_sse(response):
+        now = time.perf_counter()
+        if first_event_ms is None:
+            first_event_ms = (now - started) * 1000
+        if event.get('type') == 'progress':
+            timings = event.get('timings') or {}
+            per_ean_ms.append(timings.get('total', (now - last_event) * 1000))
+            last_event = now
+            if not event.get('success'):
+                failures += 1
+        elif event.get('type') == 'complete':
+            complete = event
+        elif event.get('type') == 'error':
+            print(f"  ⚠️ {route}: {event.get('message')}")
+    response.close()
+
+    # Las rutas de imágenes guardan el ZIP en disco: descargarlo forma parte del trabajo
+    if complete and complete.get('zip_filename'):
+        download = client.get(f"/download_zip/{complete['zip_filename']}")
+        download.close()
+
+    elapsed = time.perf_counter() - started
+    return {
+        'eans_per_sec': len(per_ean_ms) / elapsed if elapsed else 0.0,
+        'ean_latency_p50_ms': percentile(per_ean_ms, 50),
+        'ean_latency_p95_ms': percentile(per_ean_ms, 95),
+        'time_to_first_event_ms': first_event_ms or 0.0,
+        'error_rate': failures / len(per_ean_ms) if per_ean_ms else 1.0,
+        'wall_seconds': elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark E2E con proveedores simulados')
+    parser.add_argument('--eans', type=int, default=10, help='EANs por trabajo (máx. 50 por ruta)')
+    parser.add_argument('--routes', nargs='+', choices=ROUTES, default=list(ROUTES))
+    parser.add_argument('--repeat', type=int, default=1, help='Repeticiones por ruta (se usa la mediana)')
+    parser.add_argument('--no-gemini', action='store_true', help='Ejecutar sin GEMINI_API_KEY (sin mejora IA)')
+    parser.add_argument('--no-dedupe', action='store_true',
+                        help='Desactivar la de-duplicación de imágenes (el stub devuelve la misma imagen a todos los EANs)')
+    parser.add_argument('--no-http-cache', action='store_true',
+                        help='Desactivar la caché HTTP (cada repetición vuelve a pedir OFF)')
+    add_stub_arguments(parser)
+    add_baseline_arguments(parser)
+    args = parser.parse_args()
+
+    eans = sample_eans(args.eans)
+    metrics = {}
+    with StubServer(config_from_args(args)) as stubs:
+        os.environ.update(stubs.app_environment())
+        if args.no_gemini:
+            os.environ.pop('GEMINI_API_KEY', None)
+        if args.no_dedupe:
+            os.environ['DEDUPE_IMAGES'] = '0'
+        if args.no_http_cache:
+            os.environ['HTTP_CACHE_MB'] = '0'
+        add_web_app_to_path()
+        from app import app
+
+        client = app.test_client()
+        for route in args.routes:
+            runs = []
+            for attempt in range(args.repeat):
+                print(f'▶️ {route} ({len(eans)} EANs, intento {attempt + 1}/{args.repeat})')
+                runs.append(run_route(client, route, eans))
+            for key in runs[0]:
+                metrics[f'{route}.{key}'] = percentile([run[key] for run in runs], 50)
+        provider_calls = dict(stubs.config.counts)
+        not_modified = dict(stubs.config.not_modified)
+
+    metrics['peak_rss_mb'] = peak_rss_mb()
+    results = build_results('e2e', metrics, eans=len(eans), repeat=args.repeat,
+                            gemini=not args.no_gemini, dedupe=not args.no_dedupe, http_cache=not args.no_http_cache, provider_calls=provider_calls, not_modified=not_modified,
+                            latencies={name: model.spec for name, model in stubs.config.latencies.items()},
+                            error_rates=stubs.config.error_rates)
+    sys.exit(finish(results, args))
+
+
+if __name__ == '__main__':
+    main()
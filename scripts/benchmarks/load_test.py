@@ -0,0 +1,292 @@
+"""
+Prueba de carga con usuarios concurrentes contra gunicorn y proveedores simulados.
+
+El problema en producción no es un lote grande sino varias personas usando la
+herramienta a la vez. Este script levanta stub_providers, arranca gunicorn con
+cada configuración de --configs (workers x threads, p.ej. 1x2 1x8 2x4) apuntando
+a los stubs y, para cada nivel de --concurrency, lanza ese número de usuarios
+virtuales durante --duration segundos. Cada usuario (con su propia IP en
+X-Forwarded-For, como detrás del proxy de Render) repite sesiones elegidas según
+--mix: búsquedas de /process_ean y lotes SSE de --bulk-eans EANs.
+
+Por nivel se reporta:
+- latencia p50/p95/p99 de cada tipo de sesión (un lote: hasta su evento 'complete')
+- tiempo hasta el primer evento SSE (en /process_ean, hasta la respuesta) y, en los
+  lotes, hasta el primer 'progress'
+- espera media por un turno del planificador por prioridad (de /metrics; con varios
+  workers responde uno cualquiera, así que es orientativa)
+- tasa de errores (HTTP >= 400, evento 'error' o lote sin 'complete') y de timeouts
+  (sesiones de más de --session-timeout segundos)
+- sesiones/s completadas
+
+    python scripts/benchmarks/load_test.py --configs 1x2 1x8 --concurrency 1 2 4 8 --duration 60
+    python scripts/benchmarks/load_test.py --target http://127.0.0.1:5000 --concurrency 4 --mix process_ean=1
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from itertools import count
+
+import requests
+
+from bench_common import add_baseline_arguments, build_results, finish, percentile
+from stub_providers import StubServer, add_stub_arguments, config_from_args
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+SESSION_KINDS = ('process_ean', 'process_bulk', 'process_images_only', 'process_bulk_images')
+SCHEDULER_WAIT_PATTERN = re.compile(r'^ean_scheduler_wait_seconds_(sum|count)\{priority="(\w+)"\} (\S+)$', re.MULTILINE)
+STARTUP_TIMEOUT_SECONDS = 60
+
+
+def parse_mix(spec):
+    """'process_ean=3,process_images_only=1' -> {'process_ean': 3.0, 'process_images_only': 1.0}"""
+    mix = {}
+    for part in spec.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in SESSION_KINDS:
+            raise argparse.ArgumentTypeError(f'Tipo de sesión desconocido: {kind} (válidos: {", ".join(SESSION_KINDS)})')
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def parse_config(spec):
+    """'1x8' -> (1 worker, 8 threads)"""
+    workers, _, threads = spec.lower().partition('x')
+    return int(workers), int(threads or 1)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class GunicornServer:
+    """gunicorn en un subproceso con la app apuntando a los stubs; usar como context manager"""
+
+    def __init__(self, workers, threads, environment, worker_class='sync', app_module='wsgi:app'):
+        self.port = free_port()
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        self.command = [sys.executable, '-m', 'gunicorn', app_module, '-c', 'gunicorn.conf.py',
+                        '--bind', f'127.0.0.1:{self.port}', '--workers', str(workers), '--threads', str(threads),
+                        '--worker-class', worker_class, '--timeout', '300', '--log-level', 'warning']
+        self.environment = {**os.environ, **environment}
+        self.log = tempfile.NamedTemporaryFile(prefix='load_test_gunicorn_', suffix='.log', delete=False)
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(self.command, cwd=REPO_ROOT, env=self.environment,
+                                        stdout=subprocess.DEVNULL, stderr=self.log)
+        deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'gunicorn terminó al arrancar (ver {self.log.name})')
+            try:
+                if requests.get(f'{self.base_url}/health', timeout=2).status_code == 200:
+                    return self
+            except requests.RequestException:
+                pass
+            time.sleep(0.5)
+        self.__exit__(None, None, None)
+        raise RuntimeError(f'gunicorn no respondió a /health en {STARTUP_TIMEOUT_SECONDS} s (ver {self.log.name})')
+
+    def __exit__(self, *exc):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.log.close()
+        return False
+
+
+def run_session(base_url, kind, eans, client_ip, timeout):
+    """Ejecuta una sesión y devuelve su registro (tiempos en ms)"""
+    record = {'kind': kind, 'ok': False, 'timeout': False, 'latency_ms': None,
+              'first_event_ms': None, 'first_progress_ms': None}
+    headers = {'X-Forwarded-For': client_ip}
+    started = time.perf_counter()
+
+    def elapsed_ms():
+        return (time.perf_counter() - started) * 1000
+
+    try:
+        if kind == 'process_ean':
+            response = requests.post(f'{base_url}/process_ean', data={'ean': eans[0]}, headers=headers, timeout=timeout)
+            record['first_event_ms'] = response.elapsed.total_seconds() * 1000
+            record['ok'] = response.status_code == 200 and response.json().get('success', False)
+        else:
+            completed = failed = False
+            with requests.post(f'{base_url}/{kind}', data={'eans': json.dumps(eans)}, headers=headers,
+                               stream=True, timeout=timeout) as response:
+                failed = response.status_code >= 400
+                for line in response.iter_lines():
+                    if not line.startswith(b'data: '):
+                        continue
+                    if record['first_event_ms'] is None:
+                        record['first_event_ms'] = elapsed_ms()
+                    event_type = json.loads(line[6:]).get('type')
+                    if event_type == 'progress' and record['first_progress_ms'] is None:
+                        record['first_progress_ms'] = elapsed_ms()
+                    elif event_type == 'complete':
+                        completed = True
+                    elif event_type == 'error':
+                        failed = True
+                    if elapsed_ms() > timeout * 1000:
+                        record['timeout'] = True
+                        break
+            record['ok'] = completed and not failed and not record['timeout']
+    except requests.Timeout:
+        record['timeout'] = True
+    except (requests.RequestException, ValueError):
+        pass
+    record['latency_ms'] = elapsed_ms()
+    return record
+
+
+def scheduler_waits(base_url):
+    """{prioridad: (suma de segundos, número de esperas)} de /metrics (vacío si no responde)"""
+    try:
+        text = requests.get(f'{base_url}/metrics', timeout=5).text
+    except requests.RequestException:
+        return {}
+    waits = {}
+    for field, priority, value in SCHEDULER_WAIT_PATTERN.findall(text):
+        total, waits_count = waits.get(priority, (0.0, 0))
+        if field == 'sum':
+            total = float(value)
+        else:
+            waits_count = int(float(value))
+        waits[priority] = (total, waits_count)
+    return waits
+
+
+def run_level(base_url, users, duration, mix, bulk_eans, timeout, think_seconds, seed, ean_counter):
+    """Lanza `users` usuarios virtuales durante `duration` s; devuelve (registros, segundos)"""
+    records = []
+    records_lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+    kinds, weights = list(mix), list(mix.values())
+
+    def user(index):
+        rng = random.Random(seed * 1000 + index)
+        client_ip = f'10.1.{index // 250}.{index % 250 + 1}'
+        while time.monotonic() < stop_at:
+            kind = rng.choices(kinds, weights)[0]
+            size = 1 if kind == 'process_ean' else bulk_eans
+            # EANs distintos en cada sesión: ni la caché HTTP ni la de-duplicación se saltan el trabajo
+            first = 8400000000000 + next(ean_counter) * 100
+            record = run_session(base_url, kind, [str(first + offset) for offset in range(size)], client_ip, timeout)
+            with records_lock:
+                records.append(record)
+            if think_seconds:
+                time.sleep(think_seconds)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(index,), daemon=True) for index in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records, time.perf_counter() - started
+
+
+def summarize(prefix, records, seconds, waits_before, waits_after, results):
+    """Agrega los registros de un nivel a results con claves '<prefijo>.<métrica>'"""
+    total = len(records)
+    results[f'{prefix}.sessions_per_sec'] = sum(record['ok'] for record in records) / seconds if seconds else 0.0
+    results[f'{prefix}.error_rate'] = sum(not record['ok'] and not record['timeout'] for record in records) / total if total else 0.0
+    results[f'{prefix}.timeout_rate'] = sum(record['timeout'] for record in records) / total if total else 0.0
+    for kind in sorted({record['kind'] for record in records}):
+        of_kind = [record for record in records if record['kind'] == kind]
+        latencies = [record['latency_ms'] for record in of_kind if record['ok']]
+        first_events = [record['first_event_ms'] for record in of_kind if record['first_event_ms'] is not None]
+        first_progress = [record['first_progress_ms'] for record in of_kind if record['first_progress_ms'] is not None]
+        for pct in (50, 95, 99):
+            results[f'{prefix}.{kind}.p{pct}_ms'] = percentile(latencies, pct)
+        results[f'{prefix}.{kind}.first_event_p95_ms'] = percentile(first_events, 95)
+        if first_progress:
+            results[f'{prefix}.{kind}.first_progress_p95_ms'] = percentile(first_progress, 95)
+    for priority, (total_seconds, waits) in waits_after.items():
+        before_seconds, before_waits = waits_before.get(priority, (0.0, 0))
+        if waits > before_waits:
+            results[f'{prefix}.scheduler_wait_{priority}_ms'] = (total_seconds - before_seconds) / (waits - before_waits) * 1000
+
+
+def print_level(prefix, records, results):
+    errors = sum(not record['ok'] for record in records)
+    kinds = sorted({record['kind'] for record in records})
+    latency = ', '.join(f"{kind} p95 {results[f'{prefix}.{kind}.p95_ms']:.0f} ms" for kind in kinds)
+    print(f"  {prefix}: {len(records)} sesiones, {results[f'{prefix}.sessions_per_sec']:.2f}/s, "
+          f"{errors} con error o timeout; {latency}")
+
+
+def sweep(base_url, label, args, results):
+    ean_counter = count()
+    for users in args.concurrency:
+        prefix = f'{label}.c{users}'
+        print(f'▶️ {prefix}: {users} usuarios durante {args.duration:.0f} s')
+        waits_before = scheduler_waits(base_url)
+        records, seconds = run_level(base_url, users, args.duration, args.mix, args.bulk_eans,
+                                     args.session_timeout, args.think_ms / 1000, args.seed, ean_counter)
+        summarize(prefix, records, seconds, waits_before, scheduler_waits(base_url), results)
+        print_level(prefix, records, results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga con usuarios concurrentes contra gunicorn')
+    parser.add_argument('--configs', nargs='+', default=['1x8'], help='Configuraciones de gunicorn workers x threads (1x2 1x8 2x4...)')
+    parser.add_argument('--worker-class', default='sync')
+    parser.add_argument('--target', help='URL de un servidor ya arrancado (no se lanzan gunicorn ni los stubs)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8], help='Usuarios simultáneos por nivel')
+    parser.add_argument('--duration', type=float, default=30, help='Segundos por nivel (las sesiones empezadas se terminan)')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('process_ean=3,process_images_only=1'),
+                        help='Pesos de cada tipo de sesión: process_ean=3,process_images_only=1')
+    parser.add_argument('--bulk-eans', type=int, default=5, help='EANs por lote')
+    parser.add_argument('--session-timeout', type=float, default=300)
+    parser.add_argument('--think-ms', type=float, default=0, help='Pausa de cada usuario entre sesiones')
+    parser.add_argument('--no-gemini', action='store_true', help='Servidor sin GEMINI_API_KEY (sin mejora IA)')
+    add_stub_arguments(parser)
+    add_baseline_arguments(parser)
+    args = parser.parse_args()
+
+    results = {}
+    meta = {'concurrency': args.concurrency, 'duration': args.duration, 'mix': args.mix, 'bulk_eans': args.bulk_eans}
+    if args.target:
+        sweep(args.target.rstrip('/'), 'target', args, results)
+        sys.exit(finish(build_results('load', results, target=args.target, **meta), args))
+
+    with StubServer(config_from_args(args)) as stubs:
+        environment = stubs.app_environment()
+        # El stub devuelve la misma imagen a todos los EANs: sin esto casi todo se de-duplicaría
+        environment['DEDUPE_IMAGES'] = '0'
+        if args.no_gemini:
+            environment['GEMINI_API_KEY'] = ''
+        for spec in args.configs:
+            workers, threads = parse_config(spec)
+            label = f'w{workers}t{threads}'
+            print(f'🚀 gunicorn --workers {workers} --threads {threads} --worker-class {args.worker_class}')
+            with GunicornServer(workers, threads, environment, args.worker_class) as server:
+                sweep(server.base_url, label, args, results)
+        provider_calls = dict(stubs.config.counts)
+
+    output = build_results('load', results, configs=args.configs, worker_class=args.worker_class,
+                           provider_calls=provider_calls,
+                           latencies={name: model.spec for name, model in stubs.config.latencies.items()},
+                           **meta)
+    sys.exit(finish(output, args))
+
+
+if __name__ == '__main__':
+    main()
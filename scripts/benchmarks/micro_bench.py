@@ -0,0 +1,161 @@
+"""
+Micro-benchmarks de las etapas CPU del pipeline sobre fixtures generados.
+
+Etapas medidas (funciones reales de app.py):
+- rembg:  remove_white_background con el modelo U2Net por resolución de imagen
+- bg_fast: remove_white_background por el atajo NumPy (fondo blanco uniforme)
+- excel:  create_bulk_excel por cantidad de productos
+- zip:    build_zip (incluye el base64 decode de cada imagen) por cantidad de imágenes
+- json:   respuesta de /process_ean: publicar imágenes + Excel en el almacén y JSON (gzip) con sus URLs
+
+    python scripts/benchmarks/micro_bench.py --output micro_base.json
+    python scripts/benchmarks/micro_bench.py --baseline micro_base.json --threshold 0.20
+"""
+
+import argparse
+import base64
+import statistics
+import sys
+import time
+
+from bench_common import add_baseline_arguments, add_web_app_to_path, build_results, finish, peak_rss_mb
+from stub_providers import encode_image, make_product_image
+
+STAGES = ('rembg', 'bg_fast', 'excel', 'zip', 'json')
+EXCEL_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def measure(func, repeat, warmup=1):
+    """Devuelve (mediana_ms, min_ms) de func() tras `warmup` ejecuciones descartadas"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), min(samples)
+
+
+def image_fixture(size, seed=0, fmt='PNG'):
+    image = make_product_image((size, size), white_background=True, seed=seed)
+    return base64.b64encode(encode_image(image, fmt)).decode('utf-8')
+
+
+def product_fixtures(app_module, count):
+    products = []
+    for index in range(count):
+        ean = str(8400000000000 + index)
+        off_data = {'name': f'Producto {ean}', 'brand': 'Marca', 'category': 'Pruebas',
+                    'description': 'Descripción ' * 20, 'ingredients': 'agua, sal, ' * 15,
+                    'allergens': ['en:gluten'], 'image_url': f'https://example.com/{ean}.jpg'}
+        products.append(app_module.combine_product_data(ean, off_data, {}))
+    return products
+
+
+def bench_rembg(app_module, sizes, repeat, results):
+    try:
+        import rembg  # noqa: F401
+    except ImportError:
+        print('  ⚠️ rembg no está instalado: se omite la etapa rembg')
+        return
+    for size in sizes:
+        image_b64 = image_fixture(size)
+        median_ms, min_ms = measure(lambda: app_module.remove_white_background(image_b64, fast_path=False), repeat)
+        results[f'rembg.{size}px.median_ms'] = median_ms
+        results[f'rembg.{size}px.min_ms'] = min_ms
+        print(f'  rembg {size}px: {median_ms:.1f} ms')
+
+
+def bench_bg_fast(app_module, sizes, repeat, results):
+    for size in sizes:
+        image_b64 = image_fixture(size)
+        if app_module.remove_white_background(image_b64, fast_path=True)['method'] != 'fast':
+            print(f'  ⚠️ El atajo NumPy descartó el fixture de {size}px')
+            continue
+        median_ms, min_ms = measure(lambda: app_module.remove_white_background(image_b64, fast_path=True), repeat)
+        results[f'bg_fast.{size}px.median_ms'] = median_ms
+        results[f'bg_fast.{size}px.min_ms'] = min_ms
+        print(f'  bg_fast {size}px: {median_ms:.1f} ms')
+
+
+def bench_excel(app_module, batch_sizes, repeat, results):
+    for count in batch_sizes:
+        products = product_fixtures(app_module, count)
+        median_ms, min_ms = measure(lambda: app_module.create_bulk_excel(products), repeat)
+        results[f'excel.{count}.median_ms'] = median_ms
+        results[f'excel.{count}.min_ms'] = min_ms
+        print(f'  excel {count} productos: {median_ms:.1f} ms')
+
+
+def bench_zip(app_module, batch_sizes, image_size, repeat, results):
+    for count in batch_sizes:
+        images = [{'filename': f'{index}.png', 'data': image_fixture(image_size, seed=index)}
+                  for index in range(count)]
+        median_ms, min_ms = measure(lambda: app_module.build_zip(images), repeat)
+        results[f'zip.{count}x{image_size}px.median_ms'] = median_ms
+        results[f'zip.{count}x{image_size}px.min_ms'] = min_ms
+        print(f'  zip {count} imágenes de {image_size}px: {median_ms:.1f} ms')
+
+
+def bench_json(app_module, sizes, repeat, results):
+    flask_app = app_module.app
+    excel_bytes = app_module.create_bulk_excel(product_fixtures(app_module, 1))
+    for size in sizes:
+        original = encode_image(make_product_image((size, size), white_background=False), 'JPEG')
+        enhanced = encode_image(make_product_image((size, size), white_background=True), 'PNG')
+
+        def serialize():
+            # Los resultados del pipeline llegan en base64: se publican y el JSON solo lleva URLs
+            job_id = app_module.artifacts.store.new_job_id()
+            payload = {
+                'success': True,
+                'product_data': {'ean': '8400000000000', 'name': 'Producto'},
+                'images': {
+                    'original': {'url': app_module.publish_asset(job_id, 'original', base64.b64encode(original).decode('utf-8'), 'image/jpeg')},
+                    'enhanced': {'url': app_module.publish_asset(job_id, 'enhanced', base64.b64encode(enhanced).decode('utf-8'), 'image/png')},
+                },
+                'files': {'excel': {'url': app_module.publish_asset(job_id, 'datos', base64.b64encode(excel_bytes).decode('utf-8'), EXCEL_CONTENT_TYPE)}},
+            }
+            with flask_app.test_request_context('/process_ean', method='POST', headers={'Accept-Encoding': 'gzip'}):
+                return app_module.json_response(payload).get_data()
+
+        median_ms, min_ms = measure(serialize, repeat)
+        results[f'json.{size}px.median_ms'] = median_ms
+        results[f'json.{size}px.min_ms'] = min_ms
+        results[f'json.{size}px.response_kb'] = len(serialize()) / 1024
+        print(f'  json {size}px: {median_ms:.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks de las etapas CPU')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[400, 800, 1600])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--repeat', type=int, default=5)
+    add_baseline_arguments(parser)
+    args = parser.parse_args()
+
+    add_web_app_to_path()
+    import app as app_module
+
+    results = {}
+    if 'rembg' in args.stages:
+        bench_rembg(app_module, args.resolutions, args.repeat, results)
+    if 'bg_fast' in args.stages:
+        bench_bg_fast(app_module, args.resolutions, args.repeat, results)
+    if 'excel' in args.stages:
+        bench_excel(app_module, args.batch_sizes, args.repeat, results)
+    if 'zip' in args.stages:
+        bench_zip(app_module, args.batch_sizes, 800, args.repeat, results)
+    if 'json' in args.stages:
+        bench_json(app_module, args.resolutions, args.repeat, results)
+    results['peak_rss_mb'] = peak_rss_mb()
+
+    output = build_results('micro', results, repeat=args.repeat, resolutions=args.resolutions,
+                           batch_sizes=args.batch_sizes)
+    sys.exit(finish(output, args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Comparativa de modelos de rembg frente al modelo por defecto (u2net).
+
+Para cada configuración (modelo, original o cuantizado a int8, hilos de
+onnxruntime) mide la latencia de rembg.remove sobre un conjunto de imágenes y
+cuánto coincide su máscara con la de u2net en las mismas imágenes:
+
+- mask_disagreement: 1 - IoU de las máscaras binarizadas en 128 (0 = idénticas)
+- alpha_mae:         error absoluto medio del canal alfa (0-1)
+
+Las imágenes son fixtures sintéticos (producto sobre blanco y sobre gris) o, con
+--images, las de un directorio (mejor fotos reales de producto mejoradas por Gemini).
+
+    python scripts/benchmarks/model_compare.py --models u2netp silueta --quantized
+    python scripts/benchmarks/model_compare.py --images ./muestras --intra-threads 2 --output modelos.json
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from bench_common import add_baseline_arguments, add_web_app_to_path, build_results, finish, peak_rss_mb
+from stub_providers import make_product_image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def load_fixtures(count, size, image_dir=None):
+    from PIL import Image
+
+    if image_dir:
+        names = sorted(name for name in os.listdir(image_dir) if name.lower().endswith(IMAGE_EXTENSIONS))
+        return [Image.open(os.path.join(image_dir, name)).convert('RGB') for name in names[:count]]
+    return [make_product_image((size, size), white_background=index % 2 == 0, seed=index)
+            for index in range(count)]
+
+
+def run_model(session, images, repeat):
+    """Devuelve (máscaras como arrays 0-255, latencias en ms) de rembg.remove(only_mask=True)"""
+    import numpy as np
+    from rembg import remove
+
+    remove(images[0], session=session, only_mask=True)
+    masks, samples = [], []
+    for image in images:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            mask = remove(image, session=session, only_mask=True)
+            samples.append((time.perf_counter() - started) * 1000)
+        masks.append(np.asarray(mask.convert('L'), dtype=np.float32))
+    return masks, samples
+
+
+def agreement(masks, reference_masks):
+    """(1 - IoU medio, error absoluto medio del alfa) frente a las máscaras de referencia"""
+    import numpy as np
+
+    disagreements, errors = [], []
+    for mask, reference in zip(masks, reference_masks):
+        foreground, reference_foreground = mask >= 128, reference >= 128
+        union = (foreground | reference_foreground).sum()
+        iou = (foreground & reference_foreground).sum() / union if union else 1.0
+        disagreements.append(1 - iou)
+        errors.append(float(np.abs(mask - reference).mean()) / 255)
+    return statistics.mean(disagreements), statistics.mean(errors)
+
+
+def configurations(models, quantized):
+    import segmentation
+
+    configs = [(model, False) for model in models]
+    if quantized:
+        configs += [(model, True) for model in (segmentation.DEFAULT_MODEL, *models)
+                    if model in segmentation.QUANTIZABLE_MODELS]
+    return configs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latencia y coincidencia de máscaras de modelos de rembg frente a u2net')
+    parser.add_argument('--models', nargs='+', default=['u2netp', 'silueta'])
+    parser.add_argument('--quantized', action='store_true', help='Medir también las versiones int8')
+    parser.add_argument('--intra-threads', type=int, default=None, help='REMBG_INTRA_OP_THREADS para todas las sesiones')
+    parser.add_argument('--inter-threads', type=int, default=None, help='REMBG_INTER_OP_THREADS para todas las sesiones')
+    parser.add_argument('--images', help='Directorio con imágenes en lugar de los fixtures sintéticos')
+    parser.add_argument('--count', type=int, default=6)
+    parser.add_argument('--size', type=int, default=800)
+    parser.add_argument('--repeat', type=int, default=3)
+    add_baseline_arguments(parser)
+    args = parser.parse_args()
+
+    add_web_app_to_path()
+    try:
+        import rembg  # noqa: F401
+    except ImportError:
+        print('❌ rembg no está instalado')
+        sys.exit(1)
+    import segmentation
+
+    images = load_fixtures(args.count, args.size, args.images)
+    if not images:
+        print('❌ No hay imágenes que comparar')
+        sys.exit(1)
+
+    threads = {'intra_op_threads': args.intra_threads, 'inter_op_threads': args.inter_threads}
+    results = {}
+    reference_masks = None
+    # La primera configuración es la referencia; dict.fromkeys quita repetidas conservando el orden
+    for model, quantized in dict.fromkeys([(segmentation.DEFAULT_MODEL, False)] + configurations(args.models, args.quantized)):
+        label = f"{model}{'.int8' if quantized else ''}"
+        started = time.perf_counter()
+        session = segmentation.new_session(model, quantized=quantized, **threads)
+        load_ms = (time.perf_counter() - started) * 1000
+        masks, samples = run_model(session, images, args.repeat)
+        results[f'{label}.median_ms'] = statistics.median(samples)
+        results[f'{label}.load_ms'] = load_ms
+        if reference_masks is None:
+            reference_masks = masks
+        else:
+            disagreement, alpha_mae = agreement(masks, reference_masks)
+            results[f'{label}.mask_disagreement'] = disagreement
+            results[f'{label}.alpha_mae'] = alpha_mae
+        print(f"  {segmentation.describe(model, quantized, **threads)}: {results[f'{label}.median_ms']:.1f} ms")
+    results['peak_rss_mb'] = peak_rss_mb()
+
+    output = build_results('model_compare', results, images=args.images or 'synthetic', count=len(images),
+                           size=args.size, repeat=args.repeat, **threads)
+    sys.exit(finish(output, args))
+
+
+if __name__ == '__main__':
+    main()
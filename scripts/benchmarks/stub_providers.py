@@ -0,0 +1,377 @@
+"""
+Servidor local que imita a los proveedores externos del pipeline.
+
+Rutas implementadas (mismo formato de respuesta que los servicios reales):
+- GET  /api/v2/product/<ean>.json          -> Open Food Facts v2
+- GET  /search.json?engine=google_images   -> SerpAPI Google Images
+- POST /models/<modelo>:generateContent    -> Gemini texto o imagen según el modelo
+- POST /models/<modelo>:batchGenerateContent -> Gemini Batch (crea un lote de imágenes)
+- GET  /batches/<id>                       -> estado del lote y respuestas en línea al terminar
+- POST /batches/<id>:cancel                -> cancela un lote en curso
+- GET  /images/<ean>.jpg                   -> host de imágenes
+
+OFF y el host de imágenes envían ETag y Last-Modified y responden 304 a
+If-None-Match (config.not_modified cuenta esas respuestas).
+
+Cada proveedor (off, serpapi, gemini_text, gemini_image, gemini_batch, images) tiene su propia
+distribución de latencia y tasa de error, configurables por línea de comandos. En
+gemini_batch la latencia es el tiempo hasta que el lote termina y la tasa de error
+se aplica a cada petición del lote:
+
+    python stub_providers.py --port 8900 --latency gemini_image=lognormal:4000:0.4 --error-rate serpapi=0.05
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+PROVIDERS = ('off', 'serpapi', 'gemini_text', 'gemini_image', 'gemini_batch', 'images')
+
+# Validadores fijos: el contenido de los stubs no cambia entre peticiones
+STUB_LAST_MODIFIED = 'Tue, 14 Nov 2023 22:13:20 GMT'
+
+# Latencias por defecto aproximadas a lo observado en producción (ms)
+DEFAULT_LATENCIES = {
+    'off': 'lognormal:250:0.5',
+    'serpapi': 'lognormal:1200:0.4',
+    'gemini_text': 'lognormal:2500:0.4',
+    'gemini_image': 'lognormal:7000:0.3',
+    'gemini_batch': 'lognormal:20000:0.3',
+    'images': 'lognormal:300:0.6',
+}
+
+
+class LatencyModel:
+    """Distribución de latencia: fixed:<ms>, uniform:<min_ms>:<max_ms> o lognormal:<mediana_ms>:<sigma>"""
+
+    def __init__(self, spec):
+        self.spec = spec
+        parts = spec.split(':')
+        self.kind = parts[0]
+        self.params = [float(p) for p in parts[1:]]
+        expected = {'fixed': 1, 'uniform': 2, 'lognormal': 2}
+        if self.kind not in expected or len(self.params) != expected[self.kind]:
+            raise ValueError(f'Distribución de latencia inválida: {spec}')
+
+    def sample_seconds(self, rng):
+        if self.kind == 'fixed':
+            ms = self.params[0]
+        elif self.kind == 'uniform':
+            ms = rng.uniform(*self.params)
+        else:
+            median, sigma = self.params
+            ms = rng.lognormvariate(0, sigma) * median
+        return max(0.0, ms) / 1000
+
+
+def make_product_image(size=(800, 800), white_background=True, seed=0):
+    """Genera un JPEG/PNG sintético con un 'producto' centrado"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    background = (255, 255, 255) if white_background else (rng.randint(90, 200),) * 3
+    image = Image.new('RGB', size, background)
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    color = (rng.randint(0, 200), rng.randint(0, 200), rng.randint(0, 200))
+    draw.rectangle([width * 0.25, height * 0.15, width * 0.75, height * 0.85], fill=color)
+    draw.ellipse([width * 0.35, height * 0.3, width * 0.65, height * 0.5], fill=(240, 220, 40))
+    return image
+
+
+def encode_image(image, fmt):
+    buffer = BytesIO()
+    image.save(buffer, format=fmt, quality=85) if fmt == 'JPEG' else image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+class StubConfig:
+    def __init__(self, latencies=None, error_rates=None, image_size=(800, 800), seed=1234):
+        self.latencies = {name: LatencyModel(spec) for name, spec in {**DEFAULT_LATENCIES, **(latencies or {})}.items()}
+        self.error_rates = {name: 0.0 for name in PROVIDERS}
+        self.error_rates.update(error_rates or {})
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.source_jpeg = encode_image(make_product_image(image_size, white_background=False, seed=seed), 'JPEG')
+        self.enhanced_png = encode_image(make_product_image((800, 800), white_background=True, seed=seed), 'PNG')
+        self.counts = {name: 0 for name in PROVIDERS}
+        self.not_modified = {name: 0 for name in PROVIDERS}
+        self.batches = {}
+        self.batches_lock = threading.Lock()
+
+    def fails(self, provider):
+        with self.rng_lock:
+            return self.rng.random() < self.error_rates.get(provider, 0.0)
+
+    def roll(self, provider):
+        """Devuelve (latencia en s, debe_fallar) para una petición al proveedor"""
+        with self.rng_lock:
+            self.counts[provider] += 1
+            delay = self.latencies[provider].sample_seconds(self.rng)
+            fail = self.rng.random() < self.error_rates.get(provider, 0.0)
+        return delay, fail
+
+
+def _gemini_text_body():
+    web_data = {
+        'nombre': 'Producto de prueba', 'descripcion': 'Descripción generada por el stub',
+        'marca': 'Marca Stub', 'categoria': 'Alimentación',
+        'categoria_path': 'Alimentación > Pruebas', 'departamento': 'Despensa',
+        'producto_tipo': 'Prueba', 'ingredientes': 'agua', 'alergenos': 'No disponible',
+        'organico': 'no', 'no_gmo': 'no', 'altura': '10', 'ancho': '5', 'largo': '5',
+        'upc': 'No disponible', 'precio_estimado': '1.99',
+    }
+    return {'candidates': [{'content': {'parts': [{'text': json.dumps(web_data, ensure_ascii=False)}]}}]}
+
+
+def _gemini_image_body(png_bytes):
+    data = base64.b64encode(png_bytes).decode('ascii')
+    return {'candidates': [{'content': {'parts': [{'inlineData': {'mimeType': 'image/png', 'data': data}}]}}]}
+
+
+def _batch_operation(batch_id, batch, enhanced_png):
+    """Operación de Gemini Batch: RUNNING hasta ready_at y luego SUCCEEDED con respuestas en línea"""
+    operation = {'name': f'batches/{batch_id}', 'metadata': {'state': 'BATCH_STATE_RUNNING'}}
+    if batch.get('cancelled'):
+        operation['metadata']['state'] = 'BATCH_STATE_CANCELLED'
+        operation['done'] = True
+        return operation
+    if time.time() < batch['ready_at']:
+        return operation
+    responses = []
+    for key, failed in batch['items']:
+        item = {'metadata': {'key': key}}
+        if failed:
+            item['error'] = {'code': 13, 'message': 'stub failure'}
+        else:
+            item['response'] = _gemini_image_body(enhanced_png)
+        responses.append(item)
+    operation['metadata']['state'] = 'BATCH_STATE_SUCCEEDED'
+    operation['done'] = True
+    operation['response'] = {'inlinedResponses': {'inlinedResponses': responses}}
+    return operation
+
+
+def make_handler(config):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body, content_type='application/json', extra_headers=None):
+            if isinstance(body, (dict, list)):
+                body = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (extra_headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_validated(self, provider, body, content_type='application/json'):
+            """200 con ETag/Last-Modified, o 304 sin cuerpo si el cliente ya tiene esa versión"""
+            if isinstance(body, (dict, list)):
+                body = json.dumps(body).encode('utf-8')
+            validators = {'ETag': f'"{hashlib.md5(body).hexdigest()}"', 'Last-Modified': STUB_LAST_MODIFIED}
+            if self.headers.get('If-None-Match') == validators['ETag']:
+                with config.rng_lock:
+                    config.not_modified[provider] += 1
+                self._send(304, b'', content_type, validators)
+                return
+            self._send(200, body, content_type, validators)
+
+        def _simulate(self, provider):
+            delay, fail = config.roll(provider)
+            time.sleep(delay)
+            if fail:
+                self._send(503 if provider.startswith('gemini') else 500, {'error': 'stub failure'})
+                return False
+            return True
+
+        def _base_url(self):
+            return f'http://{self.headers.get("Host")}'
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            product = re.match(r'^/api/v2/product/(\d+)\.json$', parsed.path)
+            if product:
+                if not self._simulate('off'):
+                    return
+                ean = product.group(1)
+                data = {
+                    'product_name': f'Producto {ean}', 'brands': 'Marca Stub',
+                    'generic_name': 'Producto sintético', 'categories': 'Pruebas',
+                    'image_url': f'{self._base_url()}/images/{ean}.jpg',
+                    'nutrition_grade_fr': 'b', 'ingredients_text': 'agua',
+                    'allergens_tags': [], 'additives_tags': [], 'nutriments': {},
+                    'created_t': 1700000000, 'last_modified_t': 1700000000,
+                }
+                # Como OFF: ?fields=a,b devuelve solo esos campos del producto
+                fields = parse_qs(parsed.query).get('fields')
+                if fields:
+                    wanted = fields[0].split(',')
+                    data = {key: value for key, value in data.items() if key in wanted}
+                self._send_validated('off', {'status': 1, 'code': ean, 'product': data})
+                return
+            if parsed.path == '/search.json':
+                if not self._simulate('serpapi'):
+                    return
+                query = parse_qs(parsed.query).get('q', [''])[0]
+                ean = (re.findall(r'\d{8,14}', query) or ['0'])[-1]
+                self._send(200, {'images_results': [
+                    {'original': f'{self._base_url()}/images/{ean}.jpg', 'source': 'stub-host'}
+                ]})
+                return
+            batch = re.match(r'^/batches/(\w+)$', parsed.path)
+            if batch:
+                with config.batches_lock:
+                    stored = config.batches.get(batch.group(1))
+                if stored is None:
+                    self._send(404, {'error': 'batch not found'})
+                else:
+                    self._send(200, _batch_operation(batch.group(1), stored, config.enhanced_png))
+                return
+            if parsed.path.startswith('/images/'):
+                if not self._simulate('images'):
+                    return
+                self._send_validated('images', config.source_jpeg, 'image/jpeg')
+                return
+            self._send(404, {'error': 'not found'})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            parsed = urlparse(self.path)
+            if re.match(r'^/models/([\w.-]+):batchGenerateContent$', parsed.path):
+                self._create_batch(body)
+                return
+            cancel = re.match(r'^/batches/(\w+):cancel$', parsed.path)
+            if cancel:
+                with config.batches_lock:
+                    stored = config.batches.get(cancel.group(1))
+                    if stored is not None:
+                        stored['cancelled'] = True
+                if stored is None:
+                    self._send(404, {'error': 'batch not found'})
+                else:
+                    self._send(200, {})
+                return
+            match = re.match(r'^/models/([\w.-]+):generateContent$', parsed.path)
+            if not match:
+                self._send(404, {'error': 'not found'})
+                return
+            model = match.group(1)
+            provider = 'gemini_image' if 'image' in model else 'gemini_text'
+            if not self._simulate(provider):
+                return
+            body = _gemini_image_body(config.enhanced_png) if provider == 'gemini_image' else _gemini_text_body()
+            self._send(200, body)
+
+        def _create_batch(self, body):
+            delay, fail = config.roll('gemini_batch')
+            if fail:
+                self._send(503, {'error': 'stub failure'})
+                return
+            requests_list = json.loads(body)['batch']['input_config']['requests']['requests']
+            items = [(item['metadata']['key'], config.fails('gemini_batch')) for item in requests_list]
+            with config.batches_lock:
+                batch_id = str(len(config.batches) + 1)
+                config.batches[batch_id] = {'items': items, 'ready_at': time.time() + delay}
+            self._send(200, {'name': f'batches/{batch_id}', 'metadata': {'state': 'BATCH_STATE_PENDING'}})
+
+    return StubHandler
+
+
+class StubServer:
+    """Servidor de stubs en un hilo de fondo; usar como context manager"""
+
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        self.config = config or StubConfig()
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(self.config))
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def app_environment(self):
+        """Variables de entorno para que app.py use este servidor en lugar de los reales"""
+        return {
+            'OFF_API_BASE': self.base_url,
+            'SERPAPI_URL': f'{self.base_url}/search.json',
+            'GEMINI_API_BASE': self.base_url,
+            'SERPAPI_KEY': 'stub',
+            'GEMINI_API_KEY': 'stub',
+        }
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def parse_provider_options(values, cast=str):
+    """Convierte ['gemini_image=fixed:100', ...] en {'gemini_image': 'fixed:100'}"""
+    options = {}
+    for value in values or []:
+        name, _, spec = value.partition('=')
+        if name not in PROVIDERS or not spec:
+            raise argparse.ArgumentTypeError(f'Opción inválida "{value}" (proveedores: {", ".join(PROVIDERS)})')
+        options[name] = cast(spec)
+    return options
+
+
+def add_stub_arguments(parser):
+    parser.add_argument('--latency', action='append', metavar='PROVEEDOR=DIST',
+                        help='Latencia por proveedor: fixed:<ms>, uniform:<min>:<max>, lognormal:<mediana>:<sigma>')
+    parser.add_argument('--error-rate', action='append', metavar='PROVEEDOR=TASA',
+                        help='Proporción de respuestas con error por proveedor (0-1)')
+    parser.add_argument('--image-size', type=int, default=800, help='Lado en píxeles de las imágenes de origen')
+    parser.add_argument('--seed', type=int, default=1234)
+
+
+def config_from_args(args):
+    return StubConfig(
+        latencies=parse_provider_options(args.latency),
+        error_rates=parse_provider_options(args.error_rate, float),
+        image_size=(args.image_size, args.image_size),
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stubs locales de OFF, SerpAPI, Gemini y hosts de imágenes')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubServer(config_from_args(args), args.host, args.port)
+    print(f'🧪 Stubs escuchando en {server.base_url}')
+    for key, value in server.app_environment().items():
+        print(f'   export {key}={value}')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,9 @@
 import sys
+import time
 import logging
 
+_BOOT_STARTED = time.perf_counter()
+
 # Configurar logging detallado
 logging.basicConfig(
     level=logging.INFO,
@@ -11,34 +14,43 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-logger.info("🚀 Iniciando importaciones...")
-
 from flask import Flask, render_template, request, jsonify, send_file, flash, redirect, url_for, Response, stream_with_context
-logger.info("✓ Flask importado")
 
 import os
 import json
 import requests
+import threading
 from datetime import datetime
-logger.info("✓ Módulos estándar importados")
-
-from PIL import Image
+from functools import wraps
 from io import BytesIO
 import base64
-logger.info("✓ PIL y IO importados")
+import gzip
+import hmac
 
-import openpyxl
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
-logger.info("✓ openpyxl importado")
+# PIL, openpyxl y rembg se importan bajo demanda dentro de las funciones que los usan
+# (o antes del fork con PRELOAD_MODELS=1, ver preload_heavy_modules)
 
 from dotenv import load_dotenv
-import tempfile
 import shutil
 import zipfile
-import time
 import re
-logger.info("✓ Utilidades importadas")
+
+import artifacts
+import checkpoints
+import circuit
+import deadlines
+import http_cache
+import image_dedupe
+import image_matting
+import image_quality
+import image_sources
+import memory
+import metrics
+import refresh
+import scheduler
+import segmentation
+from tracing import JobTimings
+logger.info(f"✓ Importaciones completadas en {(time.perf_counter() - _BOOT_STARTED) * 1000:.0f} ms")
 
 # Cargar variables de entorno
 load_dotenv()
@@ -73,92 +85,140 @@ except Exception as e:
     PROCESSED_FOLDER = '/tmp'
     logger.info(f"✓ Usando fallback: /tmp")
 
+# URLs de servicios externos (configurables para apuntar a stubs locales en benchmarks)
+OFF_API_BASE = os.environ.get('OFF_API_BASE', 'https://world.openfoodfacts.org').rstrip('/')
+SERPAPI_URL = os.environ.get('SERPAPI_URL', 'https://serpapi.com/search.json')
+GEMINI_API_BASE = os.environ.get('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com/v1beta').rstrip('/')
+
+# Token de los endpoints /admin/* (sin token configurado no se exponen)
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+OFF_HEADERS = {
+    "User-Agent": "MiApp/1.0 (miemail@example.com)"
+}
+OFF_TIMEOUT_ERROR = 'La consulta tardó demasiado tiempo. Por favor, verifica tu conexión a internet e intenta nuevamente.'
+OFF_CONNECTION_ERROR = 'No se pudo conectar al servidor. Por favor, verifica tu conexión a internet e intenta nuevamente.'
+
+def validate_ean(ean):
+    """Devuelve un resultado de error si el EAN no es válido, o None"""
+    if not ean or not ean.isdigit() or len(ean) < 8 or len(ean) > 14:
+        print(f"❌ EAN inválido: '{ean}' (longitud: {len(ean) if ean else 0})")  # Debug
+        return {
+            'success': False, 
+            'error': 'El código EAN debe ser numérico y tener entre 8 y 14 dígitos'
+        }
+    return None
+
+def off_product_url(ean):
+    return f"{OFF_API_BASE}/api/v2/product/{ean}.json"
+
+def parse_off_response(ean, status_code, data):
+    """Traduce la respuesta de OFF v2 (código HTTP + JSON) al formato interno"""
+    print(f"Status Code: {status_code}")  # Debug
+    
+    if status_code == 200:
+        print(f"JSON Status: {data.get('status')}")  # Debug
+        
+        if data.get('status') == 1:
+            product = data.get('product', {})
+            print(f"Producto encontrado: {product.get('product_name', 'N/A')}")  # Debug
+            
+            return {
+                'success': True,
+                'data': {
+                    'ean': ean,
+                    'name': product.get('product_name', 'No disponible'),
+                    'brand': product.get('brands', 'No disponible'),
+                    'description': product.get('generic_name', 'No disponible'),
+                    'category': product.get('categories', 'No disponible'),
+                    'image_url': product.get('image_url', None),
+                    'nutrition_grade': product.get('nutrition_grade_fr', 'No disponible'),
+                    'ingredients': product.get('ingredients_text', 'No disponible'),
+                    'allergens': product.get('allergens_tags', []),
+                    'additives': product.get('additives_tags', []),
+                    'nutriments': product.get('nutriments', {}),
+                    'created_t': product.get('created_t', None),
+                    'last_modified_t': product.get('last_modified_t', None)
+                }
+            }
+        else:
+            # Producto no encontrado en la base de datos
+            return {
+                'success': False, 
+                'error': f'El producto con código EAN {ean} no se encuentra en nuestra base de datos. Verifica que el código sea correcto o intenta con otro producto.'
+            }
+    elif status_code == 404:
+        return {
+            'success': False, 
+            'error': f'El producto con código EAN {ean} no existe en nuestra base de datos. Verifica que el código sea correcto.'
+        }
+    elif status_code == 429:
+        return {
+            'success': False, 
+            'error': 'Demasiadas consultas. Por favor, espera un momento e intenta nuevamente.'
+        }
+    elif status_code >= 500:
+        return {
+            'success': False, 
+            'error': 'Error del servidor. Por favor, intenta nuevamente en unos minutos.'
+        }
+    else:
+        return {
+            'success': False, 
+            'error': f'Error de conexión (código {status_code}). Por favor, verifica tu conexión a internet e intenta nuevamente.'
+        }
+
 def get_product_data(ean):
     """Obtiene datos del producto usando Open Food Facts API v2"""
     try:
         print(f"🔍 get_product_data recibió EAN: '{ean}' (tipo: {type(ean)})")  # Debug
         
         # Validar formato del EAN
-        if not ean or not ean.isdigit() or len(ean) < 8 or len(ean) > 14:
-            print(f"❌ EAN inválido: '{ean}' (longitud: {len(ean) if ean else 0})")  # Debug
-            return {
-                'success': False, 
-                'error': 'El código EAN debe ser numérico y tener entre 8 y 14 dígitos'
-            }
+        invalid = validate_ean(ean)
+        if invalid:
+            return invalid
         
         # Usar API v2 con headers obligatorios
-        url = f"https://world.openfoodfacts.org/api/v2/product/{ean}.json"
-        headers = {
-            "User-Agent": "MiApp/1.0 (miemail@example.com)"
-        }
+        url = off_product_url(ean)
         
         print(f"🔍 Consultando API para EAN: {ean}")  # Debug
         print(f"🔍 URL: {url}")  # Debug
-        response = requests.get(url, headers=headers, timeout=15)
-        print(f"Status Code: {response.status_code}")  # Debug
         
-        if response.status_code == 200:
-            data = response.json()
-            print(f"JSON Status: {data.get('status')}")  # Debug
-            
-            if data.get('status') == 1:
-                product = data.get('product', {})
-                print(f"Producto encontrado: {product.get('product_name', 'N/A')}")  # Debug
-                
-                return {
-                    'success': True,
-                    'data': {
-                        'ean': ean,
-                        'name': product.get('product_name', 'No disponible'),
-                        'brand': product.get('brands', 'No disponible'),
-                        'description': product.get('generic_name', 'No disponible'),
-                        'category': product.get('categories', 'No disponible'),
-                        'image_url': product.get('image_url', None),
-                        'nutrition_grade': product.get('nutrition_grade_fr', 'No disponible'),
-                        'ingredients': product.get('ingredients_text', 'No disponible'),
-                        'allergens': product.get('allergens_tags', []),
-                        'additives': product.get('additives_tags', []),
-                        'nutriments': product.get('nutriments', {}),
-                        'created_t': product.get('created_t', None),
-                        'last_modified_t': product.get('last_modified_t', None)
-                    }
-                }
-            else:
-                # Producto no encontrado en la base de datos
-                status_verbose = data.get('status_verbose', 'Producto no encontrado')
-                return {
-                    'success': False, 
-                    'error': f'El producto con código EAN {ean} no se encuentra en nuestra base de datos. Verifica que el código sea correcto o intenta con otro producto.'
-                }
-        elif response.status_code == 404:
-            return {
-                'success': False, 
-                'error': f'El producto con código EAN {ean} no existe en nuestra base de datos. Verifica que el código sea correcto.'
-            }
-        elif response.status_code == 429:
-            return {
-                'success': False, 
-                'error': 'Demasiadas consultas. Por favor, espera un momento e intenta nuevamente.'
-            }
-        elif response.status_code >= 500:
-            return {
-                'success': False, 
-                'error': 'Error del servidor. Por favor, intenta nuevamente en unos minutos.'
-            }
-        else:
-            return {
-                'success': False, 
-                'error': f'Error de conexión (código {response.status_code}). Por favor, verifica tu conexión a internet e intenta nuevamente.'
-            }
+        def send(conditional_headers):
+            circuit.check('openfoodfacts')
+            try:
+                with metrics.stage_timer('off'):
+                    response = requests.get(url, headers={**OFF_HEADERS, **conditional_headers}, timeout=deadlines.timeout(15))
+            except requests.exceptions.RequestException:
+                metrics.record_upstream('openfoodfacts')
+                raise
+            metrics.record_upstream('openfoodfacts', response)
+            return response
+        
+        # Caché con revalidación (ETag/Last-Modified): un 304 no vuelve a bajar el JSON
+        response = http_cache.cached_get('off', url, send)
+        
+        data = response.json() if response.status_code == 200 else None
+        return parse_off_response(ean, response.status_code, data)
     except requests.exceptions.Timeout:
         return {
             'success': False, 
-            'error': 'La consulta tardó demasiado tiempo. Por favor, verifica tu conexión a internet e intenta nuevamente.'
+            'error': OFF_TIMEOUT_ERROR
         }
     except requests.exceptions.ConnectionError:
         return {
             'success': False, 
-            'error': 'No se pudo conectar al servidor. Por favor, verifica tu conexión a internet e intenta nuevamente.'
+            'error': OFF_CONNECTION_ERROR
+        }
+    except circuit.CircuitOpenError as e:
+        return {
+            'success': False, 
+            'error': f'{str(e)}. Por favor, intenta nuevamente en unos segundos.'
+        }
+    except deadlines.DeadlineExceeded as e:
+        return {
+            'success': False, 
+            'error': str(e)
         }
     except Exception as e:
         return {
@@ -166,34 +226,99 @@ def get_product_data(ean):
             'error': f'Error inesperado: {str(e)}. Por favor, intenta nuevamente.'
         }
 
+def parse_off_last_modified(status_code, data):
+    """last_modified_t de la respuesta de OFF con fields=last_modified_t; None si no se pudo saber"""
+    if status_code != 200 or not data or data.get('status') != 1:
+        return None
+    return data.get('product', {}).get('last_modified_t')
+
+def get_off_last_modified(ean):
+    """Consulta barata a OFF (solo last_modified_t) para saber si un producto cambió"""
+    try:
+        circuit.check('openfoodfacts')
+        try:
+            with metrics.stage_timer('off'):
+                response = requests.get(off_product_url(ean), params={'fields': 'last_modified_t'},
+                                        headers=OFF_HEADERS, timeout=deadlines.timeout(15))
+        except requests.exceptions.RequestException:
+            metrics.record_upstream('openfoodfacts')
+            raise
+        metrics.record_upstream('openfoodfacts', response)
+        return parse_off_last_modified(response.status_code, response.json() if response.status_code == 200 else None)
+    except Exception as e:
+        logger.warning(f"  ⚠️ No se pudo consultar last_modified_t de {ean}: {e}")
+        return None
+
 def download_image(image_url, ean):
     """Descarga la imagen del producto en memoria (no guarda archivos)"""
     try:
-        response = requests.get(image_url, timeout=15)
-        if response.status_code == 200:
-            # Convertir a base64 para mostrar en la web sin guardar archivo
-            image_base64 = base64.b64encode(response.content).decode('utf-8')
-            return {
-                'success': True, 
-                'image_data': image_base64,
-                'content_type': 'image/jpeg',
-                'size': len(response.content)
-            }
-        else:
-            return {'success': False, 'error': f'Error descargando imagen: {response.status_code}'}
+        def send(conditional_headers):
+            try:
+                with metrics.stage_timer('image_download'):
+                    response = requests.get(image_url, headers=conditional_headers, timeout=deadlines.timeout(15))
+            except requests.exceptions.RequestException:
+                metrics.record_upstream('image_host')
+                raise
+            metrics.record_upstream('image_host', response)
+            return response
+        
+        response = http_cache.cached_get('image', image_url, send)
+        return image_download_result(response.status_code, response.content)
     except Exception as e:
         return {'success': False, 'error': f'Error descargando imagen: {str(e)}'}
 
-def search_product_web_data(ean, product_name, api_key):
-    """Busca información adicional del producto en internet usando Gemini 2.5 Flash-Lite"""
-    try:
-        url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-lite:generateContent"
-        headers = {
-            "x-goog-api-key": api_key,
-            "Content-Type": "application/json"
+def image_download_result(status_code, content):
+    """Resultado de download_image a partir de la respuesta (también lo usa la app asíncrona)"""
+    if status_code == 200:
+        # Convertir a base64 para mostrar en la web sin guardar archivo
+        image_base64 = base64.b64encode(content).decode('utf-8')
+        return {
+            'success': True, 
+            'image_data': image_base64,
+            'content_type': 'image/jpeg',
+            'size': len(content)
         }
-        
-        prompt = f"""
+    else:
+        return {'success': False, 'error': f'Error descargando imagen: {status_code}'}
+
+GEMINI_TEXT_MODEL = 'gemini-2.5-flash-lite'
+GEMINI_IMAGE_MODEL = 'gemini-2.5-flash-image-preview'
+# Lado máximo (px) de las miniaturas que acompañan a cada imagen en los eventos 'progress'
+THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', '160'))
+# Respuestas JSON a partir de este tamaño (bytes) se comprimen con gzip
+JSON_GZIP_MIN_BYTES = 1024
+# Extensión con la que se guardan los archivos de /process_ean según su content type
+ASSET_EXTENSIONS = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/jpg': 'jpg',
+    'image/webp': 'webp',
+    'image/gif': 'gif',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': 'xlsx',
+}
+ITEM_MIMETYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'webp': 'image/webp',
+    'gif': 'image/gif',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+IMAGE_DOWNLOAD_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+def gemini_url(model):
+    return f"{GEMINI_API_BASE}/models/{model}:generateContent"
+
+def gemini_headers(api_key):
+    return {
+        "x-goog-api-key": api_key,
+        "Content-Type": "application/json"
+    }
+
+def build_web_data_payload(ean, product_name):
+    """Payload de Gemini Flash-Lite para buscar datos del producto"""
+    prompt = f"""
         Busca información detallada en internet sobre el producto con código EAN {ean} {f'y nombre "{product_name}"' if product_name and product_name != 'No disponible' else ''}.
         
         Proporciona la información en formato JSON con los siguientes campos (si no encuentras un campo, usa "No disponible"):
@@ -218,54 +343,142 @@ def search_product_web_data(ean, product_name, api_key):
         
         IMPORTANTE: Responde SOLO con el objeto JSON, sin texto adicional antes o después.
         """
-        
-        payload = {
-            "contents": [{
-                "parts": [{"text": prompt}]
-            }],
-            "generationConfig": {
-                "temperature": 0.1,
-                "topK": 40,
-                "topP": 0.95,
-                "maxOutputTokens": 2048,
-            }
+    
+    return {
+        "contents": [{
+            "parts": [{"text": prompt}]
+        }],
+        "generationConfig": {
+            "temperature": 0.1,
+            "topK": 40,
+            "topP": 0.95,
+            "maxOutputTokens": 2048,
         }
+    }
+
+def parse_web_data_response(status_code, data):
+    """Extrae el JSON de datos del producto de la respuesta de Gemini"""
+    if status_code == 200:
+        if "candidates" in data and data["candidates"]:
+            candidate = data["candidates"][0]
+            if "content" in candidate and "parts" in candidate["content"]:
+                for part in candidate["content"]["parts"]:
+                    if "text" in part:
+                        text_response = part["text"].strip()
+                        # Intentar extraer JSON de la respuesta
+                        try:
+                            # Buscar el JSON en la respuesta
+                            json_start = text_response.find('{')
+                            json_end = text_response.rfind('}') + 1
+                            if json_start != -1 and json_end > json_start:
+                                json_str = text_response[json_start:json_end]
+                                web_data = json.loads(json_str)
+                                return {
+                                    'success': True,
+                                    'data': web_data
+                                }
+                            else:
+                                return {'success': False, 'error': 'No se encontró JSON en la respuesta'}
+                        except json.JSONDecodeError:
+                            return {'success': False, 'error': 'Error parseando JSON de la respuesta'}
         
-        response = requests.post(url, headers=headers, json=payload, timeout=60)
+        return {'success': False, 'error': 'No se encontró contenido en la respuesta'}
+    else:
+        return {'success': False, 'error': f'Error API Gemini: {status_code}'}
+
+def search_product_web_data(ean, product_name, api_key):
+    """Busca información adicional del producto en internet usando Gemini 2.5 Flash-Lite"""
+    try:
+        payload = build_web_data_payload(ean, product_name)
         
-        if response.status_code == 200:
-            data = response.json()
-            
-            if "candidates" in data and data["candidates"]:
-                candidate = data["candidates"][0]
-                if "content" in candidate and "parts" in candidate["content"]:
-                    for part in candidate["content"]["parts"]:
-                        if "text" in part:
-                            text_response = part["text"].strip()
-                            # Intentar extraer JSON de la respuesta
-                            try:
-                                # Buscar el JSON en la respuesta
-                                json_start = text_response.find('{')
-                                json_end = text_response.rfind('}') + 1
-                                if json_start != -1 and json_end > json_start:
-                                    json_str = text_response[json_start:json_end]
-                                    web_data = json.loads(json_str)
-                                    return {
-                                        'success': True,
-                                        'data': web_data
-                                    }
-                                else:
-                                    return {'success': False, 'error': 'No se encontró JSON en la respuesta'}
-                            except json.JSONDecodeError:
-                                return {'success': False, 'error': 'Error parseando JSON de la respuesta'}
-            
-            return {'success': False, 'error': 'No se encontró contenido en la respuesta'}
-        else:
-            return {'success': False, 'error': f'Error API Gemini: {response.status_code}'}
+        circuit.check('gemini_text')
+        try:
+            with metrics.stage_timer('gemini_text'):
+                response = requests.post(gemini_url(GEMINI_TEXT_MODEL), headers=gemini_headers(api_key), json=payload, timeout=deadlines.timeout(60))
+        except requests.exceptions.RequestException:
+            metrics.record_upstream('gemini_text')
+            raise
+        metrics.record_upstream('gemini_text', response)
+        
+        data = response.json() if response.status_code == 200 else None
+        return parse_web_data_response(response.status_code, data)
     
     except Exception as e:
         return {'success': False, 'error': f'Error buscando datos web: {str(e)}'}
 
+def build_serpapi_params(ean, product_name, serpapi_key):
+    """Parámetros de SerpAPI Google Images para UNA imagen grande y cuadrada"""
+    # Construir query de búsqueda
+    search_query = f"{ean}"
+    if product_name and product_name != 'No disponible':
+        search_query = f"{product_name} {ean}"
+    
+    return {
+        "engine": "google_images",
+        "q": search_query,
+        "google_domain": "google.com",
+        "gl": "us",
+        "hl": "en",
+        "api_key": serpapi_key,
+        "imgsz": "l",  # Solo imágenes grandes
+        "imgar": "s",  # Solo imágenes cuadradas
+        "image_type": "photo",  # Solo fotos
+        "safe": "active"
+    }
+
+def pick_serpapi_image(status_code, data):
+    """Elige la primera imagen de los resultados de SerpAPI.
+    
+    Devuelve (img_info, None) o (None, resultado_de_error).
+    """
+    if status_code != 200:
+        logger.warning(f"  ⚠️ Error en Google Images API: {status_code}")
+        return None, {'success': False, 'error': f'Error en Google Images API: {status_code}'}
+    
+    images = data.get('images_results', [])
+    if not images:
+        logger.warning("  ⚠️ No se encontraron imágenes en Google Images")
+        return None, {'success': False, 'error': 'No se encontraron imágenes en Google Images'}
+    
+    logger.info(f"  ✓ Encontradas {len(images)} imágenes en Google Images")
+    
+    # Tomar SOLO la primera imagen (la mejor)
+    img_info = images[0]
+    if not img_info.get('original'):
+        logger.warning("  ⚠️ Primera imagen no tiene URL original")
+        return None, {'success': False, 'error': 'Imagen sin URL original'}
+    
+    return img_info, None
+
+def build_downloaded_image_result(status_code, content, content_type, img_info):
+    """Valida con PIL la imagen descargada y arma el resultado (trabajo de CPU)"""
+    if status_code == 200 and len(content) > 1000:
+        # Verificar que sea una imagen válida
+        try:
+            from PIL import Image
+            img = Image.open(BytesIO(content))
+            width, height = img.size
+            
+            logger.info(f"  ✓ Imagen Google encontrada: {width}x{height} desde {img_info.get('source', 'desconocido')}")
+            
+            # Convertir a base64
+            image_base64 = base64.b64encode(content).decode('utf-8')
+            
+            return {
+                'success': True,
+                'image_data': image_base64,
+                'content_type': content_type or 'image/jpeg',
+                'size': len(content),
+                'source': f'Google Images ({img_info.get("source", "desconocido")})',
+                'quality': 'alta' if width >= 800 else 'media' if width >= 400 else 'baja'
+            }
+        except Exception as img_error:
+            logger.warning(f"  ⚠️ Imagen no válida: {img_error}")
+            return {'success': False, 'error': 'Imagen no válida'}
+    else:
+        logger.warning(f"  ⚠️ Error descargando imagen: {status_code}")
+        return {'success': False, 'error': f'Error descargando imagen: {status_code}'}
+
 def search_web_images(ean, product_name=None):
     """Busca UNA SOLA imagen del producto usando Google Images API de SerpAPI"""
     try:
@@ -276,158 +489,144 @@ def search_web_images(ean, product_name=None):
             logger.error("❌ SERPAPI_KEY no configurada - SOLO búsqueda web disponible")
             return {'success': False, 'error': 'SERPAPI_KEY no configurada'}
         
-        # Construir query de búsqueda
-        search_query = f"{ean}"
-        if product_name and product_name != 'No disponible':
-            search_query = f"{product_name} {ean}"
-        
-        url = "https://serpapi.com/search.json"
-        params = {
-            "engine": "google_images",
-            "q": search_query,
-            "google_domain": "google.com",
-            "gl": "us",
-            "hl": "en",
-            "api_key": serpapi_key,
-            "imgsz": "l",  # Solo imágenes grandes
-            "imgar": "s",  # Solo imágenes cuadradas
-            "image_type": "photo",  # Solo fotos
-            "safe": "active"
-        }
+        params = build_serpapi_params(ean, product_name, serpapi_key)
+        
+        logger.info(f"  🌐 Buscando UNA imagen en Google Images para: {params['q']}")
+        circuit.check('serpapi')
+        try:
+            with metrics.stage_timer('serpapi'):
+                response = requests.get(SERPAPI_URL, params=params, timeout=deadlines.timeout(15))
+        except requests.exceptions.RequestException:
+            metrics.record_upstream('serpapi')
+            raise
+        metrics.record_upstream('serpapi', response)
+        
+        img_info, error_result = pick_serpapi_image(response.status_code, response.json() if response.status_code == 200 else None)
+        if error_result:
+            return error_result
         
-        logger.info(f"  🌐 Buscando UNA imagen en Google Images para: {search_query}")
-        response = requests.get(url, params=params, timeout=15)
+        img_url = img_info['original']
+        # En modo 'race' otra fuente puede haber ganado mientras se buscaba
+        if image_sources.cancelled():
+            return {'success': False, 'error': 'Fuente cancelada: otra ya encontró imagen'}
+        logger.info(f"  🔍 Descargando imagen: {img_url[:50]}...")
         
-        if response.status_code == 200:
-            data = response.json()
-            images = data.get('images_results', [])
+        def send(conditional_headers):
+            try:
+                with metrics.stage_timer('image_download'):
+                    img_response = requests.get(img_url, timeout=deadlines.timeout(10),
+                                                headers={**IMAGE_DOWNLOAD_HEADERS, **conditional_headers})
+            except requests.exceptions.RequestException:
+                metrics.record_upstream('image_host')
+                raise
+            metrics.record_upstream('image_host', img_response)
+            return img_response
+        
+        try:
+            img_response = http_cache.cached_get('image', img_url, send)
             
-            if images:
-                logger.info(f"  ✓ Encontradas {len(images)} imágenes en Google Images")
-                
-                # Tomar SOLO la primera imagen (la mejor)
-                img_info = images[0]
-                img_url = img_info.get('original')
-                
-                if not img_url:
-                    logger.warning("  ⚠️ Primera imagen no tiene URL original")
-                    return {'success': False, 'error': 'Imagen sin URL original'}
-                
-                logger.info(f"  🔍 Descargando imagen: {img_url[:50]}...")
-                
-                try:
-                    img_response = requests.get(img_url, timeout=10, headers={
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-                    })
-                    
-                    if img_response.status_code == 200 and len(img_response.content) > 1000:
-                        # Verificar que sea una imagen válida
-                        try:
-                            img = Image.open(BytesIO(img_response.content))
-                            width, height = img.size
-                            
-                            logger.info(f"  ✓ Imagen Google encontrada: {width}x{height} desde {img_info.get('source', 'desconocido')}")
-                            
-                            # Convertir a base64
-                            image_base64 = base64.b64encode(img_response.content).decode('utf-8')
-                            
-                            return {
-                                'success': True,
-                                'image_data': image_base64,
-                                'content_type': img_response.headers.get('content-type', 'image/jpeg'),
-                                'size': len(img_response.content),
-                                'source': f'Google Images ({img_info.get("source", "desconocido")})',
-                                'quality': 'alta' if width >= 800 else 'media' if width >= 400 else 'baja'
-                            }
-                        except Exception as img_error:
-                            logger.warning(f"  ⚠️ Imagen no válida: {img_error}")
-                            return {'success': False, 'error': 'Imagen no válida'}
-                    else:
-                        logger.warning(f"  ⚠️ Error descargando imagen: {img_response.status_code}")
-                        return {'success': False, 'error': f'Error descargando imagen: {img_response.status_code}'}
-                        
-                except Exception as download_error:
-                    logger.warning(f"  ⚠️ Error descargando imagen: {str(download_error)}")
-                    return {'success': False, 'error': f'Error descargando imagen: {str(download_error)}'}
-            else:
-                logger.warning("  ⚠️ No se encontraron imágenes en Google Images")
-                return {'success': False, 'error': 'No se encontraron imágenes en Google Images'}
-        else:
-            logger.warning(f"  ⚠️ Error en Google Images API: {response.status_code}")
-            return {'success': False, 'error': f'Error en Google Images API: {response.status_code}'}
+            return build_downloaded_image_result(
+                img_response.status_code,
+                img_response.content,
+                img_response.headers.get('content-type'),
+                img_info
+            )
+        except Exception as download_error:
+            logger.warning(f"  ⚠️ Error descargando imagen: {str(download_error)}")
+            return {'success': False, 'error': f'Error descargando imagen: {str(download_error)}'}
     
     except Exception as e:
         logger.error(f"  ❌ Error en búsqueda web: {e}")
         return {'success': False, 'error': f'Error en búsqueda web: {str(e)}'}
 
+def fetch_off_image(ean, off_image_url):
+    """Fuente 'off': la foto frontal de OFF a resolución completa (la de image_url es de 400 px)"""
+    result = {'success': False, 'error': 'El producto no tiene imagen en OFF'}
+    for url in image_sources.off_image_urls(off_image_url):
+        if image_sources.cancelled():
+            return {'success': False, 'error': 'Fuente cancelada: otra ya encontró imagen'}
+        result = download_image(url, ean)
+        if result['success']:
+            result['source'] = 'Open Food Facts'
+            return result
+    return result
+
+def image_source_fetchers(ean, product_name, off_image_url):
+    """Fuentes de la cascada de imágenes para un EAN (ver image_sources.py)"""
+    return {
+        'off': lambda: fetch_off_image(ean, off_image_url),
+        'serpapi': lambda: search_web_images(ean, product_name),
+    }
+
 def search_and_download_product_image(ean, product_name, image_url_fallback=None):
-    """Busca y descarga UNA SOLA imagen del producto usando SOLO Google Images"""
+    """Busca y descarga UNA SOLA imagen del producto: primero la de OFF (image_url_fallback), luego Google Images"""
     try:
-        # SOLO usar Google Images
-        web_result = search_web_images(ean, product_name)
-        if web_result['success']:
-            return web_result
-        
-        # Si falla Google Images, retornar error
-        logger.warning(f"  ❌ No se encontró imagen en Google Images para {ean}")
-        return {
-            'success': False,
-            'error': 'No se pudo encontrar imagen del producto en Google Images'
-        }
+        result = image_sources.cascade(image_source_fetchers(ean, product_name, image_url_fallback))
+        if not result['success']:
+            logger.warning(f"  ❌ No se encontró imagen para {ean} en ninguna fuente")
+        return result
     
     except Exception as e:
         return {'success': False, 'error': f'Error buscando imagen: {str(e)}'}
 
+def build_enhance_payload(image_data_base64, prompt):
+    """Payload de Gemini Image Preview con el prompt y la imagen en línea"""
+    return {
+        "contents": [
+            {
+                "parts": [
+                    {
+                        "text": prompt
+                    },
+                    {
+                        "inline_data": {
+                            "mime_type": "image/jpeg",
+                            "data": image_data_base64
+                        }
+                    }
+                ]
+            }
+        ]
+    }
+
+def parse_enhance_response(status_code, data):
+    """Extrae la imagen mejorada (base64) de la respuesta de Gemini"""
+    if status_code == 200:
+        if "candidates" in data and data["candidates"]:
+            candidate = data["candidates"][0]
+            if "content" in candidate and "parts" in candidate["content"]:
+                for part in candidate["content"]["parts"]:
+                    if "inlineData" in part:
+                        # Devolver imagen mejorada como base64
+                        enhanced_image_base64 = part['inlineData']['data']
+                        return {
+                            'success': True, 
+                            'image_data': enhanced_image_base64,
+                            'content_type': 'image/png'
+                        }
+        
+        return {'success': False, 'error': 'No se pudo procesar la imagen con IA'}
+    else:
+        return {'success': False, 'error': f'Error API Gemini: {status_code}'}
+
 def enhance_image_with_gemini(image_data_base64, prompt, api_key):
     """Mejora la imagen usando Google Gemini API (trabaja en memoria)"""
     try:
         # Preparar payload para Gemini
-        url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-image-preview:generateContent"
-        headers = {
-            "x-goog-api-key": api_key,
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "contents": [
-                {
-                    "parts": [
-                        {
-                            "text": prompt
-                        },
-                        {
-                            "inline_data": {
-                                "mime_type": "image/jpeg",
-                                "data": image_data_base64
-                            }
-                        }
-                    ]
-                }
-            ]
-        }
+        payload = build_enhance_payload(image_data_base64, prompt)
         
         # Llamar a la API
-        response = requests.post(url, headers=headers, json=payload, timeout=60)
+        circuit.check('gemini_image')
+        try:
+            with metrics.stage_timer('gemini_image'):
+                response = requests.post(gemini_url(GEMINI_IMAGE_MODEL), headers=gemini_headers(api_key), json=payload, timeout=deadlines.timeout(60))
+        except requests.exceptions.RequestException:
+            metrics.record_upstream('gemini_image')
+            raise
+        metrics.record_upstream('gemini_image', response)
         
-        if response.status_code == 200:
-            data = response.json()
-            
-            if "candidates" in data and data["candidates"]:
-                candidate = data["candidates"][0]
-                if "content" in candidate and "parts" in candidate["content"]:
-                    for part in candidate["content"]["parts"]:
-                        if "inlineData" in part:
-                            # Devolver imagen mejorada como base64
-                            enhanced_image_base64 = part['inlineData']['data']
-                            return {
-                                'success': True, 
-                                'image_data': enhanced_image_base64,
-                                'content_type': 'image/png'
-                            }
-            
-            return {'success': False, 'error': 'No se pudo procesar la imagen con IA'}
-        else:
-            return {'success': False, 'error': f'Error API Gemini: {response.status_code}'}
+        data = response.json() if response.status_code == 200 else None
+        return parse_enhance_response(response.status_code, data)
     
     except Exception as e:
         return {'success': False, 'error': f'Error procesando imagen: {str(e)}'}
@@ -511,27 +710,71 @@ def combine_product_data(ean, off_data, web_data):
             'Producto Encontrado': 'no'
         }
 
-def remove_white_background(image_data_base64):
-    """Remueve el fondo blanco de una imagen usando rembg"""
+# Sesión de rembg compartida: cargar el modelo ONNX cuesta segundos y ~170MB, así que
+# se crea una sola vez por proceso (o en el master antes del fork con PRELOAD_MODELS=1).
+# Modelo, hilos y modo cuantizado se configuran en segmentation.py
+_rembg_session = None
+_rembg_session_lock = threading.Lock()
+
+def get_rembg_session():
+    """Devuelve la sesión de rembg del proceso, creándola en el primer uso"""
+    global _rembg_session
+    if _rembg_session is None:
+        with _rembg_session_lock:
+            if _rembg_session is None:
+                started = time.perf_counter()
+                _rembg_session = segmentation.new_session()
+                logger.info(f"✓ Modelo rembg {segmentation.describe()} cargado en {(time.perf_counter() - started) * 1000:.0f} ms "
+                            f"(RSS {metrics.current_rss_bytes() / 1024 / 1024:.0f} MB)")
+    return _rembg_session
+
+_rembg_batcher = None
+
+def get_rembg_batcher():
+    """Agrupador de inferencias de rembg del proceso (ver segmentation.Batcher)"""
+    global _rembg_batcher
+    if _rembg_batcher is None:
+        session = get_rembg_session()
+        with _rembg_session_lock:
+            if _rembg_batcher is None:
+                _rembg_batcher = segmentation.Batcher(session)
+    return _rembg_batcher
+
+def remove_white_background(image_data_base64, fast_path=None):
+    """Remueve el fondo blanco de una imagen (atajo NumPy si el fondo es uniforme; si no, rembg)"""
     try:
-        # Importación lazy de rembg para evitar timeout en el inicio
-        try:
-            from rembg import remove
-        except ImportError as ie:
-            print(f"⚠️ rembg no disponible: {ie}")
-            return {
-                'success': False,
-                'error': 'Librería rembg no disponible en este entorno'
-            }
-        
         # Decodificar la imagen base64
         image_bytes = base64.b64decode(image_data_base64)
         
         # Abrir imagen con PIL
+        from PIL import Image
         input_image = Image.open(BytesIO(image_bytes))
         
-        # Remover fondo usando rembg
-        output_image = remove(input_image)
+        # Fondo blanco uniforme (lo habitual tras Gemini): máscara NumPy en milisegundos
+        output_image, method = None, 'fast'
+        use_fast = image_matting.BG_FAST_PATH if fast_path is None else fast_path
+        if use_fast:
+            output_image, reason = image_matting.remove_uniform_background(input_image)
+            if output_image is None:
+                metrics.BG_FAST_REJECTIONS.inc(reason)
+        
+        if output_image is None:
+            # Importación lazy de rembg para evitar timeout en el inicio
+            try:
+                import rembg  # noqa: F401
+            except ImportError as ie:
+                print(f"⚠️ rembg no disponible: {ie}")
+                return {
+                    'success': False,
+                    'error': 'Librería rembg no disponible en este entorno'
+                }
+            
+            # Remover fondo usando rembg (sesión ONNX compartida, en lote con otros EANs en curso)
+            batcher = get_rembg_batcher()
+            with metrics.stage_timer('rembg'):
+                output_image = batcher.remove(input_image)
+            method = 'rembg'
+        metrics.BG_REMOVALS.inc(method)
         
         # Convertir a base64
         output_buffer = BytesIO()
@@ -542,15 +785,238 @@ def remove_white_background(image_data_base64):
         return {
             'success': True,
             'image_data': output_base64,
-            'content_type': 'image/png'
+            'content_type': 'image/png',
+            'method': method
         }
     
     except Exception as e:
         return {'success': False, 'error': f'Error removiendo fondo: {str(e)}'}
 
+ENHANCE_PROMPT = (
+    "Take the provided product image and enhance it for PrestaShop e-commerce platform. "
+    "Create a square image (800x800 pixels) with these specifications: "
+    "1. Remove the background completely and replace it with pure white (#FFFFFF). "
+    "2. Center the product perfectly in the frame. "
+    "3. The product should occupy 80-85% of the image space, leaving appropriate margins. "
+    "4. Show the product from the front in its most recognizable angle. "
+    "5. Enhance lighting to be even and professional, eliminating shadows on the background. "
+    "6. Improve sharpness and color accuracy for high-quality zoom capability. "
+    "7. Ensure the product looks professional, clean, and appealing for online sales. "
+    "8. Keep the product realistic and true to its original appearance. "
+    "The final image must be optimized for PrestaShop product listings with consistent quality."
+)
+
+def process_product_image(ean, image_data_base64, api_key):
+    """Mejora con IA y remueve el fondo de la imagen de un EAN (común a los modos masivos)"""
+    image_filename = f"{ean}.png"
+    
+    # Si no hay API key, usar imagen original - Solo EAN como nombre
+    if not api_key:
+        logger.info(f"  ✓ Imagen guardada (sin IA): {image_filename}")
+        return {
+            'success': True,
+            'filename': image_filename,
+            'image_data': image_data_base64,
+            'message': 'Imagen guardada (sin IA)'
+        }
+    
+    # Si la imagen ya es un packshot apto (cuadrada, fondo blanco...) no hace falta Gemini
+    quality = check_image_quality(ean, image_data_base64)
+    if quality and quality['passes']:
+        logger.info(f"  ⏭️ Imagen ya cumple la especificación para {ean}, se omite la IA")
+        image_data_enhanced = image_data_base64
+        message = 'Imagen ya apta, IA omitida'
+    elif not deadlines.allows('gemini_image'):
+        # Sin presupuesto para una llamada de ~60 s: mejor la imagen original que ninguna
+        logger.warning(f"  ⏱️ Sin tiempo para la IA de {ean}, se guarda la imagen original")
+        image_data_enhanced = image_data_base64
+        message = 'Imagen guardada sin IA (tiempo del trabajo agotado)'
+    else:
+        # Mejorar imagen con Gemini Image Preview
+        logger.info(f"  🤖 Mejorando imagen con IA para {ean}")
+        try:
+            enhance_result = enhance_image_with_gemini(image_data_base64, ENHANCE_PROMPT, api_key)
+        except Exception as e:
+            logger.error(f"  ❌ Excepción en mejora de imagen para {ean}: {e}")
+            return {'success': False, 'message': f'Error: {str(e)}', 'quality': quality}
+        
+        if not enhance_result['success']:
+            logger.warning(f"  ⚠️ Error mejorando imagen: {enhance_result.get('error', 'Unknown')}")
+            return {'success': False, 'message': 'Error mejorando imagen', 'quality': quality}
+        
+        logger.info(f"  ✓ Imagen mejorada con IA para {ean}")
+        image_data_enhanced = enhance_result['image_data']
+        message = 'Imagen procesada correctamente'
+    
+    return finalize_product_image(ean, image_data_enhanced, message, quality)
+
+def finalize_product_image(ean, image_data_enhanced, message, quality=None):
+    """Remueve el fondo de la imagen ya mejorada (o apta) y arma el resultado final del EAN"""
+    image_filename = f"{ean}.png"
+    
+    # Remover fondo con rembg (si falla o no queda tiempo, se conserva la imagen mejorada)
+    image_data_final = image_data_enhanced
+    if not deadlines.allows('rembg'):
+        logger.warning(f"  ⏱️ Sin tiempo para remover el fondo de {ean}")
+    else:
+        logger.info(f"  🎨 Removiendo fondo para {ean}")
+        try:
+            remove_bg_result = remove_white_background(image_data_enhanced)
+            if remove_bg_result['success']:
+                image_data_final = remove_bg_result['image_data']
+        except Exception as e:
+            logger.error(f"  ❌ Error en rembg para {ean}: {e}")
+    
+    logger.info(f"  ✓ Imagen guardada: {image_filename}")
+    return {
+        'success': True,
+        'filename': image_filename,
+        'image_data': image_data_final,
+        'message': message,
+        'quality': quality
+    }
+
+def process_product_image_deduped(ean, image_data_base64, api_key, dedupe):
+    """process_product_image reutilizando el resultado de una imagen casi idéntica ya procesada"""
+    image_hash = image_dedupe.image_hash(image_data_base64) if dedupe is not None else None
+    if image_hash is None:
+        return process_product_image(ean, image_data_base64, api_key)
+    
+    entry, owner = dedupe.claim(image_hash, ean)
+    if not owner:
+        if entry.wait(deadlines.timeout(image_dedupe.DEDUPE_WAIT_SECONDS)):
+            metrics.record_cache('image_dedupe', True)
+            logger.info(f"  ♻️ Imagen de {ean} duplicada de la de {entry.ean}, se reutiliza")
+            return image_dedupe.shared_result(entry, ean)
+        return process_product_image(ean, image_data_base64, api_key)
+    
+    metrics.record_cache('image_dedupe', False)
+    result = None
+    try:
+        result = process_product_image(ean, image_data_base64, api_key)
+        return result
+    finally:
+        dedupe.resolve(entry, result)
+
+def find_product_image(ean, use_cascade=True):
+    """Nombre en OFF + búsqueda de la imagen de un EAN (rutas de imágenes).
+    
+    Con use_cascade=False busca solo en Google Images (/process_bulk_images).
+    """
+    # Obtener solo datos básicos de OFF para el nombre (sin procesar con Gemini)
+    product_result = get_product_data(ean)
+    product_name = 'producto'
+    image_url_fallback = None
+    
+    if product_result['success']:
+        off_product = product_result['data']
+        product_name = off_product.get('name', 'producto')
+        image_url_fallback = off_product.get('image_url')
+    
+    logger.info(f"  🖼️ Buscando imagen para {ean}")
+    if use_cascade:
+        return search_and_download_product_image(ean, product_name, image_url_fallback)
+    return search_web_images(ean, product_name)
+
+def process_image_item(ean, api_key, dedupe=None, use_cascade=True):
+    """Búsqueda, IA y remoción de fondo de un EAN de las rutas de imágenes (modo síncrono)"""
+    image_search_result = find_product_image(ean, use_cascade)
+    if not image_search_result['success']:
+        logger.warning(f"  ⚠️ No se pudo encontrar imagen: {image_search_result.get('error', 'Unknown')}")
+        return {'success': False, 'message': 'No se encontró imagen'}
+    
+    logger.info(f"  ✓ Imagen encontrada (fuente: {image_search_result.get('source', 'desconocida')})")
+    return process_product_image_deduped(ean, image_search_result['image_data'], api_key, dedupe)
+
+def check_image_quality(ean, image_data_base64):
+    """Análisis de la imagen de origen frente a la especificación final (None si está desactivado o falla)"""
+    if os.environ.get('SKIP_ENHANCE_IF_GOOD', '1').lower() not in ('1', 'true', 'yes'):
+        return None
+    try:
+        quality = image_quality.assess_image(image_data_base64)
+        logger.info(f"  🔍 Calidad de imagen {ean}: {quality['scores']} (falla: {quality['failed'] or 'nada'})")
+        return quality
+    except Exception as e:
+        logger.warning(f"  ⚠️ No se pudo analizar la imagen de {ean}: {e}")
+        return None
+
+def progress_event(ean, success, message, timings=None, **extra):
+    """Evento SSE 'progress' de un EAN, con el desglose de tiempos por etapa"""
+    payload = {'type': 'progress', 'ean': ean, 'success': success, 'message': message}
+    if timings is not None:
+        payload['timings'] = timings.current()
+    payload.update(extra)
+    return f"data: {json.dumps(payload)}\n\n"
+
+def build_thumbnail(image_bytes, max_side=None):
+    """Miniatura JPEG (sobre fondo blanco si la imagen tiene transparencia) para la UI"""
+    from PIL import Image
+    
+    max_side = max_side or THUMBNAIL_SIZE
+    with metrics.stage_timer('thumbnail'):
+        with Image.open(BytesIO(image_bytes)) as img:
+            img.draft('RGB', (max_side, max_side))
+            img.thumbnail((max_side, max_side))
+            if img.mode in ('RGBA', 'LA', 'P'):
+                img = img.convert('RGBA')
+                thumb = Image.new('RGB', img.size, (255, 255, 255))
+                thumb.paste(img, mask=img.getchannel('A'))
+            else:
+                thumb = img.convert('RGB')
+        buffer = BytesIO()
+        thumb.save(buffer, format='JPEG', quality=80)
+    return buffer.getvalue()
+
+def publish_item(job_id, image_result):
+    """Deja la imagen terminada (y su miniatura) descargable al momento; devuelve sus URLs para el evento 'progress'"""
+    if not job_id or not image_result.get('success'):
+        return {}
+    filename = image_result['filename']
+    thumbnail_name = f"{os.path.splitext(filename)[0]}_thumb.jpg"
+    try:
+        image_bytes = base64.b64decode(image_result['image_data'])
+        artifacts.store.put_item(job_id, filename, image_bytes)
+        artifacts.store.put_item(job_id, thumbnail_name, build_thumbnail(image_bytes))
+    except Exception as e:
+        logger.warning(f"  ⚠️ No se pudo publicar la imagen {filename}: {e}")
+        return {}
+    return {'image_url': f"/job_items/{job_id}/{filename}", 'thumbnail_url': f"/job_items/{job_id}/{thumbnail_name}"}
+
+def job_event(job_id):
+    """Primer evento de las rutas de imágenes: id del trabajo y URL del ZIP parcial"""
+    return f"data: {json.dumps({'type': 'job', 'job_id': job_id, 'partial_url': f'/download_partial/{job_id}'})}\n\n"
+
+def deadline_notice(route):
+    """Evento 'warning' cuando el trabajo agota su presupuesto y deja de empezar EANs"""
+    metrics.DEADLINE_HITS.inc(route)
+    logger.warning(f"⏱️ Tiempo del trabajo agotado en {route}: los EANs restantes quedan pendientes")
+    return {'type': 'warning', 'deadline': True,
+            'message': 'Tiempo del trabajo agotado: se entrega lo terminado y el resto queda pendiente'}
+
+def memory_notice(route):
+    """Evento 'warning' cuando el trabajo agota su presupuesto de memoria y deja de empezar EANs"""
+    metrics.MEMORY_BUDGET_HITS.inc(route)
+    job_memory = memory.current()
+    logger.warning(f"🧠 Memoria del trabajo agotada en {route} (+{job_memory.growth_bytes() / 1024 / 1024:.0f} MB "
+                   f"de {job_memory.budget_bytes / 1024 / 1024:.0f} MB): los EANs restantes quedan pendientes")
+    return {'type': 'warning', 'memory': True,
+            'message': 'Memoria del trabajo agotada: se entrega lo terminado y el resto queda pendiente'}
+
+def job_stop_notice(route):
+    """Aviso del presupuesto (memoria o tiempo) que hizo dejar de empezar EANs"""
+    return memory_notice(route) if memory.exhausted() else deadline_notice(route)
+
+def job_memory_summary():
+    """Resumen de memoria del trabajo en curso para el evento 'complete' (también al log)"""
+    summary = memory.summary()
+    logger.info(f"🧠 Resumen de memoria: {json.dumps(summary)}")
+    return summary
+
 def create_excel_data(product_data, ean):
     """Crea datos Excel en memoria (no guarda archivos)"""
     try:
+        from openpyxl import Workbook
+        
         wb = Workbook()
         ws = wb.active
         ws.title = "Datos del Producto"
@@ -587,7 +1053,6 @@ def create_excel_data(product_data, ean):
         ws.column_dimensions['B'].width = 50
         
         # Guardar en memoria como bytes
-        from io import BytesIO
         excel_buffer = BytesIO()
         wb.save(excel_buffer)
         excel_data = excel_buffer.getvalue()
@@ -613,6 +1078,43 @@ def health():
         'timestamp': datetime.now().isoformat()
     }), 200
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Métricas en formato Prometheus (latencias por etapa, upstreams, trabajos en curso)"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+def admin_authorized():
+    """True si ADMIN_TOKEN está configurado y la petición trae el mismo en X-Admin-Token"""
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+
+@app.route('/admin/memory')
+def admin_memory():
+    """RSS del worker, memoria de los trabajos en curso y recientes y (si se perfila) top de asignaciones"""
+    if not admin_authorized():
+        return jsonify({'error': 'No autorizado'}), 403
+    return jsonify(memory.status(top=request.args.get('top', type=int)))
+
+@app.route('/admin/memory/profile', methods=['POST'])
+def admin_memory_profile():
+    """Activa (enabled=1) o desactiva (enabled=0) tracemalloc en este worker"""
+    if not admin_authorized():
+        return jsonify({'error': 'No autorizado'}), 403
+    if request.values.get('enabled', '1').lower() in ('0', 'false', 'no', 'off'):
+        memory.stop_profiling()
+        logger.info("🧠 Perfilado de memoria desactivado")
+    else:
+        memory.start_profiling()
+        logger.info("🧠 Perfilado de memoria activado (tracemalloc)")
+    return jsonify(memory.status())
+
+@app.after_request
+def count_bytes_out(response):
+    """Contabiliza los bytes enviados en respuestas no streaming (las SSE se cuentan en track_job)"""
+    if not response.is_streamed and request.endpoint not in (None, 'metrics_endpoint', 'static'):
+        metrics.add_bytes_out(request.endpoint, response.content_length or 0)
+    return response
+
 @app.route('/')
 def index():
     """Pantalla de inicio con opciones de búsqueda"""
@@ -664,152 +1166,130 @@ def process_bulk_images():
             
             images_data = []
             api_key = os.getenv("GEMINI_API_KEY")
+            timings = JobTimings()
+            dedupe = image_dedupe.job_index()
+            unfinished = []
+            # Cada imagen terminada se puede descargar al momento (y el ZIP parcial en cualquier punto)
+            job_id = artifacts.store.new_job_id()
+            yield job_event(job_id)
             
-            # Procesar cada EAN - SOLO IMÁGENES
-            for idx, ean in enumerate(eans):
-                logger.info(f"🔄 Procesando imagen {idx+1}/{len(eans)}: {ean}")
+            # Procesar cada EAN - SOLO IMÁGENES (un turno del planificador por EAN, ver scheduler.py)
+            for idx, ean in enumerate(metrics.track_items(scheduler.turns(eans, request_client()))):
                 ean = ean.strip()
+                # Sin presupuesto (tiempo o memoria) para otro EAN: los restantes quedan pendientes y se entrega lo hecho
+                if deadlines.exhausted() or memory.exhausted():
+                    if not unfinished:
+                        yield f"data: {json.dumps(job_stop_notice('process_bulk_images'))}\n\n"
+                    unfinished.append(ean)
+                    continue
+                logger.info(f"🔄 Procesando imagen {idx+1}/{len(eans)}: {ean}")
+                timings.begin(ean)
                 
                 try:
-                    # Obtener solo datos básicos de OFF para el nombre (sin procesar con Gemini)
-                    product_result = get_product_data(ean)
-                    product_name = 'producto'
-                    
-                    if product_result['success']:
-                        off_product = product_result['data']
-                        product_name = off_product.get('name', 'producto')
-                    
                     # Buscar imagen usando Google Images API
-                    logger.info(f"  🖼️ Buscando imagen en Google Images para {ean}")
-                    image_search_result = search_web_images(ean, product_name)
+                    image_search_result = find_product_image(ean, use_cascade=False)
                     
                     if image_search_result['success']:
                         logger.info(f"  ✓ Imagen encontrada (fuente: {image_search_result.get('source', 'desconocida')})")
                         
-                        # Mejorar imagen con Gemini Image Preview si hay API key
-                        if api_key:
-                            logger.info(f"  🤖 Mejorando imagen con IA para {ean}")
-                            prompt = ("Take the provided product image and enhance it for PrestaShop e-commerce platform. "
-                                    "Create a square image (800x800 pixels) with these specifications: "
-                                    "1. Remove the background completely and replace it with pure white (#FFFFFF). "
-                                    "2. Center the product perfectly in the frame. "
-                                    "3. The product should occupy 80-85% of the image space, leaving appropriate margins. "
-                                    "4. Show the product from the front in its most recognizable angle. "
-                                    "5. Enhance lighting to be even and professional, eliminating shadows on the background. "
-                                    "6. Improve sharpness and color accuracy for high-quality zoom capability. "
-                                    "7. Ensure the product looks professional, clean, and appealing for online sales. "
-                                    "8. Keep the product realistic and true to its original appearance. "
-                                    "The final image must be optimized for PrestaShop product listings with consistent quality.")
-                            
-                            try:
-                                enhance_result = enhance_image_with_gemini(image_search_result['image_data'], prompt, api_key)
-                                if enhance_result['success']:
-                                    logger.info(f"  ✓ Imagen mejorada con IA para {ean}")
-                                    # Remover fondo con rembg
-                                    logger.info(f"  🎨 Removiendo fondo para {ean}")
-                                    try:
-                                        remove_bg_result = remove_white_background(enhance_result['image_data'])
-                                        if remove_bg_result['success']:
-                                            image_data_final = remove_bg_result['image_data']
-                                        else:
-                                            image_data_final = enhance_result['image_data']
-                                    except Exception as e:
-                                        logger.error(f"  ❌ Error en rembg para {ean}: {e}")
-                                        image_data_final = enhance_result['image_data']
-                                    
-                                    # Guardar imagen - Solo EAN como nombre
-                                    image_filename = f"{ean}.png"
-                                    
-                                    images_data.append({
-                                        'filename': image_filename,
-                                        'data': image_data_final
-                                    })
-                                    logger.info(f"  ✓ Imagen guardada: {image_filename}")
-                                    yield f"data: {json.dumps({'type': 'progress', 'ean': ean, 'success': True, 'message': 'Imagen procesada correctamente'})}\n\n"
-                                else:
-                                    logger.warning(f"  ⚠️ Error mejorando imagen: {enhance_result.get('error', 'Unknown')}")
-                                    yield f"data: {json.dumps({'type': 'progress', 'ean': ean, 'success': False, 'message': 'Error mejorando imagen'})}\n\n"
-                            except Exception as e:
-                                logger.error(f"  ❌ Excepción en mejora de imagen para {ean}: {e}")
-                                yield f"data: {json.dumps({'type': 'progress', 'ean': ean, 'success': False, 'message': f'Error: {str(e)}'})}\n\n"
-                        else:
-                            # Si no hay API key, usar imagen original - Solo EAN como nombre
-                            image_filename = f"{ean}.png"
-                            
+                        # Mejorar imagen con IA y remover fondo
+                        image_result = process_product_image_deduped(ean, image_search_result['image_data'], api_key, dedupe)
+                        if image_result['success']:
                             images_data.append({
-                                'filename': image_filename,
-                                'data': image_search_result['image_data']
+                                'filename': image_result['filename'],
+                                'data': image_result['image_data']
                             })
-                            logger.info(f"  ✓ Imagen guardada (sin IA): {image_filename}")
-                            yield f"data: {json.dumps({'type': 'progress', 'ean': ean, 'success': True, 'message': 'Imagen guardada (sin IA)'})}\n\n"
+                        yield progress_event(ean, image_result['success'], image_result['message'], timings,
+                                             quality=image_result.get('quality'),
+                                             duplicate_of=image_result.get('duplicate_of'),
+                                             **publish_item(job_id, image_result))
                     else:
                         logger.warning(f"  ⚠️ No se pudo encontrar imagen: {image_search_result.get('error', 'Unknown')}")
-                        yield f"data: {json.dumps({'type': 'progress', 'ean': ean, 'success': False, 'message': 'No se encontró imagen'})}\n\n"
+                        yield progress_event(ean, False, 'No se encontró imagen', timings)
                         
                 except Exception as e:
                     logger.error(f"  ❌ Error procesando imagen para {ean}: {e}")
-                    yield f"data: {json.dumps({'type': 'progress', 'ean': ean, 'success': False, 'message': f'Error: {str(e)}'})}\n\n"
+                    yield progress_event(ean, False, f'Error: {str(e)}', timings)
+            
+            timing_summary = timings.summary()
+            logger.info(f"⏱️ Resumen de tiempos: {json.dumps(timing_summary)}")
             
             # Crear archivo ZIP solo con imágenes
             logger.info(f"📦 Creando ZIP final con {len(images_data)} imágenes")
             if images_data:
                 try:
-                    zip_buffer = BytesIO()
-                    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                        # Agregar solo imágenes
-                        logger.info(f"  🖼️ Agregando {len(images_data)} imágenes...")
-                        for img in images_data:
-                            zip_file.writestr(f"imagenes/{img['filename']}", base64.b64decode(img['data']))
-                        logger.info("  ✓ Imágenes agregadas")
-                        
-                        # Listar contenido del ZIP
-                        zip_contents = zip_file.namelist()
-                        logger.info(f"  📋 Contenido del ZIP: {zip_contents}")
-                    
-                    zip_data = zip_buffer.getvalue()
-                    
-                    # Guardar en archivo temporal
-                    timestamp = int(time.time() * 1000)
-                    zip_filename = f"imagenes_google_{timestamp}.zip"
-                    zip_path = os.path.join(tempfile.gettempdir(), zip_filename)
+                    zip_data = build_zip(images_data, unfinished=unfinished)
                     
-                    with open(zip_path, 'wb') as f:
-                        f.write(zip_data)
-                    
-                    logger.info(f"✅ ZIP guardado en {zip_path} ({len(zip_data)} bytes)")
+                    # Guardar en el almacén de artefactos (TTL + cuota, ver artifacts.py)
+                    zip_filename = artifacts.store.put(zip_data, 'imagenes_google', job_id)
                     
                     # Enviar señal de completado con nombre del archivo
-                    yield f"data: {json.dumps({'type': 'complete', 'zip_filename': zip_filename})}\n\n"
+                    yield f"data: {json.dumps({'type': 'complete', 'zip_filename': zip_filename, 'job_id': job_id, 'timing_summary': timing_summary, 'memory_summary': job_memory_summary(), 'unfinished': unfinished})}\n\n"
                 except Exception as e:
                     logger.error(f"❌ Error creando ZIP: {e}", exc_info=True)
                     yield f"data: {json.dumps({'type': 'error', 'message': f'Error creando ZIP: {str(e)}'})}\n\n"
             else:
                 logger.warning("⚠️ No hay imágenes para procesar")
-                yield f"data: {json.dumps({'type': 'error', 'message': 'No se pudieron procesar imágenes'})}\n\n"
+                yield f"data: {json.dumps({'type': 'error', 'message': 'No se pudieron procesar imágenes', 'unfinished': unfinished})}\n\n"
         
         except Exception as e:
             logger.error(f"❌ ERROR FATAL en process_bulk_images: {e}", exc_info=True)
             yield f"data: {json.dumps({'type': 'error', 'message': f'Error: {str(e)}'})}\n\n"
     
-    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+    return Response(stream_with_context(metrics.track_job('process_bulk_images', circuit.announce(deadlines.bounded(generate())))), mimetype='text/event-stream')
+
+def request_client():
+    """Cliente de la petición para el reparto de turnos entre lotes"""
+    return scheduler.client_key(request.headers.get('X-Forwarded-For'), request.remote_addr)
+
+def interactive_turn(view):
+    """Atiende la vista con un turno interactivo del planificador (prioridad sobre los lotes).
+
+    La vista puede soltarlo durante una espera larga con scheduler.released().
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with scheduler.turn(scheduler.INTERACTIVE, request_client()):
+            return view(*args, **kwargs)
+    return wrapper
+
+def json_response(payload):
+    """jsonify comprimido con gzip si el cliente lo acepta y el cuerpo lo amerita"""
+    response = jsonify(payload)
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) >= JSON_GZIP_MIN_BYTES and 'gzip' in request.accept_encodings:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+def publish_asset(job_id, name, data_base64, content_type):
+    """Guarda un archivo de /process_ean en el almacén y devuelve la URL desde la que se sirve"""
+    extension = ASSET_EXTENSIONS.get((content_type or '').split(';')[0].strip().lower(), 'png')
+    filename = f"{name}.{extension}"
+    artifacts.store.put_item(job_id, filename, base64.b64decode(data_base64))
+    return f"/job_items/{job_id}/{filename}"
 
 @app.route('/process_ean', methods=['POST'])
+@interactive_turn
 def process_ean():
     try:
         ean = request.form.get('ean', '').strip()
         print(f"🔍 EAN recibido en process_ean: '{ean}'")  # Debug
         
         if not ean:
-            return jsonify({'success': False, 'error': 'EAN requerido'})
+            return json_response({'success': False, 'error': 'EAN requerido'})
         
         # Obtener datos del producto
         print(f"🔍 Llamando get_product_data con EAN: '{ean}'")  # Debug
         product_result = get_product_data(ean)
         
         if not product_result['success']:
-            return jsonify(product_result)
+            return json_response(product_result)
         
         product_data = product_result['data']
+        # Imágenes y Excel se sirven desde /job_items (cacheables); el JSON solo lleva sus URLs
+        job_id = artifacts.store.new_job_id()
         result = {
             'success': True,
             'product_data': product_data,
@@ -828,40 +1308,40 @@ def process_ean():
         
         if image_search_result['success']:
             result['images']['original'] = {
-                'data': image_search_result['image_data'],
+                'url': publish_asset(job_id, 'original', image_search_result['image_data'], image_search_result['content_type']),
                 'content_type': image_search_result['content_type'],
                 'size': image_search_result['size'],
                 'source': image_search_result.get('source', 'internet'),
                 'quality': image_search_result.get('quality', 'desconocida')
             }
             
-            # Mejorar imagen con IA si hay API key
+            # Mejorar imagen con IA si hay API key (salvo que la original ya sea apta)
             if api_key:
-                prompt = ("Take the provided product image and enhance it for PrestaShop e-commerce platform. "
-                        "Create a square image (800x800 pixels) with these specifications: "
-                        "1. Remove the background completely and replace it with pure white (#FFFFFF). "
-                        "2. Center the product perfectly in the frame. "
-                        "3. The product should occupy 80-85% of the image space, leaving appropriate margins. "
-                        "4. Show the product from the front in its most recognizable angle. "
-                        "5. Enhance lighting to be even and professional, eliminating shadows on the background. "
-                        "6. Improve sharpness and color accuracy for high-quality zoom capability. "
-                        "7. Ensure the product looks professional, clean, and appealing for online sales. "
-                        "8. Keep the product realistic and true to its original appearance. "
-                        "The final image must be optimized for PrestaShop product listings with consistent quality.")
-                
-                enhance_result = enhance_image_with_gemini(image_search_result['image_data'], prompt, api_key)
+                quality = check_image_quality(ean, image_search_result['image_data'])
+                if quality:
+                    result['image_check'] = quality
+                if quality and quality['passes']:
+                    enhance_result = {
+                        'success': True,
+                        'image_data': image_search_result['image_data'],
+                        'content_type': image_search_result['content_type']
+                    }
+                else:
+                    # Mientras se espera a Gemini el turno interactivo queda libre para otros
+                    with scheduler.released():
+                        enhance_result = enhance_image_with_gemini(image_search_result['image_data'], ENHANCE_PROMPT, api_key)
                 if enhance_result['success']:
                     # Remover fondo blanco usando rembg
                     remove_bg_result = remove_white_background(enhance_result['image_data'])
                     if remove_bg_result['success']:
                         result['images']['enhanced'] = {
-                            'data': remove_bg_result['image_data'],
+                            'url': publish_asset(job_id, 'enhanced', remove_bg_result['image_data'], remove_bg_result['content_type']),
                             'content_type': remove_bg_result['content_type']
                         }
                     else:
                         # Si falla la remoción de fondo, usar la imagen mejorada con IA
                         result['images']['enhanced'] = {
-                            'data': enhance_result['image_data'],
+                            'url': publish_asset(job_id, 'enhanced', enhance_result['image_data'], enhance_result['content_type']),
                             'content_type': enhance_result['content_type']
                         }
                         result['bg_removal_warning'] = remove_bg_result['error']
@@ -874,15 +1354,15 @@ def process_ean():
         excel_result = create_excel_data(product_data, ean)
         if excel_result['success']:
             result['files']['excel'] = {
-                'data': excel_result['excel_data'],
+                'url': publish_asset(job_id, 'datos', excel_result['excel_data'], excel_result['content_type']),
                 'content_type': excel_result['content_type'],
                 'size': excel_result['size']
             }
         
-        return jsonify(result)
+        return json_response(result)
     
     except Exception as e:
-        return jsonify({'success': False, 'error': f'Error procesando EAN: {str(e)}'})
+        return json_response({'success': False, 'error': f'Error procesando EAN: {str(e)}'})
 
 def sanitize_filename(name):
     """Sanitiza un nombre para usarlo como nombre de archivo"""
@@ -898,9 +1378,14 @@ def sanitize_filename(name):
     name = name.replace(' ', '_')
     return name if name else 'sin_nombre'
 
+@metrics.timed('excel')
 def create_bulk_excel(products_data):
     """Crea un Excel con múltiples productos organizados por columnas para PrestaShop"""
     try:
+        from openpyxl import Workbook
+        from openpyxl.styles import Font, PatternFill, Alignment
+        from openpyxl.utils import get_column_letter
+        
         wb = Workbook()
         ws = wb.active
         ws.title = "Productos para PrestaShop"
@@ -1007,11 +1492,14 @@ def create_bulk_excel(products_data):
         }
         
         for col, width in column_widths.items():
-            ws.column_dimensions[openpyxl.utils.get_column_letter(col)].width = width
+            ws.column_dimensions[get_column_letter(col)].width = width
         
         # Congelar primera fila
         ws.freeze_panes = 'A2'
         
+        # Hoja oculta con el last_modified_t de OFF para actualizaciones incrementales
+        refresh.add_manifest_sheet(wb, products_data)
+        
         # Guardar en memoria
         excel_buffer = BytesIO()
         wb.save(excel_buffer)
@@ -1023,6 +1511,155 @@ def create_bulk_excel(products_data):
         logger.error(f"Error creando Excel bulk: {str(e)}")
         return None
 
+def build_zip(images_data, excel_data=None, unfinished=None):
+    """Arma el ZIP de resultados (Excel opcional + carpeta imagenes/ + EANs pendientes) y devuelve sus bytes"""
+    with metrics.stage_timer('zip'):
+        zip_buffer = BytesIO()
+        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            if excel_data:
+                zip_file.writestr('productos_prestashop.xlsx', excel_data)
+                logger.info(f"  ✓ Excel agregado ({len(excel_data)} bytes)")
+        
+            # Agregar imágenes en una carpeta
+            logger.info(f"  🖼️ Agregando {len(images_data)} imágenes...")
+            for img in images_data:
+                # Las imágenes de checkpoints llegan como ruta y se copian del disco sin pasar por base64
+                if 'path' in img:
+                    zip_file.write(img['path'], f"imagenes/{img['filename']}")
+                else:
+                    zip_file.writestr(f"imagenes/{img['filename']}", base64.b64decode(img['data']))
+            logger.info("  ✓ Imágenes agregadas")
+        
+            if unfinished:
+                zip_file.writestr('eans_pendientes.txt', '\n'.join(unfinished) + '\n')
+                logger.info(f"  ⏱️ {len(unfinished)} EANs pendientes listados")
+        
+            # Listar contenido del ZIP
+            logger.info(f"  📋 Contenido del ZIP: {zip_file.namelist()}")
+    
+        zip_data = zip_buffer.getvalue()
+    return zip_data
+
+def encode_zip_base64(zip_data):
+    """ZIP en base64 para el evento 'complete' de /process_bulk (la copia más grande del trabajo)"""
+    with memory.stage('zip_base64'):
+        return base64.b64encode(zip_data).decode('utf-8')
+
+def process_bulk_item(ean, api_key, dedupe=None):
+    """Pipeline completo de un EAN de /process_bulk: OFF + datos web + imagen (IA y fondo).
+    
+    Devuelve {'success', 'message', 'product', 'image', 'quality', 'duplicate_of'}; 'product'
+    es None si la consulta a OFF lanzó una excepción (no hay nada que guardar).
+    """
+    # 1. Obtener datos de OpenFoodFacts
+    try:
+        product_result = get_product_data(ean)
+        logger.info(f"  ✓ Datos OFF obtenidos para {ean}: {product_result.get('success', False)}")
+    except Exception as e:
+        logger.error(f"  ❌ Error obteniendo datos OFF para {ean}: {e}")
+        return {'success': False, 'message': f'Error: {str(e)}', 'product': None}
+    
+    if product_result['success']:
+        off_product = product_result['data']
+        
+        # 2. Buscar datos adicionales con Gemini Web Search
+        web_data = {}
+        if api_key and deadlines.allows('gemini_text'):
+            logger.info(f"  🌐 Buscando datos web con Gemini para {ean}")
+            try:
+                web_result = search_product_web_data(
+                    ean, 
+                    off_product.get('name', ''), 
+                    api_key
+                )
+                if web_result['success']:
+                    web_data = web_result['data']
+                    logger.info(f"  ✓ Datos web obtenidos para {ean}")
+                else:
+                    logger.warning(f"  ⚠️ No se pudieron obtener datos web: {web_result.get('error', 'Unknown')}")
+            except Exception as e:
+                logger.error(f"  ❌ Error en búsqueda web para {ean}: {e}")
+        
+        # 3. Combinar datos de OpenFoodFacts + Gemini Web
+        combined_product = combine_product_data(ean, off_product, web_data)
+        combined_product[refresh.LAST_MODIFIED_KEY] = off_product.get('last_modified_t')
+        
+        # 4. Buscar y procesar imagen desde múltiples fuentes
+        image = None
+        quality = None
+        duplicate_of = None
+        logger.info(f"  🖼️ Buscando imagen para {ean}")
+        try:
+            # Buscar imagen de alta calidad desde múltiples fuentes
+            image_search_result = search_and_download_product_image(
+                ean,
+                off_product.get('name', 'No disponible'),
+                off_product.get('image_url')  # URL de OpenFoodFacts como fallback
+            )
+            
+            if image_search_result['success']:
+                logger.info(f"  ✓ Imagen encontrada (fuente: {image_search_result.get('source', 'desconocida')})")
+                
+                # Mejorar imagen con IA y remover fondo
+                image_result = process_product_image_deduped(ean, image_search_result['image_data'], api_key, dedupe)
+                quality = image_result.get('quality')
+                duplicate_of = image_result.get('duplicate_of')
+                if image_result['success']:
+                    image = {
+                        'filename': image_result['filename'],
+                        'data': image_result['image_data']
+                    }
+            else:
+                logger.warning(f"  ⚠️ No se pudo encontrar imagen: {image_search_result.get('error', 'Unknown')}")
+        except Exception as e:
+            logger.error(f"  ❌ Error buscando/procesando imagen para {ean}: {e}")
+        
+        # Actualizar ruta de imagen en datos combinados
+        if image:
+            combined_product['Imagen'] = f"imagenes/{image['filename']}"
+        
+        return {'success': True, 'message': 'Procesado correctamente', 'product': combined_product,
+                'image': image, 'quality': quality, 'duplicate_of': duplicate_of}
+    
+    else:
+        # Si falla OpenFoodFacts, crear registro básico marcado como no encontrado
+        error_msg = product_result.get('error', 'Error desconocido')
+        logger.warning(f"  ⚠️ Producto no encontrado en OFF: {ean}")
+        
+        # Intentar buscar solo con Gemini
+        web_data = {}
+        if api_key and deadlines.allows('gemini_text'):
+            try:
+                web_result = search_product_web_data(ean, '', api_key)
+                if web_result['success']:
+                    web_data = web_result['data']
+            except Exception as e:
+                logger.error(f"  ❌ Error en búsqueda web alternativa para {ean}: {e}")
+        
+        combined_product = combine_product_data(ean, {}, web_data)
+        combined_product['Producto Encontrado'] = 'no'
+        return {'success': False, 'message': 'No encontrado en OFF, datos web agregados',
+                'product': combined_product, 'image': None}
+
+def refresh_bulk_item(ean, api_key, previous, dedupe=None):
+    """Como process_bulk_item, pero reutiliza la fila y la imagen anteriores si el EAN no cambió en OFF"""
+    if previous.candidate(ean):
+        reused = previous.reuse(ean, get_off_last_modified(ean))
+        if reused:
+            metrics.REFRESH_ITEMS.inc('reused')
+            logger.info(f"  ♻️ {ean} sin cambios en OFF: se reutiliza el resultado anterior")
+            return {'success': True, 'message': 'Sin cambios en OFF (reutilizado)', 'reused': True, **reused}
+        metrics.REFRESH_ITEMS.inc('changed')
+    else:
+        metrics.REFRESH_ITEMS.inc('retried')
+    return process_bulk_item(ean, api_key, dedupe)
+
+def load_previous_upload(upload):
+    """PreviousRun del archivo subido en el campo 'previous' (ZIP o Excel); None si no hay"""
+    if not upload or not upload.filename:
+        return None
+    return refresh.PreviousRun.load(upload.read(), upload.filename)
+
 @app.route('/process_bulk', methods=['POST'])
 def process_bulk():
     """Procesa múltiples EANs y genera un ZIP con Excel e imágenes"""
@@ -1044,193 +1681,98 @@ def process_bulk():
                 logger.warning(f"⚠️ Limitando procesamiento a {max_eans} EANs")
                 yield f"data: {json.dumps({'type': 'warning', 'message': f'Se procesarán solo los primeros {max_eans} EANs de {len(eans)}'})}\n\n"
                 eans = eans[:max_eans]
+            eans = [ean.strip() for ean in eans]
+            
+            # Checkpoints del lote: reenviar el mismo batch_id continúa donde se cortó
+            batch_id = request.form.get('batch_id', '')
+            if not checkpoints.valid_batch_id(batch_id):
+                checkpoints.purge_expired()
+                batch_id = checkpoints.new_batch_id()
+            checkpoint = checkpoints.BatchCheckpoint(batch_id)
+            resumed = checkpoint.completed_count()
+            if resumed:
+                logger.info(f"♻️ Reanudando lote {batch_id}: {resumed} EANs ya procesados")
+            yield f"data: {json.dumps({'type': 'batch', 'batch_id': batch_id, 'resumed': resumed})}\n\n"
+            
+            # Actualización incremental: resultado anterior (ZIP o Excel) opcional
+            try:
+                previous = load_previous_upload(request.files.get('previous'))
+            except Exception as e:
+                logger.error(f"❌ Resultado anterior no válido: {e}")
+                yield f"data: {json.dumps({'type': 'error', 'message': f'Resultado anterior no válido: {str(e)}'})}\n\n"
+                return
+            if previous is not None:
+                logger.info(f"♻️ Actualización incremental sobre {len(previous)} productos anteriores")
             
-            products_data = []
-            images_data = []
             api_key = os.getenv("GEMINI_API_KEY")
+            timings = JobTimings()
+            dedupe = image_dedupe.job_index()
+            unfinished = []
             
-            # Procesar cada EAN
-            for idx, ean in enumerate(eans):
-                logger.info(f"🔄 Procesando EAN {idx+1}/{len(eans)}: {ean}")
+            # Procesar cada EAN (un turno del planificador por EAN, ver scheduler.py); los ya
+            # guardados en el checkpoint no esperan turno
+            items = scheduler.turns(eans, request_client(), skip=lambda ean: checkpoint.done(ean.strip()) is not None)
+            for idx, ean in enumerate(metrics.track_items(items)):
                 ean = ean.strip()
+                # Solo se saltan los terminados con éxito: los fallidos se reintentan
+                record = checkpoint.done(ean)
+                # Sin presupuesto (tiempo o memoria) para otro EAN: queda pendiente (reenviar el lote lo retoma)
+                if not record and (deadlines.exhausted() or memory.exhausted()):
+                    if not unfinished:
+                        yield f"data: {json.dumps(job_stop_notice('process_bulk'))}\n\n"
+                    unfinished.append(ean)
+                    continue
+                logger.info(f"🔄 Procesando EAN {idx+1}/{len(eans)}: {ean}")
+                timings.begin(ean)
                 
-                # 1. Obtener datos de OpenFoodFacts
-                try:
-                    product_result = get_product_data(ean)
-                    logger.info(f"  ✓ Datos OFF obtenidos para {ean}: {product_result.get('success', False)}")
-                except Exception as e:
-                    logger.error(f"  ❌ Error obteniendo datos OFF para {ean}: {e}")
-                    yield f"data: {json.dumps({'type': 'progress', 'ean': ean, 'success': False, 'message': f'Error: {str(e)}'})}\n\n"
+                if record:
+                    yield progress_event(ean, record['success'], record['message'], timings, resumed=True)
                     continue
                 
-                if product_result['success']:
-                    off_product = product_result['data']
-                    
-                    # 2. Buscar datos adicionales con Gemini Web Search
-                    web_data = {}
-                    if api_key:
-                        logger.info(f"  🌐 Buscando datos web con Gemini para {ean}")
-                        try:
-                            web_result = search_product_web_data(
-                                ean, 
-                                off_product.get('name', ''), 
-                                api_key
-                            )
-                            if web_result['success']:
-                                web_data = web_result['data']
-                                logger.info(f"  ✓ Datos web obtenidos para {ean}")
-                            else:
-                                logger.warning(f"  ⚠️ No se pudieron obtener datos web: {web_result.get('error', 'Unknown')}")
-                        except Exception as e:
-                            logger.error(f"  ❌ Error en búsqueda web para {ean}: {e}")
-                    
-                    # 3. Combinar datos de OpenFoodFacts + Gemini Web
-                    combined_product = combine_product_data(ean, off_product, web_data)
-                    
-                    # 4. Buscar y procesar imagen desde múltiples fuentes
-                    image_filename = ''
-                    logger.info(f"  🖼️ Buscando imagen para {ean}")
-                    try:
-                        # Buscar imagen de alta calidad desde múltiples fuentes
-                        image_search_result = search_and_download_product_image(
-                            ean,
-                            off_product.get('name', 'No disponible'),
-                            off_product.get('image_url')  # URL de OpenFoodFacts como fallback
-                        )
-                        
-                        if image_search_result['success']:
-                            logger.info(f"  ✓ Imagen encontrada (fuente: {image_search_result.get('source', 'desconocida')})")
-                            
-                            # Mejorar imagen con Gemini Image Preview si hay API key
-                            if api_key:
-                                logger.info(f"  🤖 Mejorando imagen con IA para {ean}")
-                                prompt = ("Take the provided product image and enhance it for PrestaShop e-commerce platform. "
-                                        "Create a square image (800x800 pixels) with these specifications: "
-                                        "1. Remove the background completely and replace it with pure white (#FFFFFF). "
-                                        "2. Center the product perfectly in the frame. "
-                                        "3. The product should occupy 80-85% of the image space, leaving appropriate margins. "
-                                        "4. Show the product from the front in its most recognizable angle. "
-                                        "5. Enhance lighting to be even and professional, eliminating shadows on the background. "
-                                        "6. Improve sharpness and color accuracy for high-quality zoom capability. "
-                                        "7. Ensure the product looks professional, clean, and appealing for online sales. "
-                                        "8. Keep the product realistic and true to its original appearance. "
-                                        "The final image must be optimized for PrestaShop product listings with consistent quality.")
-                                
-                                try:
-                                    enhance_result = enhance_image_with_gemini(image_search_result['image_data'], prompt, api_key)
-                                    if enhance_result['success']:
-                                        logger.info(f"  ✓ Imagen mejorada con IA para {ean}")
-                                        # Remover fondo con rembg
-                                        logger.info(f"  🎨 Removiendo fondo para {ean}")
-                                        try:
-                                            remove_bg_result = remove_white_background(enhance_result['image_data'])
-                                            if remove_bg_result['success']:
-                                                image_data_final = remove_bg_result['image_data']
-                                            else:
-                                                image_data_final = enhance_result['image_data']
-                                        except Exception as e:
-                                            logger.error(f"  ❌ Error en rembg para {ean}: {e}")
-                                            image_data_final = enhance_result['image_data']
-                                        
-                                        # Guardar imagen - Solo EAN como nombre
-                                        image_filename = f"{ean}.png"
-                                        
-                                        images_data.append({
-                                            'filename': image_filename,
-                                            'data': image_data_final
-                                        })
-                                        logger.info(f"  ✓ Imagen guardada: {image_filename}")
-                                    else:
-                                        logger.warning(f"  ⚠️ Error mejorando imagen: {enhance_result.get('error', 'Unknown')}")
-                                except Exception as e:
-                                    logger.error(f"  ❌ Excepción en mejora de imagen para {ean}: {e}")
-                            else:
-                                # Si no hay API key, usar imagen original - Solo EAN como nombre
-                                image_filename = f"{ean}.png"
-                                
-                                images_data.append({
-                                    'filename': image_filename,
-                                    'data': image_search_result['image_data']
-                                })
-                                logger.info(f"  ✓ Imagen guardada (sin IA): {image_filename}")
-                        else:
-                            logger.warning(f"  ⚠️ No se pudo encontrar imagen: {image_search_result.get('error', 'Unknown')}")
-                    except Exception as e:
-                        logger.error(f"  ❌ Error buscando/procesando imagen para {ean}: {e}")
-                    
-                    # Actualizar ruta de imagen en datos combinados
-                    if image_filename:
-                        combined_product['Imagen'] = f"imagenes/{image_filename}"
-                    
-                    products_data.append(combined_product)
-                    yield f"data: {json.dumps({'type': 'progress', 'ean': ean, 'success': True, 'message': 'Procesado correctamente'})}\n\n"
-                    
+                if previous is not None:
+                    result = refresh_bulk_item(ean, api_key, previous, dedupe)
                 else:
-                    # Si falla OpenFoodFacts, crear registro básico marcado como no encontrado
-                    error_msg = product_result.get('error', 'Error desconocido')
-                    logger.warning(f"  ⚠️ Producto no encontrado en OFF: {ean}")
-                    
-                    # Intentar buscar solo con Gemini
-                    web_data = {}
-                    if api_key:
-                        try:
-                            web_result = search_product_web_data(ean, '', api_key)
-                            if web_result['success']:
-                                web_data = web_result['data']
-                        except Exception as e:
-                            logger.error(f"  ❌ Error en búsqueda web alternativa para {ean}: {e}")
-                    
-                    combined_product = combine_product_data(ean, {}, web_data)
-                    combined_product['Producto Encontrado'] = 'no'
-                    products_data.append(combined_product)
-                    
-                    yield f"data: {json.dumps({'type': 'progress', 'ean': ean, 'success': False, 'message': f'No encontrado en OFF, datos web agregados'})}\n\n"
+                    result = process_bulk_item(ean, api_key, dedupe)
+                if result['product'] is not None:
+                    checkpoint.save(ean, result['success'], result['message'], result['product'], result['image'])
+                yield progress_event(ean, result['success'], result['message'], timings,
+                                     quality=result.get('quality'), duplicate_of=result.get('duplicate_of'),
+                                     reused=result.get('reused', False))
+            
+            timing_summary = timings.summary()
+            logger.info(f"⏱️ Resumen de tiempos: {json.dumps(timing_summary)}")
             
-            # Crear archivo ZIP con Excel e imágenes
+            # Crear archivo ZIP con Excel e imágenes a partir de los checkpoints
+            products_data, images_data = checkpoint.assemble(eans)
             logger.info(f"📦 Creando ZIP final con {len(products_data)} productos y {len(images_data)} imágenes")
             if products_data:
                 try:
                     # Verificar estructura de products_data
                     logger.info(f"  🔍 Primer producto ejemplo: {list(products_data[0].keys()) if products_data else 'vacío'}")
                     
-                    zip_buffer = BytesIO()
-                    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                        # Agregar Excel
-                        logger.info("  📊 Creando Excel...")
-                        excel_data = create_bulk_excel(products_data)
-                        if excel_data:
-                            zip_file.writestr('productos_prestashop.xlsx', excel_data)
-                            logger.info(f"  ✓ Excel agregado ({len(excel_data)} bytes)")
-                        else:
-                            logger.error("  ❌ Excel data es None!")
-                        
-                        # Agregar imágenes en una carpeta
-                        logger.info(f"  🖼️ Agregando {len(images_data)} imágenes...")
-                        for img in images_data:
-                            zip_file.writestr(f"imagenes/{img['filename']}", base64.b64decode(img['data']))
-                        logger.info("  ✓ Imágenes agregadas")
-                        
-                        # Listar contenido del ZIP
-                        zip_contents = zip_file.namelist()
-                        logger.info(f"  📋 Contenido del ZIP: {zip_contents}")
+                    # Agregar Excel
+                    logger.info("  📊 Creando Excel...")
+                    excel_data = create_bulk_excel(products_data)
+                    if not excel_data:
+                        logger.error("  ❌ Excel data es None!")
                     
-                    zip_data = zip_buffer.getvalue()
-                    zip_base64 = base64.b64encode(zip_data).decode('utf-8')
+                    zip_data = build_zip(images_data, excel_data, unfinished)
+                    zip_base64 = encode_zip_base64(zip_data)
                     logger.info(f"✅ ZIP creado exitosamente ({len(zip_data)} bytes, {len(zip_base64)} base64)")
                     
-                    yield f"data: {json.dumps({'type': 'complete', 'zip_data': zip_base64})}\n\n"
+                    yield f"data: {json.dumps({'type': 'complete', 'zip_data': zip_base64, 'batch_id': batch_id, 'timing_summary': timing_summary, 'memory_summary': job_memory_summary(), 'unfinished': unfinished})}\n\n"
                 except Exception as e:
                     logger.error(f"❌ Error creando ZIP: {e}", exc_info=True)
                     yield f"data: {json.dumps({'type': 'error', 'message': f'Error creando ZIP: {str(e)}'})}\n\n"
             else:
                 logger.warning("⚠️ No hay productos para procesar")
-                yield f"data: {json.dumps({'type': 'error', 'message': 'No se pudieron procesar productos'})}\n\n"
+                yield f"data: {json.dumps({'type': 'error', 'message': 'No se pudieron procesar productos', 'unfinished': unfinished})}\n\n"
         
         except Exception as e:
             logger.error(f"❌ ERROR FATAL en process_bulk: {e}", exc_info=True)
             yield f"data: {json.dumps({'type': 'error', 'message': f'Error: {str(e)}'})}\n\n"
     
-    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+    return Response(stream_with_context(metrics.track_job('process_bulk', circuit.announce(deadlines.bounded(generate())))), mimetype='text/event-stream')
 
 @app.route('/process_images_only', methods=['POST'])
 def process_images_only():
@@ -1256,180 +1798,159 @@ def process_images_only():
             
             images_data = []
             api_key = os.getenv("GEMINI_API_KEY")
+            timings = JobTimings()
+            dedupe = image_dedupe.job_index()
+            unfinished = []
+            # Cada imagen terminada se puede descargar al momento (y el ZIP parcial en cualquier punto)
+            job_id = artifacts.store.new_job_id()
+            yield job_event(job_id)
             
-            # Procesar cada EAN - SOLO IMÁGENES
-            for idx, ean in enumerate(eans):
-                logger.info(f"🔄 Procesando imagen {idx+1}/{len(eans)}: {ean}")
+            # Procesar cada EAN - SOLO IMÁGENES (un turno del planificador por EAN, ver scheduler.py)
+            for idx, ean in enumerate(metrics.track_items(scheduler.turns(eans, request_client()))):
                 ean = ean.strip()
+                # Sin presupuesto (tiempo o memoria) para otro EAN: los restantes quedan pendientes y se entrega lo hecho
+                if deadlines.exhausted() or memory.exhausted():
+                    if not unfinished:
+                        yield f"data: {json.dumps(job_stop_notice('process_images_only'))}\n\n"
+                    unfinished.append(ean)
+                    continue
+                logger.info(f"🔄 Procesando imagen {idx+1}/{len(eans)}: {ean}")
+                timings.begin(ean)
                 
                 try:
-                    # Obtener solo datos básicos de OFF para el nombre (sin procesar con Gemini)
-                    product_result = get_product_data(ean)
-                    product_name = 'producto'
-                    image_url_fallback = None
-                    
-                    if product_result['success']:
-                        off_product = product_result['data']
-                        product_name = off_product.get('name', 'producto')
-                        image_url_fallback = off_product.get('image_url')
-                    
                     # Buscar imagen desde múltiples fuentes
-                    logger.info(f"  🖼️ Buscando imagen para {ean}")
-                    image_search_result = search_and_download_product_image(
-                        ean,
-                        product_name,
-                        image_url_fallback
-                    )
+                    image_search_result = find_product_image(ean)
                     
                     if image_search_result['success']:
                         logger.info(f"  ✓ Imagen encontrada (fuente: {image_search_result.get('source', 'desconocida')})")
                         
-                        # Mejorar imagen con Gemini Image Preview si hay API key
-                        if api_key:
-                            logger.info(f"  🤖 Mejorando imagen con IA para {ean}")
-                            prompt = ("Take the provided product image and enhance it for PrestaShop e-commerce platform. "
-                                    "Create a square image (800x800 pixels) with these specifications: "
-                                    "1. Remove the background completely and replace it with pure white (#FFFFFF). "
-                                    "2. Center the product perfectly in the frame. "
-                                    "3. The product should occupy 80-85% of the image space, leaving appropriate margins. "
-                                    "4. Show the product from the front in its most recognizable angle. "
-                                    "5. Enhance lighting to be even and professional, eliminating shadows on the background. "
-                                    "6. Improve sharpness and color accuracy for high-quality zoom capability. "
-                                    "7. Ensure the product looks professional, clean, and appealing for online sales. "
-                                    "8. Keep the product realistic and true to its original appearance. "
-                                    "The final image must be optimized for PrestaShop product listings with consistent quality.")
-                            
-                            try:
-                                enhance_result = enhance_image_with_gemini(image_search_result['image_data'], prompt, api_key)
-                                if enhance_result['success']:
-                                    logger.info(f"  ✓ Imagen mejorada con IA para {ean}")
-                                    # Remover fondo con rembg
-                                    logger.info(f"  🎨 Removiendo fondo para {ean}")
-                                    try:
-                                        remove_bg_result = remove_white_background(enhance_result['image_data'])
-                                        if remove_bg_result['success']:
-                                            image_data_final = remove_bg_result['image_data']
-                                        else:
-                                            image_data_final = enhance_result['image_data']
-                                    except Exception as e:
-                                        logger.error(f"  ❌ Error en rembg para {ean}: {e}")
-                                        image_data_final = enhance_result['image_data']
-                                    
-                                    # Guardar imagen - Solo EAN como nombre
-                                    image_filename = f"{ean}.png"
-                                    
-                                    images_data.append({
-                                        'filename': image_filename,
-                                        'data': image_data_final
-                                    })
-                                    logger.info(f"  ✓ Imagen guardada: {image_filename}")
-                                    yield f"data: {json.dumps({'type': 'progress', 'ean': ean, 'success': True, 'message': 'Imagen procesada correctamente'})}\n\n"
-                                else:
-                                    logger.warning(f"  ⚠️ Error mejorando imagen: {enhance_result.get('error', 'Unknown')}")
-                                    yield f"data: {json.dumps({'type': 'progress', 'ean': ean, 'success': False, 'message': 'Error mejorando imagen'})}\n\n"
-                            except Exception as e:
-                                logger.error(f"  ❌ Excepción en mejora de imagen para {ean}: {e}")
-                                yield f"data: {json.dumps({'type': 'progress', 'ean': ean, 'success': False, 'message': f'Error: {str(e)}'})}\n\n"
-                        else:
-                            # Si no hay API key, usar imagen original - Solo EAN como nombre
-                            image_filename = f"{ean}.png"
-                            
+                        # Mejorar imagen con IA y remover fondo
+                        image_result = process_product_image_deduped(ean, image_search_result['image_data'], api_key, dedupe)
+                        if image_result['success']:
                             images_data.append({
-                                'filename': image_filename,
-                                'data': image_search_result['image_data']
+                                'filename': image_result['filename'],
+                                'data': image_result['image_data']
                             })
-                            logger.info(f"  ✓ Imagen guardada (sin IA): {image_filename}")
-                            yield f"data: {json.dumps({'type': 'progress', 'ean': ean, 'success': True, 'message': 'Imagen guardada (sin IA)'})}\n\n"
+                        yield progress_event(ean, image_result['success'], image_result['message'], timings,
+                                             quality=image_result.get('quality'),
+                                             duplicate_of=image_result.get('duplicate_of'),
+                                             **publish_item(job_id, image_result))
                     else:
                         logger.warning(f"  ⚠️ No se pudo encontrar imagen: {image_search_result.get('error', 'Unknown')}")
-                        yield f"data: {json.dumps({'type': 'progress', 'ean': ean, 'success': False, 'message': 'No se encontró imagen'})}\n\n"
+                        yield progress_event(ean, False, 'No se encontró imagen', timings)
                         
                 except Exception as e:
                     logger.error(f"  ❌ Error procesando imagen para {ean}: {e}")
-                    yield f"data: {json.dumps({'type': 'progress', 'ean': ean, 'success': False, 'message': f'Error: {str(e)}'})}\n\n"
+                    yield progress_event(ean, False, f'Error: {str(e)}', timings)
+            
+            timing_summary = timings.summary()
+            logger.info(f"⏱️ Resumen de tiempos: {json.dumps(timing_summary)}")
             
             # Crear archivo ZIP solo con imágenes
             logger.info(f"📦 Creando ZIP final con {len(images_data)} imágenes")
             if images_data:
                 try:
-                    zip_buffer = BytesIO()
-                    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                        # Agregar solo imágenes
-                        logger.info(f"  🖼️ Agregando {len(images_data)} imágenes...")
-                        for img in images_data:
-                            zip_file.writestr(f"imagenes/{img['filename']}", base64.b64decode(img['data']))
-                        logger.info("  ✓ Imágenes agregadas")
-                        
-                        # Listar contenido del ZIP
-                        zip_contents = zip_file.namelist()
-                        logger.info(f"  📋 Contenido del ZIP: {zip_contents}")
-                    
-                    zip_data = zip_buffer.getvalue()
+                    zip_data = build_zip(images_data, unfinished=unfinished)
                     
-                    # Guardar en archivo temporal
-                    timestamp = int(time.time() * 1000)
-                    zip_filename = f"imagenes_{timestamp}.zip"
-                    zip_path = os.path.join(tempfile.gettempdir(), zip_filename)
-                    
-                    with open(zip_path, 'wb') as f:
-                        f.write(zip_data)
-                    
-                    logger.info(f"✅ ZIP guardado en {zip_path} ({len(zip_data)} bytes)")
+                    # Guardar en el almacén de artefactos (TTL + cuota, ver artifacts.py)
+                    zip_filename = artifacts.store.put(zip_data, 'imagenes', job_id)
                     
                     # Enviar señal de completado con nombre del archivo
-                    yield f"data: {json.dumps({'type': 'complete', 'zip_filename': zip_filename})}\n\n"
+                    yield f"data: {json.dumps({'type': 'complete', 'zip_filename': zip_filename, 'job_id': job_id, 'timing_summary': timing_summary, 'memory_summary': job_memory_summary(), 'unfinished': unfinished})}\n\n"
                 except Exception as e:
                     logger.error(f"❌ Error creando ZIP: {e}", exc_info=True)
                     yield f"data: {json.dumps({'type': 'error', 'message': f'Error creando ZIP: {str(e)}'})}\n\n"
             else:
                 logger.warning("⚠️ No hay imágenes para procesar")
-                yield f"data: {json.dumps({'type': 'error', 'message': 'No se pudieron procesar imágenes'})}\n\n"
+                yield f"data: {json.dumps({'type': 'error', 'message': 'No se pudieron procesar imágenes', 'unfinished': unfinished})}\n\n"
         
         except Exception as e:
             logger.error(f"❌ ERROR FATAL en process_images_only: {e}", exc_info=True)
             yield f"data: {json.dumps({'type': 'error', 'message': f'Error: {str(e)}'})}\n\n"
     
-    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+    return Response(stream_with_context(metrics.track_job('process_images_only', circuit.announce(deadlines.bounded(generate())))), mimetype='text/event-stream')
 
 @app.route('/download_zip/<filename>')
 def download_zip(filename):
-    """Descarga un archivo ZIP temporal"""
+    """Descarga un ZIP del almacén de artefactos (se puede repetir mientras no expire)"""
     try:
-        # Seguridad: validar que el nombre de archivo sea válido
-        if not filename.endswith('.zip') or '..' in filename or '/' in filename:
-            return jsonify({'error': 'Nombre de archivo inválido'}), 400
-        
-        zip_path = os.path.join(tempfile.gettempdir(), filename)
+        zip_path = artifacts.store.open_path(filename)
+        if not zip_path:
+            return jsonify({'error': 'Archivo no encontrado o expirado'}), 404
         
-        if not os.path.exists(zip_path):
-            return jsonify({'error': 'Archivo no encontrado'}), 404
-        
-        # Enviar archivo y eliminarlo después
-        response = send_file(
+        # send_file con una ruta usa wsgi.file_wrapper: gunicorn lo envía con sendfile
+        # sin pasar el contenido por buffers de Python
+        return send_file(
             zip_path,
             mimetype='application/zip',
             as_attachment=True,
-            download_name=filename
+            download_name=filename,
+            max_age=0
         )
-        
-        # Programar eliminación del archivo después de enviarlo
-        @response.call_on_close
-        def cleanup():
-            try:
-                if os.path.exists(zip_path):
-                    os.remove(zip_path)
-                    logger.info(f"🗑️ Archivo temporal eliminado: {zip_path}")
-            except Exception as e:
-                logger.error(f"Error eliminando archivo temporal: {e}")
-        
-        return response
     
     except Exception as e:
         logger.error(f"Error descargando ZIP: {e}")
         return jsonify({'error': str(e)}), 500
 
-logger.info("✅ Aplicación Flask completamente cargada y lista!")
-logger.info(f"📊 Rutas registradas: {len(app.url_map._rules)}")
+@app.route('/job_items/<job_id>/<filename>')
+def job_item(job_id, filename):
+    """Imagen, miniatura o Excel de un trabajo, disponible mientras el trabajo sigue"""
+    item_path = artifacts.store.item_path(job_id, filename)
+    if not item_path:
+        return jsonify({'error': 'Archivo no encontrado o expirado'}), 404
+    mimetype = ITEM_MIMETYPES.get(filename.rsplit('.', 1)[-1], 'application/octet-stream')
+    # El contenido de cada URL no cambia: el navegador puede cachearla (y revalidar con ETag)
+    return send_file(item_path, mimetype=mimetype, max_age=3600, etag=True, conditional=True)
+
+@app.route('/download_partial/<job_id>')
+def download_partial(job_id):
+    """ZIP con las imágenes terminadas hasta ahora (el trabajo puede seguir en curso)"""
+    try:
+        items = artifacts.store.list_items(job_id)
+        if items is None:
+            return jsonify({'error': 'Trabajo no encontrado o expirado'}), 404
+        if not items:
+            return jsonify({'error': 'Todavía no hay imágenes terminadas'}), 404
+        
+        # Las imágenes ya son PNG comprimidos: se guardan sin volver a comprimir
+        zip_buffer = BytesIO()
+        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_STORED) as zip_file:
+            for name, item_path in items:
+                zip_file.write(item_path, f"imagenes/{name}")
+        zip_buffer.seek(0)
+        logger.info(f"📦 ZIP parcial del trabajo {job_id}: {len(items)} imágenes")
+        return send_file(
+            zip_buffer,
+            mimetype='application/zip',
+            as_attachment=True,
+            download_name=f'imagenes_parcial_{len(items)}.zip',
+            max_age=0
+        )
+    
+    except Exception as e:
+        logger.error(f"Error creando ZIP parcial: {str(e)}")
+        return jsonify({'error': f'Error creando ZIP parcial: {str(e)}'}), 500
+
+def preload_heavy_modules():
+    """Importa PIL/openpyxl y carga el modelo de rembg por adelantado.
+    
+    Con gunicorn --preload (ver gunicorn.conf.py) se ejecuta en el master antes del
+    fork, de modo que los workers comparten esas páginas de memoria copy-on-write.
+    """
+    started = time.perf_counter()
+    import PIL.Image  # noqa: F401
+    import openpyxl  # noqa: F401
+    try:
+        get_rembg_session()
+    except ImportError as e:
+        logger.warning(f"⚠️ rembg no disponible, no se precarga el modelo: {e}")
+    logger.info(f"✓ Módulos pesados precargados en {(time.perf_counter() - started) * 1000:.0f} ms")
+
+if os.environ.get('PRELOAD_MODELS', '').lower() in ('1', 'true', 'yes'):
+    preload_heavy_modules()
+
+logger.info(f"✅ Aplicación Flask cargada en {(time.perf_counter() - _BOOT_STARTED) * 1000:.0f} ms "
+            f"(RSS {metrics.current_rss_bytes() / 1024 / 1024:.0f} MB, {len(app.url_map._rules)} rutas)")
 
 if __name__ == '__main__':
     logger.info("🚀 Iniciando servidor de desarrollo...")
@@ -0,0 +1,253 @@
+"""
+Almacén acotado de artefactos descargables (ZIPs de imágenes).
+
+Los ZIPs se guardan en ARTIFACT_DIR y se pueden descargar varias veces mientras
+no expiren. Un hilo janitor aplica periódicamente:
+- TTL: se elimina todo ZIP creado hace más de ARTIFACT_TTL_MINUTES
+- Cuota: si el total supera ARTIFACT_QUOTA_MB se eliminan los menos usados (LRU)
+
+La fecha de creación es el mtime del archivo y el último acceso su atime (se
+actualiza a mano al descargar, así no depende de que el disco monte con atime).
+
+Las rutas de imágenes guardan además cada imagen terminada (y su miniatura) en
+items/<job_id>/ para servirla antes de que acabe el trabajo; /process_ean guarda
+igual sus imágenes y su Excel. Cada carpeta cuenta como un artefacto más: su
+fecha es la del último archivo escrito.
+
+Cada escritura solo suma sus bytes al total del almacén; el directorio se
+recorre entero en el janitor o cuando una escritura no cabe en la cuota. Al
+hacer sitio nunca se elimina el trabajo que escribe (sus URLs ya se enviaron
+al cliente): si sin él no cabe, la escritura falla con ValueError.
+"""
+
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_DIR = os.environ.get('ARTIFACT_DIR', os.path.join(tempfile.gettempdir(), 'artifacts'))
+ARTIFACT_QUOTA_MB = float(os.environ.get('ARTIFACT_QUOTA_MB', '500'))
+ARTIFACT_TTL_MINUTES = float(os.environ.get('ARTIFACT_TTL_MINUTES', '60'))
+ARTIFACT_JANITOR_SECONDS = float(os.environ.get('ARTIFACT_JANITOR_SECONDS', '60'))
+
+ARTIFACT_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]+\.zip$')
+JOB_ID_PATTERN = re.compile(r'^[a-f0-9]{32}$')
+ITEM_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]+\.(png|jpg|webp|gif|xlsx)$')
+ITEMS_SUBDIR = 'items'
+
+
+class ArtifactStore:
+    def __init__(self, directory=None, quota_bytes=None, ttl_seconds=None, janitor_interval=None):
+        self.directory = directory or ARTIFACT_DIR
+        self.quota_bytes = quota_bytes if quota_bytes is not None else int(ARTIFACT_QUOTA_MB * 1024 * 1024)
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else ARTIFACT_TTL_MINUTES * 60
+        self.janitor_interval = janitor_interval if janitor_interval is not None else ARTIFACT_JANITOR_SECONDS
+        self._lock = threading.Lock()
+        # Bytes ocupados (incluidas las escrituras en curso); None hasta el primer recorrido
+        self._total = None
+        self._janitor = None
+        self._janitor_pid = None
+        self.items_directory = os.path.join(self.directory, ITEMS_SUBDIR)
+        os.makedirs(self.items_directory, exist_ok=True)
+
+    def _entries(self):
+        """[(path, size, creado, último acceso)] de los ZIPs y carpetas de imágenes presentes"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not ARTIFACT_NAME_PATTERN.match(name):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime, stat.st_atime))
+        for job_id in os.listdir(self.items_directory):
+            if not JOB_ID_PATTERN.match(job_id):
+                continue
+            path = os.path.join(self.items_directory, job_id)
+            try:
+                stat = os.stat(path)
+                size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+            except FileNotFoundError:
+                continue
+            entries.append((path, size, stat.st_mtime, max(stat.st_atime, stat.st_mtime)))
+        return entries
+
+    def _remove(self, path, reason):
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            metrics.ARTIFACT_EVICTIONS.inc(reason)
+            logger.info(f"🗑️ Artefacto eliminado ({reason}): {os.path.basename(path)}")
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _enforce(self, reserve_bytes=0, keep=None):
+        """enforce con el lock ya tomado"""
+        now = time.time()
+        kept = self._item_path(keep) if keep else None
+        entries = []
+        for entry in self._entries():
+            if now - entry[2] > self.ttl_seconds and entry[0] != kept:
+                self._remove(entry[0], 'ttl')
+            else:
+                entries.append(entry)
+
+        total = sum(entry[1] for entry in entries)
+        # Menos usados primero
+        for path, size, _, _ in sorted(entries, key=lambda entry: entry[3]):
+            if total + reserve_bytes <= self.quota_bytes:
+                break
+            if path != kept and self._remove(path, 'quota'):
+                total -= size
+        self._total = total
+        metrics.ARTIFACT_BYTES.set(value=total)
+        return total
+
+    def enforce(self, reserve_bytes=0, keep=None):
+        """Aplica TTL y cuota; reserve_bytes deja sitio para un artefacto a punto de guardarse
+        y keep es el job_id cuyas imágenes no se eliminan"""
+        with self._lock:
+            return self._enforce(reserve_bytes, keep)
+
+    def _reserve(self, amount, keep=None):
+        """Suma amount bytes al total; solo recorre el almacén si no caben en la cuota"""
+        with self._lock:
+            if self._total is None or self._total + amount > self.quota_bytes:
+                self._enforce(reserve_bytes=amount, keep=keep)
+                if self._total + amount > self.quota_bytes:
+                    raise ValueError(f'No hay sitio en el almacén para {amount} bytes más sin eliminar el trabajo en curso '
+                                     f'({self._total} de {self.quota_bytes} bytes ocupados)')
+            self._total += amount
+        metrics.ARTIFACT_BYTES.inc(amount=amount)
+
+    def _release(self, amount):
+        with self._lock:
+            if self._total is not None:
+                self._total -= amount
+        metrics.ARTIFACT_BYTES.dec(amount=amount)
+
+    def _write(self, path, data, reserved, keep=None):
+        """Escribe data en path tras reservar reserved bytes (se devuelven si la escritura falla)"""
+        self._reserve(reserved, keep)
+        try:
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            self._release(reserved)
+            raise
+
+    def put(self, data, prefix, job_id=None):
+        """Guarda los bytes como un ZIP nuevo y devuelve su nombre de descarga (sin eliminar las imágenes de job_id)"""
+        self.ensure_janitor()
+        if len(data) > self.quota_bytes:
+            raise ValueError(f'El ZIP ({len(data)} bytes) supera la cuota del almacén ({self.quota_bytes} bytes)')
+        name = f"{prefix}_{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}.zip"
+        path = os.path.join(self.directory, name)
+        self._write(path, data, len(data), keep=job_id)
+        logger.info(f"✅ ZIP guardado en {path} ({len(data)} bytes)")
+        return name
+
+    def open_path(self, name):
+        """Ruta del artefacto para servirlo (marca el acceso para LRU); None si no existe o expiró"""
+        self.ensure_janitor()
+        if not ARTIFACT_NAME_PATTERN.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if time.time() - stat.st_mtime > self.ttl_seconds:
+            with self._lock:
+                self._remove(path, 'ttl')
+            return None
+        os.utime(path, (time.time(), stat.st_mtime))
+        return path
+
+    def new_job_id(self):
+        return uuid.uuid4().hex
+
+    def _item_path(self, job_id, filename=None):
+        if not JOB_ID_PATTERN.match(job_id or '') or (filename is not None and not ITEM_NAME_PATTERN.match(filename)):
+            return None
+        directory = os.path.join(self.items_directory, job_id)
+        return directory if filename is None else os.path.join(directory, filename)
+
+    def put_item(self, job_id, filename, data):
+        """Guarda una imagen (o miniatura) de un trabajo en curso para servirla al momento"""
+        self.ensure_janitor()
+        path = self._item_path(job_id, filename)
+        if path is None:
+            raise ValueError(f'Nombre de imagen no válido: {job_id}/{filename}')
+        if len(data) > self.quota_bytes:
+            raise ValueError(f'La imagen ({len(data)} bytes) supera la cuota del almacén ({self.quota_bytes} bytes)')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        # Las imágenes cuentan para la cuota igual que los ZIPs; reescribir una (p.ej. la
+        # miniatura) solo suma la diferencia
+        self._write(path, data, len(data) - replaced, keep=job_id)
+
+    def item_path(self, job_id, filename):
+        """Ruta de una imagen del trabajo para servirla; None si no existe o expiró"""
+        path = self._item_path(job_id, filename)
+        if path is None or not os.path.isfile(path):
+            return None
+        directory = os.path.dirname(path)
+        try:
+            stat = os.stat(directory)
+        except FileNotFoundError:
+            return None
+        if time.time() - stat.st_mtime > self.ttl_seconds:
+            with self._lock:
+                self._remove(directory, 'ttl')
+            return None
+        os.utime(directory, (time.time(), stat.st_mtime))
+        return path
+
+    def list_items(self, job_id):
+        """[(nombre, ruta)] de las imágenes terminadas del trabajo (sin miniaturas); None si no existe"""
+        directory = self._item_path(job_id)
+        if directory is None or not os.path.isdir(directory):
+            return None
+        names = sorted(name for name in os.listdir(directory) if name.endswith('.png'))
+        return [(name, os.path.join(directory, name)) for name in names]
+
+    def ensure_janitor(self):
+        """Arranca el hilo janitor en este proceso (los hilos no sobreviven al fork de gunicorn)"""
+        if self._janitor is not None and self._janitor_pid == os.getpid() and self._janitor.is_alive():
+            return
+        with self._lock:
+            if self._janitor is not None and self._janitor_pid == os.getpid() and self._janitor.is_alive():
+                return
+            self._janitor_pid = os.getpid()
+            self._janitor = threading.Thread(target=self._janitor_loop, name='artifact-janitor', daemon=True)
+            self._janitor.start()
+
+    def _janitor_loop(self):
+        while True:
+            try:
+                self.enforce()
+            except Exception as e:
+                logger.error(f"❌ Error en el janitor de artefactos: {e}")
+            time.sleep(self.janitor_interval)
+
+
+store = ArtifactStore()
@@ -0,0 +1,722 @@
+"""
+Variante asíncrona (aiohttp) de las rutas de procesamiento masivo con SSE.
+
+Con el worker sync de gunicorn cada stream SSE ocupa un hilo durante todo el lote,
+aunque casi todo ese tiempo esté esperando a OFF, SerpAPI o Gemini. Aquí el mismo
+pipeline corre sobre asyncio: las llamadas externas usan aiohttp (no bloquean) y
+el trabajo de CPU (PIL, rembg, openpyxl, ZIP) se envía a un ThreadPoolExecutor.
+Un solo worker puede mantener cientos de streams y llamadas en vuelo.
+
+El armado de peticiones y el parseo de respuestas son los mismos de app.py; el
+resto de rutas (páginas, /process_ean, /metrics, /health...) se delegan a la app
+Flask a través de un adaptador WSGI que corre en hilos y reenvía el cuerpo bloque
+a bloque (los streams SSE y send_file no se acumulan en memoria).
+
+    gunicorn async_app:app -c gunicorn.conf.py --bind 0.0.0.0:$PORT \\
+        --worker-class aiohttp.GunicornWebWorker --workers 1 --timeout 300
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import aiohttp
+from aiohttp import web
+
+import app as flask_module
+import artifacts
+import checkpoints
+import circuit
+import deadlines
+import http_cache
+import image_dedupe
+import image_sources
+import memory
+import metrics
+import refresh
+import scheduler
+from tracing import JobTimings
+
+logger = logging.getLogger(__name__)
+
+MAX_EANS = 50
+# EANs de un mismo lote procesados en paralelo (respetar cuotas de SerpAPI/Gemini)
+EAN_CONCURRENCY = int(os.environ.get('ASYNC_EAN_CONCURRENCY', '4'))
+# Conexiones simultáneas a servicios externos para todo el worker
+UPSTREAM_CONNECTIONS = int(os.environ.get('ASYNC_UPSTREAM_CONNECTIONS', '200'))
+CPU_WORKERS = int(os.environ.get('ASYNC_CPU_WORKERS', str(os.cpu_count() or 2)))
+WSGI_THREADS = int(os.environ.get('ASYNC_WSGI_THREADS', '4'))
+# Turnos del planificador para todo el worker: dos lotes a pleno más los reservados a /process_ean
+SCHEDULER_SLOTS = int(os.environ.get('ASYNC_SCHEDULER_SLOTS',
+                                     str(EAN_CONCURRENCY * 2 + scheduler.SCHEDULER_INTERACTIVE_SLOTS)))
+
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix='cpu')
+wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix='wsgi')
+
+HTTP_SESSION = web.AppKey('http_session', aiohttp.ClientSession)
+
+# Cabeceras que gestiona aiohttp y no deben copiarse desde la respuesta WSGI
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'content-length'}
+
+
+async def run_cpu(func, *args):
+    """Ejecuta trabajo de CPU en el executor conservando la traza del EAN en curso"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(cpu_executor, context.run, func, *args)
+
+
+async def fetch(session, provider, stage, method, url, timeout, **kwargs):
+    """Petición HTTP no bloqueante con métricas; devuelve (status, body, headers)"""
+    circuit.check(provider)
+    timeout = deadlines.timeout(timeout)
+    try:
+        with metrics.stage_timer(stage):
+            async with session.request(method, url, timeout=aiohttp.ClientTimeout(total=timeout), **kwargs) as response:
+                body = await response.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        metrics.record_upstream_status(provider, None)
+        raise
+    metrics.record_upstream_status(provider, response.status, len(body))
+    return response.status, body, response.headers
+
+
+async def cached_fetch(session, cache, provider, stage, url, timeout, headers=None):
+    """GET a través de http_cache (misma caché que la app Flask): revalida con ETag/Last-Modified"""
+    entry = http_cache.lookup(cache, url)
+    if entry is not None and entry.fresh():
+        metrics.record_cache(cache, True)
+        return entry.status_code, entry.content, entry.headers
+    status, body, response_headers = await fetch(session, provider, stage, 'GET', url, timeout,
+                                                 headers={**(headers or {}), **http_cache.validators(entry)})
+    served = http_cache.resolve(cache, url, entry, status, body, response_headers)
+    if served is not None:
+        return served.status_code, served.content, served.headers
+    return status, body, response_headers
+
+
+# --- Pipeline asíncrono (mismo comportamiento que las funciones de app.py) ---
+
+async def get_product_data(session, ean):
+    try:
+        invalid = flask_module.validate_ean(ean)
+        if invalid:
+            return invalid
+        status, body, _ = await cached_fetch(session, 'off', 'openfoodfacts', 'off',
+                                             flask_module.off_product_url(ean), 15,
+                                             headers=flask_module.OFF_HEADERS)
+        return flask_module.parse_off_response(ean, status, json.loads(body) if status == 200 else None)
+    except asyncio.TimeoutError:
+        return {'success': False, 'error': flask_module.OFF_TIMEOUT_ERROR}
+    except aiohttp.ClientConnectionError:
+        return {'success': False, 'error': flask_module.OFF_CONNECTION_ERROR}
+    except circuit.CircuitOpenError as e:
+        return {'success': False, 'error': f'{str(e)}. Por favor, intenta nuevamente en unos segundos.'}
+    except deadlines.DeadlineExceeded as e:
+        return {'success': False, 'error': str(e)}
+    except Exception as e:
+        return {'success': False, 'error': f'Error inesperado: {str(e)}. Por favor, intenta nuevamente.'}
+
+
+async def get_off_last_modified(session, ean):
+    try:
+        status, body, _ = await fetch(session, 'openfoodfacts', 'off', 'GET',
+                                      flask_module.off_product_url(ean), 15,
+                                      params={'fields': 'last_modified_t'},
+                                      headers=flask_module.OFF_HEADERS)
+        return flask_module.parse_off_last_modified(status, json.loads(body) if status == 200 else None)
+    except Exception as e:
+        logger.warning(f"  ⚠️ No se pudo consultar last_modified_t de {ean}: {e}")
+        return None
+
+
+async def search_product_web_data(session, ean, product_name, api_key):
+    try:
+        status, body, _ = await fetch(session, 'gemini_text', 'gemini_text', 'POST',
+                                      flask_module.gemini_url(flask_module.GEMINI_TEXT_MODEL), 60,
+                                      headers=flask_module.gemini_headers(api_key),
+                                      json=flask_module.build_web_data_payload(ean, product_name))
+        return flask_module.parse_web_data_response(status, json.loads(body) if status == 200 else None)
+    except Exception as e:
+        return {'success': False, 'error': f'Error buscando datos web: {str(e) or type(e).__name__}'}
+
+
+async def search_web_images(session, ean, product_name=None):
+    try:
+        serpapi_key = os.getenv("SERPAPI_KEY")
+        if not serpapi_key:
+            logger.error("❌ SERPAPI_KEY no configurada - SOLO búsqueda web disponible")
+            return {'success': False, 'error': 'SERPAPI_KEY no configurada'}
+
+        params = flask_module.build_serpapi_params(ean, product_name, serpapi_key)
+        logger.info(f"  🌐 Buscando UNA imagen en Google Images para: {params['q']}")
+        status, body, _ = await fetch(session, 'serpapi', 'serpapi', 'GET', flask_module.SERPAPI_URL, 15, params=params)
+        img_info, error_result = flask_module.pick_serpapi_image(status, json.loads(body) if status == 200 else None)
+        if error_result:
+            return error_result
+
+        try:
+            status, content, headers = await cached_fetch(session, 'image', 'image_host', 'image_download',
+                                                          img_info['original'], 10,
+                                                          headers=flask_module.IMAGE_DOWNLOAD_HEADERS)
+        except Exception as download_error:
+            logger.warning(f"  ⚠️ Error descargando imagen: {str(download_error)}")
+            return {'success': False, 'error': f'Error descargando imagen: {str(download_error) or type(download_error).__name__}'}
+        return await run_cpu(flask_module.build_downloaded_image_result,
+                             status, content, headers.get('content-type'), img_info)
+    except Exception as e:
+        logger.error(f"  ❌ Error en búsqueda web: {e}")
+        return {'success': False, 'error': f'Error en búsqueda web: {str(e)}'}
+
+
+async def fetch_off_image(session, ean, off_image_url):
+    result = {'success': False, 'error': 'El producto no tiene imagen en OFF'}
+    for url in image_sources.off_image_urls(off_image_url):
+        try:
+            status, content, _ = await cached_fetch(session, 'image', 'image_host', 'image_download', url, 15)
+        except Exception as e:
+            result = {'success': False, 'error': f'Error descargando imagen: {str(e) or type(e).__name__}'}
+            continue
+        result = flask_module.image_download_result(status, content)
+        if result['success']:
+            result['source'] = 'Open Food Facts'
+            return result
+    return result
+
+
+async def search_and_download_product_image(session, ean, product_name, image_url_fallback=None):
+    fetchers = {
+        'off': lambda: fetch_off_image(session, ean, image_url_fallback),
+        'serpapi': lambda: search_web_images(session, ean, product_name),
+    }
+    result = await image_sources.cascade_async(fetchers, run_cpu)
+    if not result['success']:
+        logger.warning(f"  ❌ No se encontró imagen para {ean} en ninguna fuente")
+    return result
+
+
+async def enhance_image_with_gemini(session, image_data_base64, prompt, api_key):
+    try:
+        status, body, _ = await fetch(session, 'gemini_image', 'gemini_image', 'POST',
+                                      flask_module.gemini_url(flask_module.GEMINI_IMAGE_MODEL), 60,
+                                      headers=flask_module.gemini_headers(api_key),
+                                      json=flask_module.build_enhance_payload(image_data_base64, prompt))
+        return flask_module.parse_enhance_response(status, json.loads(body) if status == 200 else None)
+    except Exception as e:
+        return {'success': False, 'error': f'Error procesando imagen: {str(e) or type(e).__name__}'}
+
+
+async def process_product_image(session, ean, image_data_base64, api_key):
+    """Versión asíncrona de app.process_product_image (IA + remoción de fondo)"""
+    image_filename = f"{ean}.png"
+    if not api_key:
+        return {'success': True, 'filename': image_filename, 'image_data': image_data_base64,
+                'message': 'Imagen guardada (sin IA)'}
+
+    quality = await run_cpu(flask_module.check_image_quality, ean, image_data_base64)
+    if quality and quality['passes']:
+        logger.info(f"  ⏭️ Imagen ya cumple la especificación para {ean}, se omite la IA")
+        image_data_enhanced = image_data_base64
+        message = 'Imagen ya apta, IA omitida'
+    elif not deadlines.allows('gemini_image'):
+        logger.warning(f"  ⏱️ Sin tiempo para la IA de {ean}, se guarda la imagen original")
+        image_data_enhanced = image_data_base64
+        message = 'Imagen guardada sin IA (tiempo del trabajo agotado)'
+    else:
+        logger.info(f"  🤖 Mejorando imagen con IA para {ean}")
+        enhance_result = await enhance_image_with_gemini(session, image_data_base64, flask_module.ENHANCE_PROMPT, api_key)
+        if not enhance_result['success']:
+            logger.warning(f"  ⚠️ Error mejorando imagen: {enhance_result.get('error', 'Unknown')}")
+            return {'success': False, 'message': 'Error mejorando imagen', 'quality': quality}
+        image_data_enhanced = enhance_result['image_data']
+        message = 'Imagen procesada correctamente'
+
+    image_data_final = image_data_enhanced
+    if not deadlines.allows('rembg'):
+        logger.warning(f"  ⏱️ Sin tiempo para remover el fondo de {ean}")
+    else:
+        try:
+            remove_bg_result = await run_cpu(flask_module.remove_white_background, image_data_enhanced)
+            if remove_bg_result['success']:
+                image_data_final = remove_bg_result['image_data']
+        except Exception as e:
+            logger.error(f"  ❌ Error en rembg para {ean}: {e}")
+
+    return {'success': True, 'filename': image_filename, 'image_data': image_data_final,
+            'message': message, 'quality': quality}
+
+
+async def process_product_image_deduped(session, ean, image_data_base64, api_key, dedupe):
+    """Versión asíncrona de app.process_product_image_deduped"""
+    image_hash = await run_cpu(image_dedupe.image_hash, image_data_base64) if dedupe is not None else None
+    if image_hash is None:
+        return await process_product_image(session, ean, image_data_base64, api_key)
+
+    entry, owner = dedupe.claim(image_hash, ean)
+    if not owner:
+        # Otra tarea está procesando la misma imagen: esperar su resultado sin bloquear el loop
+        wait_seconds = deadlines.timeout(image_dedupe.DEDUPE_WAIT_SECONDS)
+        if await asyncio.get_running_loop().run_in_executor(None, entry.wait, wait_seconds):
+            metrics.record_cache('image_dedupe', True)
+            logger.info(f"  ♻️ Imagen de {ean} duplicada de la de {entry.ean}, se reutiliza")
+            return image_dedupe.shared_result(entry, ean)
+        return await process_product_image(session, ean, image_data_base64, api_key)
+
+    metrics.record_cache('image_dedupe', False)
+    result = None
+    try:
+        result = await process_product_image(session, ean, image_data_base64, api_key)
+        return result
+    finally:
+        dedupe.resolve(entry, result)
+
+
+# --- SSE ---
+
+class SSEStream:
+    """Respuesta text/event-stream con el mismo formato 'data: {json}' que la app Flask"""
+
+    def __init__(self, request, route):
+        self.request = request
+        self.route = route
+        self.circuits = circuit.Watcher()
+        self.response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
+
+    async def open(self):
+        await self.response.prepare(self.request)
+
+    async def send(self, payload):
+        for status in self.circuits.poll():
+            await self._write(status)
+        await self._write(payload)
+
+    async def _write(self, payload):
+        data = f"data: {json.dumps(payload)}\n\n".encode('utf-8')
+        metrics.add_bytes_out(self.route, len(data))
+        await self.response.write(data)
+
+
+async def read_eans(request, stream):
+    """Lee y limita la lista de EANs del formulario; None si no hay nada que procesar"""
+    form = await request.post()
+    eans = json.loads(form.get('eans', '[]'))
+    logger.info(f"📊 Cantidad de EANs recibidos: {len(eans)}")
+    if not eans:
+        await stream.send({'type': 'error', 'message': 'No se recibieron códigos EAN'})
+        return None
+    if len(eans) > MAX_EANS:
+        await stream.send({'type': 'warning', 'message': f'Se procesarán solo los primeros {MAX_EANS} EANs de {len(eans)}'})
+        eans = eans[:MAX_EANS]
+    return [ean.strip() for ean in eans]
+
+
+async def run_items(eans, handler, stream, timings, restore=None):
+    """Procesa los EANs en paralelo (con límite) y emite 'progress' según van terminando.
+
+    Devuelve los resultados en el orden original de los EANs. Si el trabajo agota
+    su deadline, los EANs que no llegaron a empezar quedan en None (pendientes).
+    restore(ean) devuelve el resultado de un EAN ya guardado (o None): esos no
+    esperan semáforo ni turno.
+    """
+    semaphore = asyncio.Semaphore(EAN_CONCURRENCY)
+    results = [None] * len(eans)
+    client = scheduler.client_key(stream.request.headers.get('X-Forwarded-For'), stream.request.remote)
+
+    async def run_one(index, ean):
+        # Semáforo: límite del lote; turno: reparto del worker entre lotes y /process_ean
+        queued_at = time.perf_counter()
+        restored = await restore(ean) if restore is not None else None
+        if restored is not None:
+            trace = timings.start(ean, queued_at)
+            timings.finish(trace)
+            results[index] = restored
+            return ean, restored, trace
+        async with semaphore, scheduler.async_turn(scheduler.BULK, client):
+            if deadlines.exhausted() or memory.exhausted():
+                return ean, None, None
+            # La espera incluye el semáforo del lote además del turno del planificador
+            trace = timings.start(ean, queued_at)
+            metrics.EANS_IN_FLIGHT.inc()
+            try:
+                result = await handler(ean)
+            except Exception as e:
+                logger.error(f"  ❌ Error procesando {ean}: {e}")
+                result = {'success': False, 'message': f'Error: {str(e)}'}
+            finally:
+                metrics.EANS_IN_FLIGHT.dec()
+                timings.finish(trace)
+            results[index] = result
+            return ean, result, trace
+
+    tasks = [asyncio.create_task(run_one(index, ean)) for index, ean in enumerate(eans)]
+    notified = False
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            ean, result, trace = await next_done
+            if result is None:
+                if not notified:
+                    notified = True
+                    await stream.send(flask_module.job_stop_notice(stream.route))
+                continue
+            event = {'type': 'progress', 'ean': ean, 'success': result['success'],
+                     'message': result['message'], 'timings': trace.as_dict()}
+            if result.get('resumed'):
+                event['resumed'] = True
+            if result.get('reused'):
+                event['reused'] = True
+            if result.get('quality'):
+                event['quality'] = result['quality']
+            if result.get('duplicate_of'):
+                event['duplicate_of'] = result['duplicate_of']
+            if result.get('image_url'):
+                event['image_url'] = result['image_url']
+                event['thumbnail_url'] = result['thumbnail_url']
+            await stream.send(event)
+    finally:
+        # Si el cliente cierra el stream, no seguir gastando cuota en el resto del lote
+        for task in tasks:
+            task.cancel()
+    return results
+
+
+async def images_job(request, route, zip_prefix, use_cascade):
+    """Cuerpo común de /process_images_only y /process_bulk_images"""
+    stream = SSEStream(request, route)
+    await stream.open()
+    metrics.JOBS_IN_FLIGHT.inc(route)
+    # Deadline y memoria del trabajo: las tareas de cada EAN los heredan al copiar el contexto
+    deadlines.start()
+    job_memory = memory.start(route)
+    try:
+        eans = await read_eans(request, stream)
+        if eans is None:
+            return stream.response
+        session = request.app[HTTP_SESSION]
+        api_key = os.getenv("GEMINI_API_KEY")
+        timings = JobTimings()
+        dedupe = image_dedupe.job_index()
+        job_id = artifacts.store.new_job_id()
+        await stream.send({'type': 'job', 'job_id': job_id, 'partial_url': f'/download_partial/{job_id}'})
+
+        async def handle(ean):
+            product_result = await get_product_data(session, ean)
+            product_name = 'producto'
+            image_url_fallback = None
+            if product_result['success']:
+                product_name = product_result['data'].get('name', 'producto')
+                image_url_fallback = product_result['data'].get('image_url')
+            if use_cascade:
+                search_result = await search_and_download_product_image(session, ean, product_name, image_url_fallback)
+            else:
+                search_result = await search_web_images(session, ean, product_name)
+            if not search_result['success']:
+                return {'success': False, 'message': 'No se encontró imagen'}
+            result = await process_product_image_deduped(session, ean, search_result['image_data'], api_key, dedupe)
+            # Imagen descargable al momento (y dentro del ZIP parcial)
+            return {**result, **await run_cpu(flask_module.publish_item, job_id, result)}
+
+        results = await run_items(eans, handle, stream, timings)
+        timing_summary = timings.summary()
+        unfinished = [ean for ean, result in zip(eans, results) if result is None]
+        images_data = [{'filename': r['filename'], 'data': r['image_data']} for r in results if r and r['success']]
+        if not images_data:
+            await stream.send({'type': 'error', 'message': 'No se pudieron procesar imágenes', 'unfinished': unfinished})
+            return stream.response
+
+        zip_data = await run_cpu(flask_module.build_zip, images_data, None, unfinished)
+        zip_filename = await run_cpu(artifacts.store.put, zip_data, zip_prefix, job_id)
+        await stream.send({'type': 'complete', 'zip_filename': zip_filename, 'job_id': job_id,
+                           'timing_summary': timing_summary,
+                           'memory_summary': flask_module.job_memory_summary(), 'unfinished': unfinished})
+    except (ConnectionResetError, asyncio.CancelledError):
+        logger.warning(f"⚠️ Cliente desconectado en {route}")
+        raise
+    except Exception as e:
+        logger.error(f"❌ ERROR FATAL en {route}: {e}", exc_info=True)
+        await stream.send({'type': 'error', 'message': f'Error: {str(e)}'})
+    finally:
+        metrics.JOBS_IN_FLIGHT.dec(route)
+        metrics.finish_job_memory(route, job_memory)
+        deadlines.clear()
+    return stream.response
+
+
+async def process_images_only(request):
+    return await images_job(request, 'process_images_only', 'imagenes', use_cascade=True)
+
+
+async def process_bulk_images(request):
+    return await images_job(request, 'process_bulk_images', 'imagenes_google', use_cascade=False)
+
+
+async def process_bulk(request):
+    route = 'process_bulk'
+    stream = SSEStream(request, route)
+    await stream.open()
+    metrics.JOBS_IN_FLIGHT.inc(route)
+    # Deadline y memoria del trabajo: las tareas de cada EAN los heredan al copiar el contexto
+    deadlines.start()
+    job_memory = memory.start(route)
+    try:
+        eans = await read_eans(request, stream)
+        if eans is None:
+            return stream.response
+        session = request.app[HTTP_SESSION]
+        api_key = os.getenv("GEMINI_API_KEY")
+        timings = JobTimings()
+        dedupe = image_dedupe.job_index()
+
+        form = await request.post()
+        batch_id = form.get('batch_id', '')
+        if not checkpoints.valid_batch_id(batch_id):
+            await run_cpu(checkpoints.purge_expired)
+            batch_id = checkpoints.new_batch_id()
+        checkpoint = await run_cpu(checkpoints.BatchCheckpoint, batch_id)
+        resumed = await run_cpu(checkpoint.completed_count)
+        await stream.send({'type': 'batch', 'batch_id': batch_id, 'resumed': resumed})
+
+        # Actualización incremental: resultado anterior (ZIP o Excel) opcional
+        previous = None
+        upload = form.get('previous')
+        if getattr(upload, 'filename', None):
+            try:
+                previous = await run_cpu(refresh.PreviousRun.load, upload.file.read(), upload.filename)
+            except Exception as e:
+                await stream.send({'type': 'error', 'message': f'Resultado anterior no válido: {str(e)}'})
+                return stream.response
+
+        async def web_data_for(ean, name):
+            if not api_key or not deadlines.allows('gemini_text'):
+                return {}
+            web_result = await search_product_web_data(session, ean, name, api_key)
+            return web_result['data'] if web_result['success'] else {}
+
+        async def restore(ean):
+            record = await run_cpu(checkpoint.done, ean)
+            if record:
+                return {'success': record['success'], 'message': record['message'], 'resumed': True}
+            return None
+
+        async def handle(ean):
+            result = await refresh_item(ean) if previous is not None else await process_item(ean)
+            await run_cpu(checkpoint.save, ean, result['success'], result['message'],
+                          result['product'], result.get('image'))
+            return result
+
+        async def refresh_item(ean):
+            if previous.candidate(ean):
+                reused = await run_cpu(previous.reuse, ean, await get_off_last_modified(session, ean))
+                if reused:
+                    metrics.REFRESH_ITEMS.inc('reused')
+                    return {'success': True, 'message': 'Sin cambios en OFF (reutilizado)', 'reused': True, **reused}
+                metrics.REFRESH_ITEMS.inc('changed')
+            else:
+                metrics.REFRESH_ITEMS.inc('retried')
+            return await process_item(ean)
+
+        async def process_item(ean):
+            product_result = await get_product_data(session, ean)
+            if not product_result['success']:
+                web_data = await web_data_for(ean, '')
+                combined_product = flask_module.combine_product_data(ean, {}, web_data)
+                combined_product['Producto Encontrado'] = 'no'
+                return {'success': False, 'message': 'No encontrado en OFF, datos web agregados',
+                        'product': combined_product}
+
+            off_product = product_result['data']
+            # Datos web e imagen no dependen entre sí: se piden a la vez
+            web_data, image_search_result = await asyncio.gather(
+                web_data_for(ean, off_product.get('name', '')),
+                search_and_download_product_image(session, ean, off_product.get('name', 'No disponible'),
+                                                  off_product.get('image_url')),
+            )
+            combined_product = flask_module.combine_product_data(ean, off_product, web_data)
+            combined_product[refresh.LAST_MODIFIED_KEY] = off_product.get('last_modified_t')
+            image = None
+            quality = None
+            duplicate_of = None
+            if image_search_result['success']:
+                image_result = await process_product_image_deduped(session, ean, image_search_result['image_data'],
+                                                                   api_key, dedupe)
+                quality = image_result.get('quality')
+                duplicate_of = image_result.get('duplicate_of')
+                if image_result['success']:
+                    image = {'filename': image_result['filename'], 'data': image_result['image_data']}
+                    combined_product['Imagen'] = f"imagenes/{image['filename']}"
+            return {'success': True, 'message': 'Procesado correctamente', 'product': combined_product,
+                    'image': image, 'quality': quality, 'duplicate_of': duplicate_of}
+
+        results = await run_items(eans, handle, stream, timings, restore)
+        timing_summary = timings.summary()
+        # Los ya guardados en el checkpoint entran en el ZIP aunque no se hayan vuelto a mirar
+        unfinished = [ean for ean, result in zip(eans, results)
+                      if result is None and not await run_cpu(checkpoint.done, ean)]
+        products_data, images_data = await run_cpu(checkpoint.assemble, eans)
+        if not products_data:
+            await stream.send({'type': 'error', 'message': 'No se pudieron procesar productos', 'unfinished': unfinished})
+            return stream.response
+
+        excel_data = await run_cpu(flask_module.create_bulk_excel, products_data)
+        zip_data = await run_cpu(flask_module.build_zip, images_data, excel_data, unfinished)
+        zip_base64 = await run_cpu(flask_module.encode_zip_base64, zip_data)
+        await stream.send({'type': 'complete', 'zip_data': zip_base64, 'batch_id': batch_id,
+                           'timing_summary': timing_summary,
+                           'memory_summary': flask_module.job_memory_summary(), 'unfinished': unfinished})
+    except (ConnectionResetError, asyncio.CancelledError):
+        logger.warning(f"⚠️ Cliente desconectado en {route}")
+        raise
+    except Exception as e:
+        logger.error(f"❌ ERROR FATAL en {route}: {e}", exc_info=True)
+        await stream.send({'type': 'error', 'message': f'Error: {str(e)}'})
+    finally:
+        metrics.JOBS_IN_FLIGHT.dec(route)
+        metrics.finish_job_memory(route, job_memory)
+        deadlines.clear()
+    return stream.response
+
+
+async def download_zip(request):
+    """Sirve el ZIP del almacén de artefactos con sendfile (sin cargarlo en memoria)"""
+    filename = request.match_info['filename']
+    zip_path = await run_cpu(artifacts.store.open_path, filename)
+    if not zip_path:
+        return web.json_response({'error': 'Archivo no encontrado o expirado'}, status=404)
+    return web.FileResponse(zip_path, headers={
+        'Content-Type': 'application/zip',
+        'Content-Disposition': f'attachment; filename="{filename}"',
+    })
+
+
+async def job_item(request):
+    """Imagen, miniatura o Excel de un trabajo, servido con sendfile (ETag incluido)"""
+    filename = request.match_info['filename']
+    item_path = await run_cpu(artifacts.store.item_path, request.match_info['job_id'], filename)
+    if not item_path:
+        return web.json_response({'error': 'Archivo no encontrado o expirado'}, status=404)
+    return web.FileResponse(item_path, headers={
+        'Content-Type': flask_module.ITEM_MIMETYPES.get(filename.rsplit('.', 1)[-1], 'application/octet-stream'),
+        'Cache-Control': 'public, max-age=3600',
+    })
+
+
+# --- Delegación del resto de rutas a Flask ---
+
+def _wsgi_environ(request, body):
+    host, _, port = request.host.partition(':')
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': request.path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': request.query_string,
+        'SERVER_NAME': host,
+        'SERVER_PORT': port or ('443' if request.secure else '80'),
+        'SERVER_PROTOCOL': f'HTTP/{request.version.major}.{request.version.minor}',
+        'REMOTE_ADDR': request.remote or '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': request.scheme,
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name in set(request.headers.keys()):
+        value = ','.join(request.headers.getall(name))
+        key = name.upper().replace('-', '_')
+        if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[key] = value
+        else:
+            environ[f'HTTP_{key}'] = value
+    return environ
+
+
+def _start_wsgi(environ):
+    """Llama a la app Flask; devuelve (status, cabeceras, bloques escritos con write(), cuerpo)"""
+    captured = {}
+    written = []
+
+    def start_response(status, headers, exc_info=None):
+        captured['status'] = status
+        captured['headers'] = headers
+        return written.append
+
+    result = flask_module.app(environ, start_response)
+    return captured['status'], captured['headers'], written, result
+
+
+async def flask_fallback(request):
+    """Delega en Flask sin acumular la respuesta: SSE y send_file llegan bloque a bloque.
+
+    Cada next() del iterador WSGI corre en wsgi_executor dentro del mismo contexto
+    (stream_with_context y las ContextVar del trabajo siguen activas aunque cambie
+    el hilo), y cada bloque se escribe al cliente en cuanto sale.
+    """
+    body = await request.read()
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    status, headers, written, result = await loop.run_in_executor(
+        wsgi_executor, context.run, _start_wsgi, _wsgi_environ(request, body))
+    iterator = iter(result)
+    pending = None
+    try:
+        response = web.StreamResponse(status=int(status.split(' ', 1)[0]))
+        for name, value in headers:
+            if name.lower() not in HOP_BY_HOP_HEADERS:
+                response.headers.add(name, value)
+        await response.prepare(request)
+        for chunk in written:
+            await response.write(chunk)
+        while True:
+            pending = loop.run_in_executor(wsgi_executor, context.run, next, iterator, None)
+            chunk = await pending
+            if chunk is None:
+                break
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+    finally:
+        # Si el cliente corta a mitad de un bloque, se espera a que salga antes de cerrar el generador
+        if pending is not None and not pending.done():
+            with contextlib.suppress(Exception):
+                await asyncio.shield(pending)
+        if hasattr(result, 'close'):
+            await loop.run_in_executor(wsgi_executor, context.run, result.close)
+
+
+async def http_session_ctx(application):
+    connector = aiohttp.TCPConnector(limit=UPSTREAM_CONNECTIONS, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        application[HTTP_SESSION] = session
+        yield
+
+
+def create_app():
+    application = web.Application(client_max_size=10 * 1024 * 1024)
+    scheduler.shared.configure(slots=SCHEDULER_SLOTS)
+    application.cleanup_ctx.append(http_session_ctx)
+    application.router.add_post('/process_bulk', process_bulk)
+    application.router.add_post('/process_images_only', process_images_only)
+    application.router.add_post('/process_bulk_images', process_bulk_images)
+    application.router.add_get('/download_zip/{filename}', download_zip)
+    application.router.add_get('/job_items/{job_id}/{filename}', job_item)
+    application.router.add_route('*', '/{tail:.*}', flask_fallback)
+    logger.info(f"⚡ App asíncrona lista (EANs en paralelo por lote: {EAN_CONCURRENCY}, "
+                f"conexiones: {UPSTREAM_CONNECTIONS}, hilos CPU: {CPU_WORKERS}, turnos: {SCHEDULER_SLOTS})")
+    return application
+
+
+app = create_app()
+
+if __name__ == '__main__':
+    web.run_app(app, host='0.0.0.0', port=int(os.environ.get('PORT', '5000')))
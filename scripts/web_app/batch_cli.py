@@ -0,0 +1,569 @@
+"""
+Procesamiento masivo sin navegador para catálogos grandes.
+
+Ejecuta el mismo pipeline que /process_bulk (modo productos) o /process_images_only
+(modo imagenes) a partir de un archivo de EANs, sin el límite de 50 EANs ni el
+timeout de gunicorn:
+
+    python batch_cli.py eans.txt --output salida/ --concurrency 4
+
+- Entrada: .txt/.csv (primera columna) o .xlsx (primera columna de la primera hoja)
+- Cada EAN terminado se guarda como checkpoint en <output>/.checkpoints y su imagen
+  en <output>/imagenes/ al momento; volver a lanzar el mismo comando salta los ya
+  hechos (--retry-failed reintenta también los fallidos)
+- <output>/productos_prestashop.xlsx se reescribe cada --excel-every EANs y al final
+- <output>/eans_fallidos.txt lista los EANs sin resultado al terminar
+- --refresh-from <salida anterior> reutiliza las filas e imágenes de los EANs que no
+  cambiaron en OFF desde entonces (ver refresh.py)
+- --enhance-mode batch (modo imagenes) manda la IA a Gemini Batch: primero se buscan
+  las imágenes, se envían por lotes y se quita el fondo según llegan los resultados.
+  Los lotes enviados se guardan en <output>/.checkpoints/gemini_batches.json: si se
+  corta la ejecución, relanzar el comando recoge esos lotes en lugar de reenviarlos.
+  Relanzar sin --enhance-mode batch cancela los lotes pendientes (se procesan en modo
+  síncrono)
+"""
+
+import argparse
+import base64
+import contextlib
+import csv
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import checkpoints
+import gemini_batch
+import image_dedupe
+import refresh
+from tracing import JobTimings
+
+import app as web_app
+
+MODES = ('productos', 'imagenes')
+ENHANCE_MODES = ('sync', 'batch')
+CHECKPOINT_SUBDIR = '.checkpoints'
+BATCH_STATE_FILENAME = 'gemini_batches.json'
+CHECKPOINT_BATCH_ID = 'cli'
+EXCEL_FILENAME = refresh.EXCEL_FILENAME
+FAILED_FILENAME = 'eans_fallidos.txt'
+PROGRESS_WIDTH = 30
+
+
+def read_eans(path):
+    """EANs de la primera columna del archivo, sin duplicados y en orden"""
+    if path.lower().endswith('.xlsx'):
+        from openpyxl import load_workbook
+        workbook = load_workbook(path, read_only=True)
+        values = [row[0] for row in workbook.active.iter_rows(values_only=True) if row]
+        workbook.close()
+    else:
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            values = [row[0] for row in csv.reader(f) if row]
+
+    eans = []
+    seen = set()
+    for value in values:
+        ean = str(value).strip() if value is not None else ''
+        # Las celdas numéricas de Excel llegan como 8412345678905.0
+        if ean.endswith('.0'):
+            ean = ean[:-2]
+        # Se ignoran encabezados y líneas vacías
+        if not ean.isdigit() or ean in seen:
+            continue
+        seen.add(ean)
+        eans.append(ean)
+    return eans
+
+
+def write_atomic(path, data):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def image_record(image_result):
+    """Resultado de las rutas de imágenes con la forma de los checkpoints"""
+    image = None
+    if image_result['success']:
+        image = {'filename': image_result['filename'], 'data': image_result['image_data']}
+    return {'success': image_result['success'], 'message': image_result['message'], 'product': None, 'image': image}
+
+
+class Progress:
+    """Barra de progreso en stderr: hechos, correctos, fallidos, ritmo y tiempo restante"""
+
+    def __init__(self, total, already_done=0):
+        self.total = total
+        self.done = already_done
+        self.ok = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.processed = 0
+        self._lock = threading.Lock()
+
+    def update(self, success):
+        with self._lock:
+            self.done += 1
+            self.processed += 1
+            if success:
+                self.ok += 1
+            else:
+                self.failed += 1
+            self.render()
+
+    def render(self, final=False):
+        filled = int(PROGRESS_WIDTH * self.done / self.total) if self.total else PROGRESS_WIDTH
+        elapsed = time.monotonic() - self.started
+        rate = self.processed / elapsed if elapsed else 0.0
+        remaining = (self.total - self.done) / rate if rate else 0
+        minutes, seconds = divmod(int(remaining), 60)
+        line = (f"\r[{'#' * filled}{'-' * (PROGRESS_WIDTH - filled)}] {self.done}/{self.total} "
+                f"✓ {self.ok} ✗ {self.failed} · {rate:.2f} EAN/s · ETA {minutes}m{seconds:02d}s")
+        sys.stderr.write(line + ('\n' if final else ''))
+        sys.stderr.flush()
+
+
+class PendingBatches:
+    """Lotes de Gemini Batch enviados y aún sin recoger, persistidos junto a los checkpoints.
+
+    - batches: {nombre: {'keys': [EANs], 'submitted_at': epoch}}
+    - quality: {EAN: análisis de calidad} para el mensaje y el evento final
+    - duplicates: {EAN duplicado: EAN cuyo resultado reutiliza}
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.batches = {}
+        self.quality = {}
+        self.duplicates = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                state = json.load(f)
+            self.batches = state.get('batches', {})
+            self.quality = state.get('quality', {})
+            self.duplicates = state.get('duplicates', {})
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if not self.batches:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        state = {'batches': self.batches, 'quality': self.quality, 'duplicates': self.duplicates}
+        write_atomic(self.path, json.dumps(state, ensure_ascii=False).encode('utf-8'))
+
+    def add(self, name, keys, quality):
+        with self._lock:
+            self.batches[name] = {'keys': keys, 'submitted_at': time.time()}
+            self.quality.update({key: quality.get(key) for key in keys})
+            self._save()
+
+    def add_duplicates(self, duplicates):
+        """Anota {EAN: EAN dueño} de los duplicados cuyo dueño espera a un lote; devuelve los que no"""
+        with self._lock:
+            waiting = {key for batch in self.batches.values() for key in batch['keys']}
+            self.duplicates.update({ean: owner for ean, owner in duplicates.items() if owner in waiting})
+            self._save()
+            return [ean for ean, owner in duplicates.items() if owner not in waiting]
+
+    def remove(self, name):
+        """Olvida un lote ya recogido (y la calidad y duplicados de sus EANs)"""
+        with self._lock:
+            batch = self.batches.pop(name, None)
+            if batch is None:
+                return
+            for key in batch['keys']:
+                self.quality.pop(key, None)
+            self.duplicates = {ean: owner for ean, owner in self.duplicates.items() if owner not in batch['keys']}
+            self._save()
+
+    def eans(self):
+        """EANs a la espera de un lote (los propios y sus duplicados)"""
+        with self._lock:
+            waiting = {key for batch in self.batches.values() for key in batch['keys']}
+            return waiting | set(self.duplicates)
+
+    def duplicates_of(self, owner):
+        with self._lock:
+            return [ean for ean, other in self.duplicates.items() if other == owner]
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(batch) for name, batch in self.batches.items()}
+
+
+class CatalogRunner:
+    def __init__(self, eans, output_dir, mode='productos', concurrency=4, excel_every=50, retry_failed=False,
+                 previous=None, enhance_mode='sync'):
+        self.eans = eans
+        self.output_dir = output_dir
+        self.mode = mode
+        self.enhance_mode = enhance_mode
+        self.concurrency = max(1, concurrency)
+        self.excel_every = excel_every
+        self.retry_failed = retry_failed
+        self.previous = previous
+        self.reused = 0
+        self.images_dir = os.path.join(output_dir, 'imagenes')
+        os.makedirs(self.images_dir, exist_ok=True)
+        self.checkpoint = checkpoints.BatchCheckpoint(CHECKPOINT_BATCH_ID, root=os.path.join(output_dir, CHECKPOINT_SUBDIR))
+        self.api_key = os.getenv('GEMINI_API_KEY')
+        self.dedupe = image_dedupe.job_index()
+        self.timings = JobTimings()
+        self.batches = PendingBatches(os.path.join(output_dir, CHECKPOINT_SUBDIR, BATCH_STATE_FILENAME))
+        self._excel_lock = threading.Lock()
+        self._since_excel = 0
+        # Modo lote: imágenes encontradas a la espera de envío y trazas de los EANs en un lote
+        self._staged = []
+        self._staged_bytes = 0
+        self._duplicates = {}
+        self._claims = {}
+        self._traces = {}
+        self._stage_lock = threading.Lock()
+
+    def pending(self):
+        """EANs sin checkpoint (o fallidos, con --retry-failed) que no esperan ya a un lote de Gemini"""
+        waiting = self.batches.eans()
+        pending = []
+        for ean in self.eans:
+            if ean in waiting:
+                continue
+            record = self.checkpoint.load(ean)
+            if record is None or (self.retry_failed and not record['success']):
+                pending.append(ean)
+        return pending
+
+    def process(self, ean):
+        """Procesa un EAN en un hilo del pool, guarda su checkpoint y su imagen"""
+        # Todos los EANs entran al pool al empezar: la espera es la cola del pool
+        trace = self.timings.start(ean, self.timings.started)
+        try:
+            if self.mode == 'productos' and self.previous is not None:
+                result = web_app.refresh_bulk_item(ean, self.api_key, self.previous, self.dedupe)
+            elif self.mode == 'productos':
+                result = web_app.process_bulk_item(ean, self.api_key, self.dedupe)
+            else:
+                result = image_record(web_app.process_image_item(ean, self.api_key, self.dedupe))
+        except Exception as e:
+            web_app.logger.error(f"  ❌ Error procesando {ean}: {e}")
+            result = {'success': False, 'message': f'Error: {str(e)}', 'product': None, 'image': None}
+        finally:
+            self.timings.finish(trace)
+        return self.save(ean, result)
+
+    def save(self, ean, result):
+        """Guarda la imagen y el checkpoint del EAN"""
+        if result.get('image'):
+            write_atomic(os.path.join(self.images_dir, result['image']['filename']),
+                         base64.b64decode(result['image']['data']))
+        # En modo productos sin registro (excepción en OFF) no se guarda: se reintenta al relanzar
+        if result['product'] is not None or self.mode == 'imagenes':
+            self.checkpoint.save(ean, result['success'], result['message'], result['product'], result.get('image'))
+        return result
+
+    # --- Modo lote: búsqueda, envío a Gemini Batch y recogida ---
+
+    def stage(self, ean):
+        """Busca la imagen del EAN. Devuelve su resultado si ya terminó o None si espera al lote"""
+        trace = self.timings.start(ean, self.timings.started)
+        waits_for_batch = False
+        try:
+            search = web_app.find_product_image(ean)
+            if not search['success']:
+                return self.save(ean, image_record({'success': False, 'message': 'No se encontró imagen'}))
+            image_data = search['image_data']
+            quality = web_app.check_image_quality(ean, image_data)
+            if quality and quality['passes']:
+                image_result = web_app.finalize_product_image(ean, image_data, 'Imagen ya apta, IA omitida', quality)
+                return self.save(ean, image_record(image_result))
+            image_hash = image_dedupe.image_hash(image_data) if self.dedupe is not None else None
+            with self._stage_lock:
+                if image_hash is not None:
+                    entry, owner = self.dedupe.claim(image_hash, ean)
+                    if not owner:
+                        self._duplicates[ean] = entry.ean
+                        return None
+                    self._claims[ean] = entry
+                waits_for_batch = True
+                self._staged.append((ean, image_data, quality))
+                self._staged_bytes += len(image_data)
+            return None
+        except Exception as e:
+            web_app.logger.error(f"  ❌ Error procesando {ean}: {e}")
+            return self.save(ean, {'success': False, 'message': f'Error: {str(e)}', 'product': None, 'image': None})
+        finally:
+            self.timings.finish(trace)
+            if waits_for_batch:
+                self._traces[ean] = trace
+
+    def submit_staged(self, force=False):
+        """Envía lo encontrado a Gemini Batch si ya llena un lote (todo, con force).
+
+        Cada lote enviado se guarda al momento en el estado. Devuelve los resultados
+        de los EANs que no se pudieron enviar (quedan fallidos).
+        """
+        with self._stage_lock:
+            if not self._staged or (not force and self._staged_bytes < gemini_batch.GEMINI_BATCH_MAX_MB * 1024 * 1024):
+                return []
+            staged, self._staged, self._staged_bytes = self._staged, [], 0
+
+        quality = {ean: item_quality for ean, _, item_quality in staged}
+        items = [(ean, web_app.build_enhance_payload(image_data, web_app.ENHANCE_PROMPT)) for ean, image_data, _ in staged]
+        del staged
+        submitted = set()
+        error = 'Error enviando el lote de IA'
+        try:
+            for name, keys in gemini_batch.submit_batches(web_app.GEMINI_API_BASE, web_app.GEMINI_IMAGE_MODEL,
+                                                          web_app.gemini_headers(self.api_key), items,
+                                                          f"catalogo-{int(time.time())}"):
+                self.batches.add(name, keys, quality)
+                submitted.update(keys)
+        except Exception as e:
+            web_app.logger.error(f"❌ Error enviando el lote de Gemini: {e}")
+            error = f'{error}: {str(e)}'
+
+        results = []
+        for ean in quality:
+            if ean not in submitted:
+                results += self.complete(ean, {'success': False, 'error': error}, quality[ean], [])
+        return results
+
+    def attach_duplicates(self):
+        """Al terminar la búsqueda: los duplicados esperan al lote de su dueño (o fallan si no se envió)"""
+        with self._stage_lock:
+            duplicates, self._duplicates = self._duplicates, {}
+        results = []
+        for ean in self.batches.add_duplicates(duplicates):
+            results.append(self.save(ean, image_record({'success': False, 'message': 'Error mejorando imagen'})))
+        return results
+
+    def complete(self, ean, enhanced, quality, duplicates):
+        """Quita el fondo de la imagen que devolvió el lote y guarda el EAN y sus duplicados"""
+        trace = self._traces.pop(ean, None)
+        trace = self.timings.resume(trace) if trace is not None else self.timings.start(ean)
+        try:
+            if enhanced['success']:
+                image_result = web_app.finalize_product_image(ean, enhanced['image_data'], 'Imagen procesada correctamente',
+                                                              quality)
+            else:
+                web_app.logger.warning(f"  ⚠️ Error mejorando imagen de {ean}: {enhanced.get('error', 'Unknown')}")
+                image_result = {'success': False, 'message': 'Error mejorando imagen'}
+        except Exception as e:
+            web_app.logger.error(f"  ❌ Error procesando {ean}: {e}")
+            image_result = {'success': False, 'message': f'Error: {str(e)}'}
+        finally:
+            self.timings.finish(trace)
+        if ean in self._claims:
+            self.dedupe.resolve(self._claims.pop(ean), image_result)
+
+        results = [self.save(ean, image_record(image_result))]
+        for duplicate in duplicates:
+            if image_result['success']:
+                shared = {**image_result, 'filename': f"{duplicate}.png",
+                          'message': f"Imagen reutilizada de {ean} (duplicada)"}
+            else:
+                shared = {'success': False, 'message': 'Error mejorando imagen'}
+            results.append(self.save(duplicate, image_record(shared)))
+        return results
+
+    def collect(self, executor, progress):
+        """Consulta los lotes pendientes (de esta ejecución o de una anterior) y termina sus EANs"""
+        pending = self.batches.snapshot()
+        if not pending:
+            return
+        images = sum(len(batch['keys']) for batch in pending.values())
+        sys.stderr.write(f"\n⏳ Esperando {len(pending)} lotes de Gemini con {images} imágenes "
+                         f"(Ctrl+C y relanzar el comando los recoge más tarde)\n")
+        for update in gemini_batch.run_batches(web_app.GEMINI_API_BASE, web_app.gemini_headers(self.api_key), pending):
+            if update['type'] != 'batch_done':
+                continue
+            futures = []
+            for ean, (response, error) in update['results'].items():
+                if response is not None:
+                    enhanced = web_app.parse_enhance_response(200, response)
+                else:
+                    enhanced = {'success': False, 'error': f"Error en lote de Gemini: {(error or {}).get('message', error)}"}
+                futures.append(executor.submit(self.complete, ean, enhanced, self.batches.quality.get(ean),
+                                               self.batches.duplicates_of(ean)))
+            for future in as_completed(futures):
+                for result in future.result():
+                    progress.update(result['success'])
+            # El lote se olvida cuando todos sus EANs tienen checkpoint
+            self.batches.remove(update['name'])
+
+    def cancel_batches(self):
+        """Cancela los lotes de una ejecución anterior en modo lote: sus EANs se procesan ahora en modo síncrono"""
+        pending = self.batches.snapshot()
+        if not pending:
+            return
+        sys.stderr.write(f"🛑 Cancelando {len(pending)} lotes de Gemini pendientes de una ejecución en modo lote\n")
+        headers = web_app.gemini_headers(self.api_key or '')
+        for name in pending:
+            gemini_batch.cancel_batch(web_app.GEMINI_API_BASE, name, headers)
+            self.batches.remove(name)
+
+    def write_excel(self):
+        """Reescribe el Excel con todos los productos que ya tienen checkpoint"""
+        if self.mode != 'productos':
+            return
+        with self._excel_lock:
+            products_data = []
+            for ean in self.eans:
+                record = self.checkpoint.load(ean)
+                if record and record.get('product'):
+                    products_data.append(record['product'])
+            if not products_data:
+                return
+            excel_data = web_app.create_bulk_excel(products_data)
+            if excel_data:
+                write_atomic(os.path.join(self.output_dir, EXCEL_FILENAME), excel_data)
+            self._since_excel = 0
+
+    def write_failed(self):
+        failed = []
+        for ean in self.eans:
+            record = self.checkpoint.load(ean)
+            if record is None or not record['success']:
+                failed.append(ean)
+        path = os.path.join(self.output_dir, FAILED_FILENAME)
+        if failed:
+            write_atomic(path, ('\n'.join(failed) + '\n').encode('utf-8'))
+        elif os.path.exists(path):
+            os.remove(path)
+        return failed
+
+    def run(self):
+        if self.enhance_mode == 'batch':
+            return self.run_batch()
+        self.cancel_batches()
+        pending = self.pending()
+        progress = Progress(len(self.eans), already_done=len(self.eans) - len(pending))
+        progress.render()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='catalog')
+        try:
+            futures = {executor.submit(self.process, ean): ean for ean in pending}
+            for future in as_completed(futures):
+                result = future.result()
+                if result.get('reused'):
+                    self.reused += 1
+                progress.update(result['success'])
+                self._since_excel += 1
+                if self.excel_every and self._since_excel >= self.excel_every:
+                    self.write_excel()
+        except KeyboardInterrupt:
+            sys.stderr.write('\n⏹️ Interrumpido: se guarda lo terminado (relanza el comando para continuar)\n')
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        finally:
+            executor.shutdown(wait=True)
+            self.write_excel()
+            progress.render(final=True)
+        return progress
+
+
+    def run_batch(self):
+        """Modo lote: busca todas las imágenes, las envía a Gemini Batch según llenan un lote y recoge los resultados"""
+        pending = self.pending()
+        waiting = len(self.batches.eans())
+        progress = Progress(len(self.eans), already_done=len(self.eans) - len(pending) - waiting)
+        progress.render()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='catalog')
+        try:
+            futures = [executor.submit(self.stage, ean) for ean in pending]
+            for future in as_completed(futures):
+                result = future.result()
+                if result is not None:
+                    progress.update(result['success'])
+                # Cada lote lleno se envía sin esperar a que se busque todo el catálogo
+                for result in self.submit_staged():
+                    progress.update(result['success'])
+            for result in self.submit_staged(force=True) + self.attach_duplicates():
+                progress.update(result['success'])
+            self.collect(executor, progress)
+        except KeyboardInterrupt:
+            sys.stderr.write('\n⏹️ Interrumpido: los lotes enviados siguen en Gemini (relanza el comando para recogerlos)\n')
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        finally:
+            executor.shutdown(wait=True)
+            progress.render(final=True)
+        return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Procesa un catálogo de EANs completo sin navegador')
+    parser.add_argument('input', help='Archivo de EANs (.txt, .csv o .xlsx; se usa la primera columna)')
+    parser.add_argument('--output', default='salida_catalogo', help='Carpeta de resultados (también guarda el progreso)')
+    parser.add_argument('--mode', choices=MODES, default='productos',
+                        help='productos: datos + Excel + imágenes (/process_bulk); imagenes: solo imágenes (/process_images_only)')
+    parser.add_argument('--concurrency', type=int, default=4, help='EANs procesados en paralelo')
+    parser.add_argument('--excel-every', type=int, default=50, help='Reescribir el Excel cada N EANs (0 = solo al final)')
+    parser.add_argument('--retry-failed', action='store_true', help='Reintentar también los EANs que fallaron en una ejecución anterior')
+    parser.add_argument('--refresh-from', metavar='ANTERIOR',
+                        help='Resultado anterior (carpeta de salida, ZIP o Excel): los EANs sin cambios en OFF se reutilizan')
+    parser.add_argument('--enhance-mode', choices=ENHANCE_MODES, default='sync',
+                        help='batch: IA con Gemini Batch (más barata y lenta; solo en modo imagenes). '
+                             'Relanzar el comando recoge los lotes ya enviados')
+    parser.add_argument('--verbose', action='store_true', help='Mostrar el log detallado del pipeline')
+    args = parser.parse_args()
+
+    eans = read_eans(args.input)
+    if not eans:
+        parser.error(f'No se encontraron EANs en {args.input}')
+
+    previous = None
+    if args.refresh_from:
+        if args.mode != 'productos':
+            parser.error('--refresh-from solo se admite en modo productos')
+        try:
+            previous = refresh.PreviousRun.load(args.refresh_from)
+        except (OSError, ValueError) as e:
+            parser.error(f'No se pudo leer el resultado anterior: {e}')
+        sys.stderr.write(f"♻️ Actualización incremental sobre {len(previous)} productos de {args.refresh_from}\n")
+
+    if args.enhance_mode == 'batch':
+        if args.mode != 'imagenes':
+            parser.error('--enhance-mode batch solo se admite en modo imagenes')
+        if not os.getenv('GEMINI_API_KEY'):
+            parser.error('--enhance-mode batch necesita GEMINI_API_KEY')
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    runner = CatalogRunner(eans, args.output, args.mode, args.concurrency, args.excel_every, args.retry_failed,
+                           previous, args.enhance_mode)
+    sys.stderr.write(f"📦 {len(eans)} EANs · modo {args.mode} (IA {args.enhance_mode}) · {runner.concurrency} en paralelo"
+                     f" · salida: {args.output}\n")
+    # El pipeline imprime trazas de depuración por stdout; sin --verbose se descartan
+    with open(os.devnull, 'w') as devnull, contextlib.ExitStack() as stack:
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+        try:
+            progress = runner.run()
+        except KeyboardInterrupt:
+            runner.write_failed()
+            sys.exit(130)
+
+    failed = runner.write_failed()
+    summary = runner.timings.summary()
+    total = summary['stages'].get('total')
+    sys.stderr.write(f"✅ {len(eans) - len(failed)}/{len(eans)} EANs con resultado en {args.output}"
+                     f" ({progress.processed} procesados ahora")
+    if previous is not None:
+        sys.stderr.write(f", {runner.reused} reutilizados sin cambios")
+    if total:
+        sys.stderr.write(f", p50 {total['p50']} ms, p95 {total['p95']} ms por EAN")
+    sys.stderr.write(')\n')
+    if failed:
+        sys.stderr.write(f"⚠️ {len(failed)} EANs sin resultado: ver {os.path.join(args.output, FAILED_FILENAME)}\n")
+    sys.exit(1 if failed and len(failed) == len(eans) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Checkpoints en disco de los lotes de process_bulk.
+
+Cada EAN terminado se guarda en <CHECKPOINT_DIR>/<batch_id>/<ean>.json (registro
+combinado + estado) y, si tiene imagen, <ean>.png. Si la conexión SSE se corta o
+el worker muere a mitad de lote, reenviar el mismo batch_id salta los EANs ya
+guardados con éxito (sin volver a pagar Gemini ni SerpAPI); los que fallaron se
+reintentan. El Excel y el ZIP finales se arman siempre desde los checkpoints, y las
+imágenes pasan del disco al ZIP sin volver a cargarse en memoria.
+"""
+
+import base64
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIR = os.environ.get('CHECKPOINT_DIR', os.path.join(tempfile.gettempdir(), 'batch_checkpoints'))
+# Lotes sin actividad durante este tiempo se eliminan al abrir uno nuevo
+CHECKPOINT_TTL_HOURS = float(os.environ.get('CHECKPOINT_TTL_HOURS', '24'))
+
+BATCH_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+
+def new_batch_id():
+    return uuid.uuid4().hex
+
+
+def valid_batch_id(batch_id):
+    return bool(batch_id) and bool(BATCH_ID_PATTERN.match(batch_id))
+
+
+def _safe_name(ean):
+    return re.sub(r'[^A-Za-z0-9_-]', '_', ean)[:64] or '_'
+
+
+def _write_atomic(path, data):
+    """Escribe a un temporal y renombra: un corte a mitad nunca deja un checkpoint a medias"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def purge_expired(root=None, ttl_hours=None):
+    """Elimina los lotes cuya carpeta no se modifica desde hace más de ttl_hours"""
+    root = root or CHECKPOINT_DIR
+    ttl_seconds = (CHECKPOINT_TTL_HOURS if ttl_hours is None else ttl_hours) * 3600
+    if not os.path.isdir(root):
+        return 0
+    removed = 0
+    now = time.time()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if os.path.isdir(path) and now - os.path.getmtime(path) > ttl_seconds:
+                shutil.rmtree(path)
+                removed += 1
+        except OSError as e:
+            logger.warning(f"⚠️ No se pudo eliminar el lote {name}: {e}")
+    if removed:
+        logger.info(f"🗑️ {removed} lotes con checkpoints expirados eliminados")
+    return removed
+
+
+class BatchCheckpoint:
+    """Resultados por EAN de un lote, persistidos a medida que terminan"""
+
+    def __init__(self, batch_id, root=None):
+        self.batch_id = batch_id
+        self.directory = os.path.join(root or CHECKPOINT_DIR, batch_id)
+        os.makedirs(self.directory, exist_ok=True)
+        # Reanudar un lote renueva su TTL
+        os.utime(self.directory)
+
+    def _path(self, ean, extension):
+        return os.path.join(self.directory, f'{_safe_name(ean)}.{extension}')
+
+    def completed_count(self):
+        """EANs que ya terminaron con éxito (los que se saltan al reanudar)"""
+        return sum(1 for name in os.listdir(self.directory)
+                   if name.endswith('.json') and self._load_path(os.path.join(self.directory, name), name).get('success'))
+
+    def _load_path(self, path, label):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"  ⚠️ Checkpoint ilegible para {label}, se reprocesa: {e}")
+            return {}
+
+    def load(self, ean):
+        """Registro guardado del EAN o None si aún no se procesó"""
+        return self._load_path(self._path(ean, 'json'), ean) or None
+
+    def done(self, ean):
+        """Registro del EAN si ya terminó con éxito; None si falta o falló (se reintenta al reanudar)"""
+        record = self.load(ean)
+        return record if record and record['success'] else None
+
+    def save(self, ean, success, message, product, image=None):
+        """Guarda el resultado del EAN; image = {'filename', 'data' (base64)} opcional"""
+        record = {'ean': ean, 'success': success, 'message': message, 'product': product,
+                  'image_filename': None, 'saved_at': time.time()}
+        if image:
+            # La imagen se escribe antes que el JSON: si el JSON existe, la imagen también
+            _write_atomic(self._path(ean, 'png'), base64.b64decode(image['data']))
+            record['image_filename'] = image['filename']
+        _write_atomic(self._path(ean, 'json'), json.dumps(record, ensure_ascii=False).encode('utf-8'))
+
+    def assemble(self, eans):
+        """Devuelve (products_data, images_data) en el orden de eans a partir de los checkpoints.
+
+        Las imágenes van como {'filename', 'path'}: build_zip las copia del disco.
+        """
+        products_data = []
+        images_data = []
+        for ean in eans:
+            record = self.load(ean)
+            if not record:
+                continue
+            products_data.append(record['product'])
+            if record.get('image_filename'):
+                images_data.append({'filename': record['image_filename'], 'path': self._path(ean, 'png')})
+        return products_data, images_data
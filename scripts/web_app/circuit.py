@@ -0,0 +1,157 @@
+"""
+Circuit breakers por proveedor externo (OFF, SerpAPI, Gemini).
+
+Si un proveedor está caído, cada EAN del lote esperaría el timeout completo
+(15 s en SerpAPI, 60 s en Gemini). Cada breaker mira las últimas CIRCUIT_WINDOW
+llamadas del proveedor y, si al menos CIRCUIT_MIN_CALLS fallaron en una proporción
+>= CIRCUIT_FAILURE_RATE, se abre: durante CIRCUIT_COOLDOWN_SECONDS las llamadas
+fallan al instante con CircuitOpenError. Pasado ese tiempo queda semiabierto y deja
+pasar una única llamada de prueba: si va bien se cierra, si falla vuelve a abrirse.
+
+Cuenta como fallo no obtener respuesta (timeout, conexión), un 5xx o un 429.
+Los resultados llegan desde metrics.record_upstream_status, que ya se llama en
+cada petición externa.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+CIRCUIT_WINDOW = int(os.environ.get('CIRCUIT_WINDOW', '20'))
+CIRCUIT_MIN_CALLS = int(os.environ.get('CIRCUIT_MIN_CALLS', '5'))
+CIRCUIT_FAILURE_RATE = float(os.environ.get('CIRCUIT_FAILURE_RATE', '0.5'))
+CIRCUIT_COOLDOWN_SECONDS = float(os.environ.get('CIRCUIT_COOLDOWN_SECONDS', '30'))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Proveedores protegidos (los hosts de imágenes son muchos y distintos: no se agrupan)
+PROVIDER_LABELS = {
+    'openfoodfacts': 'Open Food Facts',
+    'serpapi': 'SerpAPI',
+    'gemini_text': 'Gemini (datos web)',
+    'gemini_image': 'Gemini (imágenes)',
+    'gemini_batch': 'Gemini Batch',
+}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, provider):
+        self.provider = provider
+        super().__init__(f"{PROVIDER_LABELS.get(provider, provider)} no disponible temporalmente (circuito abierto)")
+
+
+def is_failure(status_code):
+    return status_code is None or status_code == 429 or int(status_code) >= 500
+
+
+class CircuitBreaker:
+    def __init__(self, provider, window=None, min_calls=None, failure_rate=None, cooldown=None):
+        self.provider = provider
+        self.min_calls = CIRCUIT_MIN_CALLS if min_calls is None else min_calls
+        self.failure_rate = CIRCUIT_FAILURE_RATE if failure_rate is None else failure_rate
+        self.cooldown = CIRCUIT_COOLDOWN_SECONDS if cooldown is None else cooldown
+        self.outcomes = deque(maxlen=CIRCUIT_WINDOW if window is None else window)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_started = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True si se puede llamar al proveedor ahora (en semiabierto, solo una llamada de prueba)"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN and now - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                self.probe_started = None
+            if self.state == HALF_OPEN:
+                # Una prueba que nunca registró resultado no bloquea el circuito para siempre
+                if self.probe_started is None or now - self.probe_started >= self.cooldown:
+                    self.probe_started = now
+                    return True
+                return False
+            return self.state == CLOSED
+
+    def record(self, status_code):
+        failed = is_failure(status_code)
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed:
+                    self._open()
+                else:
+                    self.state = CLOSED
+                    self.outcomes.clear()
+                self.probe_started = None
+                return
+            if self.state == OPEN:
+                return
+            self.outcomes.append(failed)
+            failures = sum(self.outcomes)
+            if len(self.outcomes) >= self.min_calls and failures / len(self.outcomes) >= self.failure_rate:
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.outcomes.clear()
+
+    def current_state(self):
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                return HALF_OPEN
+            return self.state
+
+
+_breakers = {provider: CircuitBreaker(provider) for provider in PROVIDER_LABELS}
+
+
+def check(provider):
+    """Lanza CircuitOpenError si el circuito del proveedor está abierto"""
+    breaker = _breakers.get(provider)
+    if breaker is not None and not breaker.allow():
+        raise CircuitOpenError(provider)
+
+
+def record(provider, status_code):
+    breaker = _breakers.get(provider)
+    if breaker is not None:
+        breaker.record(status_code)
+
+
+def states():
+    return {provider: breaker.current_state() for provider, breaker in _breakers.items()}
+
+
+class Watcher:
+    """Detecta cambios de estado de los circuitos durante un trabajo para avisar por SSE"""
+
+    def __init__(self):
+        self.last = {provider: CLOSED for provider in _breakers}
+
+    def poll(self):
+        events = []
+        for provider, state in states().items():
+            # Semiabierto se informa como degradado hasta que la prueba cierre el circuito
+            shown = OPEN if state == HALF_OPEN else state
+            if shown != self.last[provider]:
+                self.last[provider] = shown
+                events.append({
+                    'type': 'provider_status',
+                    'provider': provider,
+                    'state': shown,
+                    'message': (f"{PROVIDER_LABELS[provider]} degradado: se omiten sus llamadas temporalmente"
+                                if shown == OPEN else f"{PROVIDER_LABELS[provider]} recuperado"),
+                })
+        return events
+
+
+def announce(events):
+    """Intercala eventos 'provider_status' en un stream SSE cuando cambia algún circuito"""
+    watcher = Watcher()
+    for event in events:
+        for status in watcher.poll():
+            yield f"data: {json.dumps(status)}\n\n"
+        yield event
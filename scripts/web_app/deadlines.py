@@ -0,0 +1,102 @@
+"""
+Presupuesto de tiempo (deadline) de los trabajos masivos.
+
+Gunicorn corta la petición a los 300 s (--timeout 300): si la cola del lote es lenta
+se pierde el ZIP entero aunque casi todos los EANs estén listos. Cada trabajo abre
+un Deadline de JOB_DEADLINE_SECONDS, del que se descuenta JOB_FINALIZE_RESERVE_SECONDS
+para armar el Excel y el ZIP al final.
+
+Con el deadline activo (ContextVar, igual que la traza de tiempos):
+- timeout(15) devuelve el timeout de la llamada recortado al tiempo que queda
+  (y lanza DeadlineExceeded si ya no queda nada)
+- allows('gemini_image') dice si queda presupuesto para empezar una etapa costosa
+- exhausted() dice si ya no conviene empezar otro EAN; los que no se empiezan se
+  informan como pendientes en el evento 'complete'
+"""
+
+import os
+import time
+from contextvars import ContextVar
+
+import metrics
+
+JOB_DEADLINE_SECONDS = float(os.environ.get('JOB_DEADLINE_SECONDS', '270'))
+JOB_FINALIZE_RESERVE_SECONDS = float(os.environ.get('JOB_FINALIZE_RESERVE_SECONDS', '20'))
+# Timeout mínimo con sentido para una llamada externa
+MIN_CALL_TIMEOUT = 1.0
+
+# Presupuesto mínimo (s) para empezar cada etapa; 'ean' es el de un EAN nuevo completo
+STAGE_MIN_SECONDS = {
+    'ean': 10.0,
+    'gemini_text': 8.0,
+    'gemini_image': 15.0,
+    'rembg': 4.0,
+}
+
+_current_deadline = ContextVar('job_deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self):
+        super().__init__('Tiempo del trabajo agotado')
+
+
+class Deadline:
+    def __init__(self, seconds=None, reserve=None):
+        seconds = JOB_DEADLINE_SECONDS if seconds is None else seconds
+        reserve = JOB_FINALIZE_RESERVE_SECONDS if reserve is None else reserve
+        self.started = time.monotonic()
+        self.expires_at = self.started + seconds - reserve
+
+    def remaining(self):
+        """Segundos que quedan para procesar (sin contar la reserva del final)"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+def start(seconds=None, reserve=None):
+    """Abre el deadline del trabajo en el contexto actual"""
+    deadline = Deadline(seconds, reserve)
+    _current_deadline.set(deadline)
+    return deadline
+
+
+def clear():
+    _current_deadline.set(None)
+
+
+def current():
+    return _current_deadline.get()
+
+
+def bounded(events, seconds=None):
+    """Envuelve un generador SSE: abre el deadline al empezar y lo quita al terminar"""
+    start(seconds)
+    try:
+        yield from events
+    finally:
+        clear()
+
+
+def timeout(default):
+    """Timeout de una llamada externa recortado al presupuesto restante del trabajo"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return default
+    remaining = deadline.remaining()
+    if remaining < MIN_CALL_TIMEOUT:
+        raise DeadlineExceeded()
+    return min(default, remaining)
+
+
+def allows(stage):
+    """True si queda presupuesto para empezar la etapa (siempre True sin deadline)"""
+    deadline = _current_deadline.get()
+    if deadline is None or deadline.remaining() >= STAGE_MIN_SECONDS.get(stage, MIN_CALL_TIMEOUT):
+        return True
+    metrics.DEADLINE_SKIPS.inc(stage)
+    return False
+
+
+def exhausted():
+    """True si ya no conviene empezar otro EAN"""
+    return not allows('ean')
@@ -0,0 +1,188 @@
+"""
+Mejora de imágenes con Gemini en modo lote (Batch API), para batch_cli.py.
+
+Para cargas nocturnas de catálogo importan el throughput y el coste, no la
+latencia: en lugar de una llamada generateContent bloqueante por imagen, las
+peticiones se envían juntas a models/<modelo>:batchGenerateContent y se consulta
+la operación (GET batches/<id>) hasta que llega a un estado final. Un lote puede
+tardar horas, así que no se usa desde las rutas web (su deadline es de minutos):
+solo desde el CLI, que guarda los nombres de los lotes junto a sus checkpoints
+para recogerlos en una ejecución posterior.
+
+Los lotes con peticiones en línea tienen un tamaño máximo, así que las imágenes
+se reparten en varios envíos de hasta GEMINI_BATCH_MAX_MB. Un lote que pasa de
+GEMINI_BATCH_TIMEOUT_SECONDS desde su envío se cancela (POST batches/<id>:cancel)
+para no pagar un resultado que ya nadie va a recoger.
+
+Este módulo solo conoce el protocolo; el armado de cada petición y el parseo de
+cada respuesta son los mismos de app.py.
+"""
+
+import json
+import logging
+import os
+import time
+
+import requests
+
+import circuit
+import metrics
+
+logger = logging.getLogger(__name__)
+
+GEMINI_BATCH_MAX_MB = float(os.environ.get('GEMINI_BATCH_MAX_MB', '18'))
+GEMINI_BATCH_POLL_SECONDS = float(os.environ.get('GEMINI_BATCH_POLL_SECONDS', '30'))
+GEMINI_BATCH_TIMEOUT_SECONDS = float(os.environ.get('GEMINI_BATCH_TIMEOUT_SECONDS', str(24 * 3600)))
+
+SUCCEEDED = 'BATCH_STATE_SUCCEEDED'
+TERMINAL_STATES = {SUCCEEDED, 'BATCH_STATE_FAILED', 'BATCH_STATE_CANCELLED', 'BATCH_STATE_EXPIRED'}
+# Estado con el que se informa un lote cancelado por superar el timeout
+TIMED_OUT = 'TIMEOUT'
+# Estado de un lote que Gemini ya no conoce (404)
+NOT_FOUND = 'NOT_FOUND'
+
+
+def split_requests(items, max_bytes):
+    """Reparte [(clave, petición)] en grupos cuyo JSON no supere max_bytes"""
+    groups = []
+    current, current_bytes = [], 0
+    for key, request_body in items:
+        size = len(json.dumps(request_body))
+        if current and current_bytes + size > max_bytes:
+            groups.append(current)
+            current, current_bytes = [], 0
+        current.append((key, request_body))
+        current_bytes += size
+    if current:
+        groups.append(current)
+    return groups
+
+
+def build_batch_payload(items, display_name):
+    return {
+        'batch': {
+            'display_name': display_name,
+            'input_config': {
+                'requests': {
+                    'requests': [{'request': request_body, 'metadata': {'key': key}} for key, request_body in items]
+                }
+            }
+        }
+    }
+
+
+def batch_state(operation):
+    return (operation.get('metadata') or {}).get('state', 'BATCH_STATE_UNSPECIFIED')
+
+
+def inlined_responses(operation):
+    """{clave: (respuesta generateContent o None, error o None)} de una operación terminada"""
+    response = operation.get('response') or {}
+    inlined = (response.get('inlinedResponses') or {}).get('inlinedResponses') or []
+    results = {}
+    for item in inlined:
+        key = (item.get('metadata') or {}).get('key')
+        results[key] = (item.get('response'), item.get('error'))
+    return results
+
+
+def submit_batch(base_url, model, headers, items, display_name):
+    """Crea el lote y devuelve su nombre (batches/<id>)"""
+    circuit.check('gemini_batch')
+    with metrics.stage_timer('gemini_batch_submit'):
+        response = requests.post(f"{base_url}/models/{model}:batchGenerateContent", headers=headers,
+                                 json=build_batch_payload(items, display_name), timeout=120)
+    metrics.record_upstream('gemini_batch', response)
+    response.raise_for_status()
+    return response.json()['name']
+
+
+def submit_batches(base_url, model, headers, items, display_name, max_bytes=None):
+    """Generador: envía [(clave, petición)] en lotes de hasta max_bytes MB y emite (nombre, claves) de cada uno.
+
+    Quien llama debe guardar cada nombre antes de pedir el siguiente: si un envío
+    falla, los anteriores ya están en curso.
+    """
+    max_bytes = int((GEMINI_BATCH_MAX_MB if max_bytes is None else max_bytes) * 1024 * 1024)
+    for index, group in enumerate(split_requests(items, max_bytes)):
+        name = submit_batch(base_url, model, headers, group, f"{display_name}-{index + 1}")
+        logger.info(f"📤 Lote Gemini {name} enviado con {len(group)} imágenes")
+        yield name, [key for key, _ in group]
+
+
+def get_operation(base_url, name, headers):
+    response = requests.get(f"{base_url}/{name}", headers=headers, timeout=30)
+    metrics.record_upstream('gemini_batch', response)
+    response.raise_for_status()
+    return response.json()
+
+
+def cancel_batch(base_url, name, headers):
+    """Pide a Gemini que cancele el lote; True si lo aceptó"""
+    try:
+        response = requests.post(f"{base_url}/{name}:cancel", headers=headers, timeout=30)
+        metrics.record_upstream('gemini_batch', response)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"  ⚠️ No se pudo cancelar el lote {name}: {e}")
+        return False
+    logger.info(f"🛑 Lote Gemini {name} cancelado")
+    return True
+
+
+def run_batches(base_url, headers, pending, poll_seconds=None, timeout_seconds=None):
+    """Generador: consulta los lotes ya enviados hasta que terminen.
+
+    pending: {nombre: {'keys': [claves], 'submitted_at': epoch del envío}}.
+    Emite {'type': 'batch_done', 'name', 'state', 'results': {clave: (respuesta, error)}}
+    en cuanto termina cada lote y {'type': 'batch_status', ...} tras cada ronda de
+    consultas. Las claves de lotes fallidos, cancelados o expirados quedan con su
+    error. Un lote con más de timeout_seconds desde su envío se cancela y se informa
+    con estado TIMED_OUT.
+    """
+    poll_seconds = GEMINI_BATCH_POLL_SECONDS if poll_seconds is None else poll_seconds
+    timeout_seconds = GEMINI_BATCH_TIMEOUT_SECONDS if timeout_seconds is None else timeout_seconds
+    pending = dict(pending)
+    total = sum(len(batch['keys']) for batch in pending.values())
+    completed = 0
+    started = time.time()
+
+    while pending:
+        for name in list(pending):
+            batch = pending[name]
+            try:
+                operation = get_operation(base_url, name, headers)
+            except requests.exceptions.HTTPError as e:
+                if e.response is None or e.response.status_code != 404:
+                    logger.warning(f"  ⚠️ Error consultando el lote {name}: {e}")
+                    operation = None
+                else:
+                    # Lote borrado o ya purgado por Gemini: no va a terminar nunca
+                    operation = {'metadata': {'state': NOT_FOUND}, 'done': True}
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"  ⚠️ Error consultando el lote {name}: {e}")
+                operation = None
+            state = batch_state(operation) if operation is not None else None
+            if operation is not None and (state in TERMINAL_STATES or operation.get('done')):
+                logger.info(f"📥 Lote Gemini {name} terminado: {state}")
+                responses = inlined_responses(operation) if state == SUCCEEDED else {}
+                error = {'message': f'Lote terminado con estado {state}'}
+            elif time.time() - batch['submitted_at'] > timeout_seconds:
+                logger.error(f"❌ Lote Gemini {name} sin terminar tras {timeout_seconds:.0f} s: se cancela")
+                cancel_batch(base_url, name, headers)
+                state, responses = TIMED_OUT, {}
+                error = {'message': f'El lote {name} no terminó a tiempo'}
+            else:
+                continue
+            del pending[name]
+            completed += len(batch['keys'])
+            metrics.observe_stage('gemini_batch', time.time() - batch['submitted_at'])
+            yield {'type': 'batch_done', 'name': name, 'state': state,
+                   'results': {key: responses.get(key, (None, error)) for key in batch['keys']}}
+
+        yield {'type': 'batch_status', 'pending_batches': len(pending), 'completed': completed,
+               'total': total, 'elapsed_seconds': round(time.time() - started)}
+        if pending:
+            # Se despierta antes si algún lote llega a su timeout
+            next_timeout = min(batch['submitted_at'] + timeout_seconds for batch in pending.values()) - time.time()
+            time.sleep(max(0.0, min(poll_seconds, next_timeout)))
@@ -0,0 +1,174 @@
+"""
+Caché HTTP en memoria con revalidación condicional (ETag / Last-Modified).
+
+Guarda las respuestas 200 de Open Food Facts ('off') junto con sus validadores
+(y las de los hosts de imágenes, 'image', con HTTP_CACHE_IMAGES=1):
+- Mientras la entrada está fresca (TTL por caché) se sirve sin tocar la red
+- Al caducar se revalida con If-None-Match / If-Modified-Since: un 304 renueva el
+  TTL sin volver a transferir el cuerpo; un 200 reemplaza la entrada
+- Sin validadores, al caducar se vuelve a pedir entera
+
+Los aciertos, revalidaciones y fallos se cuentan en ean_cache_requests_total.
+La memoria total se limita a HTTP_CACHE_MB (LRU); 0 desactiva la caché. El límite
+es por proceso: cada worker de gunicorn tiene su propia caché, así que se cuenta
+en ean_http_cache_bytes y en /admin/memory. Un JSON de OFF ocupa unos KB y una
+imagen cientos, por eso las imágenes no se guardan salvo que se pida.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+import memory
+import metrics
+
+HTTP_CACHE_MB = float(os.environ.get('HTTP_CACHE_MB', '16'))
+HTTP_CACHE_IMAGES = os.environ.get('HTTP_CACHE_IMAGES', '').lower() in ('1', 'true', 'yes')
+OFF_CACHE_TTL_SECONDS = float(os.environ.get('OFF_CACHE_TTL_SECONDS', '3600'))
+IMAGE_CACHE_TTL_SECONDS = float(os.environ.get('IMAGE_CACHE_TTL_SECONDS', '86400'))
+
+CACHE_TTL_SECONDS = {
+    'off': OFF_CACHE_TTL_SECONDS,
+    'image': IMAGE_CACHE_TTL_SECONDS,
+}
+# Cachés activas (las demás piden siempre al origen)
+ENABLED_CACHES = ('off', 'image') if HTTP_CACHE_IMAGES else ('off',)
+# Cabeceras de la respuesta que se conservan (el resto no lo usa nadie)
+KEPT_HEADERS = ('content-type', 'etag', 'last-modified')
+
+
+class CachedHeaders(dict):
+    """Cabeceras guardadas con get() insensible a mayúsculas, como las de requests/aiohttp"""
+
+    def get(self, key, default=None):
+        return super().get(key.lower(), default)
+
+
+class CacheEntry:
+    def __init__(self, status_code, content, headers, ttl, cache='off'):
+        self.cache = cache
+        self.status_code = status_code
+        self.content = content
+        self.headers = CachedHeaders((name, headers.get(name)) for name in KEPT_HEADERS if headers.get(name))
+        self.size = len(content)
+        self.renew(ttl)
+
+    def renew(self, ttl):
+        self.expires_at = time.monotonic() + ttl
+
+    def fresh(self):
+        return time.monotonic() < self.expires_at
+
+    def validators(self):
+        """Cabeceras condicionales para revalidar la entrada con el origen"""
+        conditional = {}
+        if self.headers.get('etag'):
+            conditional['If-None-Match'] = self.headers.get('etag')
+        if self.headers.get('last-modified'):
+            conditional['If-Modified-Since'] = self.headers.get('last-modified')
+        return conditional
+
+
+class CachedResponse:
+    """Entrada servida desde la caché con la interfaz de requests.Response que usan los llamadores"""
+
+    def __init__(self, entry):
+        self.status_code = entry.status_code
+        self.content = entry.content
+        self.headers = entry.headers
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class HttpCache:
+    def __init__(self, max_bytes=None):
+        self.max_bytes = int(HTTP_CACHE_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._release(previous)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            metrics.HTTP_CACHE_BYTES.inc(entry.cache, amount=entry.size)
+            while self._bytes > self.max_bytes:
+                _, oldest = self._entries.popitem(last=False)
+                self._release(oldest)
+
+    def _release(self, entry):
+        self._bytes -= entry.size
+        metrics.HTTP_CACHE_BYTES.dec(entry.cache, amount=entry.size)
+
+    def size_bytes(self):
+        with self._lock:
+            return self._bytes
+
+
+_store = HttpCache()
+memory.register_holder('http_cache', _store.size_bytes)
+
+
+def enabled(cache):
+    return _store.max_bytes > 0 and cache in ENABLED_CACHES
+
+
+def cache_key(cache, url, params=None):
+    return f"{cache} {url}?{urlencode(sorted(params.items()))}" if params else f"{cache} {url}"
+
+
+def lookup(cache, url, params=None):
+    """Entrada guardada para la URL (fresca o caducada) o None"""
+    if not enabled(cache):
+        return None
+    return _store.get(cache_key(cache, url, params))
+
+
+def validators(entry):
+    return entry.validators() if entry is not None else {}
+
+
+def resolve(cache, url, entry, status_code, content, headers, params=None):
+    """Incorpora la respuesta del origen. Devuelve la entrada a servir si fue un 304, si no None"""
+    if not enabled(cache):
+        return None
+    ttl = CACHE_TTL_SECONDS.get(cache, OFF_CACHE_TTL_SECONDS)
+    if status_code == 304 and entry is not None:
+        for name in ('etag', 'last-modified'):
+            if headers.get(name):
+                entry.headers[name] = headers.get(name)
+        entry.renew(ttl)
+        metrics.record_cache(cache, 'revalidated')
+        return entry
+    metrics.record_cache(cache, False)
+    cache_control = (headers.get('cache-control') or '').lower()
+    if status_code == 200 and 'no-store' not in cache_control:
+        _store.put(cache_key(cache, url, params), CacheEntry(status_code, content, headers, ttl, cache))
+    return None
+
+
+def cached_get(cache, url, send, params=None):
+    """GET a través de la caché; send(cabeceras_condicionales) hace la petición real si hace falta"""
+    entry = lookup(cache, url, params)
+    if entry is not None and entry.fresh():
+        metrics.record_cache(cache, True)
+        return CachedResponse(entry)
+    response = send(validators(entry))
+    served = resolve(cache, url, entry, response.status_code, response.content, response.headers, params)
+    return CachedResponse(served) if served is not None else response
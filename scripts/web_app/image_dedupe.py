@@ -0,0 +1,205 @@
+"""
+De-duplicación de imágenes de producto por hash perceptual (dHash de 64 bits).
+
+Las variantes de una misma línea (tamaños, sabores) suelen devolver la misma imagen
+de Google, o una casi idéntica. Antes de mandar una imagen a Gemini y rembg se
+busca en el índice una ya procesada cuyo hash esté a una distancia de Hamming
+<= DEDUPE_MAX_DISTANCE; si existe, se reutiliza su resultado para el EAN nuevo.
+
+El dHash solo mira la estructura en escala de grises, así que dos envases iguales
+de distinto color (sabores) darían el mismo hash: por eso además se compara una
+firma de color de 4x4 píxeles (diferencia máxima DEDUPE_MAX_COLOR_DIFF por canal).
+
+Para no recorrer todo el índice en cada imagen, los hashes se reparten en
+DEDUPE_MAX_DISTANCE + 1 bandas de bits: dos hashes a distancia <= DEDUPE_MAX_DISTANCE
+coinciden por fuerza en al menos una banda (principio del palomar), así que solo se
+comparan los que comparten alguna.
+
+El índice es por trabajo; con DEDUPE_ACROSS_JOBS=1 se comparte entre trabajos del
+mismo proceso (LRU acotado por DEDUPE_CACHE_MB).
+"""
+
+import base64
+import logging
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import deadlines
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEDUPE_ENABLED = os.environ.get('DEDUPE_IMAGES', '1').lower() in ('1', 'true', 'yes')
+# Bits distintos (de 64) tolerados para considerar dos imágenes duplicadas
+DEDUPE_MAX_DISTANCE = int(os.environ.get('DEDUPE_MAX_DISTANCE', '6'))
+DEDUPE_MAX_COLOR_DIFF = int(os.environ.get('DEDUPE_MAX_COLOR_DIFF', '24'))
+DEDUPE_ACROSS_JOBS = os.environ.get('DEDUPE_ACROSS_JOBS', '0').lower() in ('1', 'true', 'yes')
+DEDUPE_CACHE_MB = float(os.environ.get('DEDUPE_CACHE_MB', '100'))
+# Espera máxima por un duplicado que otro hilo/tarea está procesando (acotada al deadline del trabajo)
+DEDUPE_WAIT_SECONDS = 120
+HASH_BITS = 64
+
+
+@metrics.timed('image_hash')
+def fingerprint(image_data_base64, hash_size=8):
+    """(dHash, firma de color): el dHash compara cada píxel con su vecino en una miniatura en grises"""
+    from PIL import Image
+
+    with Image.open(BytesIO(base64.b64decode(image_data_base64))) as img:
+        img.draft('RGB', (hash_size * 4, hash_size * 4))
+        rgb = img.convert('RGB')
+    pixels = list(rgb.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR).getdata())
+    colors = bytes(channel for pixel in rgb.resize((4, 4), Image.BILINEAR).getdata() for channel in pixel)
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value, colors
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def color_difference(a, b):
+    return max(abs(x - y) for x, y in zip(a, b))
+
+
+def bands(max_distance, bits=HASH_BITS):
+    """[(desplazamiento, máscara)] de max_distance + 1 bandas de bits lo más parejas posible"""
+    count = max(1, min(max_distance + 1, bits))
+    result = []
+    start = 0
+    for index in range(count):
+        width = bits // count + (1 if index < bits % count else 0)
+        result.append((start, (1 << width) - 1))
+        start += width
+    return result
+
+
+class DedupeEntry:
+    """Imagen reclamada por un EAN; los duplicados esperan su resultado"""
+
+    def __init__(self, image_hash, ean):
+        self.image_hash = image_hash
+        self.ean = ean
+        self.result = None
+        self.size = 0
+        self._ready = threading.Event()
+
+    def wait(self, timeout=DEDUPE_WAIT_SECONDS):
+        """Resultado del EAN propietario (None si falló o no terminó a tiempo)"""
+        deadline = deadlines.current()
+        if deadline is not None:
+            timeout = max(0.0, min(timeout, deadline.remaining()))
+        if not self._ready.wait(timeout):
+            return None
+        return self.result
+
+
+class DedupeIndex:
+    def __init__(self, max_distance=None, max_color_diff=None, max_bytes=None):
+        self.max_distance = DEDUPE_MAX_DISTANCE if max_distance is None else max_distance
+        self.max_color_diff = DEDUPE_MAX_COLOR_DIFF if max_color_diff is None else max_color_diff
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bands = bands(self.max_distance)
+        # (banda, valor de la banda) -> hashes del índice con esos bits
+        self._buckets = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _bucket_keys(self, bits):
+        return [(index, (bits >> shift) & mask) for index, (shift, mask) in enumerate(self._bands)]
+
+    def _add(self, entry):
+        self._entries[entry.image_hash] = entry
+        for key in self._bucket_keys(entry.image_hash[0]):
+            self._buckets.setdefault(key, set()).add(entry.image_hash)
+
+    def _discard(self, image_hash):
+        entry = self._entries.pop(image_hash, None)
+        if entry is None:
+            return None
+        for key in self._bucket_keys(image_hash[0]):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(image_hash)
+                if not bucket:
+                    del self._buckets[key]
+        return entry
+
+    def _find(self, image_hash):
+        bits, colors = image_hash
+        candidates = set()
+        for key in self._bucket_keys(bits):
+            candidates |= self._buckets.get(key, set())
+        best, best_distance = None, self.max_distance + 1
+        for candidate in candidates:
+            entry = self._entries[candidate]
+            distance = hamming(candidate[0], bits)
+            if distance < best_distance and color_difference(candidate[1], colors) <= self.max_color_diff:
+                best, best_distance = entry, distance
+        return best
+
+    def claim(self, image_hash, ean):
+        """Devuelve (entry, es_propietario). El propietario procesa y llama a resolve()"""
+        with self._lock:
+            entry = self._find(image_hash)
+            if entry is not None:
+                self._entries.move_to_end(entry.image_hash)
+                return entry, False
+            entry = DedupeEntry(image_hash, ean)
+            self._add(entry)
+            return entry, True
+
+    def resolve(self, entry, result):
+        """Publica el resultado; si falló se quita del índice para que otro EAN lo intente"""
+        with self._lock:
+            if result and result.get('success'):
+                entry.result = result
+                entry.size = len(result.get('image_data') or '')
+                self._bytes += entry.size
+                self._evict()
+            else:
+                self._discard(entry.image_hash)
+        entry._ready.set()
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            oldest = self._discard(next(iter(self._entries)))
+            self._bytes -= oldest.size
+
+
+_shared_index = DedupeIndex(max_bytes=int(DEDUPE_CACHE_MB * 1024 * 1024))
+
+
+def job_index():
+    """Índice a usar en un trabajo nuevo (None si la de-duplicación está desactivada)"""
+    if not DEDUPE_ENABLED:
+        return None
+    return _shared_index if DEDUPE_ACROSS_JOBS else DedupeIndex()
+
+
+def image_hash(image_data_base64):
+    """Huella (dHash, firma de color) de la imagen o None si no se puede decodificar"""
+    try:
+        return fingerprint(image_data_base64)
+    except Exception as e:
+        logger.warning(f"  ⚠️ No se pudo calcular el hash perceptual: {e}")
+        return None
+
+
+def shared_result(entry, ean):
+    """Copia del resultado del propietario adaptada al EAN duplicado"""
+    return {
+        **entry.result,
+        'filename': f"{ean}.png",
+        'message': f"Imagen reutilizada de {entry.ean} (duplicada)",
+        'duplicate_of': entry.ean,
+    }
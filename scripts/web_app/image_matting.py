@@ -0,0 +1,203 @@
+"""
+Atajo NumPy para quitar fondos blancos uniformes sin pasar por rembg.
+
+El prompt de Gemini pide un fondo blanco puro (#FFFFFF), así que casi todas las
+imágenes mejoradas llegan ya con el producto sobre blanco, y U2Net tarda segundos
+por imagen en recortar algo que se resuelve con una máscara:
+
+- Un píxel es candidato a fondo si ningún canal se aleja de 255 más de
+  BG_WHITE_TOLERANCE
+- El fondo es la región de candidatos conectada con el borde de la imagen
+  (relleno por inundación): el blanco dentro del producto (etiquetas, brillos)
+  no toca el borde y se conserva
+- Los píxeles del producto pegados al fondo (BG_FEATHER_WIDTH px) reciben una
+  transparencia proporcional a lo que se alejan del blanco, y se les descuenta
+  la mezcla con el blanco: bordes suavizados sin halo
+
+Solo se usa si el resultado es fiable; si no, remove_white_background sigue con
+rembg:
+- el borde de la imagen es blanco en al menos BG_MIN_BORDER_WHITENESS
+- el producto ocupa entre BG_MIN_FOREGROUND y BG_MAX_FOREGROUND de la imagen
+- el fondo rellenado tiene el mismo tono que el borde: un producto casi blanco
+  (dentro de la tolerancia) deja una zona de otro tono y el atajo se descarta
+- el contorno tiene contraste: si más de BG_MAX_SOFT_EDGE de los píxeles justo
+  por dentro del suavizado son casi blancos, el relleno probablemente se coló en
+  un producto blanco o sin borde definido
+"""
+
+import logging
+import os
+from collections import deque
+
+import image_quality
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BG_FAST_PATH = os.environ.get('BG_FAST_PATH', '1').lower() in ('1', 'true', 'yes')
+BG_WHITE_TOLERANCE = int(os.environ.get('BG_WHITE_TOLERANCE', '12'))
+BG_FEATHER_WIDTH = int(os.environ.get('BG_FEATHER_WIDTH', '2'))
+BG_MIN_BORDER_WHITENESS = float(os.environ.get('BG_MIN_BORDER_WHITENESS', '0.97'))
+BG_MIN_FOREGROUND = 0.03
+BG_MAX_FOREGROUND = 0.95
+BG_MAX_SOFT_EDGE = float(os.environ.get('BG_MAX_SOFT_EDGE', '0.5'))
+# Píxeles del fondo rellenado que se alejan del tono del borde más de BG_MAX_TONE_SHIFT
+BG_MAX_TONE_SHIFT = 3
+BG_MAX_OFF_TONE = 0.02
+# Distancia al blanco a partir de la cual un píxel del contorno ya es opaco
+OPAQUE_LEVEL = 4 * BG_WHITE_TOLERANCE
+# Pasadas horizontales + verticales del relleno (cada una sigue un giro del contorno);
+# si el contorno tiene más giros, el relleno termina con una cola de tramos
+MAX_FILL_PASSES = 64
+
+
+def _run_labels(flat, cols):
+    """Etiqueta (1..n) de cada tramo horizontal de candidatos; fuera de los tramos no vale"""
+    import numpy as np
+
+    starts = flat.copy()
+    starts[1:] &= ~flat[:-1]
+    starts[::cols] = flat[::cols]
+    return np.cumsum(starts, dtype=np.int32)
+
+
+def _fill_runs(candidate, reached):
+    """Extiende reached a los tramos horizontales completos de candidate que ya toca"""
+    import numpy as np
+
+    rows, cols = candidate.shape
+    flat = candidate.ravel()
+    labels = _run_labels(flat, cols)
+    touched = np.zeros(int(labels[-1]) + 1, dtype=bool)
+    touched[labels[flat & reached.ravel()]] = True
+    return (flat & touched[labels]).reshape(rows, cols)
+
+
+def _fill_queue(candidate, reached):
+    """Termina el relleno recorriendo el grafo de tramos horizontales con una cola.
+
+    Dos tramos son vecinos si se solapan en filas consecutivas. Memoria acotada
+    (una etiqueta por píxel y una arista por par de tramos) y sin límite de giros.
+    """
+    import numpy as np
+
+    rows, cols = candidate.shape
+    flat = candidate.ravel()
+    labels = _run_labels(flat, cols)
+    count = int(labels[-1]) + 1
+
+    vertical = flat[:-cols] & flat[cols:]
+    upper = labels[:-cols][vertical].astype(np.int64)
+    lower = labels[cols:][vertical].astype(np.int64)
+    pairs = np.unique(upper * count + lower)
+    sources = np.concatenate([pairs // count, pairs % count])
+    targets = np.concatenate([pairs % count, pairs // count])
+    order = np.argsort(sources, kind='stable')
+    targets = targets[order]
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(sources, minlength=count))
+
+    seen = np.zeros(count, dtype=bool)
+    seen[labels[flat & reached.ravel()]] = True
+    queue = deque(np.flatnonzero(seen).tolist())
+    while queue:
+        run = queue.popleft()
+        for neighbour in targets[offsets[run]:offsets[run + 1]].tolist():
+            if not seen[neighbour]:
+                seen[neighbour] = True
+                queue.append(neighbour)
+    return (flat & seen[labels]).reshape(rows, cols)
+
+
+def flood_from_border(candidate):
+    """Región de candidate conectada (4 vecinos) con el borde de la imagen"""
+    import numpy as np
+
+    reached = np.zeros_like(candidate)
+    reached[[0, -1], :] = candidate[[0, -1], :]
+    reached[:, [0, -1]] = candidate[:, [0, -1]]
+    candidate_t = np.ascontiguousarray(candidate.T)
+    for _ in range(MAX_FILL_PASSES):
+        grown = _fill_runs(candidate, reached)
+        grown = _fill_runs(candidate_t, np.ascontiguousarray(grown.T)).T
+        if np.array_equal(grown, reached):
+            return reached
+        reached = grown
+    logger.debug(f"🌀 Relleno sin converger tras {MAX_FILL_PASSES} pasadas: se completa con cola de tramos")
+    return _fill_queue(candidate, reached)
+
+
+def _dilate(mask):
+    """Dilatación de 1 px (4 vecinos)"""
+    grown = mask.copy()
+    grown[1:, :] |= mask[:-1, :]
+    grown[:-1, :] |= mask[1:, :]
+    grown[:, 1:] |= mask[:, :-1]
+    grown[:, :-1] |= mask[:, 1:]
+    return grown
+
+
+def _border_mask(rows, cols):
+    import numpy as np
+
+    border = max(1, round(min(rows, cols) * image_quality.BORDER_FRACTION))
+    mask = np.zeros((rows, cols), dtype=bool)
+    mask[:border, :] = True
+    mask[-border:, :] = True
+    mask[:, :border] = True
+    mask[:, -border:] = True
+    return mask
+
+
+@metrics.timed('bg_fast')
+def remove_uniform_background(image):
+    """Recorta el producto de una imagen PIL sobre blanco uniforme.
+
+    Devuelve (imagen RGBA, None) o (None, motivo) si el atajo no es fiable.
+    """
+    import numpy as np
+    from PIL import Image
+
+    rgb = np.asarray(image.convert('RGB'))
+    rows, cols = rgb.shape[:2]
+    distance = 255 - np.minimum(np.minimum(rgb[..., 0], rgb[..., 1]), rgb[..., 2])
+    candidate = distance <= BG_WHITE_TOLERANCE
+
+    border = _border_mask(rows, cols)
+    if candidate[border].mean() < BG_MIN_BORDER_WHITENESS:
+        return None, 'border'
+
+    background = flood_from_border(candidate)
+    foreground_ratio = 1 - background.mean()
+    if not BG_MIN_FOREGROUND <= foreground_ratio <= BG_MAX_FOREGROUND:
+        return None, 'foreground'
+
+    # El relleno tiene que parecerse al borde: si no, se ha comido un producto casi blanco
+    border_level = float(np.median(distance[border]))
+    off_tone = np.abs(distance[background].astype(np.int16) - border_level) > BG_MAX_TONE_SHIFT
+    if off_tone.mean() > BG_MAX_OFF_TONE:
+        return None, 'uneven_background'
+
+    # Anillos del contorno: el suavizado ocupa BG_FEATHER_WIDTH px, el siguiente debe ser producto firme
+    near = background
+    for _ in range(BG_FEATHER_WIDTH):
+        near = _dilate(near)
+    feather = near & ~background
+    inner_ring = _dilate(near) & ~near
+    if inner_ring.any() and (distance[inner_ring] < 2 * BG_WHITE_TOLERANCE).mean() > BG_MAX_SOFT_EDGE:
+        return None, 'soft_edge'
+
+    alpha = np.where(background, 0, 255).astype(np.uint8)
+    feather_alpha = np.clip(distance[feather] / OPAQUE_LEVEL, 0.0, 1.0)
+    alpha[feather] = np.round(feather_alpha * 255).astype(np.uint8)
+
+    # Color del producto sin la mezcla con el blanco: c = a * f + (1 - a) * 255
+    colors = rgb.copy()
+    partial = feather_alpha > 0
+    a = feather_alpha[partial][:, None]
+    mixed = rgb[feather][partial].astype(np.float32)
+    unmixed = colors[feather]
+    unmixed[partial] = np.clip((mixed - (1 - a) * 255) / a, 0, 255).round().astype(np.uint8)
+    colors[feather] = unmixed
+
+    return Image.fromarray(np.dstack([colors, alpha]), 'RGBA'), None
@@ -0,0 +1,123 @@
+"""
+Análisis rápido (NumPy) de si una imagen de producto ya cumple la especificación final.
+
+Muchas imágenes de Google Images ya son packshots cuadrados, en alta resolución y
+sobre fondo blanco; mandarlas a Gemini solo suma latencia y coste. Se miden:
+- resolución:  lado menor de la imagen original
+- aspecto:     lado menor / lado mayor (1.0 = cuadrada)
+- borde blanco: proporción de píxeles del borde que son blancos
+- uniformidad: desviación estándar de la luminancia del borde
+- relleno:     área del recuadro del producto (píxeles no blancos) / área total
+
+El análisis se hace sobre una miniatura, así que cuesta unos pocos milisegundos.
+"""
+
+import base64
+import logging
+import os
+from io import BytesIO
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Lado de la miniatura usada para el análisis
+ANALYSIS_SIZE = 256
+# Ancho del borde analizado como fracción del lado menor
+BORDER_FRACTION = 0.03
+# Un píxel es "blanco" si todos sus canales superan este nivel
+WHITE_LEVEL = 240
+# Un píxel es "producto" si algún canal baja de este nivel
+PRODUCT_LEVEL = 225
+
+TARGET_SPEC = {
+    'min_side': int(os.environ.get('IMAGE_SPEC_MIN_SIDE', '800')),
+    'min_aspect': 0.9,
+    'min_border_whiteness': 0.97,
+    'max_border_std': 8.0,
+    'min_fill': 0.25,
+    'max_fill': 0.92,
+}
+
+
+def _load_rgb(image_bytes):
+    """Devuelve (ancho, alto originales, miniatura RGB con la transparencia sobre blanco)"""
+    from PIL import Image
+
+    with Image.open(BytesIO(image_bytes)) as img:
+        width, height = img.size
+        # En JPEG, draft decodifica directamente a escala reducida
+        img.draft('RGB', (ANALYSIS_SIZE, ANALYSIS_SIZE))
+        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+            rgba = img.convert('RGBA')
+            thumbnail = Image.new('RGBA', rgba.size, (255, 255, 255, 255))
+            thumbnail.alpha_composite(rgba)
+            thumbnail = thumbnail.convert('RGB')
+        else:
+            thumbnail = img.convert('RGB')
+    thumbnail.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+    return width, height, thumbnail
+
+
+def analyze_image(image_bytes):
+    """Calcula las puntuaciones de la imagen (ver docstring del módulo)"""
+    import numpy as np
+
+    width, height, thumbnail = _load_rgb(image_bytes)
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    rows, cols = pixels.shape[:2]
+
+    border = max(1, round(min(rows, cols) * BORDER_FRACTION))
+    border_mask = np.zeros((rows, cols), dtype=bool)
+    border_mask[:border, :] = True
+    border_mask[-border:, :] = True
+    border_mask[:, :border] = True
+    border_mask[:, -border:] = True
+
+    white = pixels.min(axis=2) >= WHITE_LEVEL
+    border_luminance = pixels[border_mask].mean(axis=1)
+
+    product = pixels.min(axis=2) < PRODUCT_LEVEL
+    product_rows = np.flatnonzero(product.any(axis=1))
+    product_cols = np.flatnonzero(product.any(axis=0))
+    if product_rows.size:
+        bbox_area = (product_rows[-1] - product_rows[0] + 1) * (product_cols[-1] - product_cols[0] + 1)
+        fill_ratio = bbox_area / (rows * cols)
+    else:
+        fill_ratio = 0.0
+
+    return {
+        'min_side': min(width, height),
+        'aspect': round(min(width, height) / max(width, height), 3),
+        'border_whiteness': round(float(white[border_mask].mean()), 3),
+        'border_std': round(float(border_luminance.std()), 2),
+        'fill_ratio': round(float(fill_ratio), 3),
+    }
+
+
+def failed_checks(scores, spec=None):
+    """Nombres de los criterios que la imagen no cumple (lista vacía = apta)"""
+    spec = spec or TARGET_SPEC
+    failed = []
+    if scores['min_side'] < spec['min_side']:
+        failed.append('resolution')
+    if scores['aspect'] < spec['min_aspect']:
+        failed.append('aspect')
+    if scores['border_whiteness'] < spec['min_border_whiteness']:
+        failed.append('border_whiteness')
+    if scores['border_std'] > spec['max_border_std']:
+        failed.append('background_uniformity')
+    if not spec['min_fill'] <= scores['fill_ratio'] <= spec['max_fill']:
+        failed.append('fill_ratio')
+    return failed
+
+
+@metrics.timed('image_check')
+def assess_image(image_data_base64):
+    """Decide si la imagen puede saltarse la mejora con IA.
+
+    Devuelve {'passes': bool, 'scores': {...}, 'failed': [...]}.
+    """
+    scores = analyze_image(base64.b64decode(image_data_base64))
+    failed = failed_checks(scores)
+    return {'passes': not failed, 'scores': scores, 'failed': failed}
@@ -0,0 +1,261 @@
+"""
+Cascada de fuentes de imagen por EAN, empezando por la imagen gratuita de OFF.
+
+Antes cada EAN pasaba por SerpAPI (de pago) aunque Open Food Facts ya tuviera una
+foto frontal usable en su CDN. Ahora las fuentes de IMAGE_SOURCES se prueban en
+orden ('off,serpapi' por defecto) y cada imagen descargada recibe una puntuación
+de 0 a 1 a partir de image_quality.analyze_image:
+
+- resolución (50%): lado menor respecto a IMAGE_SPEC_MIN_SIDE
+- aspecto (20%): lado menor / lado mayor
+- fondo (15%): proporción de borde blanco
+- encuadre (15%): el producto ocupa una parte razonable de la imagen
+
+Resolución y aspecto suman por sí solos 0.7, así que una foto grande y cuadrada
+de un estante pasaría el mínimo. Por eso, además de la puntuación, una imagen solo
+se da por buena si su borde es blanco al menos en IMAGE_SOURCE_MIN_BORDER_WHITENESS
+y el producto deja margen (relleno hasta el máximo de la especificación).
+
+La primera que llega a IMAGE_SOURCE_MIN_SCORE y pasa esos mínimos se usa sin
+consultar las demás; si ninguna lo consigue, se usa la mejor puntuada que se haya
+descargado (Gemini la mejora después).
+
+IMAGE_SOURCE_MODE:
+- 'tiered': la fuente siguiente empieza solo si la anterior falló o no alcanzó
+  la puntuación (mínimo gasto en SerpAPI)
+- 'race': la siguiente empieza además si la anterior tarda más de
+  IMAGE_SOURCE_HEDGE_MS (0 = todas a la vez); gana la primera suficiente (menos
+  latencia a cambio de algunas llamadas de más). Las que pierden no se pueden
+  interrumpir a mitad de una petición, pero se cancelan: dejan de anotar tiempos
+  en la traza del EAN (las métricas de etapas sí los cuentan: son llamadas
+  reales al proveedor), y las fuentes de app.py consultan cancelled() para no
+  empezar otra descarga
+"""
+
+import asyncio
+import base64
+import contextvars
+import logging
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import image_quality
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SOURCES = [name.strip() for name in os.environ.get('IMAGE_SOURCES', 'off,serpapi').split(',') if name.strip()]
+IMAGE_SOURCE_MODE = os.environ.get('IMAGE_SOURCE_MODE', 'tiered')
+IMAGE_SOURCE_HEDGE_MS = float(os.environ.get('IMAGE_SOURCE_HEDGE_MS', '1500'))
+IMAGE_SOURCE_MIN_SCORE = float(os.environ.get('IMAGE_SOURCE_MIN_SCORE', '0.6'))
+IMAGE_SOURCE_MIN_BORDER_WHITENESS = float(os.environ.get('IMAGE_SOURCE_MIN_BORDER_WHITENESS', '0.6'))
+
+SCORE_WEIGHTS = {
+    'resolution': 0.5,
+    'aspect': 0.2,
+    'background': 0.15,
+    'framing': 0.15,
+}
+
+# Tamaños de visualización de OFF (front_es.4.400.jpg); '.full.jpg' es el original subido
+OFF_DISPLAY_SIZE_PATTERN = re.compile(r'\.(100|200|400)\.jpg$')
+
+# Hilos para las fuentes en modo 'race' (en 'tiered' se usa el hilo de la petición)
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('IMAGE_SOURCE_THREADS', '8')),
+                               thread_name_prefix='image-source')
+
+
+def off_image_urls(image_url):
+    """URLs a probar para la imagen de OFF: la de resolución completa y, si falla, la publicada"""
+    if not image_url:
+        return []
+    full_url = OFF_DISPLAY_SIZE_PATTERN.sub('.full.jpg', image_url)
+    return [full_url, image_url] if full_url != image_url else [image_url]
+
+
+def score(scores, spec=None):
+    """Puntuación 0-1 de una imagen candidata a partir de las medidas de analyze_image"""
+    spec = spec or image_quality.TARGET_SPEC
+    framed = spec['min_fill'] <= scores['fill_ratio'] <= spec['max_fill']
+    total = (SCORE_WEIGHTS['resolution'] * min(1.0, scores['min_side'] / spec['min_side'])
+             + SCORE_WEIGHTS['aspect'] * scores['aspect']
+             + SCORE_WEIGHTS['background'] * scores['border_whiteness']
+             + SCORE_WEIGHTS['framing'] * (1.0 if framed else 0.5))
+    return round(total, 3)
+
+
+def rejection(scores, spec=None):
+    """Motivo por el que una imagen no vale aunque puntúe bien ('background'/'framing'), o None"""
+    spec = spec or image_quality.TARGET_SPEC
+    if scores['border_whiteness'] < IMAGE_SOURCE_MIN_BORDER_WHITENESS:
+        return 'background'
+    if scores['fill_ratio'] > spec['max_fill']:
+        return 'framing'
+    return None
+
+
+@metrics.timed('image_score')
+def score_result(result):
+    """Agrega 'score' (y 'quality' si falta) a un resultado de descarga; success=False si no es una imagen"""
+    try:
+        scores = image_quality.analyze_image(base64.b64decode(result['image_data']))
+    except Exception as e:
+        return {'success': False, 'error': f'Imagen no válida: {e}'}
+    result = dict(result)
+    result['score'] = score(scores)
+    result['rejected'] = rejection(scores)
+    if not result.get('quality'):
+        side = scores['min_side']
+        result['quality'] = 'alta' if side >= 800 else 'media' if side >= 400 else 'baja'
+    return result
+
+
+def _hedge_seconds(mode):
+    if (mode or IMAGE_SOURCE_MODE) != 'race':
+        return None
+    return IMAGE_SOURCE_HEDGE_MS / 1000
+
+
+def _pick(name, result, best, min_score):
+    """Registra el resultado de una fuente. Devuelve (mejor hasta ahora, True si ya basta)"""
+    if not result['success']:
+        metrics.IMAGE_SOURCE_RESULTS.inc(name, 'failed')
+        logger.info(f"  ↪️ Fuente {name} sin imagen: {result.get('error', 'desconocido')}")
+        return best, False
+    result['source_name'] = name
+    rejected = result.get('rejected')
+    good_enough = result['score'] >= min_score and not rejected
+    outcome = 'accepted' if good_enough else 'rejected' if rejected else 'low_score'
+    metrics.IMAGE_SOURCE_RESULTS.inc(name, outcome)
+    logger.info(f"  {'✓' if good_enough else '↪️'} Fuente {name}: puntuación {result['score']}"
+                f"{f' (descartada: {rejected})' if rejected else ''}")
+    if best is None or result['score'] > best['score']:
+        best = result
+    return best, good_enough
+
+
+def _finish(best, skipped):
+    for name in skipped:
+        metrics.IMAGE_SOURCE_RESULTS.inc(name, 'skipped')
+    if best is None:
+        return {'success': False, 'error': 'No se pudo encontrar imagen del producto en ninguna fuente'}
+    return best
+
+
+def cascade(fetchers, sources=None, mode=None, min_score=None):
+    """Ejecuta la cascada. fetchers: {nombre: función sin argumentos que devuelve el resultado de descarga}"""
+    sources = [name for name in (sources or IMAGE_SOURCES) if name in fetchers]
+    min_score = IMAGE_SOURCE_MIN_SCORE if min_score is None else min_score
+    hedge = _hedge_seconds(mode)
+    pending = list(sources)
+    best = None
+
+    def run(name):
+        result = fetchers[name]()
+        return score_result(result) if result['success'] else result
+
+    if hedge is None:
+        while pending:
+            name = pending.pop(0)
+            best, done = _pick(name, run(name), best, min_score)
+            if done:
+                break
+        return _finish(best, pending)
+
+    # Carrera: cada fuente corre en un hilo con una copia del contexto (deadline, memoria)
+    # y sus tiempos aparte, que se suman a la traza del EAN al recoger su resultado
+    running = {}
+
+    def run_detached(name, detached):
+        tracing.detach(detached)
+        return run(name)
+
+    def launch():
+        name = pending.pop(0)
+        detached = tracing.DetachedTrace()
+        future = _executor.submit(contextvars.copy_context().run, run_detached, name, detached)
+        running[future] = (name, detached)
+
+    launch()
+    try:
+        while running:
+            done, _ = wait(running, timeout=hedge if pending else None, return_when=FIRST_COMPLETED)
+            if not done:
+                launch()
+                continue
+            for future in done:
+                name, detached = running.pop(future)
+                tracing.adopt(detached)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {'success': False, 'error': str(e)}
+                best, good_enough = _pick(name, result, best, min_score)
+                if good_enough:
+                    return _finish(best, pending)
+            if pending and not running:
+                launch()
+        return _finish(best, pending)
+    finally:
+        # Las que siguen en vuelo terminan en segundo plano sin anotar nada; su resultado se descarta
+        for _, detached in running.values():
+            detached.cancel()
+
+
+def cancelled():
+    """True dentro de una fuente que ya perdió la carrera: no vale la pena seguir descargando"""
+    return tracing.cancelled()
+
+
+async def cascade_async(fetchers, run_cpu, sources=None, mode=None, min_score=None):
+    """Igual que cascade con fuentes asíncronas; run_cpu(func, *args) puntúa fuera del event loop"""
+    sources = [name for name in (sources or IMAGE_SOURCES) if name in fetchers]
+    min_score = IMAGE_SOURCE_MIN_SCORE if min_score is None else min_score
+    hedge = _hedge_seconds(mode)
+    pending = list(sources)
+    best = None
+
+    async def run(name):
+        result = await fetchers[name]()
+        return await run_cpu(score_result, result) if result['success'] else result
+
+    if hedge is None:
+        while pending:
+            name = pending.pop(0)
+            best, done = _pick(name, await run(name), best, min_score)
+            if done:
+                break
+        return _finish(best, pending)
+
+    running = {}
+
+    def launch():
+        name = pending.pop(0)
+        running[asyncio.create_task(run(name))] = name
+
+    launch()
+    try:
+        while running:
+            done, _ = await asyncio.wait(running, timeout=hedge if pending else None,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                launch()
+                continue
+            for task in done:
+                name = running.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    result = {'success': False, 'error': str(e) or type(e).__name__}
+                best, good_enough = _pick(name, result, best, min_score)
+                if good_enough:
+                    return _finish(best, pending)
+            if pending and not running:
+                launch()
+        return _finish(best, pending)
+    finally:
+        # A diferencia de los hilos, las tareas que pierden la carrera sí se cancelan
+        for task in running:
+            task.cancel()
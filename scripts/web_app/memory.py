@@ -0,0 +1,326 @@
+"""
+Contabilidad de memoria por trabajo y perfilado de asignaciones bajo demanda.
+
+En los trabajos masivos cada imagen llega a estar en memoria varias veces a la vez
+(base64 en images_data, los bytes decodificados, el BytesIO del ZIP, su getvalue()
+y, en /process_bulk, el ZIP entero en base64), y en instancias pequeñas eso ha
+acabado en reinicios por OOM. Cada trabajo abre un JobMemory (ContextVar, igual
+que el deadline):
+
+- Un hilo muestrea el RSS del proceso cada MEMORY_SAMPLE_SECONDS mientras hay
+  trabajos en curso (y también al entrar y salir de cada etapa de
+  metrics.stage_timer): se guarda el pico del trabajo y el de cada etapa
+- Con JOB_MEMORY_BUDGET_MB > 0, exhausted() dice si el trabajo ya creció más que
+  su presupuesto sobre el RSS con el que empezó: no se empiezan más EANs y se
+  entrega lo hecho, igual que al agotar el deadline. Como el RSS es del proceso,
+  con otros trabajos en curso el crecimiento puede ser de ellos: entonces solo se
+  avisa en el log, y se corta cuando el proceso creció más que un presupuesto por
+  cada trabajo en curso
+- Con tracemalloc activo (MEMORY_PROFILE=1 o POST /admin/memory/profile) la
+  primera vez que un trabajo pasa por cada etapa de PROFILED_STAGES se comparan
+  instantáneas antes y después y se guardan los puntos del código que más memoria
+  asignaron. Cada instantánea recorre todas las asignaciones vivas (segundos si
+  tracemalloc está activo desde el arranque): es solo para diagnóstico
+
+El RSS es del proceso: si el worker atiende dos trabajos a la vez, el crecimiento
+de cada uno incluye el del otro ('concurrent_jobs' en el resumen lo indica).
+
+Lo que vive entre trabajos (cachés en memoria) se registra con register_holder y
+/admin/memory lo muestra en 'held_mb'.
+"""
+
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+JOB_MEMORY_BUDGET_MB = float(os.environ.get('JOB_MEMORY_BUDGET_MB', '0'))
+MEMORY_SAMPLE_SECONDS = float(os.environ.get('MEMORY_SAMPLE_SECONDS', '0.25'))
+MEMORY_PROFILE = os.environ.get('MEMORY_PROFILE', '').lower() in ('1', 'true', 'yes')
+MEMORY_PROFILE_FRAMES = int(os.environ.get('MEMORY_PROFILE_FRAMES', '1'))
+MEMORY_TOP_SITES = int(os.environ.get('MEMORY_TOP_SITES', '5'))
+# Etapas en las que se comparan instantáneas de tracemalloc (las que mueven imágenes enteras)
+PROFILED_STAGES = frozenset(os.environ.get(
+    'MEMORY_PROFILED_STAGES', 'image_download,gemini_image,bg_fast,rembg,thumbnail,excel,zip,zip_base64').split(','))
+# Resúmenes de trabajos terminados que se conservan para /admin/memory
+RECENT_JOBS = 20
+
+MB = 1024 * 1024
+
+_current_job = ContextVar('job_memory', default=None)
+_active_jobs = set()
+_recent_jobs = deque(maxlen=RECENT_JOBS)
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_sampler = None
+# Nombre -> función que devuelve los bytes que retiene (cachés de proceso)
+_holders = {}
+
+
+def current_rss_bytes():
+    """RSS actual del proceso (de /proc en Linux; si no, el máximo de getrusage)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _mb(value):
+    return round(value / MB, 1)
+
+
+def register_holder(name, size_bytes):
+    """Registra una estructura de proceso que retiene memoria entre trabajos (size_bytes() -> bytes)"""
+    _holders[name] = size_bytes
+
+
+class JobMemory:
+    def __init__(self, route, budget_mb=None):
+        budget_mb = JOB_MEMORY_BUDGET_MB if budget_mb is None else budget_mb
+        self.route = route
+        self.budget_bytes = int(budget_mb * MB)
+        self.started = time.monotonic()
+        self.finished = None
+        self.rss_start = current_rss_bytes()
+        self.rss_peak = self.rss_start
+        self.budget_exceeded = False
+        # True si superó el presupuesto con otros trabajos en curso (solo se avisó)
+        self.budget_shared = False
+        self.concurrent_jobs = 0
+        # Etapa -> bloques abiertos (en la app asíncrona varios EANs del trabajo van a la vez)
+        self._open_stages = {}
+        self.stage_peaks = {}
+        # Etapa -> {'allocated', 'top'} de su primera llamada perfilada (solo con tracemalloc)
+        self.allocations = {}
+        self._profiled = set()
+        self._lock = threading.Lock()
+
+    def observe(self, rss):
+        with self._lock:
+            self.rss_peak = max(self.rss_peak, rss)
+            for stage in self._open_stages:
+                self.stage_peaks[stage] = max(self.stage_peaks.get(stage, 0), rss)
+
+    def enter(self, stage):
+        with self._lock:
+            self._open_stages[stage] = self._open_stages.get(stage, 0) + 1
+        self.observe(current_rss_bytes())
+
+    def exit(self, stage):
+        self.observe(current_rss_bytes())
+        with self._lock:
+            remaining = self._open_stages.get(stage, 1) - 1
+            if remaining > 0:
+                self._open_stages[stage] = remaining
+            else:
+                self._open_stages.pop(stage, None)
+
+    def should_profile(self, stage):
+        """True para la primera llamada del trabajo a una etapa perfilable con tracemalloc activo"""
+        if stage not in PROFILED_STAGES or not tracemalloc.is_tracing():
+            return False
+        with self._lock:
+            if stage in self._profiled:
+                return False
+            self._profiled.add(stage)
+            return True
+
+    def record_allocations(self, stage, stats):
+        """Guarda lo asignado en la etapa y los puntos del código que más asignaron"""
+        grown = [stat for stat in stats if stat.size_diff > 0]
+        with self._lock:
+            self.allocations[stage] = {'allocated': sum(stat.size_diff for stat in grown),
+                                       'top': [_site(stat) for stat in grown[:MEMORY_TOP_SITES]]}
+
+    def growth_bytes(self):
+        return self.rss_peak - self.rss_start
+
+    def exhausted(self):
+        """True si el trabajo ya superó su presupuesto (se queda así hasta terminar).
+
+        Con otros trabajos en curso el presupuesto se multiplica por su número: el
+        crecimiento del RSS no distingue de quién es.
+        """
+        if self.budget_bytes <= 0:
+            return False
+        if not self.budget_exceeded:
+            self.observe(current_rss_bytes())
+            growth = self.growth_bytes()
+            if growth > self.budget_bytes:
+                jobs = max(1, active_count())
+                if growth > self.budget_bytes * jobs:
+                    self.budget_exceeded = True
+                elif not self.budget_shared:
+                    self.budget_shared = True
+                    logger.warning(f"🧠 {self.route} creció {_mb(growth)} MB (presupuesto {_mb(self.budget_bytes)} MB) "
+                                   f"con {jobs - 1} trabajos más en curso: se sigue hasta {_mb(self.budget_bytes * jobs)} MB")
+        return self.budget_exceeded
+
+    def summary(self):
+        """Resumen en MB para el evento 'complete' y /admin/memory"""
+        with self._lock:
+            stages = {stage: {'peak_mb': _mb(peak - self.rss_start)}
+                      for stage, peak in sorted(self.stage_peaks.items(), key=lambda item: -item[1])}
+            for stage, allocation in self.allocations.items():
+                stages.setdefault(stage, {})
+                stages[stage]['allocated_mb'] = _mb(allocation['allocated'])
+                stages[stage]['top_allocations'] = allocation['top']
+        end = self.finished if self.finished is not None else time.monotonic()
+        return {
+            'route': self.route,
+            'rss_start_mb': _mb(self.rss_start),
+            'rss_peak_mb': _mb(self.rss_peak),
+            'growth_mb': _mb(self.growth_bytes()),
+            'budget_mb': _mb(self.budget_bytes) if self.budget_bytes > 0 else None,
+            'budget_exceeded': self.budget_exceeded,
+            'budget_shared': self.budget_shared,
+            'concurrent_jobs': self.concurrent_jobs,
+            'seconds': round(end - self.started, 1),
+            'stages': stages,
+        }
+
+
+def _site(stat):
+    frame = stat.traceback[0]
+    return {'site': f'{os.path.basename(frame.filename)}:{frame.lineno}',
+            'size_kb': round(stat.size_diff / 1024, 1), 'count': stat.count_diff}
+
+
+def _snapshot():
+    snapshot = tracemalloc.take_snapshot()
+    return snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                   tracemalloc.Filter(False, __file__),
+                                   tracemalloc.Filter(False, '<frozen importlib._bootstrap*>')))
+
+
+def _sample_loop():
+    while True:
+        with _lock:
+            jobs = list(_active_jobs)
+        if not jobs:
+            _wakeup.wait()
+            _wakeup.clear()
+            continue
+        rss = current_rss_bytes()
+        for job in jobs:
+            job.observe(rss)
+        time.sleep(MEMORY_SAMPLE_SECONDS)
+
+
+def _ensure_sampler():
+    global _sampler
+    if _sampler is None or not _sampler.is_alive():
+        _sampler = threading.Thread(target=_sample_loop, name='memory-sampler', daemon=True)
+        _sampler.start()
+
+
+def start(route, budget_mb=None):
+    """Abre la contabilidad de memoria del trabajo en el contexto actual"""
+    job = JobMemory(route, budget_mb)
+    with _lock:
+        _active_jobs.add(job)
+        for other in _active_jobs:
+            other.concurrent_jobs = max(other.concurrent_jobs, len(_active_jobs) - 1)
+        _ensure_sampler()
+    _wakeup.set()
+    _current_job.set(job)
+    return job
+
+
+def finish(job):
+    """Cierra el trabajo y guarda su resumen entre los recientes"""
+    job.observe(current_rss_bytes())
+    job.finished = time.monotonic()
+    with _lock:
+        _active_jobs.discard(job)
+        _recent_jobs.append(job)
+    if _current_job.get() is job:
+        _current_job.set(None)
+
+
+def current():
+    return _current_job.get()
+
+
+def active_count():
+    """Trabajos con contabilidad de memoria abierta en este proceso"""
+    with _lock:
+        return len(_active_jobs)
+
+
+def exhausted():
+    """True si el trabajo en curso agotó su presupuesto de memoria (siempre False sin presupuesto)"""
+    job = _current_job.get()
+    return job is not None and job.exhausted()
+
+
+def summary():
+    """Resumen del trabajo en curso (None fuera de un trabajo)"""
+    job = _current_job.get()
+    return job.summary() if job is not None else None
+
+
+@contextmanager
+def stage(name):
+    """Atribuye al bloque el RSS que se observe mientras dura (y sus asignaciones, si se perfila)"""
+    job = _current_job.get()
+    if job is None:
+        yield
+        return
+    job.enter(name)
+    before = _snapshot() if job.should_profile(name) else None
+    try:
+        yield
+    finally:
+        # Si se desactivó el perfilado a mitad de la etapa no hay segunda instantánea
+        if before is not None and tracemalloc.is_tracing():
+            job.record_allocations(name, _snapshot().compare_to(before, 'lineno'))
+        job.exit(name)
+
+
+def start_profiling():
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(MEMORY_PROFILE_FRAMES)
+
+
+def stop_profiling():
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def status(top=None):
+    """Estado para /admin/memory: RSS, trabajos en curso y recientes, y lo que más ocupa ahora"""
+    with _lock:
+        active = list(_active_jobs)
+        recent = list(_recent_jobs)
+    result = {
+        'rss_mb': _mb(current_rss_bytes()),
+        'held_mb': {name: _mb(size_bytes()) for name, size_bytes in _holders.items()},
+        'budget_mb': JOB_MEMORY_BUDGET_MB or None,
+        'profiling': tracemalloc.is_tracing(),
+        'active_jobs': [job.summary() for job in active],
+        'recent_jobs': [job.summary() for job in reversed(recent)],
+    }
+    if tracemalloc.is_tracing():
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        result['traced_mb'] = _mb(traced)
+        result['traced_peak_mb'] = _mb(traced_peak)
+        stats = _snapshot().statistics('lineno')[:top or MEMORY_TOP_SITES]
+        result['top_allocations'] = [{'site': f'{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}',
+                                      'size_kb': round(stat.size / 1024, 1), 'count': stat.count}
+                                     for stat in stats]
+    return result
+
+
+if MEMORY_PROFILE:
+    start_profiling()
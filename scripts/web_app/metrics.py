@@ -0,0 +1,311 @@
+"""
+Métricas en memoria expuestas en formato de texto Prometheus (/metrics).
+
+Registro mínimo sin dependencias externas: contadores, gauges e histogramas
+protegidos por un lock. Registrar una observación cuesta unos pocos
+microsegundos, así que se puede llamar desde cualquier función del pipeline.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+import circuit
+import memory
+import tracing
+from memory import current_rss_bytes
+
+# Buckets en segundos: desde respuestas de OFF (~100ms) hasta Gemini Image (~60s)
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f'{self.name} espera etiquetas {self.labelnames}, recibió {labels}')
+        return tuple(str(label) for label in labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, *labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def get(self, *labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def set(self, *labels, value):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *labels, value):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted((labels, ([*state[0]], state[1], state[2])) for labels, state in self._values.items())
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                label_str = _format_labels(self.labelnames, labels, ('le', _format_value(bound)))
+                lines.append(f'{self.name}_bucket{label_str} {cumulative}')
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_str} {_format_value(total)}')
+            lines.append(f'{self.name}_count{label_str} {count}')
+        return lines
+
+
+# Métricas de la aplicación
+STAGE_DURATION = Histogram(
+    'ean_stage_duration_seconds',
+    'Duración de cada etapa del pipeline (off, serpapi, image_download, image_score, gemini_text, image_check, gemini_image, bg_fast, rembg, rembg_batch, thumbnail, excel, zip)',
+    ('stage',)
+)
+UPSTREAM_RESPONSES = Counter(
+    'ean_upstream_responses_total',
+    'Respuestas de servicios externos por proveedor y código HTTP (code="error" si no hubo respuesta)',
+    ('provider', 'code')
+)
+CACHE_REQUESTS = Counter(
+    'ean_cache_requests_total',
+    'Consultas a cachés internas por resultado (hit/miss; revalidated = 304 del origen)',
+    ('cache', 'result')
+)
+JOBS_IN_FLIGHT = Gauge('ean_jobs_in_flight', 'Trabajos en curso por ruta', ('route',))
+EANS_IN_FLIGHT = Gauge('ean_eans_in_flight', 'EANs que se están procesando en este momento')
+BYTES_IN = Counter('ean_bytes_in_total', 'Bytes recibidos de servicios externos', ('provider',))
+BYTES_OUT = Counter('ean_bytes_out_total', 'Bytes enviados a los clientes por ruta', ('route',))
+ARTIFACT_BYTES = Gauge('ean_artifact_store_bytes', 'Bytes ocupados por los ZIPs del almacén de artefactos')
+ARTIFACT_EVICTIONS = Counter('ean_artifact_evictions_total', 'ZIPs eliminados del almacén por motivo (ttl/quota)', ('reason',))
+DEADLINE_HITS = Counter('ean_job_deadline_hits_total', 'Trabajos que agotaron su presupuesto de tiempo con EANs pendientes', ('route',))
+DEADLINE_SKIPS = Counter('ean_deadline_skipped_stages_total', 'Etapas no iniciadas por falta de presupuesto de tiempo', ('stage',))
+REFRESH_ITEMS = Counter('ean_refresh_items_total', 'EANs de actualizaciones incrementales: reused (sin cambios en OFF), changed o retried', ('outcome',))
+JOB_MEMORY_GROWTH = Histogram(
+    'ean_job_memory_growth_bytes',
+    'Crecimiento máximo del RSS durante cada trabajo sobre el RSS con el que empezó',
+    ('route',),
+    buckets=tuple(mb * 1024 * 1024 for mb in (8, 16, 32, 64, 128, 256, 512, 1024))
+)
+IMAGE_SOURCE_RESULTS = Counter('ean_image_source_total', 'Resultado de cada fuente de la cascada de imágenes (accepted/low_score/rejected/failed/skipped)', ('source', 'outcome'))
+BG_REMOVALS = Counter('ean_background_removal_total', 'Fondos removidos por método (fast = máscara NumPy, rembg = modelo U2Net)', ('method',))
+BG_FAST_REJECTIONS = Counter('ean_background_fast_path_rejections_total', 'Imágenes que el atajo NumPy pasó a rembg por motivo (border/foreground/soft_edge)', ('reason',))
+BG_BATCH_SIZE = Histogram('ean_background_batch_size', 'Imágenes por lote de inferencia de rembg', buckets=(1, 2, 3, 4, 6, 8, 12, 16))
+SCHEDULER_WAIT = Histogram('ean_scheduler_wait_seconds', 'Espera por un turno del planificador por prioridad (interactive/bulk)', ('priority',))
+SCHEDULER_QUEUED = Gauge('ean_scheduler_queued', 'Peticiones esperando turno del planificador por prioridad', ('priority',))
+SCHEDULER_BUSY = Gauge('ean_scheduler_busy_slots', 'Turnos del planificador ocupados por prioridad', ('priority',))
+MEMORY_BUDGET_HITS = Counter('ean_job_memory_budget_hits_total', 'Trabajos que agotaron su presupuesto de memoria con EANs pendientes', ('route',))
+HTTP_CACHE_BYTES = Gauge('ean_http_cache_bytes', 'Bytes de respuestas guardadas en la caché HTTP de este worker por caché (off/image)', ('cache',))
+EANS_IN_FLIGHT.set(value=0)
+ARTIFACT_BYTES.set(value=0)
+
+REGISTRY = [STAGE_DURATION, UPSTREAM_RESPONSES, CACHE_REQUESTS, JOBS_IN_FLIGHT,
+            EANS_IN_FLIGHT, BYTES_IN, BYTES_OUT, ARTIFACT_BYTES, ARTIFACT_EVICTIONS,
+            DEADLINE_HITS, DEADLINE_SKIPS, REFRESH_ITEMS, JOB_MEMORY_GROWTH, MEMORY_BUDGET_HITS,
+            SCHEDULER_WAIT, SCHEDULER_QUEUED, SCHEDULER_BUSY, IMAGE_SOURCE_RESULTS,
+            BG_REMOVALS, BG_FAST_REJECTIONS, BG_BATCH_SIZE, HTTP_CACHE_BYTES]
+
+
+def observe_stage(stage, seconds):
+    """Registra la duración de una etapa (y la suma a la traza del EAN en curso)"""
+    STAGE_DURATION.observe(stage, value=seconds)
+    # Una fuente de imagen que perdió la carrera sigue gastando cuota del proveedor
+    # (cuenta en el histograma), pero su tiempo ya no es del EAN
+    if not tracing.cancelled():
+        tracing.record(stage, seconds)
+
+
+@contextmanager
+def stage_timer(stage):
+    """Mide el bloque como una etapa del pipeline (se registra aunque falle)"""
+    start = time.perf_counter()
+    try:
+        with memory.stage(stage):
+            yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def timed(stage):
+    """Decorador equivalente a stage_timer para funciones completas"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_upstream(provider, response=None):
+    """Registra código de estado y bytes recibidos de una respuesta de requests"""
+    if response is None:
+        record_upstream_status(provider, None)
+        return
+    record_upstream_status(provider, response.status_code, len(response.content))
+
+
+def record_upstream_status(provider, status_code, size=0):
+    """Igual que record_upstream pero sin depender del cliente HTTP (status None = sin respuesta)"""
+    UPSTREAM_RESPONSES.inc(provider, 'error' if status_code is None else status_code)
+    circuit.record(provider, status_code)
+    if size:
+        BYTES_IN.inc(provider, amount=size)
+
+
+def record_cache(cache, hit):
+    """hit: True/False, o el resultado tal cual (p.ej. 'revalidated')"""
+    CACHE_REQUESTS.inc(cache, hit if isinstance(hit, str) else ('hit' if hit else 'miss'))
+
+
+def add_bytes_out(route, amount):
+    if amount:
+        BYTES_OUT.inc(route, amount=amount)
+
+
+def track_items(items):
+    """Itera los EANs de un trabajo manteniendo el gauge de EANs en curso"""
+    for item in items:
+        EANS_IN_FLIGHT.inc()
+        try:
+            yield item
+        finally:
+            EANS_IN_FLIGHT.dec()
+
+
+def track_job(route, events):
+    """Envuelve un generador SSE: cuenta el trabajo en curso, los bytes enviados y su memoria"""
+    JOBS_IN_FLIGHT.inc(route)
+    job_memory = memory.start(route)
+    try:
+        for event in events:
+            add_bytes_out(route, len(event.encode('utf-8')))
+            yield event
+    finally:
+        JOBS_IN_FLIGHT.dec(route)
+        finish_job_memory(route, job_memory)
+        tracing.clear()
+
+
+def finish_job_memory(route, job_memory):
+    """Cierra la contabilidad de memoria del trabajo y registra cuánto creció el RSS"""
+    memory.finish(job_memory)
+    JOB_MEMORY_GROWTH.observe(route, value=job_memory.growth_bytes())
+
+
+def _process_lines():
+    return ['# HELP ean_process_resident_memory_bytes RSS del proceso (worker) que atiende /metrics',
+            '# TYPE ean_process_resident_memory_bytes gauge',
+            f'ean_process_resident_memory_bytes {current_rss_bytes()}']
+
+
+def _cache_ratio_lines():
+    with CACHE_REQUESTS._lock:
+        values = dict(CACHE_REQUESTS._values)
+    caches = sorted({cache for cache, _ in values})
+    lines = ['# HELP ean_cache_hit_ratio Proporción de consultas servidas sin transferir el cuerpo (hit o revalidated) desde el arranque',
+             '# TYPE ean_cache_hit_ratio gauge']
+    for cache in caches:
+        hits = values.get((cache, 'hit'), 0) + values.get((cache, 'revalidated'), 0)
+        total = hits + values.get((cache, 'miss'), 0)
+        ratio = hits / total if total else 0.0
+        lines.append(f'ean_cache_hit_ratio{_format_labels(("cache",), (cache,))} {_format_value(ratio)}')
+    return lines
+
+
+def _circuit_lines():
+    codes = {circuit.CLOSED: 0, circuit.HALF_OPEN: 1, circuit.OPEN: 2}
+    lines = ['# HELP ean_circuit_state Estado del circuit breaker por proveedor (0 cerrado, 1 semiabierto, 2 abierto)',
+             '# TYPE ean_circuit_state gauge']
+    for provider, state in sorted(circuit.states().items()):
+        lines.append(f'ean_circuit_state{_format_labels(("provider",), (provider,))} {codes[state]}')
+    return lines
+
+
+def render():
+    """Devuelve todas las métricas en formato de exposición de texto Prometheus"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    lines.extend(_cache_ratio_lines())
+    lines.extend(_circuit_lines())
+    lines.extend(_process_lines())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,152 @@
+"""
+Actualización incremental de un catálogo a partir de un resultado anterior.
+
+El Excel de /process_bulk (y del CLI) lleva una hoja oculta '_manifest' con el
+last_modified_t de OFF de cada EAN en el momento de procesarlo. Al actualizar se
+parte de ese resultado (el ZIP, el Excel solo o la carpeta de salida del CLI):
+
+- Si el EAN salió completo (encontrado en OFF y con imagen) y OFF sigue dando el
+  mismo last_modified_t (consulta con fields=last_modified_t, unos pocos bytes),
+  se reutilizan su fila y su imagen sin llamar a Gemini ni a SerpAPI
+- Si el registro de OFF cambió o aquella vez falló, se procesa de nuevo entero
+
+Con el Excel solo (sin imágenes) las filas reutilizadas conservan su columna
+Imagen, pero la imagen no entra en el ZIP nuevo.
+"""
+
+import base64
+import logging
+import os
+import zipfile
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_SHEET = '_manifest'
+MANIFEST_HEADERS = ('EAN', 'last_modified_t')
+# Clave del registro combinado con el last_modified_t de OFF (no es una columna del Excel)
+LAST_MODIFIED_KEY = '_last_modified_t'
+EXCEL_FILENAME = 'productos_prestashop.xlsx'
+IMAGES_DIR = 'imagenes'
+
+
+def add_manifest_sheet(workbook, products_data):
+    """Agrega la hoja oculta con el last_modified_t de OFF de cada producto"""
+    ws = workbook.create_sheet(MANIFEST_SHEET)
+    ws.sheet_state = 'hidden'
+    ws.append(MANIFEST_HEADERS)
+    for product in products_data:
+        ws.append((product.get('Ean') or product.get('Referencia', ''), product.get(LAST_MODIFIED_KEY)))
+
+
+def _read_excel(data):
+    """({ean: fila}, {ean: last_modified_t}) del Excel generado"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(BytesIO(data), read_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        headers = next(rows, None) or ()
+        products = {}
+        for row in rows:
+            product = {header: ('' if value is None else value) for header, value in zip(headers, row) if header}
+            ean = str(product.get('Ean') or product.get('Referencia') or '').strip()
+            if ean:
+                products[ean] = product
+
+        last_modified = {}
+        if MANIFEST_SHEET in workbook.sheetnames:
+            manifest_rows = workbook[MANIFEST_SHEET].iter_rows(values_only=True)
+            next(manifest_rows, None)
+            for row in manifest_rows:
+                if row and row[0] and len(row) > 1 and row[1] is not None:
+                    last_modified[str(row[0]).strip()] = int(row[1])
+        return products, last_modified
+    finally:
+        workbook.close()
+
+
+class PreviousRun:
+    """Filas, last_modified_t e imágenes de una ejecución anterior, por EAN"""
+
+    def __init__(self, products, last_modified, read_image=None, has_image=None):
+        self.products = products
+        self.last_modified = last_modified
+        # read_image(filename) -> bytes y has_image(filename) -> bool; None si el resultado no trae imágenes
+        self._read_image = read_image
+        self._has_image = has_image
+
+    @classmethod
+    def load(cls, source, filename=None):
+        """source: ruta (carpeta de salida del CLI, .xlsx o .zip) o bytes subidos (el tipo lo da filename)"""
+        if isinstance(source, str) and os.path.isdir(source):
+            with open(os.path.join(source, EXCEL_FILENAME), 'rb') as f:
+                products, last_modified = _read_excel(f.read())
+            images_dir = os.path.join(source, IMAGES_DIR)
+
+            def read_image(name):
+                with open(os.path.join(images_dir, os.path.basename(name)), 'rb') as f:
+                    return f.read()
+
+            def has_image(name):
+                return os.path.isfile(os.path.join(images_dir, os.path.basename(name)))
+            return cls(products, last_modified, read_image, has_image)
+
+        if isinstance(source, str):
+            filename = filename or source
+            with open(source, 'rb') as f:
+                source = f.read()
+
+        # El .xlsx también es un ZIP: se distingue por el nombre
+        is_excel = bool(filename) and filename.lower().endswith('.xlsx')
+        if not is_excel and zipfile.is_zipfile(BytesIO(source)):
+            archive = zipfile.ZipFile(BytesIO(source))
+            excel_names = [name for name in archive.namelist() if name.lower().endswith('.xlsx')]
+            if not excel_names:
+                raise ValueError('El ZIP no contiene el Excel de productos')
+            products, last_modified = _read_excel(archive.read(excel_names[0]))
+            image_names = {os.path.basename(name): name for name in archive.namelist()
+                           if name.startswith(f'{IMAGES_DIR}/') and not name.endswith('/')}
+
+            def read_image(name):
+                return archive.read(image_names[os.path.basename(name)])
+
+            def has_image(name):
+                return os.path.basename(name) in image_names
+            return cls(products, last_modified, read_image, has_image)
+
+        if not is_excel:
+            raise ValueError('El resultado anterior debe ser el ZIP o el Excel generado')
+        products, last_modified = _read_excel(source)
+        return cls(products, last_modified)
+
+    def _image_name(self, ean):
+        product = self.products.get(ean) or {}
+        return os.path.basename(str(product.get('Imagen') or ''))
+
+    def candidate(self, ean):
+        """True si el EAN salió completo la vez anterior (vale la pena mirar si OFF cambió)"""
+        product = self.products.get(ean)
+        if not product or product.get('Producto Encontrado') != 'si' or ean not in self.last_modified:
+            return False
+        image_name = self._image_name(ean)
+        if not image_name:
+            return False
+        # Si el resultado trae imágenes, la del EAN tiene que estar
+        return self._has_image is None or self._has_image(image_name)
+
+    def reuse(self, ean, last_modified_t):
+        """{'product', 'image'} de la ejecución anterior si OFF no cambió; None si hay que reprocesar"""
+        if last_modified_t is None or not self.candidate(ean) or self.last_modified[ean] != int(last_modified_t):
+            return None
+        product = dict(self.products[ean])
+        product[LAST_MODIFIED_KEY] = int(last_modified_t)
+        image = None
+        if self._read_image is not None:
+            image_name = self._image_name(ean)
+            image = {'filename': image_name,
+                     'data': base64.b64encode(self._read_image(image_name)).decode('utf-8')}
+        return {'product': product, 'image': image}
+
+    def __len__(self):
+        return len(self.products)
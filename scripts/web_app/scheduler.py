@@ -0,0 +1,328 @@
+"""
+Planificador de turnos entre búsquedas interactivas y trabajos masivos.
+
+Con un solo worker, un /process_bulk de 50 EANs hacía esperar minutos a las
+búsquedas de /process_ean, y dos lotes a la vez bloqueaban a todos los demás.
+Con GUNICORN_THREADS se pueden aceptar más peticiones simultáneas, pero el
+trabajo real (cuotas de OFF, SerpAPI y Gemini y CPU de PIL/rembg) pasa por
+SCHEDULER_SLOTS turnos:
+
+- Cada EAN de un lote pide un turno 'bulk' y lo suelta al terminar; los EANs que
+  ya están en el checkpoint se entregan sin pedir turno (turns(..., skip=...))
+- Cada /process_ean pide uno 'interactive' para la búsqueda, y lo suelta mientras
+  espera a Gemini (released()): son segundos sin CPU en los que otro puede avanzar
+- Al quedar libre un turno entra primero la petición interactiva más antigua; los
+  turnos 'bulk' van al cliente (IP) que menos turnos tiene ocupados, en round-robin
+  si empatan, así dos lotes de personas distintas avanzan intercalados EAN a EAN
+  en lugar de uno tras otro (y dos lotes de la misma persona no valen el doble)
+- Entre un EAN y el siguiente un lote cambia su turno por uno nuevo en una sola
+  operación (renew): compite con los demás sin perder su sitio por el hueco
+- SCHEDULER_INTERACTIVE_SLOTS turnos quedan reservados para lo interactivo: los
+  lotes nunca los ocupan todos
+- La espera de un EAN de lote se acota al deadline del trabajo: si se agota
+  esperando, el EAN sigue sin turno y el bucle lo deja pendiente. Una petición
+  interactiva espera como mucho SCHEDULER_INTERACTIVE_WAIT_SECONDS y después se
+  atiende igualmente
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+import deadlines
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_SLOTS = int(os.environ.get('SCHEDULER_SLOTS', '3'))
+SCHEDULER_INTERACTIVE_SLOTS = int(os.environ.get('SCHEDULER_INTERACTIVE_SLOTS', '1'))
+SCHEDULER_INTERACTIVE_WAIT_SECONDS = float(os.environ.get('SCHEDULER_INTERACTIVE_WAIT_SECONDS', '30'))
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+# Turno del bloque turn() en curso: {'ticket', 'priority', 'client'} (released() lo suelta y lo recupera)
+_held = ContextVar('scheduler_turn', default=None)
+
+
+def client_key(forwarded_for, remote_addr):
+    """Cliente para el reparto: primera IP de X-Forwarded-For (Render va detrás de un proxy) o la remota"""
+    if forwarded_for:
+        return forwarded_for.split(',')[0].strip()
+    return remote_addr or 'desconocido'
+
+
+class Waiter:
+    """Petición de turno de un hilo"""
+
+    def __init__(self, priority, client):
+        self.priority = priority
+        self.client = client
+        self.granted = False
+        self.queued_at = time.monotonic()
+        self._event = threading.Event()
+
+    def notify(self):
+        self._event.set()
+
+    def wait(self, timeout):
+        return self._event.wait(timeout)
+
+
+class AsyncWaiter(Waiter):
+    """Petición de turno de una tarea asyncio (se le avisa desde cualquier hilo)"""
+
+    def __init__(self, priority, client):
+        super().__init__(priority, client)
+        self._loop = asyncio.get_running_loop()
+        self.future = self._loop.create_future()
+
+    def notify(self):
+        self._loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class Scheduler:
+    def __init__(self, slots=None, interactive_slots=None):
+        self._lock = threading.Lock()
+        self._busy = {INTERACTIVE: 0, BULK: 0}
+        self._busy_clients = {}
+        self._interactive = deque()
+        # Cliente -> cola de sus EANs esperando; el primero de la lista es el siguiente en el round-robin
+        self._bulk = OrderedDict()
+        self.configure(slots, interactive_slots)
+
+    def configure(self, slots=None, interactive_slots=None):
+        slots = SCHEDULER_SLOTS if slots is None else slots
+        interactive_slots = SCHEDULER_INTERACTIVE_SLOTS if interactive_slots is None else interactive_slots
+        with self._lock:
+            self.slots = max(1, slots)
+            # Al menos un turno tiene que quedar para los lotes
+            self.interactive_slots = max(0, min(interactive_slots, self.slots - 1))
+            granted = self._dispatch()
+        for waiter in granted:
+            waiter.notify()
+
+    def _can_run(self, priority):
+        if self._busy[INTERACTIVE] + self._busy[BULK] >= self.slots:
+            return False
+        return priority == INTERACTIVE or self._busy[BULK] < self.slots - self.interactive_slots
+
+    def _grant(self, waiter):
+        waiter.granted = True
+        self._busy[waiter.priority] += 1
+        self._busy_clients[waiter.client] = self._busy_clients.get(waiter.client, 0) + 1
+        metrics.SCHEDULER_BUSY.set(waiter.priority, value=self._busy[waiter.priority])
+
+    def _free(self, waiter):
+        self._busy[waiter.priority] -= 1
+        remaining = self._busy_clients.get(waiter.client, 1) - 1
+        if remaining > 0:
+            self._busy_clients[waiter.client] = remaining
+        else:
+            self._busy_clients.pop(waiter.client, None)
+        metrics.SCHEDULER_BUSY.set(waiter.priority, value=self._busy[waiter.priority])
+
+    def _enqueue(self, waiter):
+        if waiter.priority == INTERACTIVE:
+            self._interactive.append(waiter)
+        else:
+            self._bulk.setdefault(waiter.client, deque()).append(waiter)
+        metrics.SCHEDULER_QUEUED.inc(waiter.priority)
+
+    def _dispatch(self):
+        """Asigna los turnos libres (con el lock tomado); devuelve a quién hay que avisar"""
+        granted = []
+        while self._interactive and self._can_run(INTERACTIVE):
+            waiter = self._interactive.popleft()
+            self._grant(waiter)
+            granted.append(waiter)
+        while self._bulk and self._can_run(BULK):
+            # min() se queda con el primero en empatar: el orden del dict es el round-robin
+            client = min(self._bulk, key=lambda name: self._busy_clients.get(name, 0))
+            queue = self._bulk[client]
+            waiter = queue.popleft()
+            if queue:
+                self._bulk.move_to_end(client)
+            else:
+                del self._bulk[client]
+            self._grant(waiter)
+            granted.append(waiter)
+        for waiter in granted:
+            metrics.SCHEDULER_QUEUED.dec(waiter.priority)
+        return granted
+
+    def _submit(self, waiter):
+        """Da el turno al momento si hay uno libre y nadie delante; si no, encola. True si ya lo tiene"""
+        with self._lock:
+            waiting = self._interactive if waiter.priority == INTERACTIVE else self._bulk
+            if not waiting and self._can_run(waiter.priority):
+                self._grant(waiter)
+                return True
+            self._enqueue(waiter)
+            return False
+
+    def _cancel(self, waiter):
+        """Saca de la cola a quien dejó de esperar; True si justo había recibido el turno"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            if waiter.priority == INTERACTIVE:
+                self._interactive.remove(waiter)
+            else:
+                queue = self._bulk[waiter.client]
+                queue.remove(waiter)
+                if not queue:
+                    del self._bulk[waiter.client]
+            metrics.SCHEDULER_QUEUED.dec(waiter.priority)
+            return False
+
+    def _waited(self, waiter):
+        waited = time.monotonic() - waiter.queued_at
+        metrics.SCHEDULER_WAIT.observe(waiter.priority, value=waited)
+        # La etapa 'queue' de la traza del EAN es la espera desde que pidió el turno
+        tracing.record_queue_wait(waited)
+        return waiter if waiter.granted else None
+
+    def acquire(self, priority, client, timeout=None):
+        """Espera un turno (como mucho timeout segundos). Devuelve el turno o None si no llegó"""
+        waiter = Waiter(priority, client)
+        if not self._submit(waiter) and not waiter.wait(timeout):
+            self._cancel(waiter)
+        return self._waited(waiter)
+
+    async def acquire_async(self, priority, client, timeout=None):
+        """Igual que acquire sin bloquear el event loop"""
+        waiter = AsyncWaiter(priority, client)
+        if not self._submit(waiter):
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+            except asyncio.TimeoutError:
+                self._cancel(waiter)
+            except asyncio.CancelledError:
+                # Si el turno llegó justo al cancelar la tarea, se devuelve para no perderlo
+                if self._cancel(waiter):
+                    self.release(waiter)
+                raise
+        return self._waited(waiter)
+
+    def release(self, waiter):
+        with self._lock:
+            self._free(waiter)
+            granted = self._dispatch()
+        for next_waiter in granted:
+            next_waiter.notify()
+
+    def renew(self, waiter, timeout=None):
+        """Suelta el turno y pide el siguiente en la misma operación. Devuelve el nuevo turno o None"""
+        next_waiter = Waiter(waiter.priority, waiter.client)
+        with self._lock:
+            self._free(waiter)
+            self._enqueue(next_waiter)
+            granted = self._dispatch()
+        for other in granted:
+            other.notify()
+        if not next_waiter.granted and not next_waiter.wait(timeout):
+            self._cancel(next_waiter)
+        return self._waited(next_waiter)
+
+
+shared = Scheduler()
+
+
+def _timeout(priority):
+    if priority == INTERACTIVE:
+        return SCHEDULER_INTERACTIVE_WAIT_SECONDS
+    # Un EAN de lote no espera más allá del punto en que ya no conviene empezarlo
+    deadline = deadlines.current()
+    if deadline is None:
+        return None
+    return max(0.0, deadline.remaining() - deadlines.STAGE_MIN_SECONDS['ean'])
+
+
+def _log_missed(priority, client):
+    if priority == INTERACTIVE:
+        logger.warning(f"🚦 Sin turno interactivo para {client} tras {SCHEDULER_INTERACTIVE_WAIT_SECONDS:.0f} s: se atiende igualmente")
+    else:
+        logger.warning(f"🚦 Sin turno para el lote de {client} antes del deadline")
+
+
+@contextmanager
+def turn(priority, client):
+    """Ejecuta el bloque con un turno del planificador compartido (cede el valor True si lo obtuvo)"""
+    ticket = shared.acquire(priority, client, _timeout(priority))
+    if ticket is None:
+        _log_missed(priority, client)
+    held = {'ticket': ticket, 'priority': priority, 'client': client}
+    token = _held.set(held)
+    try:
+        yield ticket is not None
+    finally:
+        _held.reset(token)
+        if held['ticket'] is not None:
+            shared.release(held['ticket'])
+
+
+@contextmanager
+def released():
+    """Suelta el turno de turn() mientras dura el bloque (una espera de red larga) y lo vuelve a pedir al salir"""
+    held = _held.get()
+    if held is None or held['ticket'] is None:
+        yield
+        return
+    shared.release(held['ticket'])
+    held['ticket'] = None
+    try:
+        yield
+    finally:
+        held['ticket'] = shared.acquire(held['priority'], held['client'], _timeout(held['priority']))
+        if held['ticket'] is None:
+            _log_missed(held['priority'], held['client'])
+
+
+@asynccontextmanager
+async def async_turn(priority, client):
+    ticket = await shared.acquire_async(priority, client, _timeout(priority))
+    if ticket is None:
+        _log_missed(priority, client)
+    try:
+        yield ticket is not None
+    finally:
+        if ticket is not None:
+            shared.release(ticket)
+
+
+def turns(items, client, skip=None):
+    """Itera los EANs de un lote con un turno 'bulk' por EAN (se renueva al pedir el siguiente).
+
+    Los items con skip(item) verdadero (ya resueltos, p.ej. restaurados del
+    checkpoint) se entregan sin turno y sin esperar.
+    """
+    ticket = None
+    try:
+        for item in items:
+            if skip is not None and skip(item):
+                if ticket is not None:
+                    shared.release(ticket)
+                    ticket = None
+                yield item
+                continue
+            if ticket is None:
+                ticket = shared.acquire(BULK, client, _timeout(BULK))
+            else:
+                ticket = shared.renew(ticket, _timeout(BULK))
+            if ticket is None:
+                _log_missed(BULK, client)
+            yield item
+    finally:
+        if ticket is not None:
+            shared.release(ticket)
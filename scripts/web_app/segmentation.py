@@ -0,0 +1,252 @@
+"""
+Sesiones ONNX de rembg: modelo, hilos y modo cuantizado configurables.
+
+Por defecto rembg usa u2net (176 MB, 320x320) con los hilos que elija
+onnxruntime (uno por núcleo en cada llamada), y en una instancia con varios hilos
+de gunicorn dos remociones de fondo a la vez se pelean por los mismos núcleos:
+
+- REMBG_MODEL: cualquier modelo de rembg ('u2net', 'u2netp' de 4.7 MB, 'silueta'
+  de 43 MB, 'isnet-general-use'...). Para fotos de producto sobre blanco los
+  ligeros suelen bastar; scripts/benchmarks/model_compare.py mide su latencia y
+  cuánto coincide su máscara con la de u2net antes de cambiarlo
+- REMBG_INTRA_OP_THREADS / REMBG_INTER_OP_THREADS: hilos de onnxruntime dentro
+  de un operador y entre operadores (0 = lo que decida onnxruntime). Con
+  SCHEDULER_SLOTS turnos a la vez, núcleos / turnos es un buen punto de partida
+- REMBG_QUANTIZED=1: la primera vez se cuantiza el modelo a int8
+  (onnxruntime.quantization.quantize_dynamic) y se guarda junto a los originales
+  en U2NET_HOME; desde entonces se carga ese. Solo para la familia U2Net
+  (QUANTIZABLE_MODELS), que comparte el pre/postproceso de 'u2net_custom'
+
+Inferencia por lotes (Batcher): con varios EANs a la vez (turnos del planificador,
+pool de hilos de la app asíncrona) cada remoción llamaba a ONNX con un lote de 1 y
+el coste fijo de cada llamada pesaba más que la propia imagen de 320x320. Un hilo
+reúne las peticiones que llegan en REMBG_BATCH_WAIT_MS (hasta REMBG_BATCH_SIZE),
+las redimensiona a la entrada del modelo, las apila en una sola llamada y devuelve
+a cada hilo su máscara; el recorte final se hace en el hilo que la pidió. Solo
+para la familia U2Net con la dimensión de lote dinámica; si el modelo rechaza un
+lote, cada petición vuelve a rembg.remove como antes.
+
+Cuántas esperar lo dice la propia cola, no los contadores de la app (que la CLI
+de lotes no lleva): mientras corre un lote se acumulan las peticiones que llegan,
+y el siguiente espera a reunir tantas como el anterior. Una petición sola no
+espera; si la concurrencia baja, un lote incompleto tras la espera ajusta el
+tamaño.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+REMBG_MODEL = os.environ.get('REMBG_MODEL', 'u2net')
+REMBG_QUANTIZED = os.environ.get('REMBG_QUANTIZED', '').lower() in ('1', 'true', 'yes')
+REMBG_INTRA_OP_THREADS = int(os.environ.get('REMBG_INTRA_OP_THREADS', '0'))
+REMBG_INTER_OP_THREADS = int(os.environ.get('REMBG_INTER_OP_THREADS', '0'))
+REMBG_BATCH_SIZE = int(os.environ.get('REMBG_BATCH_SIZE', '4'))
+REMBG_BATCH_WAIT_MS = float(os.environ.get('REMBG_BATCH_WAIT_MS', '20'))
+
+DEFAULT_MODEL = 'u2net'
+# Modelos con la misma entrada (320x320, normalización ImageNet) y salida que u2net_custom
+QUANTIZABLE_MODELS = ('u2net', 'u2netp', 'u2net_human_seg', 'silueta')
+# Preproceso de la familia U2Net en rembg
+U2NET_INPUT_SIZE = (320, 320)
+U2NET_MEAN = (0.485, 0.456, 0.406)
+U2NET_STD = (0.229, 0.224, 0.225)
+
+_quantize_lock = threading.Lock()
+
+
+def session_options(intra_op_threads=None, inter_op_threads=None):
+    """SessionOptions de onnxruntime con los hilos configurados (0 = por defecto)"""
+    import onnxruntime as ort
+
+    intra_op_threads = REMBG_INTRA_OP_THREADS if intra_op_threads is None else intra_op_threads
+    inter_op_threads = REMBG_INTER_OP_THREADS if inter_op_threads is None else inter_op_threads
+    options = ort.SessionOptions()
+    if intra_op_threads > 0:
+        options.intra_op_num_threads = intra_op_threads
+    if inter_op_threads > 0:
+        options.inter_op_num_threads = inter_op_threads
+        # inter_op_num_threads solo se usa en modo paralelo
+        if inter_op_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    return options
+
+
+def _session_class(model_name):
+    from rembg.sessions import sessions_class
+
+    for session_class in sessions_class:
+        if session_class.name() == model_name:
+            return session_class
+    raise ValueError(f"Modelo de rembg desconocido: {model_name}")
+
+
+def quantized_model_path(model_name):
+    """Ruta del modelo cuantizado a int8, creándolo la primera vez"""
+    session_class = _session_class(model_name)
+    source = session_class.download_models()
+    target = os.path.join(os.path.dirname(source), f'{model_name}.quant.onnx')
+    with _quantize_lock:
+        if not os.path.exists(target):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            started = time.perf_counter()
+            # Otro worker puede estar cuantizando a la vez: cada uno escribe su temporal
+            partial = f'{target}.{os.getpid()}.tmp'
+            quantize_dynamic(source, partial, weight_type=QuantType.QUInt8)
+            os.replace(partial, target)
+            logger.info(f"✓ Modelo {model_name} cuantizado en {(time.perf_counter() - started):.1f} s "
+                        f"({os.path.getsize(source) / 1024 / 1024:.0f} MB -> {os.path.getsize(target) / 1024 / 1024:.0f} MB)")
+    return target
+
+
+def new_session(model_name=None, quantized=None, intra_op_threads=None, inter_op_threads=None):
+    """Crea una sesión de rembg (los argumentos en None toman la configuración del entorno)"""
+    model_name = model_name or REMBG_MODEL
+    quantized = REMBG_QUANTIZED if quantized is None else quantized
+    options = session_options(intra_op_threads, inter_op_threads)
+    if quantized and model_name not in QUANTIZABLE_MODELS:
+        logger.warning(f"⚠️ El modelo {model_name} no admite el modo cuantizado, se usa el original")
+        quantized = False
+    if quantized:
+        return _session_class('u2net_custom')(model_name, options, model_path=quantized_model_path(model_name))
+    return _session_class(model_name)(model_name, options)
+
+
+def describe(model_name=None, quantized=None, intra_op_threads=None, inter_op_threads=None):
+    """Descripción corta de una configuración para logs y benchmarks"""
+    model_name = model_name or REMBG_MODEL
+    quantized = (REMBG_QUANTIZED if quantized is None else quantized) and model_name in QUANTIZABLE_MODELS
+    intra_op_threads = REMBG_INTRA_OP_THREADS if intra_op_threads is None else intra_op_threads
+    inter_op_threads = REMBG_INTER_OP_THREADS if inter_op_threads is None else inter_op_threads
+    threads = f"{intra_op_threads or 'auto'}/{inter_op_threads or 'auto'}"
+    return f"{model_name}{' int8' if quantized else ''} (hilos {threads})"
+
+
+class _Request:
+    def __init__(self, image):
+        self.image = image
+        self.mask = None
+        # True si el lote no se pudo ejecutar: quien pidió la máscara usa rembg.remove
+        self.fallback = False
+        self.done = threading.Event()
+
+
+class Batcher:
+    """Agrupa las remociones de fondo concurrentes en lotes de inferencia ONNX"""
+
+    def __init__(self, session, max_batch=None, wait_ms=None):
+        self.session = session
+        self.max_batch = REMBG_BATCH_SIZE if max_batch is None else max_batch
+        self.wait_seconds = (REMBG_BATCH_WAIT_MS if wait_ms is None else wait_ms) / 1000
+        self.stacked = self.max_batch > 1 and self._supports_batches()
+        self._queue = deque()
+        # Peticiones que reunió el último lote: las que se espera que lleguen juntas
+        self._last_depth = 0
+        self._condition = threading.Condition()
+        self._worker = None
+
+    def _supports_batches(self):
+        if getattr(self.session, 'model_name', None) not in QUANTIZABLE_MODELS:
+            return False
+        # Un modelo exportado con lote fijo tiene un entero como primera dimensión
+        batch_dim = self.session.inner_session.get_inputs()[0].shape[0]
+        return not isinstance(batch_dim, int) or batch_dim > 1
+
+    def remove(self, image):
+        """Igual que rembg.remove(image, session=...) con la máscara calculada en lote"""
+        from PIL import Image, ImageOps
+        from rembg import remove
+
+        image = ImageOps.exif_transpose(image)
+        if not self.stacked:
+            return remove(image, session=self.session)
+        request = _Request(image)
+        with self._condition:
+            self._queue.append(request)
+            self._ensure_worker()
+            self._condition.notify()
+        request.done.wait()
+        if request.fallback:
+            return remove(image, session=self.session)
+        empty = Image.new('RGBA', image.size, 0)
+        return Image.composite(image.convert('RGBA'), empty, request.mask)
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._loop, name='rembg-batcher', daemon=True)
+            self._worker.start()
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._queue:
+                self._condition.wait()
+            # Se espera a tantas como reunió el lote anterior (o las que ya hay en cola)
+            target = min(self.max_batch, max(len(self._queue), self._last_depth))
+            deadline = time.monotonic() + self.wait_seconds
+            while len(self._queue) < target:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            self._last_depth = len(self._queue)
+            return [self._queue.popleft() for _ in range(min(len(self._queue), self.max_batch))]
+
+    def _loop(self):
+        while True:
+            self._run(self._next_batch())
+
+    def _run(self, batch):
+        metrics.BG_BATCH_SIZE.observe(value=len(batch))
+        try:
+            if self.stacked:
+                started = time.perf_counter()
+                masks = self.predict([request.image for request in batch])
+                metrics.observe_stage('rembg_batch', time.perf_counter() - started)
+                for request, mask in zip(batch, masks):
+                    request.mask = mask
+            else:
+                for request in batch:
+                    request.fallback = True
+        except Exception as e:
+            logger.warning(f"⚠️ Falló la inferencia por lotes de rembg ({e}); se usa rembg.remove")
+            if len(batch) > 1:
+                # Probablemente un modelo que no acepta lotes: se deja de apilar
+                self.stacked = False
+            for request in batch:
+                request.fallback = True
+        finally:
+            for request in batch:
+                request.done.set()
+
+    def predict(self, images):
+        """Máscaras (PIL 'L', tamaño original) de varias imágenes en una sola llamada al modelo"""
+        import numpy as np
+        from PIL import Image
+
+        inputs = np.stack([_u2net_input(image) for image in images])
+        inner = self.session.inner_session
+        output = inner.run(None, {inner.get_inputs()[0].name: inputs})[0][:, 0, :, :]
+        # Igual que rembg: cada predicción se reescala a 0-1 con su mínimo y su máximo
+        low = output.min(axis=(1, 2), keepdims=True)
+        high = output.max(axis=(1, 2), keepdims=True)
+        output = (output - low) / np.maximum(high - low, 1e-6)
+        return [Image.fromarray((prediction * 255).astype(np.uint8), 'L').resize(image.size, Image.Resampling.LANCZOS)
+                for prediction, image in zip(output, images)]
+
+
+def _u2net_input(image):
+    """Tensor CHW float32 de una imagen con el preproceso de rembg para U2Net"""
+    import numpy as np
+    from PIL import Image
+
+    pixels = np.asarray(image.convert('RGB').resize(U2NET_INPUT_SIZE, Image.Resampling.LANCZOS), dtype=np.float32)
+    pixels = pixels / max(float(pixels.max()), 1e-6)
+    pixels = (pixels - np.array(U2NET_MEAN, dtype=np.float32)) / np.array(U2NET_STD, dtype=np.float32)
+    return pixels.transpose((2, 0, 1))
@@ -0,0 +1,194 @@
+"""
+Traza de tiempos por EAN y resumen por trabajo para los eventos SSE.
+
+Cada EAN de un trabajo masivo abre una traza; las etapas medidas con
+metrics.stage_timer se suman a la traza activa, de modo que los eventos
+'progress' llevan el desglose (en ms) y el evento 'complete' los p50/p95.
+
+La etapa 'queue' es lo que el EAN esperó su turno: el planificador la anota con
+record_queue_wait (desde que se pide el turno hasta que se concede) y la
+siguiente traza que se abre en ese contexto la recoge.
+
+El trabajo que corre en otro hilo en nombre del EAN (las fuentes de imagen en
+carrera) anota sus etapas en un DetachedTrace: se suman a la traza del EAN solo
+si quien lo lanzó adopta su resultado, y al cancelarlo deja de anotar.
+"""
+
+import math
+import threading
+import time
+from contextvars import ContextVar
+
+# Nombre de etapa en métricas -> nombre compacto en la traza SSE
+STAGE_NAMES = {
+    'off': 'off',
+    'gemini_text': 'web_data',
+    'serpapi': 'search',
+    'image_download': 'download',
+    'image_check': 'quality',
+    'gemini_image': 'enhance',
+    'bg_fast': 'bg_removal',
+    'rembg': 'bg_removal',
+}
+STAGE_ORDER = ('queue', 'off', 'web_data', 'search', 'download', 'quality', 'enhance', 'bg_removal')
+
+_current_trace = ContextVar('ean_trace', default=None)
+# Espera del último turno concedido en este contexto, pendiente de pasar a una traza
+_queue_wait = ContextVar('queue_wait', default=0.0)
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class EanTrace:
+    """Tiempos acumulados de un EAN (segundos internamente, ms al serializar)"""
+
+    def __init__(self, ean, queue_seconds=0.0):
+        self.ean = ean
+        self.started = time.perf_counter()
+        self.finished = None
+        self.stages = {'queue': queue_seconds}
+
+    def add(self, stage, seconds):
+        name = STAGE_NAMES.get(stage)
+        if name:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def total_seconds(self):
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return end - self.started
+
+    def as_dict(self):
+        timings = {stage: round(self.stages[stage] * 1000) for stage in STAGE_ORDER if stage in self.stages}
+        timings['total'] = round(self.total_seconds() * 1000)
+        return timings
+
+
+class DetachedTrace:
+    """Etapas de una tarea lanzada aparte, pendientes de sumarse a la traza del EAN"""
+
+    def __init__(self):
+        self.records = []
+        self._cancelled = threading.Event()
+
+    def add(self, stage, seconds):
+        if not self._cancelled.is_set():
+            self.records.append((stage, seconds))
+
+    def cancel(self):
+        """Descarta la tarea: lo que haga a partir de ahora no se anota"""
+        self._cancelled.set()
+
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+
+class JobTimings:
+    """Agrupa las trazas de un trabajo y calcula el resumen final"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.traces = []
+        self._current = None
+
+    def start(self, ean, queued_at=None):
+        """Abre una traza en el contexto actual (hilo o tarea asyncio) sin cerrar otras.
+
+        La espera es la desde queued_at (perf_counter) o, sin él, la del último
+        turno del planificador anotada con record_queue_wait.
+        """
+        pending_wait = _queue_wait.get()
+        _queue_wait.set(0.0)
+        queue_seconds = time.perf_counter() - queued_at if queued_at is not None else pending_wait
+        trace = EanTrace(ean, queue_seconds)
+        _current_trace.set(trace)
+        return trace
+
+    def finish(self, trace):
+        trace.finished = time.perf_counter()
+        self.traces.append(trace)
+        if _current_trace.get() is trace:
+            _current_trace.set(None)
+
+    def begin(self, ean, queued_at=None):
+        """Cierra la traza anterior (si la hay) y abre una nueva para el EAN (procesamiento secuencial)"""
+        self.end()
+        self._current = self.start(ean, queued_at)
+        return self._current
+
+    def resume(self, trace):
+        """Reabre en el contexto actual una traza ya cerrada (EANs que esperaron al lote de Gemini)"""
+        if trace in self.traces:
+            self.traces.remove(trace)
+        trace.finished = None
+        _current_trace.set(trace)
+        return trace
+
+    def end(self):
+        if self._current is None:
+            return
+        self.finish(self._current)
+        self._current = None
+
+    def current(self):
+        """Desglose del EAN en curso para adjuntar al evento 'progress'"""
+        return self._current.as_dict() if self._current else {}
+
+    def summary(self):
+        """p50/p95/total (ms) por etapa para el evento 'complete'"""
+        self.end()
+        summary = {'eans': len(self.traces), 'elapsed_ms': round((time.perf_counter() - self.started) * 1000)}
+        stages = {}
+        for stage in STAGE_ORDER + ('total',):
+            if stage == 'total':
+                values = sorted(trace.total_seconds() for trace in self.traces)
+            else:
+                values = sorted(trace.stages[stage] for trace in self.traces if stage in trace.stages)
+            if not values:
+                continue
+            stages[stage] = {
+                'p50': round(_percentile(values, 50) * 1000),
+                'p95': round(_percentile(values, 95) * 1000),
+                'total': round(sum(values) * 1000),
+                'count': len(values),
+            }
+        summary['stages'] = stages
+        return summary
+
+
+def clear():
+    """Descarta la traza activa (p.ej. si el cliente cierra el stream a mitad de un EAN)"""
+    _current_trace.set(None)
+
+
+def record_queue_wait(seconds):
+    """Anota la espera de un turno para la próxima traza que se abra en este contexto"""
+    _queue_wait.set(seconds)
+
+
+def detach(detached):
+    """Anota las etapas del contexto actual en detached en lugar de en la traza del EAN"""
+    _current_trace.set(detached)
+
+
+def adopt(detached):
+    """Suma a la traza activa las etapas de una tarea aparte cuyo resultado se usa"""
+    for stage, seconds in detached.records:
+        record(stage, seconds)
+
+
+def cancelled():
+    """True dentro de una tarea aparte que ya se canceló (su resultado ya no interesa)"""
+    trace = _current_trace.get()
+    return isinstance(trace, DetachedTrace) and trace.cancelled()
+
+
+def record(stage, seconds):
+    """Suma la duración de una etapa a la traza activa (si existe)"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
@@ -0,0 +1,46 @@
+"""Los módulos de la app web se importan como en producción: desde scripts/web_app"""
+
+import os
+import sys
+
+import pytest
+
+WEB_APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts', 'web_app')
+if WEB_APP_DIR not in sys.path:
+    sys.path.insert(0, WEB_APP_DIR)
+
+
+def _product_image(size=(1000, 1000), background=(255, 255, 255), box=(0.2, 0.2, 0.8, 0.8),
+                   color=(200, 40, 30), clutter=False):
+    """Imagen PIL de un 'producto' rectangular sobre un fondo liso (o lleno de ruido con clutter)"""
+    import numpy as np
+    from PIL import Image
+
+    width, height = size
+    if clutter:
+        pixels = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    else:
+        pixels = np.empty((height, width, 3), dtype=np.uint8)
+        pixels[:] = background
+    left, top, right, bottom = (round(box[0] * width), round(box[1] * height),
+                                round(box[2] * width), round(box[3] * height))
+    pixels[top:bottom, left:right] = color
+    return Image.fromarray(pixels, 'RGB')
+
+
+def _encode(image, image_format='PNG'):
+    from io import BytesIO
+
+    buffer = BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def product_image():
+    return _product_image
+
+
+@pytest.fixture
+def encode_image():
+    return _encode
@@ -0,0 +1,126 @@
+import os
+import time
+
+import pytest
+
+import artifacts
+import metrics
+
+JOB_ID = 'a' * 32
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = artifacts.ArtifactStore(directory=str(tmp_path), quota_bytes=1000, ttl_seconds=3600)
+    # Sin janitor en segundo plano: cada prueba llama a enforce cuando toca
+    store.ensure_janitor = lambda: None
+    return store
+
+
+def test_put_and_open(store):
+    name = store.put(b'x' * 100, 'imagenes')
+    assert artifacts.ARTIFACT_NAME_PATTERN.match(name)
+    with open(store.open_path(name), 'rb') as f:
+        assert f.read() == b'x' * 100
+    assert store.open_path('../secreto.zip') is None
+
+
+def test_put_rejects_data_over_quota(store):
+    with pytest.raises(ValueError):
+        store.put(b'x' * 1001, 'imagenes')
+
+
+def test_put_evicts_least_recently_used(store):
+    first = store.put(b'x' * 400, 'a')
+    second = store.put(b'x' * 400, 'b')
+    past = time.time() - 60
+    os.utime(os.path.join(store.directory, first), (past - 10, past))
+    os.utime(os.path.join(store.directory, second), (past, past))
+
+    store.put(b'x' * 400, 'c')
+    assert store.open_path(first) is None
+    assert store.open_path(second) is not None
+
+
+def test_put_item_enforces_quota(store):
+    name = store.put(b'x' * 700, 'imagenes')
+    past = time.time() - 60
+    os.utime(os.path.join(store.directory, name), (past, past))
+
+    store.put_item(JOB_ID, '1.png', b'y' * 500)
+    assert store.open_path(name) is None
+    assert store.item_path(JOB_ID, '1.png') is not None
+
+
+def test_writes_under_quota_do_not_rescan_the_store(store, monkeypatch):
+    scans = []
+    entries = store._entries
+    monkeypatch.setattr(store, '_entries', lambda: scans.append(1) or entries())
+    for index in range(5):
+        store.put_item(JOB_ID, f'{index}.png', b'y' * 100)
+    # Solo el primer recorrido para conocer el total
+    assert len(scans) == 1
+    store.put(b'x' * 600, 'imagenes')
+    assert len(scans) == 2
+
+
+def test_quota_never_evicts_the_job_being_written(store):
+    other = 'b' * 32
+    store.put_item(other, '1.png', b'z' * 300)
+    past = time.time() - 60
+    os.utime(os.path.join(store.items_directory, other), (past, past))
+    store.put_item(JOB_ID, '1.png', b'y' * 600)
+
+    # Se elimina el otro trabajo, no el que escribe
+    store.put_item(JOB_ID, '2.png', b'y' * 300)
+    assert store.item_path(other, '1.png') is None
+    assert store.item_path(JOB_ID, '1.png') is not None
+
+    # Sin nada más que eliminar: la escritura falla y lo ya publicado sigue ahí
+    with pytest.raises(ValueError):
+        store.put_item(JOB_ID, '3.png', b'y' * 300)
+    assert store.item_path(JOB_ID, '1.png') is not None
+    assert store.enforce() == 900
+
+
+def test_final_zip_keeps_the_images_of_its_job(store):
+    store.put_item(JOB_ID, '1.png', b'y' * 600)
+    with pytest.raises(ValueError):
+        store.put(b'x' * 600, 'imagenes', JOB_ID)
+    assert store.item_path(JOB_ID, '1.png') is not None
+    # Sin job_id las imágenes son un artefacto más
+    assert store.put(b'x' * 600, 'imagenes')
+    assert store.item_path(JOB_ID, '1.png') is None
+
+
+def test_put_item_counts_only_the_difference_when_replacing(store):
+    store.enforce()
+    before = metrics.ARTIFACT_BYTES.get()
+    store.put_item(JOB_ID, '1.png', b'y' * 300)
+    store.put_item(JOB_ID, '1.png', b'y' * 200)
+    assert metrics.ARTIFACT_BYTES.get() - before == 200
+    assert store.enforce() == 200
+
+
+def test_item_names_are_validated(store):
+    with pytest.raises(ValueError):
+        store.put_item(JOB_ID, '../1.png', b'y')
+    with pytest.raises(ValueError):
+        store.put_item('no-es-un-id', '1.png', b'y')
+    assert store.item_path(JOB_ID, 'falta.png') is None
+
+
+def test_list_items_skips_thumbnails(store):
+    store.put_item(JOB_ID, '1.png', b'y')
+    store.put_item(JOB_ID, '1_thumb.webp', b'y')
+    assert [name for name, _ in store.list_items(JOB_ID)] == ['1.png']
+
+
+def test_enforce_applies_ttl(tmp_path):
+    store = artifacts.ArtifactStore(directory=str(tmp_path), quota_bytes=1000, ttl_seconds=1)
+    store.ensure_janitor = lambda: None
+    name = store.put(b'x' * 10, 'imagenes')
+    past = time.time() - 5
+    os.utime(os.path.join(store.directory, name), (past, past))
+    assert store.enforce() == 0
+    assert not os.path.exists(os.path.join(store.directory, name))
@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+import async_app  # noqa: E402
+from aiohttp import web  # noqa: E402
+from aiohttp.test_utils import TestClient, TestServer  # noqa: E402
+
+
+def streaming_wsgi(closed):
+    def application(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/event-stream'), ('Content-Length', '999')])
+
+        def generate():
+            try:
+                for index in range(3):
+                    yield f'data: {index}\n\n'.encode()
+                    time.sleep(0.2)
+            finally:
+                closed.append(True)
+        return generate()
+    return application
+
+
+def test_flask_fallback_streams_chunks_as_they_are_produced(monkeypatch):
+    closed = []
+    monkeypatch.setattr(async_app.flask_module, 'app', streaming_wsgi(closed))
+
+    async def run():
+        application = web.Application()
+        application.router.add_route('*', '/{tail:.*}', async_app.flask_fallback)
+        async with TestClient(TestServer(application)) as client:
+            started = time.perf_counter()
+            response = await client.get('/stream')
+            first = await response.content.readuntil(b'\n\n')
+            first_at = time.perf_counter() - started
+            rest = await response.read()
+            return response, first, first_at, rest
+
+    response, first, first_at, rest = asyncio.run(run())
+    assert response.headers['Content-Type'] == 'text/event-stream'
+    # El primer evento llega antes de que el generador termine (0.6 s)
+    assert first == b'data: 0\n\n' and first_at < 0.4
+    assert rest == b'data: 1\n\ndata: 2\n\n'
+    assert closed == [True]
@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+pytest.importorskip('flask')
+
+import batch_cli
+
+
+def test_pending_batches_survive_a_restart(tmp_path):
+    path = str(tmp_path / '.checkpoints' / batch_cli.BATCH_STATE_FILENAME)
+    batches = batch_cli.PendingBatches(path)
+    batches.add('batches/1', ['a', 'b'], {'a': {'score': 0.4}, 'b': None})
+    # 'c' reutiliza el resultado de 'a' (en un lote); 'd' el de 'z' (que no espera a ninguno)
+    assert batches.add_duplicates({'c': 'a', 'd': 'z'}) == ['d']
+
+    restored = batch_cli.PendingBatches(path)
+    assert list(restored.snapshot()) == ['batches/1']
+    assert restored.eans() == {'a', 'b', 'c'}
+    assert restored.duplicates_of('a') == ['c']
+    assert restored.quality['a'] == {'score': 0.4}
+
+    restored.remove('batches/1')
+    assert restored.eans() == set() and not restored.duplicates
+    assert not os.path.exists(path)
@@ -0,0 +1,75 @@
+import base64
+import io
+import os
+import time
+import zipfile
+
+import checkpoints
+
+PNG = b'\x89PNG\r\n\x1a\nfake'
+
+
+def image(name):
+    return {'filename': name, 'data': base64.b64encode(PNG).decode('utf-8')}
+
+
+def test_valid_batch_id():
+    assert checkpoints.valid_batch_id(checkpoints.new_batch_id())
+    assert not checkpoints.valid_batch_id('../etc')
+    assert not checkpoints.valid_batch_id('')
+
+
+def test_failed_checkpoints_are_not_done(tmp_path):
+    checkpoint = checkpoints.BatchCheckpoint('lote1234', root=str(tmp_path))
+    checkpoint.save('1', True, 'ok', {'ean': '1'})
+    checkpoint.save('2', False, 'sin datos', {'ean': '2'})
+
+    assert checkpoint.done('1')['message'] == 'ok'
+    assert checkpoint.load('2')['success'] is False
+    assert checkpoint.done('2') is None
+    assert checkpoint.done('3') is None
+    assert checkpoint.completed_count() == 1
+
+
+def test_unreadable_checkpoint_is_reprocessed(tmp_path):
+    checkpoint = checkpoints.BatchCheckpoint('lote1234', root=str(tmp_path))
+    with open(os.path.join(checkpoint.directory, '1.json'), 'w') as f:
+        f.write('{roto')
+    assert checkpoint.load('1') is None
+    assert checkpoint.completed_count() == 0
+
+
+def test_assemble_returns_image_paths_in_order(tmp_path):
+    checkpoint = checkpoints.BatchCheckpoint('lote1234', root=str(tmp_path))
+    checkpoint.save('2', True, 'ok', {'ean': '2'}, image('2.png'))
+    checkpoint.save('1', True, 'ok', {'ean': '1'})
+
+    products, images = checkpoint.assemble(['1', '2', '3'])
+    assert [product['ean'] for product in products] == ['1', '2']
+    assert images == [{'filename': '2.png', 'path': os.path.join(checkpoint.directory, '2.png')}]
+    with open(images[0]['path'], 'rb') as f:
+        assert f.read() == PNG
+
+
+def test_build_zip_streams_checkpoint_images_from_disk(tmp_path):
+    import app
+
+    checkpoint = checkpoints.BatchCheckpoint('lote1234', root=str(tmp_path))
+    checkpoint.save('1', True, 'ok', {'ean': '1'}, image('1.png'))
+    _, images = checkpoint.assemble(['1'])
+
+    zip_data = app.build_zip(images + [image('extra.png')], unfinished=['9'])
+    with zipfile.ZipFile(io.BytesIO(zip_data)) as archive:
+        assert archive.read('imagenes/1.png') == PNG
+        assert archive.read('imagenes/extra.png') == PNG
+        assert archive.read('eans_pendientes.txt') == b'9\n'
+
+
+def test_purge_expired(tmp_path):
+    old = checkpoints.BatchCheckpoint('viejo123', root=str(tmp_path))
+    checkpoints.BatchCheckpoint('nuevo123', root=str(tmp_path))
+    past = time.time() - 3 * 3600
+    os.utime(old.directory, (past, past))
+
+    assert checkpoints.purge_expired(root=str(tmp_path), ttl_hours=1) == 1
+    assert sorted(os.listdir(tmp_path)) == ['nuevo123']
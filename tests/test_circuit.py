@@ -0,0 +1,119 @@
+import json
+
+import pytest
+
+import circuit
+import metrics
+from circuit import CircuitBreaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Reloj monotónico controlado por el test"""
+    now = [1000.0]
+    monkeypatch.setattr(circuit.time, 'monotonic', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def breakers(monkeypatch):
+    """Breakers nuevos para los proveedores, sin arrastrar el estado de otros tests"""
+    fresh = {provider: CircuitBreaker(provider, window=10, min_calls=4, failure_rate=0.5, cooldown=30)
+             for provider in circuit.PROVIDER_LABELS}
+    monkeypatch.setattr(circuit, '_breakers', fresh)
+    return fresh
+
+
+def test_failures_count_timeouts_5xx_and_429():
+    assert circuit.is_failure(None)
+    assert circuit.is_failure(503) and circuit.is_failure(429)
+    assert not circuit.is_failure(200) and not circuit.is_failure(404)
+
+
+def test_opens_only_after_min_calls_at_failure_rate(clock):
+    breaker = CircuitBreaker('serpapi', window=10, min_calls=4, failure_rate=0.5, cooldown=30)
+    for status in (500, 500, 500):
+        breaker.record(status)
+    # 3 fallos de 3 no bastan: hacen falta min_calls llamadas
+    assert breaker.current_state() == circuit.CLOSED and breaker.allow()
+    breaker.record(200)
+    assert breaker.current_state() == circuit.OPEN
+    assert not breaker.allow()
+
+
+def test_successes_keep_it_closed(clock):
+    breaker = CircuitBreaker('serpapi', window=10, min_calls=4, failure_rate=0.5, cooldown=30)
+    for status in (500, 200, 200, 200, 500, 200, 200):
+        breaker.record(status)
+    assert breaker.current_state() == circuit.CLOSED
+
+
+def test_half_open_lets_a_single_probe_through(clock):
+    breaker = CircuitBreaker('serpapi', window=10, min_calls=2, failure_rate=0.5, cooldown=30)
+    breaker.record(None)
+    breaker.record(None)
+    clock[0] += 29
+    assert not breaker.allow()
+    clock[0] += 1
+    assert breaker.current_state() == circuit.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    breaker.record(200)
+    assert breaker.current_state() == circuit.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_probe_reopens(clock):
+    breaker = CircuitBreaker('serpapi', window=10, min_calls=2, failure_rate=0.5, cooldown=30)
+    breaker.record(503)
+    breaker.record(503)
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.record(503)
+    assert breaker.current_state() == circuit.OPEN
+    clock[0] += 10
+    assert not breaker.allow()
+
+
+def test_lost_probe_does_not_block_forever(clock):
+    breaker = CircuitBreaker('serpapi', window=10, min_calls=2, failure_rate=0.5, cooldown=30)
+    breaker.record(None)
+    breaker.record(None)
+    clock[0] += 30
+    assert breaker.allow()
+    # La prueba nunca registra resultado (p.ej. el hilo murió)
+    clock[0] += 29
+    assert not breaker.allow()
+    clock[0] += 1
+    assert breaker.allow()
+
+
+def test_check_raises_and_record_upstream_feeds_breaker(clock, breakers):
+    for _ in range(4):
+        metrics.record_upstream_status('gemini_image', None)
+    with pytest.raises(circuit.CircuitOpenError) as error:
+        circuit.check('gemini_image')
+    assert error.value.provider == 'gemini_image'
+    assert 'Gemini (imágenes)' in str(error.value)
+    # Otros proveedores y los hosts de imágenes no se ven afectados
+    circuit.check('serpapi')
+    circuit.check('images')
+    circuit.record('images', None)
+
+
+def test_announce_reports_open_and_recovered(clock, breakers):
+    def events():
+        yield 'data: 1\n\n'
+        for _ in range(4):
+            circuit.record('serpapi', 500)
+        yield 'data: 2\n\n'
+        clock[0] += 30
+        circuit.check('serpapi')
+        circuit.record('serpapi', 200)
+        yield 'data: 3\n\n'
+
+    stream = list(circuit.announce(events()))
+    statuses = [json.loads(chunk[len('data: '):]) for chunk in stream if 'provider_status' in chunk]
+    assert [(status['provider'], status['state']) for status in statuses] == [('serpapi', 'open'), ('serpapi', 'closed')]
+    assert stream.index('data: 3\n\n') > stream.index(next(chunk for chunk in stream if '"closed"' in chunk))
@@ -0,0 +1,86 @@
+import contextvars
+
+import pytest
+
+import deadlines
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Reloj monotónico controlado por el test; el deadline se quita al terminar"""
+    now = [500.0]
+    monkeypatch.setattr(deadlines.time, 'monotonic', lambda: now[0])
+    yield now
+    deadlines.clear()
+
+
+def test_without_deadline_nothing_is_limited():
+    deadlines.clear()
+    assert deadlines.current() is None
+    assert deadlines.timeout(15) == 15
+    assert deadlines.allows('gemini_image') and not deadlines.exhausted()
+
+
+def test_reserve_is_kept_for_finalizing(clock):
+    deadline = deadlines.start(100, reserve=20)
+    assert deadline.remaining() == 80
+    clock[0] += 90
+    assert deadline.remaining() == 0
+
+
+def test_timeout_is_capped_at_remaining_budget(clock):
+    deadlines.start(100, reserve=20)
+    assert deadlines.timeout(15) == 15
+    clock[0] += 70
+    assert deadlines.timeout(15) == 10
+    clock[0] += 9.5
+    # Menos de MIN_CALL_TIMEOUT: no tiene sentido empezar la llamada
+    with pytest.raises(deadlines.DeadlineExceeded):
+        deadlines.timeout(15)
+
+
+def test_stages_stop_in_order_of_cost(clock):
+    deadlines.start(100, reserve=20)
+    clock[0] += 70
+    # Quedan 10 s: una imagen de Gemini (15 s) ya no cabe, un EAN nuevo (10 s) sí
+    assert not deadlines.allows('gemini_image')
+    assert deadlines.allows('gemini_text') and deadlines.allows('rembg')
+    assert not deadlines.exhausted()
+    clock[0] += 5
+    assert deadlines.exhausted()
+    assert deadlines.allows('rembg')
+    # Una etapa sin mínimo propio usa MIN_CALL_TIMEOUT
+    assert deadlines.allows('otra')
+
+
+def test_bounded_opens_and_clears_deadline(clock):
+    seen = []
+
+    def events():
+        seen.append(deadlines.current().remaining())
+        yield 'data: 1\n\n'
+
+    assert list(deadlines.bounded(events(), seconds=60)) == ['data: 1\n\n']
+    assert seen == [60 - deadlines.JOB_FINALIZE_RESERVE_SECONDS]
+    assert deadlines.current() is None
+
+
+def test_deadline_is_per_context(clock):
+    deadlines.clear()
+    inner = contextvars.copy_context()
+    inner.run(deadlines.start, 100, 20)
+    assert inner.run(deadlines.current) is not None
+    assert deadlines.current() is None
+
+
+def test_finalize_skips_background_removal_without_budget(clock, monkeypatch):
+    pytest.importorskip('flask')
+    import app
+
+    calls = []
+    monkeypatch.setattr(app, 'remove_white_background', lambda data: calls.append(data) or {'success': False})
+    deadlines.start(100, reserve=20)
+    clock[0] += 78
+    result = app.finalize_product_image('1', 'imagen', 'ok')
+    assert result['success'] and result['image_data'] == 'imagen'
+    assert calls == []
@@ -0,0 +1,148 @@
+import json
+import time
+
+import pytest
+import requests
+
+import gemini_batch
+
+
+def request_of(size):
+    return {'contents': [{'parts': [{'text': 'x' * size}]}]}
+
+
+def operation(state, responses=None):
+    result = {'metadata': {'state': state}, 'done': state in gemini_batch.TERMINAL_STATES}
+    if responses is not None:
+        result['response'] = {'inlinedResponses': {'inlinedResponses': [
+            {'metadata': {'key': key}, **body} for key, body in responses.items()]}}
+    return result
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """Sustituye las llamadas HTTP: states es {nombre: [operación de cada consulta]}"""
+    calls = {'get': [], 'cancel': [], 'sleep': []}
+    states = {}
+
+    def get_operation(base_url, name, headers):
+        calls['get'].append(name)
+        pending = states[name]
+        step = pending.pop(0) if len(pending) > 1 else pending[0]
+        if isinstance(step, Exception):
+            raise step
+        return step
+
+    def cancel_batch(base_url, name, headers):
+        calls['cancel'].append(name)
+        return True
+
+    monkeypatch.setattr(gemini_batch, 'get_operation', get_operation)
+    monkeypatch.setattr(gemini_batch, 'cancel_batch', cancel_batch)
+    monkeypatch.setattr(gemini_batch.time, 'sleep', calls['sleep'].append)
+    return states, calls
+
+
+def done_events(events):
+    return {event['name']: event for event in events if event['type'] == 'batch_done'}
+
+
+def test_split_requests_respects_max_bytes():
+    items = [(str(index), request_of(100)) for index in range(5)]
+    size = len(json.dumps(request_of(100)))
+    groups = gemini_batch.split_requests(items, 2 * size)
+    assert [[key for key, _ in group] for group in groups] == [['0', '1'], ['2', '3'], ['4']]
+    # Una petición más grande que el máximo va sola, no se descarta
+    groups = gemini_batch.split_requests([('big', request_of(1000)), ('small', request_of(1))], 100)
+    assert [[key for key, _ in group] for group in groups] == [['big'], ['small']]
+
+
+def test_payload_and_responses_map_by_key():
+    payload = gemini_batch.build_batch_payload([('a', request_of(1)), ('b', request_of(2))], 'catalogo-1')
+    requests_ = payload['batch']['input_config']['requests']['requests']
+    assert payload['batch']['display_name'] == 'catalogo-1'
+    assert [item['metadata']['key'] for item in requests_] == ['a', 'b']
+    assert requests_[1]['request'] == request_of(2)
+
+    # Las respuestas llegan en cualquier orden y se asocian por clave
+    finished = operation(gemini_batch.SUCCEEDED, {'b': {'response': {'ok': 'b'}},
+                                                  'a': {'error': {'message': 'bloqueada'}}})
+    assert gemini_batch.inlined_responses(finished) == {'a': (None, {'message': 'bloqueada'}),
+                                                        'b': ({'ok': 'b'}, None)}
+
+
+def test_run_batches_collects_succeeded_batch(gemini):
+    states, calls = gemini
+    running = operation('BATCH_STATE_RUNNING')
+    states['batches/1'] = [running, running, operation(gemini_batch.SUCCEEDED, {'a': {'response': {'ok': 'a'}}})]
+    pending = {'batches/1': {'keys': ['a', 'b'], 'submitted_at': time.time()}}
+
+    events = list(gemini_batch.run_batches('http://gemini', {}, pending, poll_seconds=5, timeout_seconds=60))
+    done = done_events(events)['batches/1']
+    assert done['state'] == gemini_batch.SUCCEEDED
+    assert done['results']['a'] == ({'ok': 'a'}, None)
+    # Una clave sin respuesta se informa como error, no se pierde
+    assert done['results']['b'][0] is None and 'SUCCEEDED' in done['results']['b'][1]['message']
+    assert calls['get'] == ['batches/1'] * 3 and calls['sleep'] == [5, 5]
+    assert events[-1] == {'type': 'batch_status', 'pending_batches': 0, 'completed': 2, 'total': 2,
+                          'elapsed_seconds': 0}
+    assert not calls['cancel']
+
+
+@pytest.mark.parametrize('state', ['BATCH_STATE_FAILED', 'BATCH_STATE_EXPIRED'])
+def test_failed_and_expired_batches_report_every_key(gemini, state):
+    states, calls = gemini
+    states['batches/1'] = [operation(state)]
+    pending = {'batches/1': {'keys': ['a', 'b'], 'submitted_at': time.time()}}
+
+    done = done_events(gemini_batch.run_batches('http://gemini', {}, pending, timeout_seconds=60))['batches/1']
+    assert done['state'] == state
+    assert all(response is None and state in error['message'] for response, error in done['results'].values())
+    assert not calls['cancel'] and not calls['sleep']
+
+
+def test_missing_batch_ends_and_transient_errors_are_retried(gemini):
+    states, calls = gemini
+    not_found = requests.Response()
+    not_found.status_code = 404
+    server_error = requests.Response()
+    server_error.status_code = 503
+    states['batches/1'] = [requests.exceptions.HTTPError(response=not_found)]
+    states['batches/2'] = [requests.exceptions.HTTPError(response=server_error),
+                           requests.exceptions.ConnectionError('reset'),
+                           operation(gemini_batch.SUCCEEDED, {'c': {'response': {}}})]
+    pending = {'batches/1': {'keys': ['a'], 'submitted_at': time.time()},
+               'batches/2': {'keys': ['c'], 'submitted_at': time.time()}}
+
+    done = done_events(gemini_batch.run_batches('http://gemini', {}, pending, poll_seconds=1, timeout_seconds=60))
+    assert done['batches/1']['state'] == gemini_batch.NOT_FOUND
+    assert done['batches/2']['state'] == gemini_batch.SUCCEEDED
+    assert calls['get'].count('batches/2') == 3
+
+
+def test_batch_past_timeout_is_cancelled(gemini):
+    states, calls = gemini
+    states['batches/old'] = [operation('BATCH_STATE_RUNNING')]
+    states['batches/new'] = [operation('BATCH_STATE_RUNNING'), operation(gemini_batch.SUCCEEDED, {})]
+    pending = {'batches/old': {'keys': ['a'], 'submitted_at': time.time() - 120},
+               'batches/new': {'keys': ['b'], 'submitted_at': time.time()}}
+
+    events = list(gemini_batch.run_batches('http://gemini', {}, pending, poll_seconds=30, timeout_seconds=60))
+    done = done_events(events)
+    assert calls['cancel'] == ['batches/old']
+    assert done['batches/old']['state'] == gemini_batch.TIMED_OUT
+    assert done['batches/old']['results']['a'][0] is None
+    assert done['batches/new']['state'] == gemini_batch.SUCCEEDED
+    # El lote vencido se informa en la primera ronda, sin esperar al siguiente sondeo
+    assert events[0]['type'] == 'batch_done' and events[0]['name'] == 'batches/old'
+
+
+def test_sleep_is_capped_at_nearest_timeout(gemini):
+    states, calls = gemini
+    states['batches/1'] = [operation('BATCH_STATE_RUNNING')]
+    pending = {'batches/1': {'keys': ['a'], 'submitted_at': time.time() - 55}}
+
+    events = gemini_batch.run_batches('http://gemini', {}, pending, poll_seconds=30, timeout_seconds=60)
+    assert next(events)['type'] == 'batch_status'
+    next(events, None)
+    assert len(calls['sleep']) == 1 and calls['sleep'][0] <= 5
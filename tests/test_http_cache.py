@@ -0,0 +1,128 @@
+import json
+
+import pytest
+
+import http_cache
+import memory
+import metrics
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = http_cache.CachedHeaders((name.lower(), value) for name, value in (headers or {}).items())
+
+    def json(self):
+        return json.loads(self.content)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """Caché vacía de 1 KB; el gauge de bytes se deja como estaba"""
+    fresh = http_cache.HttpCache(max_bytes=1024)
+    monkeypatch.setattr(http_cache, '_store', fresh)
+    for cache in ('off', 'image'):
+        monkeypatch.setitem(metrics.HTTP_CACHE_BYTES._values, (cache,), 0)
+    return fresh
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(http_cache.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def sender(*responses):
+    """send() que devuelve las respuestas en orden y anota las cabeceras condicionales"""
+    sent = []
+    pending = list(responses)
+
+    def send(conditional):
+        sent.append(conditional)
+        return pending.pop(0)
+    return send, sent
+
+
+def test_fresh_entry_is_served_without_network(store, clock):
+    send, sent = sender(FakeResponse(200, b'{"a": 1}', {'ETag': '"v1"'}))
+    assert http_cache.cached_get('off', 'http://off/1', send).status_code == 200
+    response = http_cache.cached_get('off', 'http://off/1', send)
+    assert response.json() == {'a': 1}
+    assert response.headers.get('ETag') == '"v1"'
+    assert sent == [{}]
+
+
+def test_stale_entry_is_revalidated(store, clock):
+    send, sent = sender(FakeResponse(200, b'{"a": 1}', {'ETag': '"v1"', 'Last-Modified': 'ayer'}),
+                        FakeResponse(304, headers={'ETag': '"v2"'}),
+                        FakeResponse(200, b'{"a": 2}', {'ETag': '"v3"'}))
+    http_cache.cached_get('off', 'http://off/1', send)
+    clock[0] += http_cache.OFF_CACHE_TTL_SECONDS + 1
+    # 304: se sirve el cuerpo guardado y se renueva el TTL
+    assert http_cache.cached_get('off', 'http://off/1', send).json() == {'a': 1}
+    assert sent[1] == {'If-None-Match': '"v1"', 'If-Modified-Since': 'ayer'}
+    assert http_cache.cached_get('off', 'http://off/1', send).json() == {'a': 1}
+    assert len(sent) == 2
+
+    clock[0] += http_cache.OFF_CACHE_TTL_SECONDS + 1
+    assert http_cache.cached_get('off', 'http://off/1', send).json() == {'a': 2}
+    assert sent[2]['If-None-Match'] == '"v2"'
+
+
+def test_no_store_and_errors_are_not_cached(store, clock):
+    send, sent = sender(FakeResponse(200, b'{}', {'Cache-Control': 'no-store'}), FakeResponse(500, b'error'),
+                        FakeResponse(200, b'{}'))
+    for _ in range(3):
+        http_cache.cached_get('off', 'http://off/1', send)
+    assert len(sent) == 3 and sent[2] == {}
+
+
+def test_images_are_not_cached_by_default(store, clock):
+    assert not http_cache.HTTP_CACHE_IMAGES and not http_cache.enabled('image')
+    send, sent = sender(FakeResponse(200, b'png'), FakeResponse(200, b'png'))
+    http_cache.cached_get('image', 'http://img/1.png', send)
+    http_cache.cached_get('image', 'http://img/1.png', send)
+    assert len(sent) == 2 and store.size_bytes() == 0
+
+
+def test_images_cached_when_enabled(store, clock, monkeypatch):
+    monkeypatch.setattr(http_cache, 'ENABLED_CACHES', ('off', 'image'))
+    send, sent = sender(FakeResponse(200, b'png'))
+    http_cache.cached_get('image', 'http://img/1.png', send)
+    assert http_cache.cached_get('image', 'http://img/1.png', send).content == b'png'
+    assert metrics.HTTP_CACHE_BYTES.get('image') == 3
+
+
+def test_lru_limit_and_byte_accounting(store, clock):
+    for index in range(3):
+        send, _ = sender(FakeResponse(200, b'x' * 400))
+        http_cache.cached_get('off', f'http://off/{index}', send)
+    # 3 x 400 > 1024: se descarta la más antigua
+    assert http_cache.lookup('off', 'http://off/0') is None
+    assert http_cache.lookup('off', 'http://off/2') is not None
+    assert store.size_bytes() == 800
+    assert metrics.HTTP_CACHE_BYTES.get('off') == 800
+
+    # Reemplazar una entrada no cuenta sus bytes dos veces
+    http_cache.resolve('off', 'http://off/2', None, 200, b'x' * 100, {})
+    assert store.size_bytes() == 500 and metrics.HTTP_CACHE_BYTES.get('off') == 500
+
+    # Una respuesta mayor que toda la caché no desplaza a las demás
+    http_cache.resolve('off', 'http://off/big', None, 200, b'x' * 2000, {})
+    assert store.size_bytes() == 500
+
+
+def test_cache_bytes_are_reported_in_memory_status(store, clock):
+    http_cache.resolve('off', 'http://off/1', None, 200, b'x' * 300, {})
+    assert memory.status()['held_mb']['http_cache'] == round(300 / memory.MB, 1)
+    assert 'ean_http_cache_bytes{cache="off"} 300' in metrics.render()
+
+
+def test_disabled_cache(store, clock, monkeypatch):
+    monkeypatch.setattr(store, 'max_bytes', 0)
+    send, sent = sender(FakeResponse(200, b'{}'), FakeResponse(200, b'{}'))
+    http_cache.cached_get('off', 'http://off/1', send)
+    http_cache.cached_get('off', 'http://off/1', send)
+    assert len(sent) == 2
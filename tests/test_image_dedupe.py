@@ -0,0 +1,103 @@
+import base64
+import contextvars
+import random
+import time
+
+import deadlines
+import image_dedupe
+from image_dedupe import DedupeIndex
+
+GREY = bytes([128] * 48)
+
+
+def flip(bits, *positions):
+    for position in positions:
+        bits ^= 1 << position
+    return bits
+
+
+def test_bands_cover_all_bits():
+    widths = [bin(mask).count('1') for _, mask in image_dedupe.bands(6)]
+    assert len(widths) == 7 and sum(widths) == 64
+    assert max(widths) - min(widths) <= 1
+
+
+def test_claim_finds_near_duplicate():
+    index = DedupeIndex(max_distance=6, max_color_diff=24)
+    owner, is_owner = index.claim((0x0123456789ABCDEF, GREY), '1')
+    assert is_owner
+    # 6 bits distintos repartidos por todas las bandas: sigue siendo duplicado
+    entry, is_owner = index.claim((flip(0x0123456789ABCDEF, 0, 10, 20, 30, 40, 50), GREY), '2')
+    assert entry is owner and not is_owner
+    _, is_owner = index.claim((flip(0x0123456789ABCDEF, 0, 10, 20, 30, 40, 50, 60), GREY), '3')
+    assert is_owner
+
+
+def test_color_signature_separates_flavours():
+    index = DedupeIndex(max_distance=6, max_color_diff=24)
+    index.claim((42, GREY), '1')
+    _, is_owner = index.claim((42, bytes([200] * 48)), '2')
+    assert is_owner
+
+
+def test_bucketed_lookup_matches_linear_scan():
+    rng = random.Random(1)
+    index = DedupeIndex(max_distance=6, max_color_diff=255)
+    hashes = [rng.getrandbits(64) for _ in range(300)]
+    for position, bits in enumerate(hashes):
+        index.claim((bits, GREY), str(position))
+    for _ in range(200):
+        base = rng.choice(hashes)
+        query = flip(base, *rng.sample(range(64), rng.randint(0, 8)))
+        expected = min((image_dedupe.hamming(bits, query), bits) for bits in hashes)
+        found = index._find((query, GREY))
+        if expected[0] <= 6:
+            assert found is not None and image_dedupe.hamming(found.image_hash[0], query) == expected[0]
+        else:
+            assert found is None
+
+
+def test_failed_owner_is_removed_from_buckets():
+    index = DedupeIndex(max_distance=6)
+    entry, _ = index.claim((7, GREY), '1')
+    index.resolve(entry, {'success': False})
+    assert index._buckets == {}
+    _, is_owner = index.claim((7, GREY), '2')
+    assert is_owner
+
+
+def test_eviction_drops_oldest_from_buckets():
+    index = DedupeIndex(max_distance=6, max_bytes=10)
+    first, _ = index.claim((0, GREY), '1')
+    index.resolve(first, {'success': True, 'image_data': 'x' * 8})
+    second, _ = index.claim(((1 << 64) - 1, GREY), '2')
+    index.resolve(second, {'success': True, 'image_data': 'x' * 8})
+    assert list(index._entries) == [((1 << 64) - 1, GREY)]
+    assert all(bucket == {((1 << 64) - 1, GREY)} for bucket in index._buckets.values())
+
+
+def test_wait_is_capped_by_job_deadline():
+    entry = image_dedupe.DedupeEntry((1, GREY), '1')
+
+    def run():
+        deadlines.start(0.1, reserve=0)
+        started = time.perf_counter()
+        assert entry.wait() is None
+        return time.perf_counter() - started
+
+    assert contextvars.copy_context().run(run) < 1.0
+
+
+def test_shared_result_and_fingerprint(product_image, encode_image):
+    data = base64.b64encode(encode_image(product_image())).decode('utf-8')
+    same = base64.b64encode(encode_image(product_image(), 'JPEG')).decode('utf-8')
+    first, second = image_dedupe.image_hash(data), image_dedupe.image_hash(same)
+    assert image_dedupe.hamming(first[0], second[0]) <= image_dedupe.DEDUPE_MAX_DISTANCE
+    assert image_dedupe.image_hash('no es una imagen') is None
+
+    index = DedupeIndex()
+    entry, _ = index.claim(first, '1')
+    index.resolve(entry, {'success': True, 'image_data': data, 'filename': '1.png', 'message': 'ok'})
+    duplicate, _ = index.claim(second, '2')
+    shared = image_dedupe.shared_result(duplicate, '2')
+    assert shared['filename'] == '2.png' and shared['duplicate_of'] == '1'
@@ -0,0 +1,95 @@
+import base64
+from collections import deque
+
+import numpy as np
+import pytest
+
+import image_matting
+
+
+def spiral(size):
+    """Pasillo en espiral de 1 px que entra desde el borde izquierdo: un giro por vuelta"""
+    grid = np.zeros((size, size), dtype=bool)
+    row, col = 1, 0
+    grid[row, col] = True
+    moves = [(0, 1), (1, 0), (0, -1), (-1, 0)]
+    direction, stuck = 0, 0
+    while stuck < 2:
+        step_row, step_col = moves[direction]
+        ahead_row, ahead_col = row + 2 * step_row, col + 2 * step_col
+        if 1 <= ahead_row <= size - 2 and 1 <= ahead_col <= size - 2 and not grid[ahead_row, ahead_col]:
+            row, col = row + step_row, col + step_col
+            grid[row, col] = True
+            stuck = 0
+        else:
+            direction = (direction + 1) % 4
+            stuck += 1
+    return grid
+
+
+def reference_flood(candidate):
+    """Relleno píxel a píxel, lento pero obvio"""
+    rows, cols = candidate.shape
+    reached = np.zeros_like(candidate)
+    queue = deque((row, col) for row in range(rows) for col in range(cols)
+                  if candidate[row, col] and (row in (0, rows - 1) or col in (0, cols - 1)))
+    for row, col in queue:
+        reached[row, col] = True
+    while queue:
+        row, col = queue.popleft()
+        for near_row, near_col in ((row - 1, col), (row + 1, col), (row, col - 1), (row, col + 1)):
+            if 0 <= near_row < rows and 0 <= near_col < cols and candidate[near_row, near_col] \
+                    and not reached[near_row, near_col]:
+                reached[near_row, near_col] = True
+                queue.append((near_row, near_col))
+    return reached
+
+
+def test_spiral_with_more_turns_than_passes_is_filled_completely():
+    corridor = spiral(201)
+    # ~100 vueltas: más que MAX_FILL_PASSES
+    assert image_matting.flood_from_border(corridor).sum() == corridor.sum()
+
+    # Un hueco blanco encerrado en la espiral no toca el borde
+    closed = corridor.copy()
+    closed[99:102, 99:102] = False
+    closed[100, 100] = True
+    assert not image_matting.flood_from_border(closed)[100, 100]
+
+
+@pytest.mark.parametrize('passes', [0, 1, image_matting.MAX_FILL_PASSES])
+def test_queue_fill_matches_pixel_flood(monkeypatch, passes):
+    monkeypatch.setattr(image_matting, 'MAX_FILL_PASSES', passes)
+    candidate = np.random.default_rng(1).random((60, 80)) < 0.6
+    assert np.array_equal(image_matting.flood_from_border(candidate), reference_flood(candidate))
+
+
+def test_white_inside_the_product_is_kept(product_image):
+    image = product_image(size=(400, 400))
+    pixels = np.asarray(image).copy()
+    pixels[180:220, 180:220] = 255
+    from PIL import Image
+
+    output, reason = image_matting.remove_uniform_background(Image.fromarray(pixels, 'RGB'))
+    assert reason is None
+    alpha = np.asarray(output)[..., 3]
+    assert alpha[0, 0] == 0 and alpha[200, 200] == 255 and alpha[100, 100] == 255
+
+
+def test_unreliable_backgrounds_fall_back(product_image):
+    assert image_matting.remove_uniform_background(product_image(clutter=True)) == (None, 'border')
+    assert image_matting.remove_uniform_background(product_image(box=(0.5, 0.5, 0.51, 0.51)))[1] == 'foreground'
+
+
+def test_fast_path_override(product_image, encode_image, monkeypatch):
+    import app
+
+    data = base64.b64encode(encode_image(product_image(size=(400, 400)))).decode('utf-8')
+    result = app.remove_white_background(data, fast_path=True)
+    assert result['success'] and result['method'] == 'fast'
+
+    calls = []
+    monkeypatch.setattr(image_matting, 'BG_FAST_PATH', True)
+    monkeypatch.setattr(image_matting, 'remove_uniform_background', lambda image: calls.append(image) or (None, 'x'))
+    app.remove_white_background(data, fast_path=False)
+    assert calls == []
@@ -0,0 +1,46 @@
+import base64
+
+import image_quality
+
+
+def test_packshot_passes(product_image, encode_image):
+    data = base64.b64encode(encode_image(product_image())).decode('utf-8')
+    result = image_quality.assess_image(data)
+    assert result['passes'], result
+    assert result['scores']['border_whiteness'] == 1.0
+    assert 0.3 < result['scores']['fill_ratio'] < 0.4
+
+
+def test_scores_of_a_small_wide_image(product_image, encode_image):
+    scores = image_quality.analyze_image(encode_image(product_image((600, 300)), 'JPEG'))
+    assert scores['min_side'] == 300
+    assert scores['aspect'] == 0.5
+    assert image_quality.failed_checks(scores) == ['resolution', 'aspect']
+
+
+def test_cluttered_background_fails_border_checks(product_image, encode_image):
+    scores = image_quality.analyze_image(encode_image(product_image(clutter=True)))
+    failed = image_quality.failed_checks(scores)
+    assert 'border_whiteness' in failed and 'background_uniformity' in failed
+
+
+def test_transparency_counts_as_white(product_image, encode_image):
+    rgba = product_image().convert('RGBA')
+    pixels = rgba.load()
+    for x in range(rgba.width):
+        pixels[x, 0] = (0, 0, 0, 0)
+    scores = image_quality.analyze_image(encode_image(rgba))
+    assert scores['border_whiteness'] == 1.0
+
+
+def test_fill_ratio_limits(product_image, encode_image):
+    tiny = image_quality.analyze_image(encode_image(product_image(box=(0.45, 0.45, 0.55, 0.55))))
+    assert 'fill_ratio' in image_quality.failed_checks(tiny)
+    blank = image_quality.analyze_image(encode_image(product_image(box=(0, 0, 0, 0))))
+    assert blank['fill_ratio'] == 0.0
+
+
+def test_custom_spec():
+    scores = {'min_side': 500, 'aspect': 1.0, 'border_whiteness': 1.0, 'border_std': 0.0, 'fill_ratio': 0.5}
+    assert image_quality.failed_checks(scores) == ['resolution']
+    assert image_quality.failed_checks(scores, dict(image_quality.TARGET_SPEC, min_side=400)) == []
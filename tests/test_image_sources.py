@@ -0,0 +1,157 @@
+import asyncio
+import base64
+import contextvars
+import threading
+
+import pytest
+
+import image_quality
+import image_sources
+import metrics
+import tracing
+from tracing import JobTimings
+
+
+@pytest.fixture
+def downloads(product_image, encode_image):
+    """Resultados de descarga como los de app.py para una imagen limpia y una con fondo recargado"""
+    def result(**kwargs):
+        data = base64.b64encode(encode_image(product_image(**kwargs), 'JPEG')).decode('utf-8')
+        return {'success': True, 'image_data': data, 'content_type': 'image/jpeg'}
+    return {
+        'clean': result(size=(1000, 1000)),
+        'cluttered': result(size=(1600, 1600), clutter=True),
+        'small': result(size=(300, 300)),
+    }
+
+
+def fetchers_from(results, calls):
+    def fetcher(name):
+        def fetch():
+            calls.append(name)
+            return results[name]
+        return fetch
+    return {name: fetcher(name) for name in results}
+
+
+def test_off_urls_prefer_full_resolution():
+    url = 'https://images.openfoodfacts.org/images/products/841/front_es.4.400.jpg'
+    assert image_sources.off_image_urls(url) == [url.replace('.400.jpg', '.full.jpg'), url]
+    assert image_sources.off_image_urls('https://x/front.full.jpg') == ['https://x/front.full.jpg']
+    assert image_sources.off_image_urls(None) == []
+
+
+def test_cluttered_high_res_image_scores_well_but_is_rejected(downloads):
+    scores = image_quality.analyze_image(base64.b64decode(downloads['cluttered']['image_data']))
+    # Resolución y aspecto bastan para pasar el mínimo de puntuación...
+    assert image_sources.score(scores) >= image_sources.IMAGE_SOURCE_MIN_SCORE
+    # ...pero el fondo no es blanco
+    assert image_sources.rejection(scores) == 'background'
+
+    clean = image_sources.score_result(downloads['clean'])
+    assert clean['rejected'] is None and clean['score'] >= image_sources.IMAGE_SOURCE_MIN_SCORE
+    assert clean['quality'] == 'alta'
+
+
+def test_product_without_margin_is_rejected(product_image, encode_image):
+    scores = image_quality.analyze_image(encode_image(product_image(size=(1000, 1000), box=(0.0, 0.01, 1.0, 0.99))))
+    assert image_sources.rejection(scores) in ('background', 'framing')
+
+
+def test_tiered_cascade_falls_through_cluttered_image(downloads):
+    calls = []
+    results = {'off': downloads['cluttered'], 'serpapi': downloads['clean']}
+    result = image_sources.cascade(fetchers_from(results, calls), sources=['off', 'serpapi'], mode='tiered')
+    assert calls == ['off', 'serpapi']
+    assert result['source_name'] == 'serpapi'
+
+
+def test_tiered_cascade_stops_at_first_good_image(downloads):
+    calls = []
+    results = {'off': downloads['clean'], 'serpapi': downloads['cluttered']}
+    result = image_sources.cascade(fetchers_from(results, calls), sources=['off', 'serpapi'], mode='tiered')
+    assert calls == ['off'] and result['source_name'] == 'off'
+
+
+def test_best_download_is_used_when_none_is_good_enough(downloads):
+    calls = []
+    results = {'off': downloads['small'], 'serpapi': {'success': False, 'error': 'sin resultados'}}
+    result = image_sources.cascade(fetchers_from(results, calls), sources=['off', 'serpapi'], mode='tiered')
+    assert result['success'] and result['source_name'] == 'off'
+
+    failed = image_sources.cascade(fetchers_from({'off': results['serpapi']}, []), sources=['off'], mode='tiered')
+    assert not failed['success']
+
+
+def test_race_loser_is_cancelled_and_not_traced(downloads, monkeypatch):
+    monkeypatch.setattr(image_sources, 'IMAGE_SOURCE_HEDGE_MS', 0)
+    release_loser = threading.Event()
+    loser_state = {}
+    observed = []
+    monkeypatch.setattr(metrics.STAGE_DURATION, 'observe', lambda stage, value: observed.append((stage, value)))
+
+    def winner():
+        metrics.observe_stage('image_download', 0.25)
+        return downloads['clean']
+
+    def loser():
+        metrics.observe_stage('serpapi', 0.5)
+        release_loser.wait(5)
+        # Después de perder: sigue corriendo, pero ya no anota en la traza del EAN
+        loser_state['cancelled'] = image_sources.cancelled()
+        metrics.observe_stage('serpapi', 10.0)
+        loser_state['done'] = True
+        return downloads['clean']
+
+    def run():
+        timings = JobTimings()
+        trace = timings.start('1')
+        result = image_sources.cascade({'off': winner, 'serpapi': loser}, sources=['serpapi', 'off'], mode='race')
+        return result, trace
+
+    result, trace = contextvars.copy_context().run(run)
+    assert result['source_name'] == 'off'
+    release_loser.set()
+    for _ in range(500):
+        if loser_state.get('done'):
+            break
+        threading.Event().wait(0.01)
+    assert loser_state == {'cancelled': True, 'done': True}
+    # Solo los tiempos de la fuente ganadora llegan a la traza
+    assert trace.stages.get('download') == 0.25
+    assert 'search' not in trace.stages
+    # El histograma de etapas cuenta también las llamadas de la perdedora
+    assert ('serpapi', 0.5) in observed and ('serpapi', 10.0) in observed
+
+
+def test_detached_trace_is_only_added_when_adopted():
+    def run():
+        trace = JobTimings().start('1')
+        kept, dropped = tracing.DetachedTrace(), tracing.DetachedTrace()
+        contextvars.copy_context().run(lambda: (tracing.detach(kept), tracing.record('serpapi', 1.0)))
+        contextvars.copy_context().run(lambda: (tracing.detach(dropped), tracing.record('gemini_image', 2.0)))
+        dropped.cancel()
+        dropped.add('gemini_image', 3.0)
+        tracing.adopt(kept)
+        assert not tracing.cancelled()
+        return trace
+
+    trace = contextvars.copy_context().run(run)
+    assert trace.stages['search'] == 1.0 and 'enhance' not in trace.stages
+
+
+def test_async_cascade_falls_through_cluttered_image(downloads):
+    calls = []
+
+    def fetcher(name, result):
+        async def fetch():
+            calls.append(name)
+            return result
+        return fetch
+
+    async def run_cpu(func, *args):
+        return func(*args)
+
+    fetchers = {'off': fetcher('off', downloads['cluttered']), 'serpapi': fetcher('serpapi', downloads['clean'])}
+    result = asyncio.run(image_sources.cascade_async(fetchers, run_cpu, sources=['off', 'serpapi'], mode='tiered'))
+    assert calls == ['off', 'serpapi'] and result['source_name'] == 'serpapi'
@@ -0,0 +1,77 @@
+import contextvars
+import logging
+
+import pytest
+
+import memory
+
+MB = memory.MB
+
+
+@pytest.fixture
+def rss(monkeypatch):
+    """RSS del proceso controlado por el test (en MB)"""
+    value = [100]
+    monkeypatch.setattr(memory, 'current_rss_bytes', lambda: value[0] * MB)
+    return value
+
+
+@pytest.fixture
+def jobs():
+    """Abre trabajos en contextos propios (como dos peticiones) y los cierra al terminar"""
+    opened = []
+
+    def open_job(route, budget_mb):
+        context = contextvars.copy_context()
+        job = context.run(memory.start, route, budget_mb)
+        opened.append(job)
+        return job, context
+    yield open_job
+    for job in opened:
+        memory.finish(job)
+
+
+def test_single_job_stops_at_its_budget(rss, jobs):
+    job, context = jobs('/process_bulk', 10)
+    rss[0] = 109
+    assert not context.run(memory.exhausted)
+    rss[0] = 111
+    assert context.run(memory.exhausted)
+    # Una vez agotado sigue así aunque el RSS baje
+    rss[0] = 100
+    assert job.exhausted()
+    summary = job.summary()
+    assert summary['budget_exceeded'] and not summary['budget_shared']
+
+
+def test_concurrent_jobs_only_warn_until_the_shared_budget(rss, jobs, caplog):
+    light, _ = jobs('/process_images_only', 10)
+    heavy, _ = jobs('/process_bulk', 10)
+    # El trabajo pesado hace crecer el RSS: el ligero lo ve como propio
+    rss[0] = 115
+    with caplog.at_level(logging.WARNING, logger='memory'):
+        assert not light.exhausted()
+        assert not light.exhausted()
+    assert light.budget_shared and not light.budget_exceeded
+    assert len([record for record in caplog.records if '1 trabajos más' in record.message]) == 1
+
+    # Dos trabajos en curso: se corta al pasar de dos presupuestos
+    rss[0] = 121
+    assert light.exhausted() and heavy.exhausted()
+
+
+def test_budget_applies_again_when_the_other_job_ends(rss, jobs):
+    job, _ = jobs('/process_bulk', 10)
+    other, _ = jobs('/process_bulk', 10)
+    rss[0] = 115
+    assert not job.exhausted()
+    memory.finish(other)
+    assert job.exhausted()
+
+
+def test_without_budget_or_job_nothing_is_cut(rss, jobs):
+    job, context = jobs('/process_bulk', 0)
+    rss[0] = 10000
+    assert not context.run(memory.exhausted)
+    assert context.run(memory.summary)['budget_mb'] is None
+    assert not memory.exhausted()
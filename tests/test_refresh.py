@@ -0,0 +1,112 @@
+import base64
+import os
+import zipfile
+from io import BytesIO
+
+import pytest
+
+import refresh
+
+pytest.importorskip('openpyxl')
+
+HEADERS = ('Ean', 'Nombre', 'Producto Encontrado', 'Imagen')
+
+
+def excel_bytes(rows, manifest=True):
+    from openpyxl import Workbook
+
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(HEADERS)
+    products = []
+    for ean, name, found, image, last_modified in rows:
+        sheet.append((ean, name, found, image))
+        products.append({'Ean': ean, refresh.LAST_MODIFIED_KEY: last_modified})
+    if manifest:
+        refresh.add_manifest_sheet(workbook, products)
+    buffer = BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+ROWS = [
+    ('1', 'Completo', 'si', '1.png', 100),
+    ('2', 'No encontrado', 'no', '', 200),
+    ('3', 'Sin imagen', 'si', '', 300),
+    ('4', 'Sin manifest', 'si', '4.png', None),
+]
+
+
+def zip_bytes(excel, images):
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('productos_prestashop.xlsx', excel)
+        for name, data in images.items():
+            archive.writestr(f'{refresh.IMAGES_DIR}/{name}', data)
+    return buffer.getvalue()
+
+
+def test_manifest_sheet_is_hidden_and_read_back():
+    from openpyxl import load_workbook
+
+    data = excel_bytes(ROWS)
+    workbook = load_workbook(BytesIO(data))
+    assert workbook[refresh.MANIFEST_SHEET].sheet_state == 'hidden'
+
+    previous = refresh.PreviousRun.load(data, 'anterior.xlsx')
+    assert len(previous) == 4
+    assert previous.last_modified == {'1': 100, '2': 200, '3': 300}
+    assert previous.products['1']['Nombre'] == 'Completo'
+
+
+def test_only_complete_rows_with_unchanged_off_record_are_reused():
+    previous = refresh.PreviousRun.load(excel_bytes(ROWS), 'anterior.xlsx')
+    assert previous.candidate('1')
+    assert not previous.candidate('2') and not previous.candidate('3') and not previous.candidate('4')
+    assert not previous.candidate('desconocido')
+
+    reused = previous.reuse('1', '100')
+    assert reused['product']['Nombre'] == 'Completo'
+    assert reused['product'][refresh.LAST_MODIFIED_KEY] == 100
+    # Solo el Excel: la fila se reutiliza sin imagen
+    assert reused['image'] is None
+    # OFF cambió o no respondió: se reprocesa
+    assert previous.reuse('1', 101) is None
+    assert previous.reuse('1', None) is None
+
+
+def test_zip_reuses_images_and_requires_them():
+    excel = excel_bytes(ROWS)
+    previous = refresh.PreviousRun.load(zip_bytes(excel, {'1.png': b'png-1'}), 'resultado.zip')
+    reused = previous.reuse('1', 100)
+    assert reused['image'] == {'filename': '1.png', 'data': base64.b64encode(b'png-1').decode('utf-8')}
+
+    previous = refresh.PreviousRun.load(zip_bytes(excel, {}), 'resultado.zip')
+    assert not previous.candidate('1')
+
+
+def test_cli_output_directory(tmp_path):
+    (tmp_path / refresh.IMAGES_DIR).mkdir()
+    (tmp_path / refresh.EXCEL_FILENAME).write_bytes(excel_bytes(ROWS))
+    (tmp_path / refresh.IMAGES_DIR / '1.png').write_bytes(b'png-1')
+
+    previous = refresh.PreviousRun.load(str(tmp_path))
+    assert base64.b64decode(previous.reuse('1', 100)['image']['data']) == b'png-1'
+    os.remove(tmp_path / refresh.IMAGES_DIR / '1.png')
+    assert not previous.candidate('1')
+
+
+def test_excel_without_manifest_reuses_nothing():
+    previous = refresh.PreviousRun.load(excel_bytes(ROWS, manifest=False), 'viejo.xlsx')
+    assert previous.last_modified == {}
+    assert previous.reuse('1', 100) is None
+
+
+def test_rejects_unknown_inputs():
+    with pytest.raises(ValueError):
+        refresh.PreviousRun.load(b'no es un zip', 'resultado.csv')
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr(f'{refresh.IMAGES_DIR}/1.png', b'png-1')
+    with pytest.raises(ValueError):
+        refresh.PreviousRun.load(buffer.getvalue(), 'resultado.zip')
@@ -0,0 +1,150 @@
+import threading
+
+import pytest
+
+import scheduler
+import tracing
+from scheduler import BULK, INTERACTIVE, Scheduler
+
+
+@pytest.fixture(autouse=True)
+def no_pending_queue_wait():
+    """Los turnos de estos tests anotan su espera en el contexto del test: no debe pasar a otros"""
+    yield
+    tracing.record_queue_wait(0.0)
+
+
+@pytest.fixture
+def shared(monkeypatch):
+    """Planificador compartido nuevo: 3 turnos, 1 reservado para lo interactivo"""
+    fresh = Scheduler(slots=3, interactive_slots=1)
+    monkeypatch.setattr(scheduler, 'shared', fresh)
+    return fresh
+
+
+def acquire_in_thread(queue, priority, client, order, timeout=5):
+    """Pide un turno desde otro hilo y anota (cliente, turno) al recibirlo"""
+    def run():
+        ticket = queue.acquire(priority, client, timeout)
+        order.append((client, ticket))
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_queued(queue, count):
+    for _ in range(500):
+        with queue._lock:
+            queued = len(queue._interactive) + sum(len(waiting) for waiting in queue._bulk.values())
+        if queued >= count:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError('las peticiones no llegaron a la cola')
+
+
+def test_bulk_never_takes_the_reserved_slots():
+    queue = Scheduler(slots=3, interactive_slots=1)
+    first = queue.acquire(BULK, 'a', 0)
+    second = queue.acquire(BULK, 'b', 0)
+    assert first and second
+    assert queue.acquire(BULK, 'c', 0) is None
+    assert queue.acquire(INTERACTIVE, 'd', 0)
+
+
+def test_interactive_goes_before_queued_bulk():
+    queue = Scheduler(slots=1, interactive_slots=0)
+    held = queue.acquire(BULK, 'a', 0)
+    order = []
+    bulk = acquire_in_thread(queue, BULK, 'b', order)
+    wait_queued(queue, 1)
+    interactive = acquire_in_thread(queue, INTERACTIVE, 'i', order)
+    wait_queued(queue, 2)
+
+    queue.release(held)
+    interactive.join(2)
+    assert [client for client, _ in order] == ['i']
+    queue.release(order[0][1])
+    bulk.join(2)
+    assert [client for client, _ in order] == ['i', 'b']
+
+
+def test_bulk_turns_alternate_between_clients():
+    queue = Scheduler(slots=1, interactive_slots=0)
+    held = queue.acquire(BULK, 'a', 0)
+    order = []
+    threads = []
+    for client in ('a', 'a', 'b'):
+        threads.append(acquire_in_thread(queue, BULK, client, order))
+        wait_queued(queue, len(threads))
+
+    # 'b' no espera a que 'a' termine todos sus EANs: a, b, a
+    for granted in range(1, 4):
+        queue.release(held)
+        for _ in range(500):
+            if len(order) == granted:
+                break
+            threading.Event().wait(0.01)
+        held = order[-1][1]
+    queue.release(held)
+    for thread in threads:
+        thread.join(2)
+    assert [client for client, _ in order] == ['a', 'b', 'a']
+
+
+def test_wait_timeout_leaves_the_queue():
+    queue = Scheduler(slots=1, interactive_slots=0)
+    queue.acquire(BULK, 'a', 0)
+    assert queue.acquire(BULK, 'b', 0.05) is None
+    assert not queue._bulk
+
+
+def test_turns_do_not_wait_for_skipped_items(shared, monkeypatch):
+    calls = []
+    acquire = shared.acquire
+    monkeypatch.setattr(shared, 'acquire', lambda *args: calls.append(args) or acquire(*args))
+    # Todos los turnos de lotes ocupados: si un item restaurado pidiera turno, se quedaría esperando
+    blockers = [shared.acquire(BULK, 'otro', 0), shared.acquire(BULK, 'otro', 0)]
+    calls.clear()
+
+    items = []
+    worker = threading.Thread(target=lambda: items.extend(scheduler.turns(['1', '2', '3'], 'cliente', skip=lambda item: True)),
+                              daemon=True)
+    worker.start()
+    worker.join(2)
+    assert items == ['1', '2', '3'] and calls == []
+    for ticket in blockers:
+        shared.release(ticket)
+
+
+def test_turns_release_the_turn_before_a_skipped_item(shared):
+    seen = []
+    for item in scheduler.turns(['nuevo', 'restaurado', 'otro'], 'cliente', skip=lambda item: item == 'restaurado'):
+        seen.append((item, shared._busy[BULK]))
+    assert seen == [('nuevo', 1), ('restaurado', 0), ('otro', 1)]
+    assert shared._busy[BULK] == 0
+
+
+def test_released_frees_the_interactive_turn_while_waiting(shared):
+    shared.configure(slots=1, interactive_slots=0)
+    with scheduler.turn(INTERACTIVE, 'cliente') as granted:
+        assert granted and shared._busy[INTERACTIVE] == 1
+        with scheduler.released():
+            assert shared._busy[INTERACTIVE] == 0
+            # Otro puede usar el turno mientras tanto
+            other = shared.acquire(BULK, 'otro', 0)
+            assert other is not None
+            shared.release(other)
+        assert shared._busy[INTERACTIVE] == 1
+    assert shared._busy[INTERACTIVE] == 0
+
+
+def test_released_outside_a_turn_does_nothing(shared):
+    with scheduler.released():
+        pass
+    assert shared._busy == {INTERACTIVE: 0, BULK: 0}
+
+
+def test_client_key_prefers_first_forwarded_address():
+    assert scheduler.client_key('1.1.1.1, 10.0.0.1', '10.0.0.2') == '1.1.1.1'
+    assert scheduler.client_key(None, '10.0.0.2') == '10.0.0.2'
+    assert scheduler.client_key('', None) == 'desconocido'
@@ -0,0 +1,217 @@
+import importlib
+import sys
+import threading
+import types
+
+import pytest
+
+import segmentation
+
+
+def fake_remove(image, session=None):
+    raise AssertionError('el lote no debería volver a rembg.remove')
+
+
+class FakeSessionOptions:
+    def __init__(self):
+        self.intra_op_num_threads = None
+        self.inter_op_num_threads = None
+        self.execution_mode = None
+
+
+def session_class(model_name, model_file):
+    """Clase de sesión al estilo de rembg.sessions que anota cómo se creó"""
+    class FakeSession:
+        def __init__(self, name, options, model_path=None):
+            self.model_name = name
+            self.options = options
+            self.model_path = model_path
+            self.session_name = model_name
+
+        @classmethod
+        def name(cls):
+            return model_name
+
+        @classmethod
+        def download_models(cls):
+            return str(model_file)
+    return FakeSession
+
+
+@pytest.fixture
+def fake_onnx(monkeypatch, tmp_path):
+    """onnxruntime y rembg falsos: sesiones que no cargan nada y una cuantización que anota sus llamadas"""
+    quantized = []
+
+    def quantize_dynamic(source, target, weight_type):
+        quantized.append((source, weight_type))
+        with open(target, 'wb') as handle:
+            handle.write(b'int8')
+
+    ort = types.ModuleType('onnxruntime')
+    ort.SessionOptions = FakeSessionOptions
+    ort.ExecutionMode = types.SimpleNamespace(ORT_PARALLEL='parallel')
+    quantization = types.ModuleType('onnxruntime.quantization')
+    quantization.QuantType = types.SimpleNamespace(QUInt8='quint8')
+    quantization.quantize_dynamic = quantize_dynamic
+    ort.quantization = quantization
+
+    model_file = tmp_path / 'u2net.onnx'
+    model_file.write_bytes(b'fp32')
+    rembg = types.ModuleType('rembg')
+    sessions = types.ModuleType('rembg.sessions')
+    sessions.sessions_class = [session_class(name, tmp_path / f'{name}.onnx')
+                               for name in ('u2net', 'u2net_custom', 'isnet-general-use')]
+    rembg.sessions = sessions
+    rembg.remove = fake_remove
+
+    monkeypatch.setitem(sys.modules, 'onnxruntime', ort)
+    monkeypatch.setitem(sys.modules, 'onnxruntime.quantization', quantization)
+    monkeypatch.setitem(sys.modules, 'rembg', rembg)
+    monkeypatch.setitem(sys.modules, 'rembg.sessions', sessions)
+    return types.SimpleNamespace(quantized=quantized, model_file=model_file)
+
+
+def test_quantization_is_off_by_default(monkeypatch):
+    monkeypatch.delenv('REMBG_QUANTIZED', raising=False)
+    monkeypatch.delenv('REMBG_MODEL', raising=False)
+    try:
+        importlib.reload(segmentation)
+        assert not segmentation.REMBG_QUANTIZED
+        assert segmentation.describe(intra_op_threads=0, inter_op_threads=0) == 'u2net (hilos auto/auto)'
+    finally:
+        monkeypatch.undo()
+        importlib.reload(segmentation)
+
+
+def test_session_options_threads(fake_onnx):
+    options = segmentation.session_options(intra_op_threads=4, inter_op_threads=2)
+    assert options.intra_op_num_threads == 4
+    assert options.inter_op_num_threads == 2
+    assert options.execution_mode == 'parallel'
+
+    # 0 = lo que decida onnxruntime: no se toca nada
+    options = segmentation.session_options(intra_op_threads=0, inter_op_threads=0)
+    assert vars(options) == vars(FakeSessionOptions())
+
+    # Un solo hilo entre operadores no necesita el modo paralelo
+    assert segmentation.session_options(intra_op_threads=0, inter_op_threads=1).execution_mode is None
+
+
+def test_default_session_uses_the_original_model(fake_onnx):
+    session = segmentation.new_session('u2net', quantized=False, intra_op_threads=2, inter_op_threads=0)
+    assert session.session_name == 'u2net' and session.model_path is None
+    assert session.options.intra_op_num_threads == 2
+    assert fake_onnx.quantized == []
+
+
+def test_quantized_model_is_built_once_and_cached(fake_onnx):
+    session = segmentation.new_session('u2net', quantized=True, intra_op_threads=0, inter_op_threads=0)
+    target = fake_onnx.model_file.parent / 'u2net.quant.onnx'
+    # Se carga con el pre/postproceso de u2net_custom desde el modelo cuantizado
+    assert session.session_name == 'u2net_custom' and session.model_name == 'u2net'
+    assert session.model_path == str(target) and target.read_bytes() == b'int8'
+    assert fake_onnx.quantized == [(str(fake_onnx.model_file), 'quint8')]
+
+    again = segmentation.new_session('u2net', quantized=True, intra_op_threads=0, inter_op_threads=0)
+    assert again.model_path == str(target)
+    assert len(fake_onnx.quantized) == 1
+    assert not list(target.parent.glob('*.tmp'))
+
+
+def test_models_outside_the_u2net_family_are_not_quantized(fake_onnx):
+    session = segmentation.new_session('isnet-general-use', quantized=True, intra_op_threads=0, inter_op_threads=0)
+    assert session.session_name == 'isnet-general-use' and session.model_path is None
+    assert fake_onnx.quantized == []
+    assert 'int8' not in segmentation.describe('isnet-general-use', quantized=True)
+
+
+class FakeInner:
+    """Modelo con lote dinámico: la máscara de cada imagen solo depende de esa imagen"""
+
+    def __init__(self):
+        self.batches = []
+        self.hold_first = None
+
+    def get_inputs(self):
+        return [types.SimpleNamespace(shape=['batch_size', 3, 320, 320], name='input.1')]
+
+    def run(self, outputs, feeds):
+        inputs = feeds['input.1']
+        self.batches.append(len(inputs))
+        if self.hold_first is not None and len(self.batches) == 1:
+            self.hold_first()
+        return [inputs[:, :1] * 0.5 + inputs[:, 1:2] ** 2 - inputs[:, 2:3]]
+
+
+@pytest.fixture
+def images(product_image):
+    return [product_image(size=(200 + 40 * index, 240), color=(40 * index, 200 - 30 * index, 90), box=(0.1 * index, 0.2, 0.9, 0.8))
+            for index in range(4)]
+
+
+def masks(images):
+    import numpy as np
+
+    return [np.asarray(image) for image in images]
+
+
+def test_batched_masks_equal_single_image_masks(images):
+    session = types.SimpleNamespace(model_name='u2net', inner_session=FakeInner())
+    batcher = segmentation.Batcher(session, max_batch=4, wait_ms=0)
+    assert batcher.stacked
+
+    batched = masks(batcher.predict(images))
+    single = [mask for image in images for mask in masks(batcher.predict([image]))]
+    assert session.inner_session.batches == [4, 1, 1, 1, 1]
+    assert all((left == right).all() for left, right in zip(batched, single))
+    assert [mask.shape for mask in batched] == [(image.height, image.width) for image in images]
+
+
+def test_batch_size_comes_from_the_queue_not_from_app_counters(fake_onnx, images, monkeypatch):
+    import numpy as np
+
+    monkeypatch.setitem(segmentation.metrics.EANS_IN_FLIGHT._values, (), 0)
+    inner = FakeInner()
+    session = types.SimpleNamespace(model_name='u2net', inner_session=inner)
+    batcher = segmentation.Batcher(session, max_batch=4, wait_ms=2000)
+    expected = [np.asarray(mask) for image in images for mask in batcher.predict([image])]
+    inner.batches.clear()
+
+    def wait_queued(count):
+        for _ in range(500):
+            with batcher._condition:
+                if len(batcher._queue) >= count:
+                    return
+            threading.Event().wait(0.01)
+        raise AssertionError('las peticiones no llegaron a la cola')
+
+    results = {}
+
+    def remove_in_thread(index):
+        thread = threading.Thread(target=lambda: results.__setitem__(index, batcher.remove(images[index])), daemon=True)
+        thread.start()
+        return thread
+
+    # La primera imagen llega sola y no espera; mientras se infiere se acumulan las otras tres
+    started = threading.Event()
+    inner.hold_first = lambda: (started.set(), wait_queued(3))
+    threads = [remove_in_thread(0)]
+    assert started.wait(5)
+    threads += [remove_in_thread(index) for index in (1, 2, 3)]
+    for thread in threads:
+        thread.join(5)
+    assert inner.batches == [1, 3]
+
+    # Ya sabe que llegan de tres en tres: espera a reunirlas aunque lleguen escalonadas
+    threads = []
+    for index in (0, 1, 2):
+        threads.append(remove_in_thread(index))
+        threading.Event().wait(0.02)
+    for thread in threads:
+        thread.join(5)
+    assert inner.batches == [1, 3, 3]
+
+    for index, image in enumerate(images):
+        alpha = np.asarray(results[index])[..., 3]
+        assert (alpha == expected[index]).all()
@@ -0,0 +1,81 @@
+import contextvars
+import threading
+import time
+
+import scheduler
+import tracing
+from tracing import JobTimings
+
+
+def test_queue_is_zero_without_a_turn():
+    timings = JobTimings()
+    time.sleep(0.02)
+    trace = contextvars.copy_context().run(timings.begin, '1')
+    # El tiempo desde que empezó el trabajo no es espera de cola
+    assert trace.stages['queue'] == 0.0
+
+
+def test_queue_wait_is_consumed_by_the_next_trace():
+    def run():
+        timings = JobTimings()
+        tracing.record_queue_wait(0.25)
+        first = timings.begin('1')
+        second = timings.begin('2')
+        return first.stages['queue'], second.stages['queue']
+
+    assert contextvars.copy_context().run(run) == (0.25, 0.0)
+
+
+def test_queued_at_overrides_recorded_wait():
+    def run():
+        timings = JobTimings()
+        tracing.record_queue_wait(5.0)
+        return timings.start('1', time.perf_counter() - 0.1).stages['queue']
+
+    assert 0.1 <= contextvars.copy_context().run(run) < 1.0
+
+
+def test_scheduler_turn_records_wait_until_granted(monkeypatch):
+    shared = scheduler.Scheduler(slots=1, interactive_slots=0)
+    monkeypatch.setattr(scheduler, 'shared', shared)
+    holder = shared.acquire(scheduler.BULK, 'otro')
+
+    def run():
+        timings = JobTimings()
+        time.sleep(0.05)
+        threading.Timer(0.1, shared.release, args=(holder,)).start()
+        with scheduler.turn(scheduler.BULK, 'cliente'):
+            trace = timings.begin('1')
+        return trace.stages['queue']
+
+    waited = contextvars.copy_context().run(run)
+    # Cuenta desde que se pidió el turno, no desde que empezó el trabajo
+    assert 0.08 <= waited < 0.14
+
+
+def test_turns_records_each_wait():
+    shared = scheduler.Scheduler(slots=2, interactive_slots=0)
+
+    def run():
+        original, scheduler.shared = scheduler.shared, shared
+        try:
+            timings = JobTimings()
+            return [timings.begin(ean).stages['queue'] for ean in scheduler.turns(['1', '2'], 'cliente')]
+        finally:
+            scheduler.shared = original
+
+    waits = contextvars.copy_context().run(run)
+    assert len(waits) == 2 and all(0 <= wait < 0.05 for wait in waits)
+
+
+def test_summary_reports_stage_percentiles():
+    def run():
+        timings = JobTimings()
+        for index, seconds in enumerate((0.1, 0.2, 0.3)):
+            timings.begin(str(index))
+            tracing.record('off', seconds)
+        return timings.summary()
+
+    summary = contextvars.copy_context().run(run)
+    assert summary['eans'] == 3
+    assert summary['stages']['off'] == {'p50': 200, 'p95': 300, 'total': 600, 'count': 3}
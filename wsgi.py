@@ -5,8 +5,11 @@ Importa la aplicación Flask desde scripts/web_app/app.py
 
 import sys
 import os
+import time
 import logging
 
+_started = time.perf_counter()
+
 # Configurar logging
 logging.basicConfig(
     level=logging.INFO,
@@ -27,7 +30,7 @@ logger.info(f"✓ Path actualizado")
 try:
     logger.info("📦 Importando aplicación Flask desde app...")
     from app import app
-    logger.info("✅ Aplicación Flask importada exitosamente en WSGI!")
+    logger.info(f"✅ Aplicación Flask importada exitosamente en WSGI! ({(time.perf_counter() - _started) * 1000:.0f} ms)")
 except Exception as e:
     logger.error(f"❌ ERROR FATAL en WSGI al importar app: {e}", exc_info=True)
     raise